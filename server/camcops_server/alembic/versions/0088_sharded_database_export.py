@@ -0,0 +1,216 @@
+"""
+camcops_server/alembic/versions/0088_sharded_database_export.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+DATABASE REVISION SCRIPT
+
+sharded_database_export
+
+Revision ID: 0088
+Revises: 0087
+Creation date: 2026-10-19 10:12:41.338210
+
+"""
+
+# =============================================================================
+# Imports
+# =============================================================================
+
+from alembic import op
+import cardinal_pythonlib.sqlalchemy.list_types
+import sqlalchemy as sa
+
+# =============================================================================
+# Revision identifiers, used by Alembic.
+# =============================================================================
+
+revision = "0088"
+down_revision = "0087"
+branch_labels = None
+depends_on = None
+
+
+# =============================================================================
+# The upgrade/downgrade steps
+# =============================================================================
+
+
+# noinspection PyPep8,PyTypeChecker
+def upgrade() -> None:
+    op.create_table(
+        "_exported_database_runs",
+        sa.Column(
+            "id",
+            sa.Integer(),
+            autoincrement=True,
+            nullable=False,
+            comment="Arbitrary primary key",
+        ),
+        sa.Column(
+            "recipient_id",
+            sa.BigInteger(),
+            nullable=False,
+            comment="FK to _export_recipients.id",
+        ),
+        sa.Column(
+            "started_at_utc",
+            sa.DateTime(),
+            nullable=False,
+            comment="Time export was started (UTC)",
+        ),
+        sa.Column(
+            "finished_at_utc",
+            sa.DateTime(),
+            nullable=True,
+            comment="Time export was finished (UTC)",
+        ),
+        sa.ForeignKeyConstraint(
+            ["recipient_id"],
+            ["_export_recipients.id"],
+            name=op.f("fk__exported_database_runs_recipient_id"),
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk__exported_database_runs")),
+        mysql_charset="utf8mb4 COLLATE utf8mb4_unicode_ci",
+        mysql_engine="InnoDB",
+        mysql_row_format="DYNAMIC",
+    )
+    op.create_table(
+        "_exported_database_shards",
+        sa.Column(
+            "id",
+            sa.Integer(),
+            autoincrement=True,
+            nullable=False,
+            comment="Arbitrary primary key",
+        ),
+        sa.Column(
+            "run_id",
+            sa.Integer(),
+            nullable=False,
+            comment="FK to _exported_database_runs.id",
+        ),
+        sa.Column(
+            "basetable",
+            sa.String(length=128),
+            nullable=False,
+            comment="Base table of tasks concerned",
+        ),
+        sa.Column(
+            "task_pks",
+            cardinal_pythonlib.sqlalchemy.list_types.IntListType(),
+            nullable=True,
+            comment="Server PKs of tasks in basetable (_pk field), as CSV",
+        ),
+        sa.Column(
+            "pk_min",
+            sa.Integer(),
+            nullable=False,
+            comment="Lowest server PK of tasks in this shard",
+        ),
+        sa.Column(
+            "pk_max",
+            sa.Integer(),
+            nullable=False,
+            comment="Highest server PK of tasks in this shard",
+        ),
+        sa.Column(
+            "attempts",
+            sa.Integer(),
+            nullable=False,
+            comment="Number of attempts to copy this shard",
+        ),
+        sa.Column(
+            "finished_at_utc",
+            sa.DateTime(),
+            nullable=True,
+            comment="Time shard was copied (UTC)",
+        ),
+        sa.ForeignKeyConstraint(
+            ["run_id"],
+            ["_exported_database_runs.id"],
+            name=op.f("fk__exported_database_shards_run_id"),
+        ),
+        sa.PrimaryKeyConstraint(
+            "id", name=op.f("pk__exported_database_shards")
+        ),
+        mysql_charset="utf8mb4 COLLATE utf8mb4_unicode_ci",
+        mysql_engine="InnoDB",
+        mysql_row_format="DYNAMIC",
+    )
+    with op.batch_alter_table(
+        "_exported_database_shards", schema=None
+    ) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix__exported_database_shards_run_id"),
+            ["run_id"],
+            unique=False,
+        )
+    op.create_table(
+        "_exported_database_shared_objects",
+        sa.Column(
+            "shard_id",
+            sa.Integer(),
+            autoincrement=False,
+            nullable=False,
+            comment="FK to _exported_database_shards.id",
+        ),
+        sa.Column(
+            "tablename",
+            sa.String(length=128),
+            nullable=False,
+            comment="Table name of the shared object",
+        ),
+        sa.Column(
+            "pk",
+            sa.Integer(),
+            autoincrement=False,
+            nullable=False,
+            comment="Primary key of the shared object",
+        ),
+        sa.ForeignKeyConstraint(
+            ["shard_id"],
+            ["_exported_database_shards.id"],
+            name=op.f("fk__exported_database_shared_objects_shard_id"),
+        ),
+        sa.PrimaryKeyConstraint(
+            "shard_id",
+            "tablename",
+            "pk",
+            name=op.f("pk__exported_database_shared_objects"),
+        ),
+        mysql_charset="utf8mb4 COLLATE utf8mb4_unicode_ci",
+        mysql_engine="InnoDB",
+        mysql_row_format="DYNAMIC",
+    )
+
+
+# noinspection PyPep8,PyTypeChecker
+def downgrade() -> None:
+    op.drop_table("_exported_database_shared_objects")
+    with op.batch_alter_table(
+        "_exported_database_shards", schema=None
+    ) as batch_op:
+        batch_op.drop_index(batch_op.f("ix__exported_database_shards_run_id"))
+    op.drop_table("_exported_database_shards")
+    op.drop_table("_exported_database_runs")
@@ -0,0 +1,131 @@
+"""
+camcops_server/alembic/versions/0089_user_downloads.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+DATABASE REVISION SCRIPT
+
+user_downloads
+
+Revision ID: 0089
+Revises: 0088
+Creation date: 2026-10-19 14:05:12.518470
+
+"""
+
+# =============================================================================
+# Imports
+# =============================================================================
+
+from alembic import op
+import sqlalchemy as sa
+
+# =============================================================================
+# Revision identifiers, used by Alembic.
+# =============================================================================
+
+revision = "0089"
+down_revision = "0088"
+branch_labels = None
+depends_on = None
+
+
+# =============================================================================
+# The upgrade/downgrade steps
+# =============================================================================
+
+
+# noinspection PyPep8,PyTypeChecker
+def upgrade() -> None:
+    op.create_table(
+        "_user_downloads",
+        sa.Column(
+            "id",
+            sa.Integer(),
+            autoincrement=True,
+            nullable=False,
+            comment="Arbitrary primary key",
+        ),
+        sa.Column(
+            "user_id",
+            sa.Integer(),
+            nullable=False,
+            comment="User ID (owner of the file)",
+        ),
+        sa.Column(
+            "filename",
+            sa.Unicode(length=255),
+            nullable=False,
+            comment="Filename, relative to the user's download directory",
+        ),
+        sa.Column(
+            "size_bytes",
+            sa.BigInteger(),
+            nullable=False,
+            comment="File size (bytes)",
+        ),
+        sa.Column(
+            "created_at_utc",
+            sa.DateTime(),
+            nullable=False,
+            comment="Time the file was created (UTC)",
+        ),
+        sa.Column(
+            "expires_at_utc",
+            sa.DateTime(),
+            nullable=False,
+            comment="Time after which the file may be deleted (UTC)",
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["_security_users.id"],
+            name=op.f("fk__user_downloads_user_id"),
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk__user_downloads")),
+        mysql_charset="utf8mb4 COLLATE utf8mb4_unicode_ci",
+        mysql_engine="InnoDB",
+        mysql_row_format="DYNAMIC",
+    )
+    with op.batch_alter_table("_user_downloads", schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix__user_downloads_expires_at_utc"),
+            ["expires_at_utc"],
+            unique=False,
+        )
+        batch_op.create_index(
+            batch_op.f("ix__user_downloads_user_id"),
+            ["user_id"],
+            unique=False,
+        )
+    # Existing download files are not recorded here (migrations don't know
+    # the download directory); the back end's first housekeeping run records
+    # them, as does the "camcops_server reconcile_user_downloads" command.
+
+
+# noinspection PyPep8,PyTypeChecker
+def downgrade() -> None:
+    with op.batch_alter_table("_user_downloads", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix__user_downloads_user_id"))
+        batch_op.drop_index(batch_op.f("ix__user_downloads_expires_at_utc"))
+    op.drop_table("_user_downloads")
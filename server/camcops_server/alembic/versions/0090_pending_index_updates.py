@@ -0,0 +1,131 @@
+"""
+camcops_server/alembic/versions/0090_pending_index_updates.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+DATABASE REVISION SCRIPT
+
+pending_index_updates
+
+Revision ID: 0090
+Revises: 0089
+Creation date: 2026-10-19 16:21:37.104512
+
+"""
+
+# =============================================================================
+# Imports
+# =============================================================================
+
+from alembic import op
+import sqlalchemy as sa
+
+# =============================================================================
+# Revision identifiers, used by Alembic.
+# =============================================================================
+
+revision = "0090"
+down_revision = "0089"
+branch_labels = None
+depends_on = None
+
+
+# =============================================================================
+# The upgrade/downgrade steps
+# =============================================================================
+
+
+# noinspection PyPep8,PyTypeChecker
+def upgrade() -> None:
+    op.create_table(
+        "_pending_index_updates",
+        sa.Column(
+            "id",
+            sa.Integer(),
+            autoincrement=True,
+            nullable=False,
+            comment="Arbitrary primary key (in order of upload)",
+        ),
+        sa.Column(
+            "device_id",
+            sa.Integer(),
+            nullable=False,
+            comment="ID of the uploading device",
+        ),
+        sa.Column(
+            "group_id",
+            sa.Integer(),
+            nullable=True,
+            comment="ID of the group into which the upload was made",
+        ),
+        sa.Column(
+            "batch_utc",
+            sa.DateTime(),
+            nullable=False,
+            comment="Time of the upload batch (UTC); used as the indexing "
+            "time",
+        ),
+        sa.Column(
+            "tablename",
+            sa.String(length=128),
+            nullable=False,
+            comment="Name of the table uploaded to",
+        ),
+        sa.Column(
+            "table_changes",
+            sa.UnicodeText(),
+            nullable=False,
+            comment="Server PKs added, removed, preserved, and current (JSON)",
+        ),
+        sa.ForeignKeyConstraint(
+            ["device_id"],
+            ["_security_devices.id"],
+            name=op.f("fk__pending_index_updates_device_id"),
+        ),
+        sa.ForeignKeyConstraint(
+            ["group_id"],
+            ["_security_groups.id"],
+            name=op.f("fk__pending_index_updates_group_id"),
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk__pending_index_updates")),
+        mysql_charset="utf8mb4 COLLATE utf8mb4_unicode_ci",
+        mysql_engine="InnoDB",
+        mysql_row_format="DYNAMIC",
+    )
+    with op.batch_alter_table(
+        "_pending_index_updates", schema=None
+    ) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix__pending_index_updates_device_id"),
+            ["device_id"],
+            unique=False,
+        )
+
+
+# noinspection PyPep8,PyTypeChecker
+def downgrade() -> None:
+    with op.batch_alter_table(
+        "_pending_index_updates", schema=None
+    ) as batch_op:
+        batch_op.drop_index(batch_op.f("ix__pending_index_updates_device_id"))
+    op.drop_table("_pending_index_updates")
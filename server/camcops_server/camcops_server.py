@@ -75,6 +75,7 @@ from camcops_server.cc_modules.cc_config import (
 )
 from camcops_server.cc_modules.cc_constants import (
     CAMCOPS_URL,
+    ConfigParamSite,
     DEFAULT_FLOWER_ADDRESS,
     DEFAULT_FLOWER_PORT,
 )
@@ -400,6 +401,38 @@ def _cmd_show_export_queue(
     )
 
 
+def _cmd_export_basic_dump(
+    filename: str,
+    viewtype: str,
+    task_types: List[str] = None,
+    group_ids: List[int] = None,
+    simplified: bool = False,
+    sort_by_heading: bool = False,
+    include_information_schema: bool = False,
+) -> None:
+    import camcops_server.camcops_server_core as core
+
+    # ... delayed import; import side effects
+
+    core.cmd_export_basic_dump(
+        filename=filename,
+        viewtype=viewtype,
+        task_types=task_types,
+        group_ids=group_ids,
+        simplified=simplified,
+        sort_by_heading=sort_by_heading,
+        include_information_schema=include_information_schema,
+    )
+
+
+def _cmd_reconcile_user_downloads() -> None:
+    import camcops_server.camcops_server_core as core
+
+    # ... delayed import; import side effects
+
+    core.cmd_reconcile_user_downloads()
+
+
 def _cmd_crate_dd(filename: str, recipient_name: str) -> None:
     import camcops_server.camcops_server_core as core
 
@@ -449,6 +482,16 @@ def _serve_gunicorn(cfg: "CamcopsConfig") -> None:
     core.serve_gunicorn(cfg)
 
 
+def _cmd_startup_diagnostics(
+    cfg: "CamcopsConfig", num_workers: int, preload: bool
+) -> None:
+    import camcops_server.camcops_server_core as core
+
+    # ... delayed import; import side effects
+
+    core.cmd_startup_diagnostics(cfg, num_workers=num_workers, preload=preload)
+
+
 # -----------------------------------------------------------------------------
 # Celery etc.
 # -----------------------------------------------------------------------------
@@ -1203,6 +1246,79 @@ def camcops_main() -> int:
         )
     )
 
+    # Write a basic (spreadsheet-style) research dump
+    basic_dump_parser = add_sub(
+        subparsers,
+        "export_basic_dump",
+        help="Write a spreadsheet-style research dump of tasks to a file "
+        "(as for the web 'basic research dump')",
+    )
+    basic_dump_parser.add_argument(
+        "--filename",
+        type=str,
+        required=True,
+        help="Output filename",
+    )
+    basic_dump_parser.add_argument(
+        "--format",
+        type=str,
+        # Values of ViewArg:
+        choices=["ods", "parquet_zip", "r", "tsv_zip", "xlsx"],
+        default="xlsx",
+        help="Output format: ODS, ZIP of Apache Parquet files, R script, ZIP "
+        "of TSV files, or XLSX",
+    )
+    basic_dump_parser.add_argument(
+        "--task_types",
+        type=str,
+        nargs="*",
+        help="Task types (table names) to include (if omitted: all)",
+    )
+    basic_dump_parser.add_argument(
+        "--group_ids",
+        type=int,
+        nargs="*",
+        help="Group IDs to include (if omitted: all)",
+    )
+    basic_dump_parser.add_argument(
+        "--simplified",
+        action="store_true",
+        help="Simplify spreadsheets (omit less useful columns)",
+    )
+    basic_dump_parser.add_argument(
+        "--sort_by_heading",
+        action="store_true",
+        help="Sort columns within each page by heading name",
+    )
+    basic_dump_parser.add_argument(
+        "--include_information_schema",
+        action="store_true",
+        help="Include descriptions of the database source columns",
+    )
+    basic_dump_parser.set_defaults(
+        func=lambda args: _cmd_export_basic_dump(
+            filename=args.filename,
+            viewtype=args.format,
+            task_types=args.task_types,
+            group_ids=args.group_ids,
+            simplified=args.simplified,
+            sort_by_heading=args.sort_by_heading,
+            include_information_schema=args.include_information_schema,
+        )
+    )
+
+    # Reconcile the ledger of user download files with the disk
+    reconcile_downloads_parser = add_sub(
+        subparsers,
+        "reconcile_user_downloads",
+        help="Bring the database's record of user download files (used for "
+        "quotas and expiry) into line with the files in the user download "
+        "directory",
+    )
+    reconcile_downloads_parser.set_defaults(
+        func=lambda args: _cmd_reconcile_user_downloads()
+    )
+
     # Make CRATE data dictionary
     crate_dd_parser = add_sub(
         subparsers,
@@ -1273,6 +1389,34 @@ def camcops_main() -> int:
         func=lambda args: _serve_gunicorn(cfg=get_default_config_from_os_env())
     )
 
+    # Web server startup diagnostics
+    startup_diagnostics_parser = add_sub(
+        subparsers,
+        "startup_diagnostics",
+        help="Report web server startup time and memory use per worker "
+        "process, by loading the application and forking workers as "
+        "serve_gunicorn does (UNIX only; memory use is reported under Linux)",
+    )
+    startup_diagnostics_parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=2,
+        help="Number of worker processes to start",
+    )
+    startup_diagnostics_parser.add_argument(
+        "--no_preload",
+        action="store_true",
+        help="Have each worker load the application, as with "
+        "GUNICORN_PRELOAD_APP = False",
+    )
+    startup_diagnostics_parser.set_defaults(
+        func=lambda args: _cmd_startup_diagnostics(
+            cfg=get_default_config_from_os_env(),
+            num_workers=args.num_workers,
+            preload=not args.no_preload,
+        )
+    )
+
     # Serve via the Pyramid test server
     serve_pyr_parser = add_sub(
         subparsers,
@@ -1330,6 +1474,18 @@ def camcops_main() -> int:
         )
     )
 
+    compile_snomed_parser = add_sub(
+        subparsers,
+        "compile_snomed",
+        help=f"Compile the SNOMED-CT XML files (see "
+        f"{ConfigParamSite.SNOMED_TASK_XML_FILENAME} etc.) into the file "
+        f"given by {ConfigParamSite.SNOMED_COMPILED_FILENAME}, from which "
+        f"the server will look up SNOMED-CT concepts as they are needed",
+    )
+    compile_snomed_parser.set_defaults(
+        func=lambda args: get_default_config_from_os_env().compile_snomed()
+    )
+
     # -------------------------------------------------------------------------
     # Celery options
     # -------------------------------------------------------------------------
@@ -41,18 +41,29 @@ Importing this module does the following:
 # for gunicorn from the command line; I'm less clear about whether the disk
 # logs look polluted by ANSI codes; needs checking.
 import logging
+import time
 from cardinal_pythonlib.logs import BraceStyleAdapter
 
 log = BraceStyleAdapter(logging.getLogger(__name__))
 log.info("Imports starting")
+_imports_started_at = time.perf_counter()
 
 # Main imports (E402 relates to imports not at the top of the file)
 
+import gc  # noqa: E402
+import json  # noqa: E402
 import os  # noqa: E402
 import platform  # noqa: E402
 import sys  # noqa: E402
 import subprocess  # noqa: E402
-from typing import Any, Dict, List, TYPE_CHECKING  # noqa: E402
+from typing import (  # noqa: E402
+    Any,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+)
 
 import cherrypy  # noqa: E402
 
@@ -62,10 +73,12 @@ except ImportError:
     BaseApplication = (
         None  # e.g. on Windows: "ImportError: no module named 'fcntl'".
     )
+from webob import Request  # noqa: E402
 from wsgiref.simple_server import make_server  # noqa: E402
 
 from cardinal_pythonlib.fileops import mkdir_p  # noqa: E402
 from cardinal_pythonlib.process import nice_call  # noqa: E402
+from cardinal_pythonlib.sizeformatter import bytes2human  # noqa: E402
 from cardinal_pythonlib.ui_commandline import (  # noqa: E402
     ask_user,
     ask_user_password,
@@ -81,7 +94,7 @@ from cardinal_pythonlib.wsgi.reverse_proxied_mw import (  # noqa: E402
 
 # Import this one early:
 # noinspection PyUnresolvedReferences
-import camcops_server.cc_modules.cc_all_models  # noqa: E402
+import camcops_server.cc_modules.cc_all_models  # noqa: E402, F401
 
 # ... import side effects (ensure all models registered)
 
@@ -90,8 +103,9 @@ from camcops_server.cc_modules.cc_anon import (  # noqa: E402
     write_cris_data_dictionary,
 )
 
-# noinspection PyUnresolvedReferences
-import camcops_server.cc_modules.client_api  # noqa: E402, F401
+from camcops_server.cc_modules.client_api import (  # noqa: E402
+    get_extra_strings_payload,
+)
 
 # ... import side effects (register unit test)
 
@@ -102,14 +116,23 @@ from camcops_server.cc_modules.cc_constants import (  # noqa: E402
     DEFAULT_FLOWER_PORT,
     USER_NAME_FOR_SYSTEM,
 )
+from camcops_server.cc_modules.cc_debug import (  # noqa: E402
+    get_memory_usage_bytes,
+)
 from camcops_server.cc_modules.cc_exception import (  # noqa: E402
     raise_runtime_error,
 )
 from camcops_server.cc_modules.cc_export import (  # noqa: E402
+    DownloadOptions,
+    make_exporter,
     print_export_queue,
     export,
 )
-from camcops_server.cc_modules.cc_pyramid import RouteCollection  # noqa: E402
+from camcops_server.cc_modules.cc_pyramid import (  # noqa: E402
+    precompile_mako_templates,
+    RouteCollection,
+    ViewArg,
+)
 from camcops_server.cc_modules.cc_request import (  # noqa: E402
     CamcopsRequest,
     command_line_request_context,
@@ -119,6 +142,11 @@ from camcops_server.cc_modules.cc_string import (  # noqa: E402
     all_extra_strings_as_dicts,
 )
 from camcops_server.cc_modules.cc_task import Task  # noqa: E402
+from camcops_server.cc_modules.cc_taskcollection import (  # noqa: E402
+    TaskCollection,
+    TaskSortMethod,
+)
+from camcops_server.cc_modules.cc_taskfilter import TaskFilter  # noqa: E402
 from camcops_server.cc_modules.cc_taskindex import (  # noqa: E402
     check_indexes,
     reindex_everything,
@@ -130,6 +158,9 @@ from camcops_server.cc_modules.cc_user import (  # noqa: E402
     set_password_directly,
     User,
 )
+from camcops_server.cc_modules.cc_userdownload import (  # noqa: E402
+    reconcile_user_downloads,
+)
 from camcops_server.cc_modules.cc_validators import (  # noqa: E402
     validate_new_password,
 )
@@ -138,6 +169,7 @@ from camcops_server.cc_modules.celery import (  # noqa: E402
     CELERY_SOFT_TIME_LIMIT_SEC,
 )
 
+IMPORT_DURATION_S = time.perf_counter() - _imports_started_at
 log.info("Imports complete")
 log.info("Using {} task types", len(Task.all_subclasses_by_tablename()))
 
@@ -206,6 +238,10 @@ def precache(config: CamcopsConfig) -> None:
     _ = config.get_icd10_snomed_concepts()
     with command_line_request_context() as req:
         _ = req.get_export_recipients(all_recipients=True)
+        if not config.restricted_tasks:
+            # Otherwise, the payloads depend on the user, and are built on
+            # first use.
+            _ = get_extra_strings_payload(req)
 
 
 # =============================================================================
@@ -336,6 +372,31 @@ def ensure_ok_for_webserver(config: CamcopsConfig) -> None:
     precache(config)
 
 
+def prepare_to_fork_workers(config: CamcopsConfig) -> None:
+    """
+    Called in a web server's master process, once it has loaded the
+    application and before it forks worker processes, so that the workers
+    share (copy-on-write) as much as possible of what has been loaded.
+    """
+    log.info("Compiled {} templates", precompile_mako_templates())
+    # Database connections can't be shared between processes. Close the
+    # master's, so that each worker makes its own.
+    config.get_sqla_engine().dispose()
+    # Hide everything loaded so far from the garbage collector, whose scans
+    # would otherwise write to (and so un-share) the memory holding it.
+    gc.collect()
+    gc.freeze()
+
+
+def after_fork_in_worker(config: CamcopsConfig) -> None:
+    """
+    Called in a newly forked web server worker process.
+    """
+    # Forget (without closing) any database connections inherited from the
+    # master; closing them would affect the master's use of them.
+    config.get_sqla_engine().dispose(close=False)
+
+
 def make_wsgi_app_from_config(cfg: "CamcopsConfig") -> "Router":
     """
     Creates a WSGI application from the config.
@@ -486,9 +547,6 @@ def serve_gunicorn(
             "(It relies on the UNIX fork() facility.)"
         )
 
-    ensure_ok_for_webserver(cfg)
-    application = make_wsgi_app_from_config(cfg)
-
     host = cfg.host
     port = cfg.port
     unix_domain_socket_filename = cfg.unix_domain_socket
@@ -498,6 +556,20 @@ def serve_gunicorn(
     reload = cfg.gunicorn_debug_reload
     timeout_s = cfg.gunicorn_timeout_s
     debug_show_gunicorn_options = cfg.debug_show_gunicorn_options
+    # Gunicorn can't reload code that the master process has loaded.
+    preload_app = cfg.gunicorn_preload_app and not reload
+
+    if preload_app:
+        log.info("Loading application before starting workers")
+        ensure_ok_for_webserver(cfg)
+        application = make_wsgi_app_from_config(cfg)
+        prepare_to_fork_workers(cfg)
+    else:
+        log.info("Each worker will load the application")
+        ensure_database_is_ok(cfg)
+        ensure_directories_exist(cfg)
+        cfg.get_sqla_engine().dispose()
+        application = None
 
     # Report on options, and calculate Gunicorn versions
     if unix_domain_socket_filename:
@@ -520,7 +592,7 @@ def serve_gunicorn(
     class StandaloneApplication(BaseApplication):
         def __init__(
             self,
-            app_: "Router",
+            app_: Optional["Router"],
             options: Dict[str, Any] = None,
             debug_show_known_settings: bool = False,
         ) -> None:
@@ -545,12 +617,21 @@ def serve_gunicorn(
                     self.cfg.set(key_lower, value)
 
         def load(self) -> "Router":
+            if self.application is None:  # not preloaded; we're a worker
+                precache(cfg)
+                return make_wsgi_app_from_config(cfg)
             return self.application
 
+    # noinspection PyUnusedLocal
+    def post_fork(server: Any, worker: Any) -> None:
+        after_fork_in_worker(cfg)
+
     opts = {
         "bind": bind,
         "certfile": ssl_certificate,
         "keyfile": ssl_private_key,
+        "post_fork": post_fork,
+        "preload_app": preload_app,
         "reload": reload,
         "timeout": timeout_s,
         "workers": num_workers,
@@ -563,6 +644,118 @@ def serve_gunicorn(
     app.run()
 
 
+def cmd_startup_diagnostics(
+    cfg: CamcopsConfig, num_workers: int = 2, preload: bool = True
+) -> None:
+    """
+    Reports how long the web server takes to start, and how much memory its
+    master and worker processes use. This does what ``serve_gunicorn`` does,
+    without serving anything: the master process loads the application (if
+    ``preload``) and forks ``num_workers`` workers, each of which loads the
+    application (if not ``preload``) and handles one request for the login
+    page. Memory use is then measured with all the workers still running.
+
+    UNIX only. Memory use is only reported under Linux.
+
+    Args:
+        cfg:
+            the CamCOPS config
+        num_workers:
+            number of worker processes
+        preload:
+            load the application before forking, as with the
+            ``GUNICORN_PRELOAD_APP`` config parameter?
+    """
+    if not hasattr(os, "fork"):
+        raise_runtime_error("This diagnostic needs fork(), which is UNIX only")
+
+    def memory_description(pid: int = None) -> str:
+        usage = get_memory_usage_bytes(pid)
+        if usage is None:
+            return "memory use unknown"
+        return ", ".join(
+            f"{k} {bytes2human(usage[k])}"
+            for k in ("rss", "pss", "private", "shared")
+        )
+
+    def timed(description: str, func: Any) -> Any:
+        start = time.perf_counter()
+        result = func()
+        print(f"{description}: {time.perf_counter() - start:.2f} s")
+        return result
+
+    print(f"Mode: {'preloaded' if preload else 'not preloaded'}")
+    print(f"Imports: {IMPORT_DURATION_S:.2f} s")
+    if preload:
+        timed(
+            "Database check and cache population",
+            lambda: ensure_ok_for_webserver(cfg),
+        )
+        application = timed(
+            "WSGI application", lambda: make_wsgi_app_from_config(cfg)
+        )
+        timed("Preparation for forking", lambda: prepare_to_fork_workers(cfg))
+    else:
+        timed("Database check", lambda: ensure_database_is_ok(cfg))
+        cfg.get_sqla_engine().dispose()
+        application = None
+    print(f"Master process: {memory_description()}")
+
+    def worker(ready_fd: int, release_fd: int) -> None:
+        start = time.perf_counter()
+        after_fork_in_worker(cfg)
+        app = application
+        if app is None:
+            precache(cfg)
+            app = make_wsgi_app_from_config(cfg)
+        loaded = time.perf_counter()
+        response = Request.blank(RouteCollection.LOGIN.path).get_response(app)
+        result = dict(
+            load_s=loaded - start,
+            request_s=time.perf_counter() - loaded,
+            status=response.status,
+        )
+        with os.fdopen(ready_fd, "w") as f:
+            json.dump(result, f)
+        os.read(release_fd, 1)  # wait until the master has measured us
+
+    release_read_fd, release_write_fd = os.pipe()
+    workers = []  # type: List[Tuple[int, int]]
+    for _ in range(num_workers):
+        ready_read_fd, ready_write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # worker process
+            os.close(ready_read_fd)
+            os.close(release_write_fd)
+            exitcode = 0
+            try:
+                worker(ready_write_fd, release_read_fd)
+            except Exception:
+                log.exception("Worker failed")
+                exitcode = 1
+            os._exit(exitcode)
+        os.close(ready_write_fd)
+        workers.append((pid, ready_read_fd))
+    os.close(release_read_fd)
+
+    for i, (pid, ready_read_fd) in enumerate(workers, start=1):
+        with os.fdopen(ready_read_fd) as f:
+            data = f.read()
+        if not data:
+            print(f"Worker {i} (PID {pid}): failed")
+            continue
+        result = json.loads(data)
+        print(
+            f"Worker {i} (PID {pid}): "
+            f"loading {result['load_s']:.2f} s, "
+            f"first request {result['request_s']:.2f} s "
+            f"({result['status']}); {memory_description(pid)}"
+        )
+    os.close(release_write_fd)
+    for pid, _ in workers:
+        os.waitpid(pid, 0)
+
+
 # =============================================================================
 # Helper functions for command-line functions
 # =============================================================================
@@ -704,6 +897,75 @@ def cmd_export(
         )
 
 
+def cmd_export_basic_dump(
+    filename: str,
+    viewtype: str = ViewArg.XLSX,
+    task_types: List[str] = None,
+    group_ids: List[int] = None,
+    simplified: bool = False,
+    sort_by_heading: bool = False,
+    include_information_schema: bool = False,
+) -> None:
+    """
+    Writes a spreadsheet-style "basic" research dump of tasks to a file, as
+    for the equivalent web download (but with bounded memory use).
+
+    Args:
+        filename:
+            Output filename.
+        viewtype:
+            Output format (e.g. ``xlsx``, ``parquet_zip``), as for
+            :class:`camcops_server.cc_modules.cc_pyramid.ViewArg`.
+        task_types:
+            Task table names to restrict to (default: all).
+        group_ids:
+            Group IDs to restrict to (default: all).
+        simplified:
+            Simplify the spreadsheets (remove less useful columns)?
+        sort_by_heading:
+            Sort columns within each page by heading name?
+        include_information_schema:
+            Include descriptions of the database source columns?
+    """
+    with command_line_request_context() as req:
+        taskfilter = TaskFilter()
+        if task_types:
+            taskfilter.task_types = task_types
+        if group_ids:
+            taskfilter.group_ids = group_ids
+        collection = TaskCollection(
+            req=req,
+            taskfilter=taskfilter,
+            as_dump=True,
+            sort_method_by_class=TaskSortMethod.CREATION_DATE_ASC,
+        )
+        exporter = make_exporter(
+            req=req,
+            collection=collection,
+            options=DownloadOptions(
+                user_id=req.user_id,
+                viewtype=viewtype,
+                delivery_mode=ViewArg.DOWNLOAD,
+                spreadsheet_simplified=simplified,
+                spreadsheet_sort_by_heading=sort_by_heading,
+                include_information_schema_columns=include_information_schema,
+                include_summary_schema=True,
+            ),
+        )
+        fullpath = os.path.abspath(filename)
+        exporter.write_file_body(fullpath)
+        log.info("Wrote {}", fullpath)
+
+
+def cmd_reconcile_user_downloads() -> None:
+    """
+    Brings the ledger of user download files into line with the files on
+    disk.
+    """
+    with command_line_request_context() as req:
+        reconcile_user_downloads(req)
+
+
 def make_data_dictionary(
     filename: str, recipient_name: str, cris: bool = False
 ) -> None:
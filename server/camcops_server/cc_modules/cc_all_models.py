@@ -99,6 +99,7 @@ from camcops_server.cc_modules.cc_taskschedule import (
 # noinspection PyUnresolvedReferences
 from camcops_server.cc_modules.cc_taskindex import (
     PatientIdNumIndexEntry,
+    PendingIndexUpdate,
     TaskIndexEntry,
 )
 from camcops_server.cc_modules.cc_user import (
@@ -106,6 +107,7 @@ from camcops_server.cc_modules.cc_user import (
     SecurityLoginFailure,
     User,
 )
+from camcops_server.cc_modules.cc_userdownload import UserDownloadRecord
 
 # -----------------------------------------------------------------------------
 # Task imports
@@ -173,6 +175,7 @@ RESERVED_TABLE_NAMES = [
     group_group_table.name,
     IdNumDefinition.__tablename__,
     PatientIdNumIndexEntry.__tablename__,
+    PendingIndexUpdate.__tablename__,
     SecurityAccountLockout.__tablename__,
     SecurityLoginFailure.__tablename__,
     ServerSettings.__tablename__,
@@ -182,6 +185,7 @@ RESERVED_TABLE_NAMES = [
     TaskSchedule.__tablename__,
     TaskScheduleItem.__tablename__,
     User.__tablename__,
+    UserDownloadRecord.__tablename__,
     UserGroupMembership.__tablename__,
 ]
 
@@ -107,14 +107,47 @@ Crash using type-hinted functions under Python 3.5 with dogpile.cache==0.6.4:
 
   - there should be no calls to cache_region_static.delete
 
+4. SHARED CACHE FOR DATABASE-DERIVED DATA
+
+- ``cache_region_shared`` holds small, rarely changing, database-derived data
+  (e.g. ID number definitions). Its backend is set by the
+  ``SHARED_CACHE_BACKEND`` config parameter: none (the default; nothing is
+  cached), a DBM file shared by processes on one host, or Redis. There is no
+  per-process memory option: a commit in one process could not invalidate
+  the copies held by others.
+
+- Each kind of data has a "generation" (a random token, kept in the shared
+  cache), which is part of the key under which its values are cached. After a
+  database transaction that changed the relevant ORM objects commits, the
+  generation is replaced, so every process then misses and reloads. Values
+  computed from the old data can only be stored under the old generation.
+  Changes made other than through the ORM (e.g. raw SQL) are not seen; the
+  ``SHARED_CACHE_EXPIRATION_S`` parameter limits how long those may be stale.
+
 """  # noqa
 
 # =============================================================================
 # Imports; logging
 # =============================================================================
 
+import logging
+import threading
+from typing import Any, Callable, Dict, Set, Type, TYPE_CHECKING
+import uuid
+
 from cardinal_pythonlib.dogpile_cache import kw_fkg_allowing_type_hints as fkg
-from dogpile.cache import make_region
+from cardinal_pythonlib.logs import BraceStyleAdapter
+from dogpile.cache import CacheRegion, make_region
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SqlASession
+
+from camcops_server.cc_modules.cc_constants import SharedCacheBackendNames
+
+if TYPE_CHECKING:
+    from camcops_server.cc_modules.cc_config import CamcopsConfig
+    from camcops_server.cc_modules.cc_request import CamcopsRequest
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
 
 # =============================================================================
 # The main cache: static for the lifetime of this process.
@@ -131,3 +164,179 @@ cache_region_static.configure(
 
 # https://stackoverflow.com/questions/44834/can-someone-explain-all-in-python
 __all__ = ["cache_region_static", "fkg"]  # prevents "Unused import statement"
+
+
+# =============================================================================
+# The shared cache, for database-derived data.
+# =============================================================================
+
+cache_region_shared = make_region()
+_shared_cache_config_lock = threading.Lock()
+
+_GENERATIONS_TO_REPLACE_INFO_KEY = "camcops_cache_generations_to_replace"
+_generation_names_by_class = {}  # type: Dict[Type, str]
+
+
+def configure_shared_cache(
+    backend_name: str,
+    filename: str = "",
+    redis_url: str = "",
+    expiration_time_s: int = 600,
+) -> None:
+    """
+    Configures (or reconfigures) the shared cache region.
+
+    Args:
+        backend_name:
+            one of the values in
+            :class:`camcops_server.cc_modules.cc_constants.SharedCacheBackendNames`
+        filename:
+            DBM filename, for the file backend
+        redis_url:
+            Redis URL (e.g. ``redis://localhost:6379/0``), for the Redis
+            backend
+        expiration_time_s:
+            time after which values are recomputed regardless
+    """
+    arguments = {}  # type: Dict[str, Any]
+    if backend_name == SharedCacheBackendNames.NONE:
+        backend = "dogpile.cache.null"
+    elif backend_name == SharedCacheBackendNames.FILE:
+        backend = "dogpile.cache.dbm"
+        arguments["filename"] = filename
+    elif backend_name == SharedCacheBackendNames.REDIS:
+        backend = "dogpile.cache.redis"  # requires the "redis" package
+        arguments["url"] = redis_url
+        arguments["distributed_lock"] = True
+    else:
+        raise ValueError(f"Unknown shared cache backend: {backend_name!r}")
+    cache_region_shared.configure(
+        backend,
+        expiration_time=expiration_time_s,
+        arguments=arguments,
+        replace_existing_backend=True,
+    )
+    log.debug("Shared cache configured with backend {!r}", backend)
+
+
+def get_shared_cache_region(cfg: "CamcopsConfig") -> CacheRegion:
+    """
+    Returns the shared cache region, configuring it from the CamCOPS config
+    on first use.
+    """
+    if not cache_region_shared.is_configured:
+        with _shared_cache_config_lock:
+            if not cache_region_shared.is_configured:
+                configure_shared_cache(
+                    backend_name=cfg.shared_cache_backend,
+                    filename=cfg.shared_cache_filename,
+                    redis_url=cfg.shared_cache_redis_url,
+                    expiration_time_s=cfg.shared_cache_expiration_s,
+                )
+    return cache_region_shared
+
+
+def _generation_key(generation_name: str) -> str:
+    return f"generation:{generation_name}"
+
+
+def get_cache_generation(region: CacheRegion, generation_name: str) -> str:
+    """
+    Returns the current generation token for a kind of cached data, creating
+    one if necessary.
+    """
+    return region.get_or_create(
+        _generation_key(generation_name),
+        lambda: uuid.uuid4().hex,
+        expiration_time=-1,  # never expires
+    )
+
+
+def replace_cache_generation(
+    region: CacheRegion, generation_name: str
+) -> None:
+    """
+    Replaces the generation token for a kind of cached data, so that values
+    cached under the old token are no longer used.
+    """
+    region.set(_generation_key(generation_name), uuid.uuid4().hex)
+
+
+def _session_changes_generation(
+    session: SqlASession, generation_name: str
+) -> bool:
+    """
+    Has this session changed (or is it about to change) the data behind
+    ``generation_name``, without yet committing?
+    """
+    if generation_name in session.info.get(
+        _GENERATIONS_TO_REPLACE_INFO_KEY, ()
+    ):
+        return True
+    return any(
+        _generation_names_by_class.get(type(obj)) == generation_name
+        for obj in (*session.new, *session.dirty, *session.deleted)
+    )
+
+
+def get_or_create_shared(
+    req: "CamcopsRequest", generation_name: str, creator: Callable[[], Any]
+) -> Any:
+    """
+    Fetches a value from the shared cache, for the current generation of its
+    data, calling ``creator`` to make it if necessary. The value must be
+    picklable and should be plain data, not ORM objects.
+
+    If no shared cache is configured, or the request's database session has
+    uncommitted changes to the data (which may yet be rolled back),
+    ``creator`` is called and nothing is cached.
+    """
+    if req.config.shared_cache_backend == SharedCacheBackendNames.NONE:
+        return creator()
+    region = get_shared_cache_region(req.config)
+    if _session_changes_generation(req.dbsession, generation_name):
+        return creator()
+    generation = get_cache_generation(region, generation_name)
+    return region.get_or_create(f"{generation_name}:{generation}", creator)
+
+
+def replace_generation_on_commit(cls: Type, generation_name: str) -> None:
+    """
+    Registers an ORM class whose objects are the source of a kind of cached
+    data: when a transaction that adds, changes, or deletes such objects
+    commits, that data's generation is replaced.
+    """
+    _generation_names_by_class[cls] = generation_name
+
+
+@event.listens_for(SqlASession, "after_flush")
+def _note_cached_data_changes(
+    session: SqlASession, flush_context: Any
+) -> None:
+    changed = set()  # type: Set[str]
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        generation_name = _generation_names_by_class.get(type(obj))
+        if generation_name:
+            changed.add(generation_name)
+    if changed:
+        session.info.setdefault(
+            _GENERATIONS_TO_REPLACE_INFO_KEY, set()
+        ).update(changed)
+
+
+@event.listens_for(SqlASession, "after_commit")
+def _replace_changed_generations(session: SqlASession) -> None:
+    changed = session.info.pop(_GENERATIONS_TO_REPLACE_INFO_KEY, None)
+    if not changed or not cache_region_shared.is_configured:
+        # CamcopsRequest.dbsession configures the region, so if it is not
+        # configured, this is a session with no CamCOPS request (e.g. during
+        # database upgrades), and there is nothing to invalidate.
+        return
+    for generation_name in sorted(changed):
+        log.debug("Replacing shared cache generation: {}", generation_name)
+        replace_cache_generation(cache_region_shared, generation_name)
+
+
+@event.listens_for(SqlASession, "after_rollback")
+def _forget_cached_data_changes(session: SqlASession) -> None:
+    session.info.pop(_GENERATIONS_TO_REPLACE_INFO_KEY, None)
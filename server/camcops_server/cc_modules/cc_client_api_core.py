@@ -96,6 +96,7 @@ class TabletParam(object):
     DUE_FROM = "due_from"  # C->S; new in v2.4.0
     EMAIL = "email"  # C->S; new in v2.4.0
     ERROR = "error"  # S->C
+    EXTRA_STRINGS_HASH = "extra_strings_hash"  # B; new in v2.4.24
     FIELDS = "fields"  # B
     FINALIZING = "finalizing"
     # ... C->S, in JSON and upload_entire_database, v2.3.0; synonym for
@@ -649,6 +650,43 @@ class UploadTableChanges(object):
         if preserving or sr.move_off_tablet:
             self.note_preservation_pk(pk)
 
+    # -------------------------------------------------------------------------
+    # Storage, for processing later
+    # -------------------------------------------------------------------------
+
+    def pks_as_dict(self) -> Dict[str, List[int]]:
+        """
+        Returns all the PKs we know about, as a JSON-serializable dictionary
+        that :meth:`from_pks_dict` will read back.
+        """
+        return {
+            "addition": self.addition_pks,
+            "removal_modified": self.removal_modified_pks,
+            "removal_deleted": self.removal_deleted_pks,
+            "preservation": self.preservation_pks,
+            "current": self.current_pks,
+        }
+
+    @classmethod
+    def from_pks_dict(
+        cls, table: Table, pks: Dict[str, List[int]]
+    ) -> "UploadTableChanges":
+        """
+        Recreates an :class:`UploadTableChanges` from the output of
+        :meth:`pks_as_dict`.
+
+        Args:
+            table: the SQLAlchemy :class:`Table`
+            pks: dictionary from :meth:`pks_as_dict`
+        """
+        tablechanges = cls(table)
+        tablechanges.note_addition_pks(pks["addition"])
+        tablechanges.note_removal_modified_pks(pks["removal_modified"])
+        tablechanges.note_removal_deleted_pks(pks["removal_deleted"])
+        tablechanges.note_preservation_pks(pks["preservation"])
+        tablechanges.note_current_pks(pks["current"])
+        return tablechanges
+
     # -------------------------------------------------------------------------
     # Counts
     # -------------------------------------------------------------------------
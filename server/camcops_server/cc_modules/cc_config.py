@@ -76,7 +76,7 @@ import os
 import logging
 import re
 from subprocess import run, PIPE
-from typing import Any, Dict, Generator, List, Optional, Union
+from typing import Any, Dict, Generator, List, Mapping, Optional, Union
 
 from cardinal_pythonlib.classes import class_attribute_values
 from cardinal_pythonlib.configfiles import (
@@ -129,9 +129,16 @@ from camcops_server.cc_modules.cc_constants import (
     ConfigParamServer,
     ConfigParamSite,
     DockerConstants,
+    ExportLockBackendNames,
     MfaMethod,
+    SendfileMethodNames,
+    SharedCacheBackendNames,
     SmsBackendNames,
 )
+from camcops_server.cc_modules.cc_exportlock import (
+    ExportLockManager,
+    make_export_lock_manager,
+)
 from camcops_server.cc_modules.cc_exportrecipientinfo import (
     ExportRecipientInfo,
 )
@@ -149,6 +156,7 @@ from camcops_server.cc_modules.cc_snomed import (
     get_icd9_snomed_concepts_from_xml,
     get_icd10_snomed_concepts_from_xml,
     SnomedConcept,
+    write_compiled_snomed_concepts,
 )
 from camcops_server.cc_modules.cc_validators import (
     validate_export_recipient_name,
@@ -355,12 +363,14 @@ def get_demo_config(for_docker: bool = False) -> str:
 {ConfigParamSite.CAMCOPS_LOGO_FILE_ABSOLUTE} = {cd.CAMCOPS_LOGO_FILE_ABSOLUTE}
 
 {ConfigParamSite.EXTRA_STRING_FILES} = {cd.EXTRA_STRING_FILES}
+{ConfigParamSite.EXTRA_STRINGS_COMPILED_FILENAME} =
 {ConfigParamSite.RESTRICTED_TASKS} =
 {ConfigParamSite.LANGUAGE} = {cd.LANGUAGE}
 
 {ConfigParamSite.SNOMED_TASK_XML_FILENAME} =
 {ConfigParamSite.SNOMED_ICD9_XML_FILENAME} =
 {ConfigParamSite.SNOMED_ICD10_XML_FILENAME} =
+{ConfigParamSite.SNOMED_COMPILED_FILENAME} =
 
 {ConfigParamSite.WKHTMLTOPDF_FILENAME} =
 
@@ -378,6 +388,7 @@ def get_demo_config(for_docker: bool = False) -> str:
 {ConfigParamSite.MFA_TIMEOUT_S} = {cd.MFA_TIMEOUT_S}
 {ConfigParamSite.SESSION_COOKIE_SECRET} = camcops_autogenerated_secret_{session_cookie_secret}
 {ConfigParamSite.SESSION_TIMEOUT_MINUTES} = {cd.SESSION_TIMEOUT_MINUTES}
+{ConfigParamSite.SESSION_ACTIVITY_GRANULARITY_S} = {cd.SESSION_ACTIVITY_GRANULARITY_S}
 {ConfigParamSite.SESSION_CHECK_USER_IP} = {cd.SESSION_CHECK_USER_IP}
 {ConfigParamSite.PASSWORD_CHANGE_FREQUENCY_DAYS} = {cd.PASSWORD_CHANGE_FREQUENCY_DAYS}
 {ConfigParamSite.LOCKOUT_THRESHOLD} = {cd.LOCKOUT_THRESHOLD}
@@ -422,6 +433,24 @@ def get_demo_config(for_docker: bool = False) -> str:
 {ConfigParamSite.USER_DOWNLOAD_DIR} = {cd.USER_DOWNLOAD_DIR}
 {ConfigParamSite.USER_DOWNLOAD_FILE_LIFETIME_MIN} = {cd.USER_DOWNLOAD_FILE_LIFETIME_MIN}
 {ConfigParamSite.USER_DOWNLOAD_MAX_SPACE_MB} = {cd.USER_DOWNLOAD_MAX_SPACE_MB}
+{ConfigParamSite.USER_DOWNLOAD_SENDFILE} = {cd.USER_DOWNLOAD_SENDFILE}
+{ConfigParamSite.USER_DOWNLOAD_ACCEL_REDIRECT_PREFIX} =
+
+# -----------------------------------------------------------------------------
+# Caching options
+# -----------------------------------------------------------------------------
+
+{ConfigParamSite.SHARED_CACHE_BACKEND} = {cd.SHARED_CACHE_BACKEND}
+{ConfigParamSite.SHARED_CACHE_FILENAME} =
+{ConfigParamSite.SHARED_CACHE_REDIS_URL} =
+{ConfigParamSite.SHARED_CACHE_EXPIRATION_S} = {cd.SHARED_CACHE_EXPIRATION_S}
+
+# -----------------------------------------------------------------------------
+# Upload processing options
+# -----------------------------------------------------------------------------
+
+{ConfigParamSite.INDEX_UPLOADS_IN_BACKGROUND} = {cd.INDEX_UPLOADS_IN_BACKGROUND}
+{ConfigParamSite.CLIENT_API_MAX_DECOMPRESSED_MB} = {cd.CLIENT_API_MAX_DECOMPRESSED_MB}
 
 # -----------------------------------------------------------------------------
 # Debugging options
@@ -505,6 +534,7 @@ def get_demo_config(for_docker: bool = False) -> str:
 {ConfigParamServer.GUNICORN_NUM_WORKERS} = {cd.GUNICORN_NUM_WORKERS}
 {ConfigParamServer.GUNICORN_DEBUG_RELOAD} = {cd.GUNICORN_DEBUG_RELOAD}
 {ConfigParamServer.GUNICORN_TIMEOUT_S} = {cd.GUNICORN_TIMEOUT_S}
+{ConfigParamServer.GUNICORN_PRELOAD_APP} = {cd.GUNICORN_PRELOAD_APP}
 {ConfigParamServer.DEBUG_SHOW_GUNICORN_OPTIONS} = {cd.DEBUG_SHOW_GUNICORN_OPTIONS}
 
 
@@ -524,6 +554,7 @@ def get_demo_config(for_docker: bool = False) -> str:
     --max-tasks-per-child=1000
     --max-memory-per-child=100000
 {ConfigParamExportGeneral.CELERY_EXPORT_TASK_RATE_LIMIT} = 100/m
+{ConfigParamExportGeneral.EXPORT_LOCK_BACKEND} = {cd.EXPORT_LOCK_BACKEND}
 {ConfigParamExportGeneral.EXPORT_LOCKDIR} = {cd.EXPORT_LOCKDIR}
 
 {ConfigParamExportGeneral.RECIPIENTS} =
@@ -1291,6 +1322,11 @@ class CamcopsConfig(object):
             self.client_api_loglevel
         )
         # ... MUTABLE GLOBAL STATE (if relatively unimportant); todo: fix
+        self.client_api_max_decompressed_mb = _get_int(
+            s,
+            cs.CLIENT_API_MAX_DECOMPRESSED_MB,
+            cd.CLIENT_API_MAX_DECOMPRESSED_MB,
+        )
 
         self.disable_password_autocomplete = _get_bool(
             s,
@@ -1317,6 +1353,13 @@ class CamcopsConfig(object):
         self.email_reply_to = _get_str(s, cs.EMAIL_REPLY_TO, "")
 
         self.extra_string_files = _get_multiline(s, cs.EXTRA_STRING_FILES)
+        self.extra_strings_compiled_filename = _get_str(
+            s, cs.EXTRA_STRINGS_COMPILED_FILENAME, ""
+        )
+
+        self.index_uploads_in_background = _get_bool(
+            s, cs.INDEX_UPLOADS_IN_BACKGROUND, cd.INDEX_UPLOADS_IN_BACKGROUND
+        )
 
         self.language = _get_str(s, cs.LANGUAGE, cd.LANGUAGE)
         if self.language not in POSSIBLE_LOCALES:
@@ -1403,6 +1446,24 @@ class CamcopsConfig(object):
         self.session_timeout = datetime.timedelta(
             minutes=self.session_timeout_minutes
         )
+        self.session_activity_granularity_s = _get_int(
+            s,
+            cs.SESSION_ACTIVITY_GRANULARITY_S,
+            cd.SESSION_ACTIVITY_GRANULARITY_S,
+        )
+        self.session_activity_granularity = datetime.timedelta(
+            seconds=self.session_activity_granularity_s
+        )
+        if not (
+            datetime.timedelta(0)
+            <= self.session_activity_granularity
+            < self.session_timeout
+        ):
+            raise ValueError(
+                f"Bad {cs.SESSION_ACTIVITY_GRANULARITY_S}: "
+                f"{self.session_activity_granularity_s!r} (must be at least "
+                f"zero, and less than {cs.SESSION_TIMEOUT_MINUTES})"
+            )
         self.session_check_user_ip = _get_bool(
             s, cs.SESSION_CHECK_USER_IP, cd.SESSION_CHECK_USER_IP
         )
@@ -1418,6 +1479,9 @@ class CamcopsConfig(object):
         self.snomed_icd10_xml_filename = _get_str(
             s, cs.SNOMED_ICD10_XML_FILENAME
         )
+        self.snomed_compiled_filename = _get_str(
+            s, cs.SNOMED_COMPILED_FILENAME, ""
+        )
 
         self.task_filename_spec = _get_str(s, cs.TASK_FILENAME_SPEC)
         self.tracker_filename_spec = _get_str(s, cs.TRACKER_FILENAME_SPEC)
@@ -1431,6 +1495,56 @@ class CamcopsConfig(object):
         self.user_download_max_space_mb = _get_int(
             s, cs.USER_DOWNLOAD_MAX_SPACE_MB, cd.USER_DOWNLOAD_MAX_SPACE_MB
         )
+        self.user_download_sendfile = _get_str(
+            s, cs.USER_DOWNLOAD_SENDFILE, cd.USER_DOWNLOAD_SENDFILE
+        ).lower()
+        if self.user_download_sendfile not in class_attribute_values(
+            SendfileMethodNames
+        ):
+            raise ValueError(
+                f"Bad {cs.USER_DOWNLOAD_SENDFILE}: "
+                f"{self.user_download_sendfile!r}"
+            )
+        self.user_download_accel_redirect_prefix = _get_str(
+            s, cs.USER_DOWNLOAD_ACCEL_REDIRECT_PREFIX, ""
+        )
+        if (
+            self.user_download_sendfile == SendfileMethodNames.X_ACCEL_REDIRECT
+            and not self.user_download_accel_redirect_prefix
+        ):
+            raise_missing(s, cs.USER_DOWNLOAD_ACCEL_REDIRECT_PREFIX)
+
+        self.shared_cache_backend = _get_str(
+            s, cs.SHARED_CACHE_BACKEND, cd.SHARED_CACHE_BACKEND
+        ).lower()
+        if self.shared_cache_backend not in class_attribute_values(
+            SharedCacheBackendNames
+        ):
+            raise ValueError(
+                f"Bad {cs.SHARED_CACHE_BACKEND}: "
+                f"{self.shared_cache_backend!r}"
+            )
+        self.shared_cache_filename = _get_str(s, cs.SHARED_CACHE_FILENAME, "")
+        if (
+            self.shared_cache_backend == SharedCacheBackendNames.FILE
+            and not self.shared_cache_filename
+        ):
+            raise_missing(s, cs.SHARED_CACHE_FILENAME)
+        self.shared_cache_redis_url = _get_str(
+            s, cs.SHARED_CACHE_REDIS_URL, ""
+        )
+        if (
+            self.shared_cache_backend == SharedCacheBackendNames.REDIS
+            and not self.shared_cache_redis_url
+        ):
+            raise_missing(s, cs.SHARED_CACHE_REDIS_URL)
+        self.shared_cache_expiration_s = _get_int(
+            s, cs.SHARED_CACHE_EXPIRATION_S, cd.SHARED_CACHE_EXPIRATION_S
+        )
+        if self.shared_cache_expiration_s <= 0:
+            raise ValueError(
+                f"Bad {cs.SHARED_CACHE_EXPIRATION_S}: must be positive"
+            )
 
         self.webview_loglevel = get_config_parameter_loglevel(
             parser, s, cs.WEBVIEW_LOGLEVEL, cd.WEBVIEW_LOGLEVEL
@@ -1501,6 +1615,9 @@ class CamcopsConfig(object):
         self.gunicorn_num_workers = _get_int(
             ws, cw.GUNICORN_NUM_WORKERS, cd.GUNICORN_NUM_WORKERS
         )
+        self.gunicorn_preload_app = _get_bool(
+            ws, cw.GUNICORN_PRELOAD_APP, cd.GUNICORN_PRELOAD_APP
+        )
         self.gunicorn_timeout_s = _get_int(
             ws, cw.GUNICORN_TIMEOUT_S, cd.GUNICORN_TIMEOUT_S
         )
@@ -1588,6 +1705,15 @@ class CamcopsConfig(object):
             es, ce.CELERY_EXPORT_TASK_RATE_LIMIT
         )
 
+        self.export_lock_backend = _get_str(
+            es, ce.EXPORT_LOCK_BACKEND, cd.EXPORT_LOCK_BACKEND
+        ).lower()
+        if self.export_lock_backend not in class_attribute_values(
+            ExportLockBackendNames
+        ):
+            raise ValueError(
+                f"Bad {ce.EXPORT_LOCK_BACKEND}: {self.export_lock_backend!r}"
+            )
         self.export_lockdir = _get_str(es, ce.EXPORT_LOCKDIR)
         if not self.export_lockdir:
             raise_missing(es, ConfigParamExportGeneral.EXPORT_LOCKDIR)
@@ -1645,6 +1771,7 @@ class CamcopsConfig(object):
         # Other attributes
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         self._sqla_engine: Optional[Engine] = None
+        self._export_lock_manager: Optional[ExportLockManager] = None
 
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         # Docker checks
@@ -1728,6 +1855,12 @@ class CamcopsConfig(object):
                 permit_cfg=True,
                 permit_venv=True,
             )
+            warn_if_not_within_docker_dir(
+                param_name=ConfigParamSite.SNOMED_COMPILED_FILENAME,
+                filespec=self.snomed_compiled_filename,
+                permit_cfg=True,
+                permit_venv=True,
+            )
 
             # Temporary/scratch space that needs to be shared between Docker
             # containers
@@ -1736,6 +1869,11 @@ class CamcopsConfig(object):
                 filespec=self.user_download_dir,
                 permit_tmp=True,
             )
+            warn_if_not_within_docker_dir(
+                param_name=ConfigParamSite.EXTRA_STRINGS_COMPILED_FILENAME,
+                filespec=self.extra_strings_compiled_filename,
+                permit_tmp=True,
+            )
             warn_if_not_within_docker_dir(
                 param_name=ConfigParamExportGeneral.CELERY_BEAT_SCHEDULE_DATABASE,  # noqa
                 filespec=self.celery_beat_schedule_database,
@@ -1875,18 +2013,23 @@ class CamcopsConfig(object):
     # SNOMED-CT functions
     # -------------------------------------------------------------------------
 
-    def get_task_snomed_concepts(self) -> Dict[str, SnomedConcept]:
+    def get_task_snomed_concepts(self) -> Mapping[str, SnomedConcept]:
         """
-        Returns all SNOMED-CT concepts for tasks.
+        Returns all SNOMED-CT concepts for tasks (from the compiled SNOMED-CT
+        file, if there is an up-to-date one, or else from the XML).
 
         Returns:
             dict: maps lookup strings to :class:`SnomedConcept` objects
         """
         if not self.snomed_task_xml_filename:
             return {}
-        return get_all_task_snomed_concepts(self.snomed_task_xml_filename)
+        return get_all_task_snomed_concepts(
+            self.snomed_task_xml_filename, self.snomed_compiled_filename
+        )
 
-    def get_icd9cm_snomed_concepts(self) -> Dict[str, List[SnomedConcept]]:
+    def get_icd9cm_snomed_concepts(
+        self,
+    ) -> Mapping[str, List[SnomedConcept]]:
         """
         Returns all SNOMED-CT concepts for ICD-9-CM codes supported by CamCOPS.
 
@@ -1895,9 +2038,11 @@ class CamcopsConfig(object):
         """
         if not self.snomed_icd9_xml_filename:
             return {}
-        return get_icd9_snomed_concepts_from_xml(self.snomed_icd9_xml_filename)
+        return get_icd9_snomed_concepts_from_xml(
+            self.snomed_icd9_xml_filename, self.snomed_compiled_filename
+        )
 
-    def get_icd10_snomed_concepts(self) -> Dict[str, List[SnomedConcept]]:
+    def get_icd10_snomed_concepts(self) -> Mapping[str, List[SnomedConcept]]:
         """
         Returns all SNOMED-CT concepts for ICD-10-CM codes supported by
         CamCOPS.
@@ -1908,7 +2053,22 @@ class CamcopsConfig(object):
         if not self.snomed_icd10_xml_filename:
             return {}
         return get_icd10_snomed_concepts_from_xml(
-            self.snomed_icd10_xml_filename
+            self.snomed_icd10_xml_filename, self.snomed_compiled_filename
+        )
+
+    def compile_snomed(self) -> None:
+        """
+        Writes the compiled SNOMED-CT file from the SNOMED-CT XML files.
+        """
+        if not self.snomed_compiled_filename:
+            raise ValueError(
+                f"No {ConfigParamSite.SNOMED_COMPILED_FILENAME} is configured"
+            )
+        write_compiled_snomed_concepts(
+            compiled_filename=self.snomed_compiled_filename,
+            task_xml_filename=self.snomed_task_xml_filename,
+            icd9_xml_filename=self.snomed_icd9_xml_filename,
+            icd10_xml_filename=self.snomed_icd10_xml_filename,
         )
 
     # -------------------------------------------------------------------------
@@ -1952,78 +2112,31 @@ class CamcopsConfig(object):
         return self._export_recipients
 
     # -------------------------------------------------------------------------
-    # File-based locks
+    # Export locks
     # -------------------------------------------------------------------------
 
-    def get_export_lockfilename_recipient_db(self, recipient_name: str) -> str:
+    def get_export_lock_manager(self) -> ExportLockManager:
         """
-        Returns a full path to a lockfile suitable for locking for a
-        whole-database export to a particular export recipient.
-
-        Args:
-            recipient_name: name of the recipient
-
-        Returns:
-            a filename
+        Returns the export lock manager, for the backend chosen by
+        ``EXPORT_LOCK_BACKEND``. See
+        :mod:`camcops_server.cc_modules.cc_exportlock`.
         """
-        filename = f"camcops_export_db_{recipient_name}"
-        # ".lock" is appended automatically by the lockfile package
-        return os.path.join(self.export_lockdir, filename)
-
-    def get_export_lockfilename_recipient_fhir(
-        self, recipient_name: str
-    ) -> str:
-        """
-        Returns a full path to a lockfile suitable for locking for a
-        FHIR export to a particular export recipient.
-
-        (This must be different from
-        :meth:`get_export_lockfilename_recipient_db`, because of what we assume
-        about someone else holding the same lock.)
-
-        Args:
-            recipient_name: name of the recipient
-
-        Returns:
-            a filename
-        """
-        filename = f"camcops_export_fhir_{recipient_name}"
-        # ".lock" is appended automatically by the lockfile package
-        return os.path.join(self.export_lockdir, filename)
-
-    def get_export_lockfilename_recipient_task(
-        self, recipient_name: str, basetable: str, pk: int
-    ) -> str:
-        """
-        Returns a full path to a lockfile suitable for locking for a
-        single-task export to a particular export recipient.
-
-        Args:
-            recipient_name: name of the recipient
-            basetable: task base table name
-            pk: server PK of the task
-
-        Returns:
-            a filename
-        """
-        filename = f"camcops_export_task_{recipient_name}_{basetable}_{pk}"
-        # ".lock" is appended automatically by the lockfile package
-        return os.path.join(self.export_lockdir, filename)
-
-    def get_master_export_recipient_lockfilename(self) -> str:
-        """
-        When we are modifying export recipients, we check "is this information
-        the same as the current version in the database", and if not, we write
-        fresh information to the database. If lots of processes do that at the
-        same time, we have a problem (usually a database deadlock) -- hence
-        this lock.
+        if self._export_lock_manager is None:
+            self._export_lock_manager = make_export_lock_manager(
+                backend_name=self.export_lock_backend,
+                lockdir=self.export_lockdir,
+                engine=(
+                    self.get_sqla_engine()
+                    if self.export_lock_backend
+                    == ExportLockBackendNames.DATABASE
+                    else None
+                ),
+            )
+        return self._export_lock_manager
 
-        Returns:
-            a filename
-        """
-        filename = "camcops_master_export_recipient"
-        # ".lock" is appended automatically by the lockfile package
-        return os.path.join(self.export_lockdir, filename)
+    # -------------------------------------------------------------------------
+    # Other files in the lock directory
+    # -------------------------------------------------------------------------
 
     def get_celery_beat_pidfilename(self) -> str:
         """
@@ -34,7 +34,6 @@ import multiprocessing
 import os
 from typing import cast
 
-from cardinal_pythonlib.pdf import Processors
 from cardinal_pythonlib.randomness import create_base64encoded_randomness
 from cardinal_pythonlib.sqlalchemy.session import make_mysql_url
 from cardinal_pythonlib.tcpipconst import Ports
@@ -235,10 +234,12 @@ ERA_NOW = "NOW"  # defines the current era in database records
 # PDF engine: now always "weasyprint".
 # =============================================================================
 
-# PDF_ENGINE = Processors.XHTML2PDF  # working, though SVG appears broken
-# PDF_ENGINE = Processors.PDFKIT  # no longer maintained, wkhtmltopdf not available on later Ubuntu  # noqa: E501
-PDF_ENGINE = Processors.WEASYPRINT
-# ... value must be one of: XHTML2PDF, WEASYPRINT, PDFKIT
+# PDF_ENGINE = "xhtml2pdf"  # working, though SVG appears broken
+# PDF_ENGINE = "pdfkit"  # no longer maintained, wkhtmltopdf not available on later Ubuntu  # noqa: E501
+PDF_ENGINE = "weasyprint"
+# ... value must be one of those in cardinal_pythonlib.pdf.Processors (not
+# imported here, since importing cardinal_pythonlib.pdf loads all the PDF
+# engines)
 
 
 # =============================================================================
@@ -445,6 +446,7 @@ class ConfigParamSite(object):
     ALLOW_INSECURE_COOKIES = "ALLOW_INSECURE_COOKIES"
     CAMCOPS_LOGO_FILE_ABSOLUTE = "CAMCOPS_LOGO_FILE_ABSOLUTE"
     CLIENT_API_LOGLEVEL = "CLIENT_API_LOGLEVEL"
+    CLIENT_API_MAX_DECOMPRESSED_MB = "CLIENT_API_MAX_DECOMPRESSED_MB"
     CTV_FILENAME_SPEC = "CTV_FILENAME_SPEC"
     DB_URL = "DB_URL"
     DB_ECHO = "DB_ECHO"
@@ -459,7 +461,9 @@ class ConfigParamSite(object):
     EMAIL_SENDER = "EMAIL_SENDER"
     EMAIL_USE_TLS = "EMAIL_USE_TLS"
     EXTRA_STRING_FILES = "EXTRA_STRING_FILES"
+    EXTRA_STRINGS_COMPILED_FILENAME = "EXTRA_STRINGS_COMPILED_FILENAME"
     FONTTOOLS_LOGLEVEL = "FONTTOOLS_LOGLEVEL"
+    INDEX_UPLOADS_IN_BACKGROUND = "INDEX_UPLOADS_IN_BACKGROUND"
     LANGUAGE = "LANGUAGE"
     LOCAL_INSTITUTION_URL = "LOCAL_INSTITUTION_URL"
     LOCAL_LOGO_FILE_ABSOLUTE = "LOCAL_LOGO_FILE_ABSOLUTE"
@@ -473,18 +477,26 @@ class ConfigParamSite(object):
     PERMIT_IMMEDIATE_DOWNLOADS = "PERMIT_IMMEDIATE_DOWNLOADS"
     REGION_CODE = "REGION_CODE"
     RESTRICTED_TASKS = "RESTRICTED_TASKS"
+    SESSION_ACTIVITY_GRANULARITY_S = "SESSION_ACTIVITY_GRANULARITY_S"
     SESSION_COOKIE_SECRET = "SESSION_COOKIE_SECRET"
     SESSION_TIMEOUT_MINUTES = "SESSION_TIMEOUT_MINUTES"
     SESSION_CHECK_USER_IP = "SESSION_CHECK_USER_IP"
+    SHARED_CACHE_BACKEND = "SHARED_CACHE_BACKEND"
+    SHARED_CACHE_EXPIRATION_S = "SHARED_CACHE_EXPIRATION_S"
+    SHARED_CACHE_FILENAME = "SHARED_CACHE_FILENAME"
+    SHARED_CACHE_REDIS_URL = "SHARED_CACHE_REDIS_URL"
     SMS_BACKEND = "SMS_BACKEND"
+    SNOMED_COMPILED_FILENAME = "SNOMED_COMPILED_FILENAME"
     SNOMED_TASK_XML_FILENAME = "SNOMED_TASK_XML_FILENAME"
     SNOMED_ICD9_XML_FILENAME = "SNOMED_ICD9_XML_FILENAME"
     SNOMED_ICD10_XML_FILENAME = "SNOMED_ICD10_XML_FILENAME"
     TASK_FILENAME_SPEC = "TASK_FILENAME_SPEC"
     TRACKER_FILENAME_SPEC = "TRACKER_FILENAME_SPEC"
+    USER_DOWNLOAD_ACCEL_REDIRECT_PREFIX = "USER_DOWNLOAD_ACCEL_REDIRECT_PREFIX"
     USER_DOWNLOAD_DIR = "USER_DOWNLOAD_DIR"
     USER_DOWNLOAD_FILE_LIFETIME_MIN = "USER_DOWNLOAD_FILE_LIFETIME_MIN"
     USER_DOWNLOAD_MAX_SPACE_MB = "USER_DOWNLOAD_MAX_SPACE_MB"
+    USER_DOWNLOAD_SENDFILE = "USER_DOWNLOAD_SENDFILE"
     WEASYPRINT_LOGLEVEL = "WEASYPRINT_LOGLEVEL"
     WEBVIEW_LOGLEVEL = "WEBVIEW_LOGLEVEL"
     WKHTMLTOPDF_FILENAME = "WKHTMLTOPDF_FILENAME"
@@ -510,6 +522,7 @@ class ConfigParamServer(object):
     EXTERNAL_SCRIPT_NAME = "EXTERNAL_SCRIPT_NAME"
     GUNICORN_DEBUG_RELOAD = "GUNICORN_DEBUG_RELOAD"
     GUNICORN_NUM_WORKERS = "GUNICORN_NUM_WORKERS"
+    GUNICORN_PRELOAD_APP = "GUNICORN_PRELOAD_APP"
     GUNICORN_TIMEOUT_S = "GUNICORN_TIMEOUT_S"
     HOST = "HOST"
     PORT = "PORT"
@@ -541,6 +554,7 @@ class ConfigParamExportGeneral(object):
     CELERY_BROKER_URL = "CELERY_BROKER_URL"
     CELERY_WORKER_EXTRA_ARGS = "CELERY_WORKER_EXTRA_ARGS"
     CELERY_EXPORT_TASK_RATE_LIMIT = "CELERY_EXPORT_TASK_RATE_LIMIT"
+    EXPORT_LOCK_BACKEND = "EXPORT_LOCK_BACKEND"
     EXPORT_LOCKDIR = "EXPORT_LOCKDIR"
     RECIPIENTS = "RECIPIENTS"
     SCHEDULE = "SCHEDULE"
@@ -658,6 +672,36 @@ class MfaMethod:
             return cls.NO_MFA
 
 
+class ExportLockBackendNames:
+    """
+    Names of allowed export lock backends.
+    """
+
+    DATABASE = "database"
+    FILE = "file"
+
+
+class SharedCacheBackendNames:
+    """
+    Names of allowed backends for the shared cache of database-derived data.
+    """
+
+    NONE = "none"
+    FILE = "file"
+    REDIS = "redis"
+
+
+class SendfileMethodNames:
+    """
+    Ways of delegating the sending of user download files to the front-end
+    web server.
+    """
+
+    NONE = "none"  # CamCOPS sends the file itself
+    X_ACCEL_REDIRECT = "x_accel_redirect"  # e.g. NGINX
+    X_SENDFILE = "x_sendfile"  # e.g. Apache with mod_xsendfile; lighttpd
+
+
 class SmsBackendNames:
     """
     Names of allowed SMS backends.
@@ -715,6 +759,7 @@ class ConfigDefaults(object):
     )
     CLIENT_API_LOGLEVEL = logging.INFO
     CLIENT_API_LOGLEVEL_TEXTFORMAT = "info"  # should match CLIENT_API_LOGLEVEL
+    CLIENT_API_MAX_DECOMPRESSED_MB = 100
     DB_DATABASE = "camcops"  # for demo configs only
     DB_ECHO = False
     DB_PORT = str(Ports.MYSQL)  # for demo configs only
@@ -733,6 +778,7 @@ class ConfigDefaults(object):
     FONTTOOLS_LOGLEVEL_TEXTFORMAT = (
         "warning"  # should match FONTTOOLS_LOGLEVEL
     )
+    INDEX_UPLOADS_IN_BACKGROUND = False
     LANGUAGE = DEFAULT_LOCALE
     LOCAL_INSTITUTION_URL = "https://camcops.readthedocs.io/"
     LOCAL_LOGO_FILE_ABSOLUTE = os.path.join(STATIC_ROOT_DIR, "logo_local.png")
@@ -744,14 +790,18 @@ class ConfigDefaults(object):
     PATIENT_SPEC_IF_ANONYMOUS = "anonymous"
     PERMIT_IMMEDIATE_DOWNLOADS = False
     REGION_CODE = "GB"
+    SESSION_ACTIVITY_GRANULARITY_S = 60  # zero to record every request
     SESSION_CHECK_USER_IP = True
     SESSION_TIMEOUT_MINUTES = 30
+    SHARED_CACHE_BACKEND = SharedCacheBackendNames.NONE
+    SHARED_CACHE_EXPIRATION_S = 600
     SMS_BACKEND = SmsBackendNames.CONSOLE
     USER_DOWNLOAD_DIR = (
         LINUX_DEFAULT_USER_DOWNLOAD_DIR  # for demo configs only
     )
     USER_DOWNLOAD_FILE_LIFETIME_MIN = 60
     USER_DOWNLOAD_MAX_SPACE_MB = 100
+    USER_DOWNLOAD_SENDFILE = SendfileMethodNames.NONE
     WEASYPRINT_LOGLEVEL = logging.ERROR
     WEASYPRINT_LOGLEVEL_TEXTFORMAT = (
         "error"  # should match WEASYPRINT_LOGLEVEL
@@ -778,6 +828,7 @@ class ConfigDefaults(object):
     else:
         GUNICORN_NUM_WORKERS = 2 * multiprocessing.cpu_count()
 
+    GUNICORN_PRELOAD_APP = True
     GUNICORN_TIMEOUT_S = 30
     HOST = "127.0.0.1"
     PORT = Ports.ALTERNATIVE_HTTP_NONSTANDARD
@@ -795,6 +846,7 @@ class ConfigDefaults(object):
     CELERY_BEAT_SCHEDULE_DATABASE = os.path.join(
         LINUX_DEFAULT_LOCK_DIR, "camcops_celerybeat_schedule"
     )  # for demo configs only
+    EXPORT_LOCK_BACKEND = ExportLockBackendNames.FILE
     EXPORT_LOCKDIR = LINUX_DEFAULT_LOCK_DIR  # for demo configs only
     SCHEDULE_TIMEZONE = "UTC"
 
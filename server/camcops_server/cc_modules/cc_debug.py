@@ -28,8 +28,16 @@ camcops_server/cc_modules/cc_debug.py
 """
 
 import cProfile
+import sys
 from types import FrameType
-from typing import Any, Callable, Set, Union
+from typing import Any, Callable, Dict, Optional, Set, Union
+
+from cardinal_pythonlib.sizeformatter import bytes2human
+
+try:
+    import resource
+except ImportError:  # e.g. Windows
+    resource = None
 
 TraceFuncType = Callable[[FrameType, str, Any], Union[Callable, None]]
 # ... returns a trace function (but we can't make the type definition
@@ -107,3 +115,58 @@ def makefunc_trace_unique_calls(file_only: bool = False) -> TraceFuncType:
             called.add(signature)
 
     return _trace_calls
+
+
+def get_peak_rss_bytes() -> Optional[int]:
+    """
+    Returns the peak resident set size (RSS) of this process, in bytes, or
+    ``None`` if we can't tell (e.g. under Windows).
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return maxrss  # bytes
+    return maxrss * 1024  # Linux reports kilobytes
+
+
+def get_peak_rss_description() -> str:
+    """
+    Returns the peak RSS of this process as a human-readable string, for
+    logging.
+    """
+    peak_rss = get_peak_rss_bytes()
+    return "unknown" if peak_rss is None else bytes2human(peak_rss)
+
+
+def get_memory_usage_bytes(pid: int = None) -> Optional[Dict[str, int]]:
+    """
+    Returns the current memory use of a process (by default, this one), in
+    bytes, from ``/proc/<pid>/smaps_rollup``, or ``None`` if that isn't
+    available (it is Linux-specific). The dictionary has the keys:
+
+    - ``rss``: resident set size;
+    - ``pss``: proportional set size, in which each page shared with other
+      processes (e.g. copy-on-write after ``fork()``) counts as a fraction;
+    - ``shared``: resident memory shared with other processes;
+    - ``private``: resident memory used by this process alone (what would be
+      freed if it exited).
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    kb = {}  # type: Dict[str, int]
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 3 and parts[0].endswith(":") and parts[2] == "kB":
+            kb[parts[0][:-1]] = int(parts[1])
+    return {
+        "rss": kb.get("Rss", 0) * 1024,
+        "pss": kb.get("Pss", 0) * 1024,
+        "shared": (kb.get("Shared_Clean", 0) + kb.get("Shared_Dirty", 0))
+        * 1024,
+        "private": (kb.get("Private_Clean", 0) + kb.get("Private_Dirty", 0))
+        * 1024,
+    }
@@ -65,6 +65,12 @@ require careful multi-instance locking), but to have a "sent" log. That way:
   - On UNIX, ``lockfile`` uses ``LinkLockFile``:
     https://github.com/smontanaro/pylockfile/blob/master/lockfile/linklockfile.py
 
+- Locking via database advisory locks (MySQL ``GET_LOCK()``, PostgreSQL
+  ``pg_try_advisory_lock()``) is an alternative (``EXPORT_LOCK_BACKEND =
+  database``). These are not row locks, so the warning above doesn't apply;
+  they avoid one lockfile per task, and work without a shared filesystem. See
+  :mod:`camcops_server.cc_modules.cc_exportlock`.
+
 *MESSAGE QUEUE AND BACKEND*
 
 Thoughts as of 2018-12-22.
@@ -150,17 +156,23 @@ Thoughts as of 2018-12-22.
 """  # noqa
 
 from contextlib import ExitStack
+import io
 import json
 import logging
 import os
 import sqlite3
 import tempfile
+import urllib.parse
 from typing import (
     Any,
+    BinaryIO,
+    Callable,
     Container,
     Dict,
     List,
     Generator,
+    Iterable,
+    Iterator,
     Optional,
     Set,
     Tuple,
@@ -172,12 +184,15 @@ from cardinal_pythonlib.classes import gen_all_subclasses
 from cardinal_pythonlib.datetimefunc import (
     format_datetime,
     get_now_localtz_pendulum,
+    get_now_utc_datetime,
     get_tz_local,
     get_tz_utc,
 )
 from cardinal_pythonlib.email_utils.sendmail import CONTENT_TYPE_TEXT
 from cardinal_pythonlib.fileops import relative_filename_within_dir
+from cardinal_pythonlib.httpconst import MimeType
 from cardinal_pythonlib.json_utils.serialize import register_for_json
+from cardinal_pythonlib.lists import chunks
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.pyramid.responses import (
     OdsResponse,
@@ -193,10 +208,16 @@ from pendulum import DateTime as Pendulum, Duration
 from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.renderers import render_to_response
 from pyramid.response import Response
-from sqlalchemy import insert
-from sqlalchemy.engine import create_engine, Result
+from sqlalchemy import insert, inspect
+from sqlalchemy.engine import create_engine, Engine, Result
 from sqlalchemy.orm import Session as SqlASession, sessionmaker
-from sqlalchemy.sql.expression import text
+from sqlalchemy.sql.expression import (
+    column,
+    ColumnClause,
+    select,
+    table,
+    text,
+)
 from sqlalchemy.sql.schema import Column, MetaData, Table
 from sqlalchemy.sql.sqltypes import Text
 
@@ -206,10 +227,27 @@ from camcops_server.cc_modules.cc_dataclasses import SummarySchemaInfo
 from camcops_server.cc_modules.cc_db import (
     REMOVE_COLUMNS_FOR_SIMPLIFIED_SPREADSHEETS,
 )
-from camcops_server.cc_modules.cc_dump import copy_tasks_and_summaries
+from camcops_server.cc_modules.cc_debug import get_peak_rss_description
+from camcops_server.cc_modules.cc_dump import (
+    copy_shared_objects,
+    copy_tasks_and_summaries,
+    copy_tasks_without_shared_objects,
+    create_sqlite_dump_engine,
+    DUMP_SHARED_CLASSES,
+    DumpController,
+)
 from camcops_server.cc_modules.cc_email import Email
 from camcops_server.cc_modules.cc_exception import FhirExportException
+from camcops_server.cc_modules.cc_exportlock import (
+    export_lockname_database_run,
+    export_lockname_database_shard,
+    export_lockname_recipient_db,
+    export_lockname_recipient_fhir,
+    export_lockname_recipient_task,
+)
 from camcops_server.cc_modules.cc_exportmodels import (
+    ExportedDatabaseRun,
+    ExportedDatabaseShard,
     ExportedTask,
     ExportRecipient,
     gen_tasks_having_exportedtasks,
@@ -217,16 +255,36 @@ from camcops_server.cc_modules.cc_exportmodels import (
 )
 from camcops_server.cc_modules.cc_forms import UserDownloadDeleteForm
 from camcops_server.cc_modules.cc_pyramid import Routes, ViewArg, ViewParam
+from camcops_server.cc_modules.cc_response import (
+    FileAttachmentResponse,
+    gen_encoded_blocks,
+    gen_gzipped_blocks,
+    GZIP_MIMETYPE,
+    StreamingAttachmentResponse,
+)
 from camcops_server.cc_modules.cc_simpleobjects import TaskExportOptions
-from camcops_server.cc_modules.cc_sqlalchemy import sql_from_sqlite_database
-from camcops_server.cc_modules.cc_task import SNOMED_TABLENAME, Task
+from camcops_server.cc_modules.cc_sqlalchemy import (
+    gen_sql_from_sqlite_database,
+    sql_from_sqlite_database,
+)
+from camcops_server.cc_modules.cc_task import (
+    SNOMED_TABLENAME,
+    tablename_to_task_class_dict,
+    Task,
+)
+from camcops_server.cc_modules.cc_taskindex import TaskIndexEntry
 from camcops_server.cc_modules.cc_spreadsheet import (
+    SpooledSpreadsheetCollection,
+    SpoolTooLargeError,
     SpreadsheetCollection,
     SpreadsheetPage,
 )
+from camcops_server.cc_modules.cc_userdownload import UserDownloadRecord
 from camcops_server.cc_modules.celery import (
     create_user_download,
     email_basic_dump,
+    export_database_shard_backend,
+    export_database_shared_objects_backend,
     export_task_backend,
     jittered_delay_s,
 )
@@ -248,6 +306,8 @@ INFOSCHEMA_PAGENAME = "_camcops_information_schema_columns"
 SUMMARYSCHEMA_PAGENAME = "_camcops_column_explanations"
 REMOVE_TABLES_FOR_SIMPLIFIED_SPREADSHEETS = {SNOMED_TABLENAME}
 EMPTY_SET: Container[str] = set()
+EXPORT_TASK_BATCH_SIZE = 100  # tasks per lock/recheck batch, serial exports
+EXPORT_DB_SHARD_SIZE = 1000  # max tasks per shard, sharded database exports
 
 
 # =============================================================================
@@ -332,7 +392,8 @@ def export(
 
     - Called from the command line, or from
       :func:`camcops_server.cc_modules.celery.export_to_recipient_backend`.
-    - Calls :func:`export_whole_database` or :func:`export_tasks_individually`.
+    - Calls :func:`export_whole_database`, :func:`export_database_sharded`, or
+      :func:`export_tasks_individually`.
 
     Args:
         req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
@@ -353,10 +414,12 @@ def export(
         log.info("Exporting to recipient: {}", recipient.recipient_name)
         if recipient.using_db():
             if schedule_via_backend:
-                raise NotImplementedError(
-                    "Not yet implemented: whole-database export via Celery "
-                    "backend"
-                )  # todo: implement whole-database export via Celery backend  # noqa
+                export_database_sharded(
+                    req,
+                    recipient,
+                    via_index=via_index,
+                    schedule_via_backend=True,
+                )
             else:
                 export_whole_database(req, recipient, via_index=via_index)
         else:
@@ -377,7 +440,7 @@ def export_whole_database(
     Exports to a database.
 
     - Called by :func:`export`.
-    - Holds a recipient-specific "database" file lock in the process.
+    - Holds a recipient-specific "database" export lock in the process.
 
     Args:
         req:
@@ -389,28 +452,32 @@ def export_whole_database(
             use the task index (faster)?
     """
     cfg = req.config
-    lockfilename = cfg.get_export_lockfilename_recipient_db(
+    lockname = export_lockname_recipient_db(
         recipient_name=recipient.recipient_name
     )
     try:
-        with lockfile.FileLock(lockfilename, timeout=0):  # doesn't wait
+        with cfg.get_export_lock_manager().lock(lockname, timeout=0):
+            # ... doesn't wait
+            if ExportedDatabaseRun.get_unfinished_run(
+                req.dbsession, recipient.recipient_name
+            ):
+                log.warning(
+                    "A sharded export to {} is unfinished; not starting "
+                    "another export to the same database",
+                    recipient.recipient_name,
+                )
+                return
             collection = get_collection_for_export(
                 req, recipient, via_index=via_index
             )
-            dst_engine = create_engine(
-                recipient.db_url, echo=recipient.db_echo
+            dst_engine, dst_session = _make_database_export_destination(
+                recipient
             )
-            log.info(
-                "Exporting to database: {}",
-                get_safe_url_from_engine(dst_engine),
+            task_generator = gen_tasks_having_exportedtasks(
+                collection, chunked=True
             )
-            dst_session = sessionmaker(bind=dst_engine)()  # type: SqlASession
-            task_generator = gen_tasks_having_exportedtasks(collection)
-            export_options = TaskExportOptions(
-                include_blobs=recipient.db_include_blobs,
-                db_patient_id_per_row=recipient.db_patient_id_per_row,
-                db_make_all_tables_even_empty=True,
-                db_include_summaries=recipient.db_add_summaries,
+            export_options = _make_database_export_options(
+                recipient, make_all_tables=True
             )
             copy_tasks_and_summaries(
                 tasks=task_generator,
@@ -418,18 +485,454 @@ def export_whole_database(
                 dst_session=dst_session,
                 export_options=export_options,
                 req=req,
+                streaming=True,
             )
             dst_session.commit()
+            log.info(
+                "Finished exporting to database {} (peak RSS {})",
+                recipient.recipient_name,
+                get_peak_rss_description(),
+            )
     except lockfile.AlreadyLocked:
         log.warning(
-            "Export logfile {!r} already locked by another process; "
+            "Export lock {!r} already held by another process; "
             "aborting (another process is doing this work)",
-            lockfilename,
+            lockname,
         )
         # No need to retry by raising -- if someone else holds this lock, they
         # are doing the work that we wanted to do.
 
 
+def _make_database_export_destination(
+    recipient: ExportRecipient,
+) -> Tuple[Engine, SqlASession]:
+    """
+    Returns an engine and a session for a database recipient.
+    """
+    dst_engine = create_engine(recipient.db_url, echo=recipient.db_echo)
+    log.info("Exporting to database: {}", get_safe_url_from_engine(dst_engine))
+    dst_session = sessionmaker(bind=dst_engine)()  # type: SqlASession
+    return dst_engine, dst_session
+
+
+def _make_database_export_options(
+    recipient: ExportRecipient, make_all_tables: bool
+) -> TaskExportOptions:
+    """
+    Returns export options for a database recipient.
+    """
+    return TaskExportOptions(
+        include_blobs=recipient.db_include_blobs,
+        db_patient_id_per_row=recipient.db_patient_id_per_row,
+        db_make_all_tables_even_empty=make_all_tables,
+        db_include_summaries=recipient.db_add_summaries,
+    )
+
+
+def _dst_pks_present(
+    dst_session: SqlASession, tablename: str, pks: List[int]
+) -> Set[int]:
+    """
+    Which of the given server PKs (``_pk``) are already present in a
+    destination table?
+    """
+    if not inspect(dst_session.get_bind()).has_table(tablename):
+        return set()
+    present = set()  # type: Set[int]
+    pkcol = column("_pk")  # type: ColumnClause[int]
+    for pk_chunk in chunks(pks, EXPORT_DB_SHARD_SIZE):
+        q = (
+            select(pkcol)
+            .select_from(table(tablename))
+            .where(pkcol.in_(pk_chunk))
+        )
+        present.update(pk for pk, in dst_session.execute(q))
+    return present
+
+
+def export_database_sharded(
+    req: "CamcopsRequest",
+    recipient: ExportRecipient,
+    via_index: bool = True,
+    schedule_via_backend: bool = True,
+) -> None:
+    """
+    Exports to a database, in shards, resuming an unfinished export if there
+    is one.
+
+    - Called by :func:`export`.
+    - A new export is planned as an :class:`ExportedDatabaseRun`, divided into
+      :class:`ExportedDatabaseShard` objects (each with up to
+      :data:`EXPORT_DB_SHARD_SIZE` tasks of one class); all destination tables
+      are created now. The plan, and progress, are stored in our database.
+    - Each shard is copied by :func:`export_database_shard`, via
+      :func:`camcops_server.cc_modules.celery.export_database_shard_backend`
+      if ``schedule_via_backend`` is True. Shards may be copied in parallel.
+      Patients, ID numbers, groups, devices and users (which are shared
+      between tasks) are not copied with each shard, but noted.
+    - When all shards are done, :func:`export_database_shared_objects` copies
+      the shared objects and finishes the run.
+    - If the export is interrupted, calling this function again resumes it,
+      by rescheduling any unfinished steps (which are idempotent).
+    - Holds a recipient-specific "database" export lock while planning.
+
+    Args:
+        req:
+            a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        recipient:
+            an
+            :class:`camcops_server.cc_modules.cc_exportmodels.ExportRecipient`
+        via_index:
+            use the task index (faster)?
+        schedule_via_backend:
+            schedule jobs via the backend instead?
+    """
+    dbsession = req.dbsession
+    lockname = export_lockname_recipient_db(
+        recipient_name=recipient.recipient_name
+    )
+    try:
+        with req.config.get_export_lock_manager().lock(lockname, timeout=0):
+            run = ExportedDatabaseRun.get_unfinished_run(
+                dbsession, recipient.recipient_name
+            )
+            if run:
+                log.info(
+                    "Resuming sharded export {} to {}",
+                    run.id,
+                    recipient.recipient_name,
+                )
+            else:
+                run = _plan_database_export_run(req, recipient, via_index)
+            dbsession.commit()
+            run_id = run.id
+            shard_ids = run.unfinished_shard_ids()
+    except lockfile.AlreadyLocked:
+        log.warning(
+            "Export lock {!r} already held by another process; "
+            "aborting (another process is doing this work)",
+            lockname,
+        )
+        return
+
+    log.info(
+        "Sharded export {} to {}: {} shard(s) to copy",
+        run_id,
+        recipient.recipient_name,
+        len(shard_ids),
+    )
+    if schedule_via_backend:
+        if shard_ids:
+            for shard_id in shard_ids:
+                export_database_shard_backend.delay(shard_id=shard_id)
+        else:
+            export_database_shared_objects_backend.delay(run_id=run_id)
+    else:
+        for shard_id in shard_ids:
+            export_database_shard(req, shard_id)
+        export_database_shared_objects(req, run_id)
+
+
+def _plan_database_export_run(
+    req: "CamcopsRequest", recipient: ExportRecipient, via_index: bool
+) -> ExportedDatabaseRun:
+    """
+    Creates a new :class:`ExportedDatabaseRun`, with its shards, and creates
+    the destination tables.
+    """
+    collection = get_collection_for_export(req, recipient, via_index=via_index)
+    pks_by_basetable = {}  # type: Dict[str, List[int]]
+    for item in collection.gen_all_tasks_or_indexes():
+        if isinstance(item, TaskIndexEntry):
+            basetable, pk = item.task_table_name, item.task_pk
+        else:
+            basetable, pk = item.tablename, item.pk
+        pks_by_basetable.setdefault(basetable, []).append(pk)
+
+    run = ExportedDatabaseRun(recipient)
+    req.dbsession.add(run)
+    for basetable in sorted(pks_by_basetable.keys()):
+        for task_pks in chunks(
+            sorted(pks_by_basetable[basetable]), EXPORT_DB_SHARD_SIZE
+        ):
+            run.shards.append(
+                ExportedDatabaseShard(basetable=basetable, task_pks=task_pks)
+            )
+
+    dst_engine, dst_session = _make_database_export_destination(recipient)
+    controller = DumpController(
+        dst_engine=dst_engine,
+        dst_session=dst_session,
+        export_options=_make_database_export_options(
+            recipient, make_all_tables=False
+        ),
+        req=req,
+    )
+    controller.create_all_dest_tables_for_sharded_copy()
+    dst_session.commit()
+    log.info(
+        "Planned sharded export to {}: {} task(s) in {} shard(s)",
+        recipient.recipient_name,
+        sum(len(pks) for pks in pks_by_basetable.values()),
+        len(run.shards),
+    )
+    return run
+
+
+def export_database_shard(req: "CamcopsRequest", shard_id: int) -> bool:
+    """
+    Copies one shard of a sharded database export (see
+    :func:`export_database_sharded`), unless that has been done already.
+
+    - Called by :func:`export_database_sharded`, or by
+      :func:`camcops_server.cc_modules.celery.export_database_shard_backend`.
+    - Holds a shard-specific export lock in the process.
+    - The destination is committed in a single transaction. If a previous
+      attempt committed it, but failed to record that, we detect the copied
+      rows (by the PKs of the shard's tasks) and don't copy them again.
+
+    Args:
+        req:
+            a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        shard_id:
+            ID of the :class:`ExportedDatabaseShard`
+
+    Returns:
+        are all shards of the run now finished?
+    """
+    dbsession = req.dbsession
+    shard = dbsession.get(ExportedDatabaseShard, shard_id)
+    if shard is None:
+        log.error("No database export shard with ID {}", shard_id)
+        return False
+    run = shard.run
+    lockname = export_lockname_database_shard(shard_id)
+    try:
+        with req.config.get_export_lock_manager().lock(lockname, timeout=0):
+            if shard.finished_at_utc is None:
+                _copy_database_shard(req, shard)
+    except lockfile.AlreadyLocked:
+        log.warning(
+            "Export lock {!r} already held by another process; "
+            "aborting (another process is doing this work)",
+            lockname,
+        )
+        return False
+    return not run.unfinished_shard_ids()
+
+
+def _copy_database_shard(
+    req: "CamcopsRequest", shard: ExportedDatabaseShard
+) -> None:
+    """
+    Does the work for :func:`export_database_shard`.
+    """
+    dbsession = req.dbsession
+    recipient = shard.run.recipient
+    start_at_utc = get_now_utc_datetime()
+    shard.attempts += 1
+    dbsession.commit()  # so a failed attempt is visible
+
+    dst_engine, dst_session = _make_database_export_destination(recipient)
+    task_pks = shard.task_pks or []
+    if shard.attempts > 1:
+        present = _dst_pks_present(dst_session, shard.basetable, task_pks)
+        pks_to_copy = [pk for pk in task_pks if pk not in present]
+    else:
+        pks_to_copy = task_pks
+    if not pks_to_copy:
+        log.info(
+            "Database export shard {} was copied by a previous attempt",
+            shard.id,
+        )
+    else:
+        log.info(
+            "Copying database export shard {}: {} task(s) from {}",
+            shard.id,
+            len(pks_to_copy),
+            shard.basetable,
+        )
+        taskclass = tablename_to_task_class_dict()[shard.basetable]
+        tasks = []  # type: List[Task]
+        for pk_chunk in chunks(pks_to_copy, EXPORT_DB_SHARD_SIZE):
+            # noinspection PyProtectedMember
+            tasks.extend(
+                dbsession.query(taskclass)
+                .filter(taskclass._pk.in_(pk_chunk))
+                .all()
+            )
+        shared_keys = copy_tasks_without_shared_objects(
+            tasks=tasks,
+            dst_engine=dst_engine,
+            dst_session=dst_session,
+            export_options=_make_database_export_options(
+                recipient, make_all_tables=False
+            ),
+            req=req,
+        )
+        # Record the shared objects before committing the destination, so
+        # that a copied shard always has them recorded.
+        if len(pks_to_copy) == len(task_pks):
+            shard.replace_shared_object_keys(shared_keys)
+        else:
+            # Keep those recorded for the tasks copied previously.
+            shard.add_shared_object_keys(shared_keys)
+        dbsession.commit()
+        dst_session.commit()
+
+    ExportedTask.bulk_insert_successes(
+        dbsession,
+        recipient,
+        [(shard.basetable, pk, start_at_utc) for pk in shard.task_pks],
+    )
+    shard.finished_at_utc = get_now_utc_datetime()
+    dbsession.commit()
+
+
+def export_database_shared_objects(req: "CamcopsRequest", run_id: int) -> None:
+    """
+    The final step of a sharded database export (see
+    :func:`export_database_sharded`): once all shards are copied, copies the
+    objects they share (patients, ID numbers, groups, devices, users), and
+    marks the run as finished.
+
+    - Called by :func:`export_database_sharded`, or by
+      :func:`camcops_server.cc_modules.celery.export_database_shared_objects_backend`.
+    - Holds a run-specific export lock in the process.
+
+    Args:
+        req:
+            a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        run_id:
+            ID of the :class:`ExportedDatabaseRun`
+    """  # noqa
+    dbsession = req.dbsession
+    run = dbsession.get(ExportedDatabaseRun, run_id)
+    if run is None:
+        log.error("No sharded database export with ID {}", run_id)
+        return
+    lockname = export_lockname_database_run(run_id)
+    try:
+        with req.config.get_export_lock_manager().lock(lockname, timeout=0):
+            if run.finished_at_utc is not None:
+                return
+            if run.unfinished_shard_ids():
+                log.warning(
+                    "Sharded database export {} has unfinished shards; not "
+                    "finishing it yet",
+                    run_id,
+                )
+                return
+            _copy_database_shared_objects(req, run)
+    except lockfile.AlreadyLocked:
+        log.warning(
+            "Export lock {!r} already held by another process; "
+            "aborting (another process is doing this work)",
+            lockname,
+        )
+
+
+def _copy_database_shared_objects(
+    req: "CamcopsRequest", run: ExportedDatabaseRun
+) -> None:
+    """
+    Does the work for :func:`export_database_shared_objects`.
+    """
+    dbsession = req.dbsession
+    recipient = run.recipient
+    dst_engine, dst_session = _make_database_export_destination(recipient)
+    keys = list(run.gen_shared_object_keys())
+    # Shared objects may be in the destination already, having been copied by
+    # a previous attempt at this run, or by a previous (incremental) run.
+    # Only this run's objects are checked, and only those present are skipped.
+    already_copied = _dst_shared_object_keys_present(dst_session, keys)
+    if already_copied:
+        log.info(
+            "{} of {} shared object(s) for sharded database export {} are "
+            "already in the destination",
+            len(already_copied),
+            len(keys),
+            run.id,
+        )
+    copy_shared_objects(
+        objects=_gen_shared_objects(
+            dbsession, [key for key in keys if key not in already_copied]
+        ),
+        dst_engine=dst_engine,
+        dst_session=dst_session,
+        export_options=_make_database_export_options(
+            recipient, make_all_tables=False
+        ),
+        req=req,
+        already_copied=already_copied,
+    )
+    dst_session.commit()
+    run.delete_shared_object_keys()
+    run.finished_at_utc = get_now_utc_datetime()
+    dbsession.commit()
+    log.info("Finished sharded export {} to {}", run.id, recipient)
+
+
+def _shared_object_pks_by_tablename(
+    keys: Iterable[Tuple[str, int]],
+) -> Dict[str, List[int]]:
+    """
+    Groups ``(tablename, pk)`` tuples for shared objects by table name.
+    """
+    pks_by_tablename = {}  # type: Dict[str, List[int]]
+    for tablename, pk in keys:
+        pks_by_tablename.setdefault(tablename, []).append(pk)
+    return pks_by_tablename
+
+
+def _dst_shared_object_keys_present(
+    dst_session: SqlASession, keys: Iterable[Tuple[str, int]]
+) -> Set[Tuple[str, int]]:
+    """
+    Which of these shared objects (as ``(tablename, pk)`` tuples) are in the
+    destination database already?
+    """
+    class_by_tablename = {
+        cls.__tablename__: cls for cls in DUMP_SHARED_CLASSES
+    }
+    dst_inspector = inspect(dst_session.get_bind())
+    present = set()  # type: Set[Tuple[str, int]]
+    for tablename, pks in _shared_object_pks_by_tablename(keys).items():
+        if not dst_inspector.has_table(tablename):
+            continue
+        pk_col = column(
+            inspect(class_by_tablename[tablename]).primary_key[0].name
+        )  # type: ColumnClause[Any]
+        for pk_chunk in chunks(pks, EXPORT_DB_SHARD_SIZE):
+            q = (
+                select(pk_col)
+                .select_from(table(tablename))
+                .where(pk_col.in_(pk_chunk))
+            )
+            present.update(
+                (tablename, pk) for pk in dst_session.execute(q).scalars()
+            )
+    return present
+
+
+def _gen_shared_objects(
+    dbsession: SqlASession, keys: Iterable[Tuple[str, int]]
+) -> Generator[object, None, None]:
+    """
+    Generates shared objects, from ``(tablename, pk)`` tuples, fetching them
+    in chunks.
+    """
+    class_by_tablename = {
+        cls.__tablename__: cls for cls in DUMP_SHARED_CLASSES
+    }
+    for tablename, pks in _shared_object_pks_by_tablename(keys).items():
+        cls = class_by_tablename[tablename]
+        pk_col = inspect(cls).primary_key[0]
+        for pk_chunk in chunks(pks, EXPORT_DB_SHARD_SIZE):
+            for obj in dbsession.query(cls).filter(pk_col.in_(pk_chunk)):
+                yield obj
+
+
 def export_tasks_individually(
     req: "CamcopsRequest",
     recipient: ExportRecipient,
@@ -483,13 +986,16 @@ def export_tasks_individually(
             f"{recipient_name}"
         )
     else:
-        for task in collection.gen_tasks_by_class():
+        for cls in collection.task_classes():
             # Do NOT use this to check the working of export_task_backend():
             # export_task_backend(recipient.recipient_name, task.tablename, task.pk)  # noqa
             # ... it will deadlock at the database (because we're already
             # within a query of some sort, I presume)
-            export_task(req, recipient, task)
-            n_tasks += 1
+            for batch in collection.gen_task_chunks_for_task_class(
+                cls, EXPORT_TASK_BATCH_SIZE, expunge=True
+            ):
+                export_task_batch(req, recipient, batch)
+                n_tasks += len(batch)
         log.info(f"Exported {n_tasks} tasks to {recipient_name}")
 
 
@@ -499,13 +1005,10 @@ def export_task(
     """
     Exports a single task, checking that it remains valid to do so.
 
-    - Called by :func:`export_tasks_individually` directly, or called via
+    - Called via
       :func:``camcops_server.cc_modules.celery.export_task_backend`` if
       :func:`export_tasks_individually` requested that.
-    - Calls
-      :meth:`camcops_server.cc_modules.cc_exportmodels.ExportedTask.export`.
-    - For FHIR, holds a recipient-specific "FHIR" file lock during export.
-    - Always holds a recipient-and-task-specific file lock during export.
+    - Calls :func:`export_task_batch`.
 
     Args:
         req:
@@ -516,20 +1019,48 @@ def export_task(
         task:
             a :class:`camcops_server.cc_modules.cc_task.Task`
     """
+    export_task_batch(req, recipient, [task])
+
+
+def export_task_batch(
+    req: "CamcopsRequest", recipient: ExportRecipient, tasks: List[Task]
+) -> None:
+    """
+    Exports several tasks (typically of a single task class), checking that it
+    remains valid to do so.
+
+    - Called by :func:`export_tasks_individually` directly, or by
+      :func:`export_task`.
+    - Calls
+      :meth:`camcops_server.cc_modules.cc_exportmodels.ExportedTask.export`.
+    - For FHIR, holds a recipient-specific "FHIR" export lock during export.
+    - Always holds a recipient-and-task-specific export lock for each task
+      during export; these are acquired as a batch. Tasks whose lock is held by
+      another process are skipped.
+    - Once those locks are held, rechecks which tasks have already been
+      exported with one query per base table, rather than one per task.
+
+    Args:
+        req:
+            a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        recipient:
+            an
+            :class:`camcops_server.cc_modules.cc_exportmodels.ExportRecipient`
+        tasks:
+            a list of :class:`camcops_server.cc_modules.cc_task.Task` objects
+    """
 
     # Double-check it's OK! Just in case, for example, an old backend task has
     # persisted, or someone's managed to get an iffy back-end request in some
     # other way.
-    if not recipient.is_task_suitable(task):
-        # Warning will already have been emitted (by is_task_suitable).
+    # (For unsuitable tasks, a warning will already have been emitted by
+    # is_task_suitable.)
+    tasks = [task for task in tasks if recipient.is_task_suitable(task)]
+    if not tasks:
         return
 
-    cfg = req.config
-    lockfilename = cfg.get_export_lockfilename_recipient_task(
-        recipient_name=recipient.recipient_name,
-        basetable=task.tablename,
-        pk=task.pk,
-    )
+    lock_manager = req.config.get_export_lock_manager()
+    recipient_name = recipient.recipient_name
     dbsession = req.dbsession
     with ExitStack() as stack:
 
@@ -537,64 +1068,84 @@ def export_task(
             # Some FHIR servers struggle with parallel processing, so we hold
             # a lock to serialize them. See notes in cc_fhir.py.
             #
-            # We always use the order (1) FHIR lockfile, (2) task lockfile, to
-            # avoid a deadlock.
+            # We always use the order (1) FHIR lock, (2) task locks, to avoid
+            # a deadlock.
             #
             # (Note that it is impossible that a non-FHIR task export grabs the
-            # second of these without the first, because the second lockfile is
+            # second of these without the first, because the second lock is
             # recipient-specific and the recipient details include the fact
             # that it is a FHIR recipient.)
-            fhir_lockfilename = cfg.get_export_lockfilename_recipient_fhir(
-                recipient_name=recipient.recipient_name
+            fhir_lockname = export_lockname_recipient_fhir(
+                recipient_name=recipient_name
             )
             try:
                 stack.enter_context(
-                    lockfile.FileLock(
-                        fhir_lockfilename, timeout=jittered_delay_s()
-                    )
-                    # waits for a while
+                    lock_manager.lock(
+                        fhir_lockname, timeout=jittered_delay_s()
+                    )  # waits for a while
                 )
             except lockfile.AlreadyLocked:
                 log.warning(
-                    "Export logfile {!r} already locked by another process; "
+                    "Export lock {!r} already held by another process; "
                     "will try again later",
-                    fhir_lockfilename,
+                    fhir_lockname,
                 )
                 raise
                 # We will reschedule via Celery; see "self.retry(...)" in
                 # celery.py
 
-        try:
-            stack.enter_context(
-                lockfile.FileLock(lockfilename, timeout=0)  # doesn't wait
+        task_locknames = [
+            export_lockname_recipient_task(
+                recipient_name=recipient_name,
+                basetable=task.tablename,
+                pk=task.pk,
             )
-            # We recheck the export status once we hold the lock, in case
-            # multiple jobs are competing to export it.
-            if ExportedTask.task_already_exported(
+            for task in tasks
+        ]
+        acquired = set(
+            stack.enter_context(lock_manager.try_lock_many(task_locknames))
+        )  # doesn't wait
+        locked_tasks = []  # type: List[Task]
+        for task, lockname in zip(tasks, task_locknames):
+            if lockname not in acquired:
+                log.warning(
+                    "Export lock {!r} already held by another process; "
+                    "aborting (another process is doing this work)",
+                    lockname,
+                )
+                continue
+            locked_tasks.append(task)
+
+        # We recheck the export status once we hold the locks, in case
+        # multiple jobs are competing to export the same tasks.
+        pks_by_basetable = {}  # type: Dict[str, List[int]]
+        for task in locked_tasks:
+            pks_by_basetable.setdefault(task.tablename, []).append(task.pk)
+        already_exported = set()  # type: Set[Tuple[str, int]]
+        for basetable, task_pks in pks_by_basetable.items():
+            for pk in ExportedTask.task_pks_already_exported(
                 dbsession=dbsession,
-                recipient_name=recipient.recipient_name,
-                basetable=task.tablename,
-                task_pk=task.pk,
+                recipient_name=recipient_name,
+                basetable=basetable,
+                task_pks=task_pks,
             ):
+                already_exported.add((basetable, pk))
+
+        for task in locked_tasks:
+            if (task.tablename, task.pk) in already_exported:
                 log.info(
-                    "Task {!r} already exported to recipient {}; " "ignoring",
+                    "Task {!r} already exported to recipient {}; ignoring",
                     task,
                     recipient,
                 )
                 # Not a warning; it's normal to see these because it allows the
                 # client API to skip some checks for speed.
-                return
+                continue
             # OK; safe to export now.
             et = ExportedTask(recipient, task)
             dbsession.add(et)
             et.export(req)
             dbsession.commit()  # so the ExportedTask is visible to others ASAP
-        except lockfile.AlreadyLocked:
-            log.warning(
-                "Export logfile {!r} already locked by another process; "
-                "aborting (another process is doing this work)",
-                lockfilename,
-            )
 
 
 # =============================================================================
@@ -611,6 +1162,10 @@ def gen_audited_tasks_for_task_class(
     Generates tasks from a collection, for a given task class, simultaneously
     adding to an audit description. Used for user-triggered downloads.
 
+    Tasks are fetched in chunks, and expunged from the session once used, for
+    bounded memory use; see
+    :meth:`camcops_server.cc_modules.cc_taskcollection.TaskCollection.gen_tasks_for_task_class_chunked`.
+
     Args:
         collection:
             a
@@ -622,9 +1177,9 @@ def gen_audited_tasks_for_task_class(
 
     Yields:
         :class:`camcops_server.cc_modules.cc_task.Task` objects
-    """
+    """  # noqa
     pklist = []  # type: List[int]
-    for task in collection.tasks_for_task_class(cls):
+    for task in collection.gen_tasks_for_task_class_chunked(cls):
         pklist.append(task.pk)
         yield task
     audit_descriptions.append(
@@ -732,6 +1287,45 @@ def write_information_schema_to_dst(
 # =============================================================================
 
 
+class DownloadTooLargeError(Exception):
+    """
+    Exception raised when a file being written for a user to download would
+    exceed the space available to them.
+    """
+
+    pass
+
+
+class SizeLimitedFile(io.BufferedWriter):
+    """
+    A binary file, opened for writing, that raises
+    :exc:`DownloadTooLargeError` as soon as its size exceeds a limit, so that
+    we stop creating a download that the user has no space for (rather than
+    finding out after writing all of it).
+    """
+
+    def __init__(self, filename: str, max_size: int) -> None:
+        """
+        Args:
+            filename: file to create (or overwrite)
+            max_size: maximum permitted size of the file, in bytes
+        """
+        super().__init__(io.FileIO(filename, mode="wb"))
+        self.max_size = max_size
+        self.size = 0
+
+    def write(self, b: Any) -> int:
+        n = super().write(b)
+        # Writers such as zipfile may seek back to rewrite headers, so the
+        # size is the furthest point written, not the amount written.
+        self.size = max(self.size, self.tell())
+        if self.size > self.max_size:
+            raise DownloadTooLargeError(
+                f"File {self.name!r} would exceed {self.max_size} bytes"
+            )
+        return n
+
+
 @register_for_json
 class DownloadOptions(object):
     """
@@ -915,38 +1509,47 @@ class TaskCollectionExporter(object):
 
         download_dir = self.req.user_download_dir
         space = self.req.user_download_bytes_available
-        filename, contents = self.to_file()
-        size = len(contents)
+        filename = self.get_filename()
+        fullpath = os.path.join(download_dir, filename)
 
-        if size > space:
+        # Create file, stopping if it outgrows the space available
+        try:
+            self.write_file_body(fullpath, max_size=space)
+            size = os.path.getsize(fullpath)
+        except DownloadTooLargeError:
             # Not enough space
+            log.warning(f"User download exceeded space available: {fullpath}")
+            self._remove_file_if_present(fullpath)
             total_permitted = self.req.user_download_bytes_permitted
             msg = _(
                 "You do not have enough space to create this download. "
-                "You are allowed {total_permitted} bytes and you are have "
-                "{space} bytes free. This download would need {size} bytes."
-            ).format(total_permitted=total_permitted, space=space, size=size)
+                "You are allowed {total_permitted} bytes and you have "
+                "{space} bytes free."
+            ).format(total_permitted=total_permitted, space=space)
+        except Exception as e:
+            # Some error
+            log.exception(f"Failed to create user download: {fullpath}")
+            self._remove_file_if_present(fullpath)
+            msg = _(
+                "Failed to create file {filename}. Error was: {message}"
+            ).format(filename=filename, message=e)
         else:
-            # Create file
-            fullpath = os.path.join(download_dir, filename)
-            try:
-                with open(fullpath, "wb") as f:
-                    f.write(contents)
-                # Success
-                log.info(f"Created user download: {fullpath}")
-                msg = (
-                    _(
-                        "The research data dump you requested is ready to be "
-                        "downloaded. You will find it in your download area. "
-                        "It is called %s"
-                    )
-                    % filename
+            # Success
+            UserDownloadRecord.record_file(
+                self.req,
+                user_id=self.req.user_id,
+                filename=filename,
+                size_bytes=size,
+            )
+            log.info(f"Created user download: {fullpath}")
+            msg = (
+                _(
+                    "The research data dump you requested is ready to be "
+                    "downloaded. You will find it in your download area. "
+                    "It is called %s"
                 )
-            except Exception as e:
-                # Some other error
-                msg = _(
-                    "Failed to create file {filename}. Error was: {message}"
-                ).format(filename=filename, message=e)
+                % filename
+            )
 
         # E-mail the user, if they have an e-mail address
         email_to = self.req.user.email
@@ -985,6 +1588,46 @@ class TaskCollectionExporter(object):
             "Exporter needs to implement 'get_file_body'"
         )
 
+    def write_file_body(self, fullpath: str, max_size: int = None) -> None:
+        """
+        Writes the data from :meth:`get_file_body` to a file. Exporters that
+        can write straight to disk, without holding the whole file in memory,
+        override this.
+
+        Args:
+            fullpath: file to write
+            max_size: if set, the maximum permitted size of the file, in bytes
+
+        Raises:
+            :exc:`DownloadTooLargeError` if the file would exceed
+            ``max_size``; a partial file is left behind
+        """
+        body = self.get_file_body()
+        with self._open_file_for_writing(fullpath, max_size) as f:
+            f.write(body)
+
+    @staticmethod
+    def _open_file_for_writing(
+        fullpath: str, max_size: int = None
+    ) -> BinaryIO:
+        """
+        Opens a file for binary writing, limited to ``max_size`` bytes (see
+        :class:`SizeLimitedFile`) if that is set.
+        """
+        if max_size is None:
+            return open(fullpath, "wb")
+        return SizeLimitedFile(fullpath, max_size)
+
+    @staticmethod
+    def _remove_file_if_present(fullpath: str) -> None:
+        """
+        Deletes a (partially written) file, if it exists.
+        """
+        try:
+            os.remove(fullpath)
+        except FileNotFoundError:
+            pass
+
     def get_spreadsheet_collection(self) -> SpreadsheetCollection:
         """
         Converts the collection of tasks to a collection of spreadsheet-style
@@ -995,6 +1638,82 @@ class TaskCollectionExporter(object):
             :class:`camcops_server.cc_modules.cc_spreadsheet.SpreadsheetCollection`
             object
         """
+        coll = SpreadsheetCollection()
+        self._add_spreadsheet_pages(coll)
+        return coll
+
+    def get_spooled_spreadsheet_collection(
+        self, directory: str, max_size: int = None
+    ) -> SpooledSpreadsheetCollection:
+        """
+        As for :meth:`get_spreadsheet_collection`, but with bounded memory
+        use: tasks are fetched in chunks, and spreadsheet rows are kept in
+        temporary files in ``directory``.
+
+        Args:
+            directory: directory for the temporary files
+            max_size: if set, the maximum permitted total size of the
+                temporary files, in bytes
+
+        Returns:
+            a
+            :class:`camcops_server.cc_modules.cc_spreadsheet.SpooledSpreadsheetCollection`
+            object, which the caller should close
+
+        Raises:
+            :exc:`DownloadTooLargeError` if the temporary files would exceed
+            ``max_size``
+        """  # noqa
+        coll = SpooledSpreadsheetCollection(directory, max_size=max_size)
+        try:
+            self._add_spreadsheet_pages(coll)
+        except SpoolTooLargeError as e:
+            coll.close()
+            raise DownloadTooLargeError(str(e)) from e
+        except Exception:
+            coll.close()
+            raise
+        return coll
+
+    def _write_spooled_file_body(
+        self,
+        fullpath: str,
+        max_size: Optional[int],
+        write: Callable[[SpooledSpreadsheetCollection, BinaryIO], None],
+    ) -> None:
+        """
+        Implements :meth:`write_file_body` for exporters that write a
+        spreadsheet collection, via temporary files in the same directory (see
+        :meth:`get_spooled_spreadsheet_collection`). The temporary files count
+        towards ``max_size``, as they use the same space.
+
+        Args:
+            fullpath: file to write
+            max_size: if set, the maximum permitted size of the file plus the
+                temporary files, in bytes
+            write: function to write the collection to a binary file
+        """
+        directory = os.path.dirname(fullpath)
+        with self.get_spooled_spreadsheet_collection(
+            directory, max_size
+        ) as coll:
+            if max_size is not None:
+                max_size -= coll.spool_size
+            with self._open_file_for_writing(fullpath, max_size) as f:
+                write(coll, f)
+
+    def _add_spreadsheet_pages(self, coll: SpreadsheetCollection) -> None:
+        """
+        Adds spreadsheet pages for our tasks (and any schema pages) to a
+        spreadsheet collection, then simplifies and sorts it as requested. Also
+        audits the request as a basic data dump.
+
+        Args:
+            coll:
+                the
+                :class:`camcops_server.cc_modules.cc_spreadsheet.SpreadsheetCollection`
+                to add to
+        """  # noqa
         audit_descriptions = []  # type: List[str]
         options = self.options
         if options.spreadsheet_simplified:
@@ -1008,7 +1727,6 @@ class TaskCollectionExporter(object):
             summary_exclusion_tables = EMPTY_SET  # type: ignore[assignment]
             summary_exclusion_columns = EMPTY_SET  # type: ignore[assignment]
         # Task may return >1 sheet for output (e.g. for subtables).
-        coll = SpreadsheetCollection()
 
         # Iterate through tasks, creating the spreadsheet collection
         schema_elements = set()  # type: Set[SummarySchemaInfo]
@@ -1057,8 +1775,6 @@ class TaskCollectionExporter(object):
         # Audit
         audit(self.req, f"Basic dump: {'; '.join(audit_descriptions)}")
 
-        return coll
-
 
 class OdsExporter(TaskCollectionExporter):
     """
@@ -1071,6 +1787,11 @@ class OdsExporter(TaskCollectionExporter):
     def get_file_body(self) -> bytes:
         return self.get_spreadsheet_collection().as_ods()
 
+    def write_file_body(self, fullpath: str, max_size: int = None) -> None:
+        self._write_spooled_file_body(
+            fullpath, max_size, lambda coll, f: coll.write_ods(f)
+        )
+
     def get_data_response(self, body: bytes, filename: str) -> Response:
         return OdsResponse(body=body, filename=filename)
 
@@ -1111,6 +1832,32 @@ class TsvZipExporter(TaskCollectionExporter):
     def get_file_body(self) -> bytes:
         return self.get_spreadsheet_collection().as_zip()
 
+    def write_file_body(self, fullpath: str, max_size: int = None) -> None:
+        self._write_spooled_file_body(
+            fullpath, max_size, lambda coll, f: coll.write_zip(f)
+        )
+
+    def get_data_response(self, body: bytes, filename: str) -> Response:
+        return ZipResponse(body=body, filename=filename)
+
+
+class ParquetZipExporter(TaskCollectionExporter):
+    """
+    Converts a set of tasks to a set of Apache Parquet files (one per table),
+    with column types preserved, in a ZIP file.
+    """
+
+    file_extension = "zip"
+    viewtype = ViewArg.PARQUET_ZIP
+
+    def get_file_body(self) -> bytes:
+        return self.get_spreadsheet_collection().as_parquet_zip()
+
+    def write_file_body(self, fullpath: str, max_size: int = None) -> None:
+        self._write_spooled_file_body(
+            fullpath, max_size, lambda coll, f: coll.write_parquet_zip(f)
+        )
+
     def get_data_response(self, body: bytes, filename: str) -> Response:
         return ZipResponse(body=body, filename=filename)
 
@@ -1126,6 +1873,11 @@ class XlsxExporter(TaskCollectionExporter):
     def get_file_body(self) -> bytes:
         return self.get_spreadsheet_collection().as_xlsx()
 
+    def write_file_body(self, fullpath: str, max_size: int = None) -> None:
+        self._write_spooled_file_body(
+            fullpath, max_size, lambda coll, f: coll.write_xlsx(f)
+        )
+
     def get_data_response(self, body: bytes, filename: str) -> Response:
         return XlsxResponse(body=body, filename=filename)
 
@@ -1221,8 +1973,7 @@ class SqliteExporter(TaskCollectionExporter):
         # ---------------------------------------------------------------------
         # Make SQLAlchemy session
         # ---------------------------------------------------------------------
-        url = "sqlite:///" + db_filename
-        engine = create_engine(url, echo=False)
+        engine = create_sqlite_dump_engine(db_filename)
         dst_session: SqlASession = sessionmaker(bind=engine)()
         # ---------------------------------------------------------------------
         # Iterate through tasks, creating tables as we need them.
@@ -1246,8 +1997,14 @@ class SqliteExporter(TaskCollectionExporter):
             dst_session=dst_session,
             export_options=self.get_export_options(),
             req=self.req,
+            streaming=True,
         )
         dst_session.commit()
+        log.info(
+            "Wrote SQLite dump to {} (peak RSS {})",
+            db_filename,
+            get_peak_rss_description(),
+        )
         if self.options.include_information_schema_columns:
             # Must have committed before we do this:
             write_information_schema_to_dst(self.req, dst_session)
@@ -1266,17 +2023,33 @@ class SqliteExporter(TaskCollectionExporter):
 class SqlExporter(SqliteExporter):
     """
     Converts a set of tasks to the textual SQL needed to create an SQLite file.
+
+    The SQLite database is still created (in a temporary file), but the SQL is
+    then written to the file or HTTP response a statement at a time, so its
+    size doesn't affect memory use.
     """
 
     file_extension = "sql"
     viewtype = ViewArg.SQL
+    content_type = MimeType.TEXT
+    compress = False  # gzip the SQL?
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
         self.encoding = "utf-8"
 
     def get_file_body(self) -> bytes:
-        return self.get_sql().encode(self.encoding)
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            db_filename = os.path.join(tmpdirname, self.db_basename)
+            self._write_to_sqlite_file(db_filename)
+            return b"".join(self.gen_sql_blocks(db_filename))
+
+    def write_file_body(self, fullpath: str, max_size: int = None) -> None:
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            db_filename = os.path.join(tmpdirname, self.db_basename)
+            self._write_to_sqlite_file(db_filename)
+            with self._open_file_for_writing(fullpath, max_size) as f:
+                f.writelines(self.gen_sql_blocks(db_filename))
 
     def get_sql(self) -> str:
         """
@@ -1284,13 +2057,52 @@ class SqlExporter(SqliteExporter):
         """
         return self.get_sqlite_data_as_text()
 
+    def gen_sql_blocks(self, db_filename: str) -> Iterator[bytes]:
+        """
+        Generates the SQL describing an SQLite database, encoded (and
+        compressed, if :attr:`compress` is set), in blocks.
+
+        Args:
+            db_filename: filename of the SQLite database
+        """
+        connection = sqlite3.connect(db_filename)
+        try:
+            blocks = gen_encoded_blocks(
+                gen_sql_from_sqlite_database(connection),
+                encoding=self.encoding,
+            )
+            if self.compress:
+                blocks = gen_gzipped_blocks(blocks)
+            yield from blocks
+        finally:
+            connection.close()
+
     def download_now(self) -> Response:
         """
-        Download the data dump in the selected format
+        Download the data dump in the selected format. The SQLite database is
+        created now; the SQL is generated as the response is sent.
         """
-        filename = self.get_filename()
-        sql_text = self.get_sql()
-        return TextAttachmentResponse(body=sql_text, filename=filename)
+        tmpdir = tempfile.TemporaryDirectory()
+        db_filename = os.path.join(tmpdir.name, self.db_basename)
+        try:
+            self._write_to_sqlite_file(db_filename)
+        except Exception:
+            tmpdir.cleanup()
+            raise
+
+        def gen_blocks_then_clean_up() -> Iterator[bytes]:
+            try:
+                yield from self.gen_sql_blocks(db_filename)
+            finally:
+                tmpdir.cleanup()
+
+        # If the response is never iterated, the TemporaryDirectory is
+        # cleaned up when it's garbage-collected.
+        return StreamingAttachmentResponse(
+            app_iter=gen_blocks_then_clean_up(),
+            filename=self.get_filename(),
+            content_type=self.content_type,
+        )
 
     def get_data_response(self, body: bytes, filename: str) -> Response:
         """
@@ -1299,6 +2111,18 @@ class SqlExporter(SqliteExporter):
         pass
 
 
+class SqlGzipExporter(SqlExporter):
+    """
+    Converts a set of tasks to the textual SQL needed to create an SQLite
+    file, compressed with gzip as it is written.
+    """
+
+    file_extension = "sql.gz"
+    viewtype = ViewArg.SQL_GZ
+    content_type = GZIP_MIMETYPE
+    compress = True
+
+
 # Create mapping from "viewtype" to class.
 # noinspection PyTypeChecker
 DOWNLOADER_CLASSES = {}  # type: Dict[str, Type[TaskCollectionExporter]]
@@ -1576,6 +2400,34 @@ class UserDownloadFile(object):
         with open(self.fullpath, "rb") as f:
             return f.read()
 
+    def make_response(self, req: "CamcopsRequest") -> Response:
+        """
+        Returns a response that sends the file to the user, without reading
+        it into memory (possibly delegating to the front-end web server, as
+        configured). May raise :exc:`OSError` if the file can't be opened.
+
+        Args:
+            req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        """
+        config = req.config
+        # For X-Accel-Redirect, the front end maps an internal location to
+        # the root user download directory.
+        relative_path = os.path.relpath(
+            self.fullpath, os.path.abspath(config.user_download_dir)
+        )
+        accel_redirect_uri = (
+            config.user_download_accel_redirect_prefix.rstrip("/")
+            + "/"
+            + urllib.parse.quote(relative_path)
+        )
+        return FileAttachmentResponse(
+            request=req,
+            fullpath=self.fullpath,
+            filename=self.filename,
+            sendfile_method=config.user_download_sendfile,
+            accel_redirect_uri=accel_redirect_uri,
+        )
+
     # -------------------------------------------------------------------------
     # Bulk creation
     # -------------------------------------------------------------------------
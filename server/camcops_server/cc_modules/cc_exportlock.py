@@ -0,0 +1,532 @@
+"""
+camcops_server/cc_modules/cc_exportlock.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Process locks used during export.**
+
+Export functions hold named locks so that only one process does a given piece
+of mutually exclusive work (e.g. exporting the same task to the same
+recipient). Two backends are available, selected by the ``EXPORT_LOCK_BACKEND``
+config parameter:
+
+- ``file`` (the default): lockfiles in ``EXPORT_LOCKDIR``, via the
+  ``lockfile`` package. All processes must share that directory.
+
+- ``database``: advisory locks in the CamCOPS database itself; MySQL
+  ``GET_LOCK()`` or PostgreSQL ``pg_try_advisory_lock()``. These involve no
+  filesystem operations and work across machines. Locks are held on a
+  connection of their own, so they are released by the database server if the
+  process dies. SQLite has no advisory locks, and a SQLite database can only
+  be shared by processes on one machine anyway, so for SQLite (and any other
+  dialect) we fall back to file locks.
+
+Both backends offer :meth:`ExportLockManager.try_lock_many`, which takes a
+batch of locks without waiting (one database round trip for the database
+backend), for chunked exports.
+
+For consistency with the ``lockfile`` package, failure to acquire a lock is
+signalled by :exc:`lockfile.AlreadyLocked`, whichever backend is in use.
+
+"""
+
+from contextlib import contextmanager
+import hashlib
+import logging
+import math
+import os
+import time
+from typing import Generator, Iterable, List, Optional, TYPE_CHECKING
+
+from cardinal_pythonlib.logs import BraceStyleAdapter
+import lockfile
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.expression import func, select
+
+from camcops_server.cc_modules.cc_constants import ExportLockBackendNames
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine.base import Connection, Engine
+    from sqlalchemy.sql.functions import Function
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+
+# =============================================================================
+# Lock names
+# =============================================================================
+
+MASTER_EXPORT_RECIPIENT_LOCKNAME = "camcops_master_export_recipient"
+# ... When we are modifying export recipients, we check "is this information
+# the same as the current version in the database", and if not, we write fresh
+# information to the database. If lots of processes do that at the same time,
+# we have a problem (usually a database deadlock) -- hence this lock.
+
+
+def export_lockname_recipient_db(recipient_name: str) -> str:
+    """
+    Lock name for a whole-database export to a particular export recipient.
+    """
+    return f"camcops_export_db_{recipient_name}"
+
+
+def export_lockname_recipient_fhir(recipient_name: str) -> str:
+    """
+    Lock name for a FHIR export to a particular export recipient.
+
+    (This must be different from :func:`export_lockname_recipient_db`, because
+    of what we assume about someone else holding the same lock.)
+    """
+    return f"camcops_export_fhir_{recipient_name}"
+
+
+def export_lockname_database_run(run_id: int) -> str:
+    """
+    Lock name for the final step of a sharded database export.
+    """
+    return f"camcops_export_db_run_{run_id}"
+
+
+def export_lockname_database_shard(shard_id: int) -> str:
+    """
+    Lock name for one shard of a sharded database export.
+    """
+    return f"camcops_export_db_shard_{shard_id}"
+
+
+def export_lockname_recipient_task(
+    recipient_name: str, basetable: str, pk: int
+) -> str:
+    """
+    Lock name for a single-task export to a particular export recipient.
+    """
+    return f"camcops_export_task_{recipient_name}_{basetable}_{pk}"
+
+
+# =============================================================================
+# ExportLockManager
+# =============================================================================
+
+
+class ExportLockManager(object):
+    """
+    Base class for export lock backends. Subclasses implement
+    :meth:`_lock` and :meth:`_try_lock_many`; this class adds the timing and
+    logging.
+    """
+
+    backend_name = ""
+
+    @contextmanager
+    def lock(
+        self, name: str, timeout: Optional[float] = 0
+    ) -> Generator[None, None, None]:
+        """
+        Context manager to hold a single named lock.
+
+        Args:
+            name:
+                lock name
+            timeout:
+                as for :class:`lockfile.FileLock`: ``None`` to wait for ever;
+                ``0`` (or less) not to wait; otherwise, the number of seconds
+                to wait.
+
+        Raises:
+            :exc:`lockfile.AlreadyLocked` if the lock could not be acquired
+        """
+        t_start = time.perf_counter()
+        acquired = False
+        try:
+            with self._lock(name, timeout):
+                acquired = True
+                t_acquired = time.perf_counter()
+                log.debug(
+                    "Acquired export lock {!r} ({} backend) after waiting "
+                    "{:.3f} s",
+                    name,
+                    self.backend_name,
+                    t_acquired - t_start,
+                )
+                try:
+                    yield
+                finally:
+                    log.debug(
+                        "Released export lock {!r} after holding it for "
+                        "{:.3f} s",
+                        name,
+                        time.perf_counter() - t_acquired,
+                    )
+        except lockfile.AlreadyLocked:
+            if not acquired:
+                log.debug(
+                    "Failed to acquire export lock {!r} after waiting "
+                    "{:.3f} s",
+                    name,
+                    time.perf_counter() - t_start,
+                )
+            raise
+
+    @contextmanager
+    def try_lock_many(
+        self, names: Iterable[str]
+    ) -> Generator[List[str], None, None]:
+        """
+        Context manager to hold as many as possible of a batch of named locks,
+        without waiting for any of them.
+
+        Args:
+            names:
+                lock names
+
+        Yields:
+            the names of the locks that were acquired (in their original
+            order); the others are held by someone else.
+        """
+        names = list(dict.fromkeys(names))  # de-duplicate, preserving order
+        if not names:
+            yield []
+            return
+        t_start = time.perf_counter()
+        with self._try_lock_many(names) as acquired:
+            t_acquired = time.perf_counter()
+            log.info(
+                "Acquired {} of {} export locks ({} backend) in {:.3f} s",
+                len(acquired),
+                len(names),
+                self.backend_name,
+                t_acquired - t_start,
+            )
+            try:
+                yield acquired
+            finally:
+                log.info(
+                    "Released {} export locks after holding them for "
+                    "{:.3f} s",
+                    len(acquired),
+                    time.perf_counter() - t_acquired,
+                )
+
+    @contextmanager
+    def _lock(
+        self, name: str, timeout: Optional[float]
+    ) -> Generator[None, None, None]:
+        """
+        Acquires and holds a single lock, or raises
+        :exc:`lockfile.AlreadyLocked`.
+        """
+        raise NotImplementedError
+        # noinspection PyUnreachableCode
+        yield
+
+    @contextmanager
+    def _try_lock_many(
+        self, names: List[str]
+    ) -> Generator[List[str], None, None]:
+        """
+        Acquires and holds whichever of the (unique) locks are available.
+        """
+        raise NotImplementedError
+        # noinspection PyUnreachableCode
+        yield []
+
+
+# =============================================================================
+# File locks
+# =============================================================================
+
+
+class FileExportLockManager(ExportLockManager):
+    """
+    Lock backend using lockfiles in a directory.
+    """
+
+    backend_name = ExportLockBackendNames.FILE
+
+    def __init__(self, lockdir: str) -> None:
+        """
+        Args:
+            lockdir: directory in which to create lockfiles
+        """
+        self.lockdir = lockdir
+
+    def lockfilename(self, name: str) -> str:
+        """
+        Returns the lockfile name for a given lock name.
+        """
+        # ".lock" is appended automatically by the lockfile package
+        return os.path.join(self.lockdir, name)
+
+    @contextmanager
+    def _lock(
+        self, name: str, timeout: Optional[float]
+    ) -> Generator[None, None, None]:
+        filelock = lockfile.FileLock(self.lockfilename(name), timeout=timeout)
+        try:
+            filelock.acquire()
+        except lockfile.LockTimeout as e:
+            # Report this the same way as the no-wait case.
+            raise lockfile.AlreadyLocked(str(e))
+        try:
+            yield
+        finally:
+            filelock.release()
+
+    @contextmanager
+    def _try_lock_many(
+        self, names: List[str]
+    ) -> Generator[List[str], None, None]:
+        filelocks = []  # type: List[lockfile.FileLock]
+        acquired = []  # type: List[str]
+        try:
+            for name in names:
+                filelock = lockfile.FileLock(
+                    self.lockfilename(name), timeout=0
+                )
+                try:
+                    filelock.acquire()
+                except lockfile.AlreadyLocked:
+                    continue
+                filelocks.append(filelock)
+                acquired.append(name)
+            yield acquired
+        finally:
+            for filelock in reversed(filelocks):
+                filelock.release()
+
+
+# =============================================================================
+# Database advisory locks
+# =============================================================================
+
+
+class DatabaseExportLockManager(ExportLockManager):
+    """
+    Base class for lock backends using database advisory locks. Each lock (or
+    batch of locks) is held on a connection of its own, in autocommit mode, so
+    that it is independent of the caller's transactions.
+    """
+
+    backend_name = ExportLockBackendNames.DATABASE
+    POLL_INTERVAL_S = 0.1
+
+    def __init__(self, engine: "Engine") -> None:
+        """
+        Args:
+            engine: SQLAlchemy engine for the CamCOPS database
+        """
+        self.engine = engine
+
+    @contextmanager
+    def _connection(self) -> Generator["Connection", None, None]:
+        with self.engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT")
+            yield conn
+
+    def _try_acquire_all(
+        self, conn: "Connection", names: List[str]
+    ) -> List[bool]:
+        """
+        Tries to acquire each lock, without waiting, in one round trip.
+        Returns a list of success flags.
+        """
+        row = conn.execute(
+            select(*[self._try_acquire_func(name) for name in names])
+        ).one()
+        return [bool(x) for x in row]
+
+    def _release_all(self, conn: "Connection", names: List[str]) -> None:
+        """
+        Releases the locks, in one round trip. If that fails, we discard the
+        connection, which makes the database release them.
+        """
+        if not names:
+            return
+        try:
+            conn.execute(select(*[self._release_func(name) for name in names]))
+        except SQLAlchemyError:
+            log.exception(
+                "Failed to release export locks {!r}; discarding connection",
+                names,
+            )
+            conn.invalidate()
+
+    def _acquire_waiting(
+        self, conn: "Connection", name: str, timeout: Optional[float]
+    ) -> bool:
+        """
+        Tries to acquire a single lock, waiting for up to ``timeout`` seconds
+        (for ever if ``timeout`` is ``None``). This default implementation
+        polls.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._try_acquire_all(conn, [name])[0]:
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.POLL_INTERVAL_S)
+
+    def _try_acquire_func(self, name: str) -> "Function":
+        """
+        SQL function call to acquire a lock without waiting; returns a true
+        value for success.
+        """
+        raise NotImplementedError
+
+    def _release_func(self, name: str) -> "Function":
+        """
+        SQL function call to release a lock.
+        """
+        raise NotImplementedError
+
+    @contextmanager
+    def _lock(
+        self, name: str, timeout: Optional[float]
+    ) -> Generator[None, None, None]:
+        with self._connection() as conn:
+            if timeout is not None and timeout <= 0:
+                acquired = self._try_acquire_all(conn, [name])[0]
+            else:
+                acquired = self._acquire_waiting(conn, name, timeout)
+            if not acquired:
+                raise lockfile.AlreadyLocked(
+                    f"Database lock {name!r} is already locked"
+                )
+            try:
+                yield
+            finally:
+                self._release_all(conn, [name])
+
+    @contextmanager
+    def _try_lock_many(
+        self, names: List[str]
+    ) -> Generator[List[str], None, None]:
+        with self._connection() as conn:
+            successes = self._try_acquire_all(conn, names)
+            acquired = [name for name, ok in zip(names, successes) if ok]
+            try:
+                yield acquired
+            finally:
+                self._release_all(conn, acquired)
+
+
+class MySQLExportLockManager(DatabaseExportLockManager):
+    """
+    Lock backend using MySQL/MariaDB ``GET_LOCK()``.
+
+    - Requires MySQL 5.7+ or MariaDB 10.0.2+ to hold several locks at once.
+    - Lock names are server-wide, so we qualify them with the database name.
+    - Lock names are limited to 64 characters; longer ones are hashed.
+    """
+
+    MAX_LOCKNAME_LENGTH = 64
+
+    def server_lockname(self, name: str) -> str:
+        """
+        Returns the name used for the lock on the server.
+        """
+        qualified = f"{self.engine.url.database}.{name}"
+        if len(qualified) <= self.MAX_LOCKNAME_LENGTH:
+            return qualified
+        digest = hashlib.sha1(qualified.encode("utf-8")).hexdigest()
+        return f"camcops_{digest}"
+
+    def _try_acquire_func(self, name: str) -> "Function":
+        return func.get_lock(self.server_lockname(name), 0)
+
+    def _release_func(self, name: str) -> "Function":
+        return func.release_lock(self.server_lockname(name))
+
+    def _acquire_waiting(
+        self, conn: "Connection", name: str, timeout: Optional[float]
+    ) -> bool:
+        # GET_LOCK() can wait by itself; a negative timeout means for ever.
+        timeout_s = -1 if timeout is None else math.ceil(timeout)
+        result = conn.execute(
+            select(func.get_lock(self.server_lockname(name), timeout_s))
+        ).scalar()
+        return bool(result)
+
+
+class PostgreSQLExportLockManager(DatabaseExportLockManager):
+    """
+    Lock backend using PostgreSQL session-level advisory locks. These are
+    identified by a 64-bit integer key (within the current database), which we
+    derive from a hash of the lock name.
+    """
+
+    @staticmethod
+    def lock_key(name: str) -> int:
+        """
+        Returns the signed 64-bit advisory lock key for a lock name.
+        """
+        digest = hashlib.sha256(name.encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], byteorder="big", signed=True)
+
+    def _try_acquire_func(self, name: str) -> "Function":
+        return func.pg_try_advisory_lock(self.lock_key(name))
+
+    def _release_func(self, name: str) -> "Function":
+        return func.pg_advisory_unlock(self.lock_key(name))
+
+
+# =============================================================================
+# Factory
+# =============================================================================
+
+
+def make_export_lock_manager(
+    backend_name: str, lockdir: str, engine: Optional["Engine"]
+) -> ExportLockManager:
+    """
+    Creates an export lock manager.
+
+    Args:
+        backend_name:
+            one of the values in
+            :class:`camcops_server.cc_modules.cc_constants.ExportLockBackendNames`
+        lockdir:
+            directory for lockfiles
+        engine:
+            SQLAlchemy engine for the CamCOPS database (not needed for the
+            file backend)
+
+    Returns:
+        an :class:`ExportLockManager`
+    """
+    if backend_name == ExportLockBackendNames.FILE:
+        return FileExportLockManager(lockdir)
+    if backend_name != ExportLockBackendNames.DATABASE:
+        raise ValueError(f"Unknown export lock backend: {backend_name!r}")
+    dialect_name = engine.dialect.name
+    if dialect_name in ("mysql", "mariadb"):
+        return MySQLExportLockManager(engine)
+    if dialect_name == "postgresql":
+        return PostgreSQLExportLockManager(engine)
+    log.info(
+        "No database advisory locks for dialect {!r}; using file-based "
+        "export locks",
+        dialect_name,
+    )
+    return FileExportLockManager(lockdir)
@@ -34,7 +34,20 @@ import posixpath
 import socket
 import subprocess
 import sys
-from typing import Any, Generator, List, Optional, Tuple, TYPE_CHECKING
+from typing import (
+    Any,
+    cast,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+    Union,
+)
 
 from cardinal_pythonlib.datetimefunc import (
     get_now_utc_datetime,
@@ -47,10 +60,14 @@ from cardinal_pythonlib.email_utils.sendmail import (
 from cardinal_pythonlib.fileops import mkdir_p
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.network import ping
-from cardinal_pythonlib.sqlalchemy.list_types import StringListType
+from cardinal_pythonlib.lists import chunks
+from cardinal_pythonlib.sqlalchemy.list_types import (
+    IntListType,
+    StringListType,
+)
 from cardinal_pythonlib.sqlalchemy.orm_query import bool_from_exists_clause
-import hl7
 from pendulum import DateTime as Pendulum
+from sqlalchemy import delete, insert
 from sqlalchemy.orm import (
     Mapped,
     mapped_column,
@@ -58,7 +75,8 @@ from sqlalchemy.orm import (
     relationship,
     Session as SqlASession,
 )
-from sqlalchemy.sql.schema import ForeignKey
+from sqlalchemy.sql.expression import and_, exists, select
+from sqlalchemy.sql.schema import ForeignKey, Table
 from sqlalchemy.sql.sqltypes import (
     BigInteger,
     Text,
@@ -86,10 +104,6 @@ from camcops_server.cc_modules.cc_hl7 import (
     msg_is_successful_ack,
     SEGMENT_SEPARATOR,
 )
-from camcops_server.cc_modules.cc_redcap import (
-    RedcapExportException,
-    RedcapTaskExporter,
-)
 from camcops_server.cc_modules.cc_sqla_coltypes import (
     LongText,
     TableNameColType,
@@ -104,6 +118,11 @@ from camcops_server.cc_modules.cc_taskfactory import (
 )
 
 if TYPE_CHECKING:
+    import hl7
+    from sqlalchemy.orm import InstrumentedAttribute
+    from sqlalchemy.sql.elements import ColumnElement
+    from sqlalchemy.sql.selectable import Exists
+
     from camcops_server.cc_modules.cc_request import CamcopsRequest
     from camcops_server.cc_modules.cc_task import Task
 
@@ -115,6 +134,7 @@ log = BraceStyleAdapter(logging.getLogger(__name__))
 # =============================================================================
 
 DOS_NEWLINE = "\r\n"
+EXPORT_LOG_BULK_INSERT_SIZE = 1000  # rows per bulk INSERT of export logs
 
 
 # =============================================================================
@@ -187,23 +207,44 @@ def gen_exportedtasks(
 
 
 def gen_tasks_having_exportedtasks(
-    collection: TaskCollection,
+    collection: TaskCollection, chunked: bool = False
 ) -> Generator["Task", None, None]:
     """
     Generates tasks from a collection, creating export logs as we go.
 
-    Used for database exports.
+    Used for database exports. Rather than creating an :class:`ExportedTask`
+    ORM object (and an ``INSERT``) per task, the successful export logs are
+    written in bulk, via :meth:`ExportedTask.bulk_insert_successes`, every
+    :data:`EXPORT_LOG_BULK_INSERT_SIZE` tasks and once the tasks are
+    exhausted.
 
     Args:
         collection: a :class:`camcops_server.cc_modules.cc_taskcollection.TaskCollection`
+        chunked: fetch tasks in chunks (for bounded memory use), rather than
+            all at once?
 
     Yields:
         :class:`camcops_server.cc_modules.cc_task.Task` objects
 
     """  # noqa
-    for et in gen_exportedtasks(collection):
-        yield et.task
-        et.succeed()
+    dbsession = collection.dbsession
+    recipient = collection.export_recipient
+    assert recipient is not None, "TaskCollection has no export_recipient"
+    pending = []  # type: List[Tuple[str, int, datetime.datetime]]
+    tasks = (
+        collection.gen_tasks_by_class_chunked()
+        if chunked
+        else collection.gen_tasks_by_class()
+    )
+    for task in tasks:
+        start_at_utc = get_now_utc_datetime()
+        yield task
+        # If we get here, the consumer has dealt with the task successfully.
+        pending.append((task.tablename, task.pk, start_at_utc))
+        if len(pending) >= EXPORT_LOG_BULK_INSERT_SIZE:
+            ExportedTask.bulk_insert_successes(dbsession, recipient, pending)
+            pending = []
+    ExportedTask.bulk_insert_successes(dbsession, recipient, pending)
 
 
 # =============================================================================
@@ -453,7 +494,7 @@ class ExportedTask(Base):
     def export_file(
         self,
         filename: str,
-        text: str = None,
+        text: Union[str, Iterable[str]] = None,
         binary: bytes = None,
         text_encoding: str = UTF8,
     ) -> bool:
@@ -462,7 +503,8 @@ class ExportedTask(Base):
 
         Args:
             filename:
-            text: text contents (specify this XOR ``binary``)
+            text: text contents, or an iterable of text fragments to be
+                written in turn (specify this XOR ``binary``)
             binary: binary contents (specify this XOR ``text``)
             text_encoding: encoding to use when writing text
 
@@ -485,6 +527,95 @@ class ExportedTask(Base):
         self.cancelled = True
         self.cancelled_at_utc = get_now_utc_datetime()
 
+    @classmethod
+    def bulk_insert_successes(
+        cls,
+        dbsession: SqlASession,
+        recipient: ExportRecipient,
+        tasks: Sequence[Tuple[str, int, datetime.datetime]],
+    ) -> None:
+        """
+        Records successful exports of several tasks to a recipient, with a
+        single multi-row ``INSERT`` (executemany) rather than one ORM object
+        per task.
+
+        Args:
+            dbsession: a :class:`sqlalchemy.orm.session.Session`
+            recipient: an :class:`camcops_server.cc_modules.cc_exportrecipient.ExportRecipient`
+            tasks: list of ``basetable, task_pk, start_at_utc`` tuples
+        """  # noqa
+        if not tasks:
+            return
+        if recipient.id is None:
+            dbsession.flush()  # ensure the recipient has its PK
+        finish_at_utc = get_now_utc_datetime()
+        rows = [
+            {
+                cls.recipient_id.name: recipient.id,
+                cls.basetable.name: basetable,
+                cls.task_server_pk.name: task_pk,
+                cls.start_at_utc.name: start_at_utc,
+                cls.finish_at_utc.name: finish_at_utc,
+                cls.success.name: True,
+                cls.cancelled.name: False,
+            }
+            for basetable, task_pk, start_at_utc in tasks
+        ]  # type: List[Dict[str, Any]]
+        dbsession.execute(insert(cast(Table, cls.__table__)), rows)
+        log.debug(
+            "Recorded {} successful export(s) to recipient {}",
+            len(rows),
+            recipient.recipient_name,
+        )
+
+    @classmethod
+    def successful_export_exists(
+        cls,
+        recipient_name: str,
+        basetable: Union[
+            str, "ColumnElement[Any]", "InstrumentedAttribute[str]"
+        ],
+        task_pk: Union[
+            int, "ColumnElement[Any]", "InstrumentedAttribute[int]"
+        ],
+    ) -> "Exists":
+        """
+        Returns an SQL ``EXISTS`` clause that is true if there is a successful
+        (and not cancelled) export of the task to a recipient of this name
+        (regardless of ``ExportRecipient.id``, which changes when the export
+        recipient is reconfigured).
+
+        ``basetable`` and ``task_pk`` may be columns of an outer query, in
+        which case the negation of this clause (``~exists``) is an anti-join
+        against the export log. That's how
+        :class:`camcops_server.cc_modules.cc_taskcollection.TaskCollection`
+        restricts incremental exports to tasks not yet sent.
+
+        Args:
+            recipient_name: export recipient name
+            basetable: name of the task's base table, or a column giving it
+            task_pk: server PK of the task, or a column giving it
+        """
+        # noinspection PyUnresolvedReferences
+        return (
+            exists()
+            .select_from(
+                cls.__table__.join(
+                    ExportRecipient.__table__,
+                    cls.recipient_id == ExportRecipient.id,
+                )
+            )
+            .where(
+                and_(
+                    ExportRecipient.recipient_name == recipient_name,
+                    cls.basetable == basetable,
+                    cls.task_server_pk == task_pk,
+                    cls.success == True,  # noqa: E712
+                    cls.cancelled == False,  # noqa: E712
+                )
+            )
+        )
+
     @classmethod
     def task_already_exported(
         cls,
@@ -506,17 +637,49 @@ class ExportedTask(Base):
             does a successful export record exist for this task?
 
         """
-        exists_q = (
-            dbsession.query(cls)
+        exists_q = cls.successful_export_exists(
+            recipient_name=recipient_name,
+            basetable=basetable,
+            task_pk=task_pk,
+        )
+        return bool_from_exists_clause(dbsession, exists_q)
+
+    @classmethod
+    def task_pks_already_exported(
+        cls,
+        dbsession: SqlASession,
+        recipient_name: str,
+        basetable: str,
+        task_pks: Iterable[int],
+    ) -> Set[int]:
+        """
+        Set-based version of :meth:`task_already_exported`: which of these
+        tasks (all from the same base table) have already been successfully
+        exported? Uses a single query.
+
+        Args:
+            dbsession: a :class:`sqlalchemy.orm.session.Session`
+            recipient_name:
+            basetable: name of the tasks' base table
+            task_pks: server PKs of the tasks
+
+        Returns:
+            the subset of ``task_pks`` having a successful export record
+        """
+        task_pks = list(task_pks)
+        if not task_pks:
+            return set()
+        q = (
+            dbsession.query(cls.task_server_pk)
             .join(cls.recipient)
             .filter(ExportRecipient.recipient_name == recipient_name)
             .filter(cls.basetable == basetable)
-            .filter(cls.task_server_pk == task_pk)
+            .filter(cls.task_server_pk.in_(task_pks))
             .filter(cls.success == True)  # noqa: E712
             .filter(cls.cancelled == False)  # noqa: E712
-            .exists()
+            .distinct()
         )
-        return bool_from_exists_clause(dbsession, exists_q)
+        return set(row[0] for row in q)
 
 
 # =============================================================================
@@ -711,6 +874,8 @@ class ExportedTaskHL7Message(Base):
 
         - https://python-hl7.readthedocs.org/en/latest/index.html
         """
+        import hl7  # delayed import
+
         task = self.exported_task.task
         recipient = self.exported_task.recipient
 
@@ -746,6 +911,8 @@ class ExportedTaskHL7Message(Base):
         - https://python-hl7.readthedocs.org/en/latest/api.html; however,
           we've modified that
         """  # noqa
+        import hl7  # delayed import
+
         recipient = self.exported_task.recipient
 
         if recipient.hl7_ping_first:
@@ -889,7 +1056,7 @@ class ExportedTaskFileGroup(Base):
     def export_file(
         self,
         filename: str,
-        text: str = None,
+        text: Union[str, Iterable[str]] = None,
         binary: bytes = None,
         text_encoding: str = UTF8,
     ) -> bool:
@@ -898,7 +1065,8 @@ class ExportedTaskFileGroup(Base):
 
         Args:
             filename:
-            text: text contents (specify this XOR ``binary``)
+            text: text contents, or an iterable of text fragments to be
+                written in turn (specify this XOR ``binary``)
             binary: binary contents (specify this XOR ``text``)
             text_encoding: encoding to use when writing text
 
@@ -926,7 +1094,10 @@ class ExportedTaskFileGroup(Base):
             log.debug("Writing to {!r}", filename)
             if text:
                 with open(filename, mode="w", encoding=text_encoding) as f:
-                    f.write(text)
+                    if isinstance(text, str):
+                        f.write(text)
+                    else:
+                        f.writelines(text)
             else:
                 with open(filename, mode="wb") as f:
                     f.write(binary)
@@ -988,7 +1159,7 @@ class ExportedTaskFileGroup(Base):
             text = task.get_html(req)
         elif task_format == FileType.XML:
             binary = None
-            text = task.get_xml(req)
+            text = task.gen_xml(req)
         else:
             raise AssertionError("Unknown task_format")
         written = self.export_file(
@@ -1235,6 +1406,11 @@ class ExportedTaskRedcap(Base):
         Args:
             req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
         """
+        from camcops_server.cc_modules.cc_redcap import (
+            RedcapExportException,
+            RedcapTaskExporter,
+        )  # delayed import
+
         exported_task = self.exported_task
         exporter = RedcapTaskExporter()
 
@@ -1362,3 +1538,251 @@ class ExportedTaskFhirEntry(Base):
         # wrong) things. See
         # https://stackoverflow.com/questions/10893374/python-confusions-with-urljoin
         return posixpath.join(api_url, self.location)
+
+
+# =============================================================================
+# Sharded database export
+# =============================================================================
+
+
+class ExportedDatabaseRun(Base):
+    """
+    Represents a whole-database export to a database recipient, done in shards
+    via the back end, so that it can be resumed if it is interrupted. See
+    :func:`camcops_server.cc_modules.cc_export.export_database_sharded`.
+    """
+
+    __tablename__ = "_exported_database_runs"
+
+    id: Mapped[int] = mapped_column(
+        primary_key=True,
+        autoincrement=True,
+        comment="Arbitrary primary key",
+    )
+    recipient_id: Mapped[int] = mapped_column(
+        BigInteger,
+        ForeignKey(ExportRecipient.id),
+        comment=f"FK to {ExportRecipient.__tablename__}.{ExportRecipient.id.name}",  # noqa
+    )
+    started_at_utc: Mapped[datetime.datetime] = mapped_column(
+        comment="Time export was started (UTC)",
+    )
+    finished_at_utc: Mapped[Optional[datetime.datetime]] = mapped_column(
+        comment="Time export was finished (UTC)"
+    )
+
+    recipient = relationship(ExportRecipient)
+    shards = relationship(
+        "ExportedDatabaseShard",
+        back_populates="run",
+        order_by="ExportedDatabaseShard.id",
+    )
+
+    def __init__(
+        self, recipient: ExportRecipient = None, **kwargs: Any
+    ) -> None:
+        """
+        Args:
+            recipient: an :class:`camcops_server.cc_modules.cc_exportrecipient.ExportRecipient`
+        """  # noqa
+        super().__init__(**kwargs)
+        self.recipient = recipient
+        self.started_at_utc = get_now_utc_datetime()
+
+    @classmethod
+    def get_unfinished_run(
+        cls, dbsession: SqlASession, recipient_name: str
+    ) -> Optional["ExportedDatabaseRun"]:
+        """
+        Returns the most recent unfinished run for a recipient (with this
+        name, even if other aspects of the export recipient have changed), if
+        there is one.
+        """
+        return (
+            dbsession.query(cls)
+            .join(ExportRecipient, cls.recipient_id == ExportRecipient.id)
+            .filter(ExportRecipient.recipient_name == recipient_name)
+            .filter(cls.finished_at_utc.is_(None))
+            .order_by(cls.id.desc())
+            .first()
+        )
+
+    def unfinished_shard_ids(self) -> List[int]:
+        """
+        Returns the IDs of shards that have not yet been copied, fetched
+        afresh from the database.
+        """
+        dbsession = SqlASession.object_session(self)
+        return list(
+            dbsession.execute(
+                select(ExportedDatabaseShard.id)
+                .where(ExportedDatabaseShard.run_id == self.id)
+                .where(ExportedDatabaseShard.finished_at_utc.is_(None))
+                .order_by(ExportedDatabaseShard.id)
+            ).scalars()
+        )
+
+    def gen_shared_object_keys(
+        self,
+    ) -> Generator[Tuple[str, int], None, None]:
+        """
+        Generates ``(tablename, pk)`` tuples for all the shared objects (e.g.
+        patients) referred to by tasks in this run, without duplicates.
+        """
+        dbsession = SqlASession.object_session(self)
+        so = ExportedDatabaseSharedObject
+        q = (
+            select(so.tablename, so.pk)
+            .join(
+                ExportedDatabaseShard, so.shard_id == ExportedDatabaseShard.id
+            )
+            .where(ExportedDatabaseShard.run_id == self.id)
+            .distinct()
+            .order_by(so.tablename, so.pk)
+        )
+        for tablename, pk in dbsession.execute(q):
+            yield tablename, pk
+
+    def delete_shared_object_keys(self) -> None:
+        """
+        Deletes the shared object records for this run (once they have been
+        copied).
+        """
+        dbsession = SqlASession.object_session(self)
+        shard_ids = select(ExportedDatabaseShard.id).where(
+            ExportedDatabaseShard.run_id == self.id
+        )
+        dbsession.execute(
+            delete(ExportedDatabaseSharedObject).where(
+                ExportedDatabaseSharedObject.shard_id.in_(shard_ids)
+            )
+        )
+
+
+class ExportedDatabaseShard(Base):
+    """
+    Represents one shard of an :class:`ExportedDatabaseRun`: a set of tasks of
+    a single class, copied (by one back-end job) in a single destination
+    transaction.
+    """
+
+    __tablename__ = "_exported_database_shards"
+
+    id: Mapped[int] = mapped_column(
+        primary_key=True,
+        autoincrement=True,
+        comment="Arbitrary primary key",
+    )
+    run_id: Mapped[int] = mapped_column(
+        ForeignKey(ExportedDatabaseRun.id),
+        index=True,
+        comment=f"FK to {ExportedDatabaseRun.__tablename__}.{ExportedDatabaseRun.id.name}",  # noqa
+    )
+    basetable: Mapped[str] = mapped_column(
+        TableNameColType,
+        comment="Base table of tasks concerned",
+    )
+    task_pks: Mapped[Optional[list[int]]] = mapped_column(
+        IntListType,
+        comment="Server PKs of tasks in basetable (_pk field), as CSV",
+    )
+    pk_min: Mapped[int] = mapped_column(
+        comment="Lowest server PK of tasks in this shard",
+    )
+    pk_max: Mapped[int] = mapped_column(
+        comment="Highest server PK of tasks in this shard",
+    )
+    attempts: Mapped[int] = mapped_column(
+        default=0,
+        comment="Number of attempts to copy this shard",
+    )
+    finished_at_utc: Mapped[Optional[datetime.datetime]] = mapped_column(
+        comment="Time shard was copied (UTC)"
+    )
+
+    run = relationship(ExportedDatabaseRun, back_populates="shards")
+
+    def __init__(
+        self,
+        basetable: str = None,
+        task_pks: List[int] = None,
+        **kwargs: Any,
+    ) -> None:
+        """
+        Args:
+            basetable: base table name of the tasks
+            task_pks: server PKs of the tasks
+        """
+        super().__init__(**kwargs)
+        self.basetable = basetable
+        self.task_pks = task_pks
+        self.attempts = 0
+        if task_pks:
+            self.pk_min = min(task_pks)
+            self.pk_max = max(task_pks)
+
+    def replace_shared_object_keys(
+        self, keys: Iterable[Tuple[str, int]]
+    ) -> None:
+        """
+        Records the shared objects that this shard's tasks refer to, replacing
+        any recorded by a previous attempt.
+
+        Args:
+            keys: ``(tablename, pk)`` tuples
+        """
+        dbsession = SqlASession.object_session(self)
+        table = cast(Table, ExportedDatabaseSharedObject.__table__)
+        dbsession.execute(delete(table).where(table.c.shard_id == self.id))
+        self.add_shared_object_keys(keys)
+
+    def add_shared_object_keys(self, keys: Iterable[Tuple[str, int]]) -> None:
+        """
+        Records further shared objects that this shard's tasks refer to,
+        besides any already recorded.
+
+        Args:
+            keys: ``(tablename, pk)`` tuples
+        """
+        dbsession = SqlASession.object_session(self)
+        table = cast(Table, ExportedDatabaseSharedObject.__table__)
+        existing = set(
+            dbsession.execute(
+                select(table.c.tablename, table.c.pk).where(
+                    table.c.shard_id == self.id
+                )
+            ).tuples()
+        )
+        rows = [
+            dict(shard_id=self.id, tablename=tablename, pk=pk)
+            for tablename, pk in sorted(set(keys) - existing)
+        ]
+        for chunk in chunks(rows, EXPORT_LOG_BULK_INSERT_SIZE):
+            dbsession.execute(insert(table), chunk)
+
+
+class ExportedDatabaseSharedObject(Base):
+    """
+    Records that tasks in an :class:`ExportedDatabaseShard` refer to a shared
+    object (e.g. a patient), which will be copied by the final step of the
+    :class:`ExportedDatabaseRun`.
+    """
+
+    __tablename__ = "_exported_database_shared_objects"
+
+    shard_id: Mapped[int] = mapped_column(
+        ForeignKey(ExportedDatabaseShard.id),
+        primary_key=True,
+        autoincrement=False,
+        comment=f"FK to {ExportedDatabaseShard.__tablename__}.{ExportedDatabaseShard.id.name}",  # noqa
+    )
+    tablename: Mapped[str] = mapped_column(
+        TableNameColType,
+        primary_key=True,
+        comment="Table name of the shared object",
+    )
+    pk: Mapped[int] = mapped_column(
+        primary_key=True,
+        autoincrement=False,
+        comment="Primary key of the shared object",
+    )
@@ -150,22 +150,6 @@ from typing import Any, Dict, List, TYPE_CHECKING
 
 from cardinal_pythonlib.datetimefunc import format_datetime
 from cardinal_pythonlib.httpconst import HttpMethod
-from fhirclient.client import FHIRClient
-from fhirclient.models.bundle import Bundle, BundleEntry, BundleEntryRequest
-from fhirclient.models.codeableconcept import CodeableConcept
-from fhirclient.models.coding import Coding
-from fhirclient.models.fhirdate import FHIRDate
-from fhirclient.models.identifier import Identifier
-from fhirclient.models.observation import ObservationComponent
-from fhirclient.models.questionnaire import (
-    QuestionnaireItem,
-    QuestionnaireItemAnswerOption,
-)
-from fhirclient.models.quantity import Quantity
-from fhirclient.models.questionnaireresponse import (
-    QuestionnaireResponseItem,
-    QuestionnaireResponseItemAnswer,
-)
 from requests.exceptions import HTTPError
 
 from camcops_server.cc_modules.cc_constants import (
@@ -178,6 +162,11 @@ from camcops_server.cc_modules.cc_pyramid import Routes
 from camcops_server.cc_modules.cc_snomed import SnomedExpression, SnomedLookup
 
 if TYPE_CHECKING:
+    from fhirclient.models.bundle import Bundle
+    from fhirclient.models.identifier import Identifier
+    from fhirclient.models.questionnaireresponse import (
+        QuestionnaireResponseItemAnswer,
+    )
     from camcops_server.cc_modules.cc_exportmodels import ExportedTaskFhir
     from camcops_server.cc_modules.cc_request import CamcopsRequest
 
@@ -333,6 +322,8 @@ class FhirTaskExporter(object):
     def __init__(
         self, request: "CamcopsRequest", exported_task_fhir: "ExportedTaskFhir"
     ) -> None:
+        from fhirclient.client import FHIRClient  # delayed import
+
         self.request = request
         self.exported_task = exported_task_fhir.exported_task
         self.exported_task_fhir = exported_task_fhir
@@ -452,12 +443,14 @@ class FhirTaskExporter(object):
         (https://www.hl7.org/fhir/bundle-definitions.html#Bundle.entry).
 
         """
+        from fhirclient.models.bundle import Bundle  # delayed import
+
         bundle = Bundle(jsondict=response)
 
         if bundle.entry is not None:
             self._save_exported_entries(bundle)
 
-    def _save_exported_entries(self, bundle: Bundle) -> None:
+    def _save_exported_entries(self, bundle: "Bundle") -> None:
         """
         Record the server's reply components in strucured format.
         """
@@ -485,12 +478,14 @@ class FhirTaskExporter(object):
 
 def fhir_pk_identifier(
     req: "CamcopsRequest", tablename: str, pk: int, value_within_task: str
-) -> Identifier:
+) -> "Identifier":
     """
     Creates a "fallback" identifier -- this is poor, but allows unique
     identification of anything (such as a patient with no proper ID numbers)
     based on its CamCOPS table name and server PK.
     """
+    from fhirclient.models.identifier import Identifier  # delayed import
+
     return Identifier(
         jsondict={
             Fc.SYSTEM: req.route_url(
@@ -508,14 +503,14 @@ def fhir_system_value(system: str, value: str) -> str:
     return f"{system}|{value}"
 
 
-def fhir_sysval_from_id(identifier: Identifier) -> str:
+def fhir_sysval_from_id(identifier: "Identifier") -> str:
     """
     How FHIR expresses system/value pairs.
     """
     return f"{identifier.system}|{identifier.value}"
 
 
-def fhir_reference_from_identifier(identifier: Identifier) -> str:
+def fhir_reference_from_identifier(identifier: "Identifier") -> str:
     """
     Returns a reference to a specific FHIR identifier.
     """
@@ -529,6 +524,14 @@ def fhir_observation_component_from_snomed(
     Returns a FHIR ObservationComponent (as a dict in JSON format) for a SNOMED
     CT expression.
     """
+    from fhirclient.models.codeableconcept import (
+        CodeableConcept,
+    )  # delayed import
+    from fhirclient.models.coding import Coding  # delayed import
+    from fhirclient.models.observation import (
+        ObservationComponent,
+    )  # delayed import
+
     observable_entity = req.snomed(SnomedLookup.OBSERVABLE_ENTITY)
     expr_longform = expr.as_string(longform=True)
     # For SNOMED, we are providing an observation where the "value" is a code
@@ -584,7 +587,7 @@ def fhir_observation_component_from_snomed(
 
 def make_fhir_bundle_entry(
     resource_type_url: str,
-    identifier: Identifier,
+    identifier: "Identifier",
     resource: Dict,
     identifier_is_list: bool = True,
 ) -> Dict:
@@ -595,6 +598,11 @@ def make_fhir_bundle_entry(
     is labelled with the identifier, and (b) that the BundleEntryRequest has
     an ifNoneExist condition referring to that identifier.
     """
+    from fhirclient.models.bundle import (
+        BundleEntry,
+        BundleEntryRequest,
+    )  # delayed import
+
     if Fc.IDENTIFIER in resource:
         log.warning(
             f"Duplication: {Fc.IDENTIFIER!r} specified in resource "
@@ -757,6 +765,11 @@ class FHIRAnsweredQuestion:
         """
         Returns a JSON/dict representation of a FHIR QuestionnaireItem.
         """
+        from fhirclient.models.questionnaire import (
+            QuestionnaireItem,
+            QuestionnaireItemAnswerOption,
+        )  # delayed import
+
         qtype = self.qtype
         # Basics
         qitem_dict = {
@@ -789,10 +802,16 @@ class FHIRAnsweredQuestion:
     # Concrete (instance)
     # -------------------------------------------------------------------------
 
-    def _qr_item_answer(self) -> QuestionnaireResponseItemAnswer:
+    def _qr_item_answer(self) -> "QuestionnaireResponseItemAnswer":
         """
         Returns a QuestionnaireResponseItemAnswer.
         """
+        from fhirclient.models.fhirdate import FHIRDate  # delayed import
+        from fhirclient.models.quantity import Quantity  # delayed import
+        from fhirclient.models.questionnaireresponse import (
+            QuestionnaireResponseItemAnswer,
+        )  # delayed import
+
         # Look things up
         raw_answer = self.answer
         answer_type = self.answer_type
@@ -843,6 +862,10 @@ class FHIRAnsweredQuestion:
         """
         Returns a JSON/dict representation of a FHIR QuestionnaireResponseItem.
         """
+        from fhirclient.models.questionnaireresponse import (
+            QuestionnaireResponseItem,
+        )  # delayed import
+
         answer = self._qr_item_answer()
         return QuestionnaireResponseItem(
             jsondict={
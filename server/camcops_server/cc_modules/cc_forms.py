@@ -4138,6 +4138,10 @@ class SpreadsheetFormatSelector(SchemaNode, RequestAwareMixin):
                 ViewArg.TSV_ZIP,
                 _("ZIP file of tab-separated value (TSV) files"),
             ),
+            (
+                ViewArg.PARQUET_ZIP,
+                _("ZIP file of Apache Parquet files (with column types)"),
+            ),
         )
         values, pv = get_values_and_permissible(choices)
         self.widget = RadioChoiceWidget(values=values)
@@ -4221,6 +4225,10 @@ class SqliteSelector(SchemaNode, RequestAwareMixin):
             # https://docs.sqlalchemy.org/en/latest/dialects/
             (ViewArg.SQLITE, _("Binary SQLite database")),
             (ViewArg.SQL, _("SQL text to create SQLite database")),
+            (
+                ViewArg.SQL_GZ,
+                _("SQL text to create SQLite database (gzip-compressed)"),
+            ),
         )
         values, pv = get_values_and_permissible(choices)
         self.widget = RadioChoiceWidget(values=values)
@@ -69,13 +69,13 @@ from typing import List, Optional, Tuple, Type, TYPE_CHECKING, Union
 
 from cardinal_pythonlib.datetimefunc import format_datetime
 from cardinal_pythonlib.logs import BraceStyleAdapter
-import hl7
 from pendulum import Date, DateTime as Pendulum
 
 from camcops_server.cc_modules.cc_constants import DateFormat, FileType
 from camcops_server.cc_modules.cc_simpleobjects import HL7PatientIdentifier
 
 if TYPE_CHECKING:
+    import hl7
     from camcops_server.cc_modules.cc_request import CamcopsRequest
     from camcops_server.cc_modules.cc_simpleobjects import TaskExportOptions
     from camcops_server.cc_modules.cc_task import Task
@@ -146,7 +146,7 @@ def get_mod11_checkdigit(strnum: str) -> str:
 
 def make_msh_segment(
     message_datetime: Pendulum, message_control_id: str
-) -> hl7.Segment:
+) -> "hl7.Segment":
     """
     Creates an HL7 message header (MSH) segment.
 
@@ -159,6 +159,7 @@ def make_msh_segment(
       - https://www.corepointhealth.com/resource-center/hl7-resources/hl7-oru-message
       - https://www.hl7kit.com/joomla/index.php/hl7resources/examples/107-orur01
     """  # noqa
+    import hl7  # delayed import
 
     segment_id = "MSH"
     encoding_characters = (
@@ -228,7 +229,7 @@ def make_pid_segment(
     sex: str,
     address: str,
     patient_id_list: List[HL7PatientIdentifier] = None,
-) -> hl7.Segment:
+) -> "hl7.Segment":
     """
     Creates an HL7 patient identification (PID) segment.
 
@@ -238,6 +239,7 @@ def make_pid_segment(
     - ID numbers...
       https://www.cdc.gov/vaccines/programs/iis/technical-guidance/downloads/hl7guide-1-4-2012-08.pdf
     """  # noqa
+    import hl7  # delayed import
 
     patient_id_list = patient_id_list or []  # type: List[HL7PatientIdentifier]
 
@@ -347,7 +349,7 @@ def make_pid_segment(
 
 
 # noinspection PyUnusedLocal
-def make_obr_segment(task: "Task") -> hl7.Segment:
+def make_obr_segment(task: "Task") -> "hl7.Segment":
     # noinspection HttpUrlsUsage
     """
     Creates an HL7 observation request (OBR) segment.
@@ -358,6 +360,7 @@ def make_obr_segment(task: "Task") -> hl7.Segment:
       - https://www.corepointhealth.com/resource-center/hl7-resources/hl7-oru-message
       - https://www.corepointhealth.com/resource-center/hl7-resources/hl7-obr-segment
     """  # noqa
+    import hl7  # delayed import
 
     segment_id = "OBR"
     set_id = "1"
@@ -464,7 +467,7 @@ def make_obx_segment(
     observation_datetime: Pendulum,
     responsible_observer: str,
     export_options: "TaskExportOptions",
-) -> hl7.Segment:
+) -> "hl7.Segment":
     # noinspection HttpUrlsUsage
     """
     Creates an HL7 observation result (OBX) segment.
@@ -478,6 +481,7 @@ def make_obx_segment(
     - subtype of data:
       https://www.hl7.org/implement/standards/fhir/v2/0291/index.html
     """  # noqa
+    import hl7  # delayed import
 
     segment_id = "OBX"
     set_id = str(1)
@@ -596,7 +600,7 @@ def make_dg1_segment(
     clinician_identifier_type_code: str = "",
     clinician_assigning_facility: str = "",
     attestation_datetime: Pendulum = None,
-) -> hl7.Segment:
+) -> "hl7.Segment":
     # noinspection HttpUrlsUsage
     """
     Creates an HL7 diagnosis (DG1) segment.
@@ -641,6 +645,7 @@ def make_dg1_segment(
     - http://www.mexi.be/documents/hl7/ch600012.htm
     - https://www.hl7.org/special/committees/vocab/V26_Appendix_A.pdf
     """
+    import hl7  # delayed import
 
     segment_id = "DG1"
     try:
@@ -790,7 +795,7 @@ def escape_hl7_text(s: str) -> str:
     return s
 
 
-def msg_is_successful_ack(msg: hl7.Message) -> Tuple[bool, Optional[str]]:
+def msg_is_successful_ack(msg: "hl7.Message") -> Tuple[bool, Optional[str]]:
     # noinspection HttpUrlsUsage
     """
     Checks whether msg represents a successful acknowledgement message.
@@ -907,7 +912,7 @@ class MLLPTimeoutClient(object):
         self.socket.close()
 
     def send_message(
-        self, message: Union[str, hl7.Message]
+        self, message: "Union[str, hl7.Message]"
     ) -> Tuple[bool, Optional[str]]:
         """
         Wraps a string or :class:`hl7.Message` in a MLLP container
@@ -915,6 +920,8 @@ class MLLPTimeoutClient(object):
 
         Returns ``success, ack_msg``.
         """
+        import hl7  # delayed import
+
         if isinstance(message, hl7.Message):
             message = str(message)
         # wrap in MLLP message container
@@ -28,7 +28,7 @@ camcops_server/cc_modules/cc_idnumdef.py
 """
 
 import logging
-from typing import List, Optional, Tuple, TYPE_CHECKING
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.nhs import is_valid_nhs_number
@@ -36,6 +36,10 @@ from cardinal_pythonlib.reprfunc import simple_repr
 from sqlalchemy.orm import Mapped, mapped_column, Session as SqlASession
 from sqlalchemy.sql.sqltypes import String
 
+from camcops_server.cc_modules.cc_cache import (
+    get_or_create_shared,
+    replace_generation_on_commit,
+)
 from camcops_server.cc_modules.cc_pyramid import Routes
 from camcops_server.cc_modules.cc_sqla_coltypes import (
     HL7AssigningAuthorityType,
@@ -209,6 +213,12 @@ class IdNumDefinition(Base):
         return f'{prefix} <a href="{url}">{url}</a>'
 
 
+CACHE_GENERATION_IDNUM_DEFINITIONS = "idnum_definitions"
+replace_generation_on_commit(
+    IdNumDefinition, CACHE_GENERATION_IDNUM_DEFINITIONS
+)
+
+
 # =============================================================================
 # Retrieving all IdNumDefinition objects
 # =============================================================================
@@ -221,3 +231,33 @@ def get_idnum_definitions(dbsession: SqlASession) -> List[IdNumDefinition]:
     return list(
         dbsession.query(IdNumDefinition).order_by(IdNumDefinition.which_idnum)
     )
+
+
+def get_cached_idnum_definitions(
+    req: "CamcopsRequest",
+) -> List[IdNumDefinition]:
+    """
+    Get all ID number definitions, in order, via the shared cache.
+
+    The objects returned are transient copies, not attached to the database
+    session; to alter a definition, fetch it from the database.
+    """
+
+    def creator() -> List[Dict[str, Any]]:
+        return [
+            dict(
+                which_idnum=iddef.which_idnum,
+                description=iddef.description,
+                short_description=iddef.short_description,
+                hl7_id_type=iddef.hl7_id_type,
+                hl7_assigning_authority=iddef.hl7_assigning_authority,
+                validation_method=iddef.validation_method,
+                fhir_id_system=iddef.fhir_id_system,
+            )
+            for iddef in get_idnum_definitions(req.dbsession)
+        ]
+
+    rows = get_or_create_shared(
+        req, CACHE_GENERATION_IDNUM_DEFINITIONS, creator
+    )
+    return [IdNumDefinition(**row) for row in rows]
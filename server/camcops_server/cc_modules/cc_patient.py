@@ -52,13 +52,6 @@ from cardinal_pythonlib.datetimefunc import (
 from cardinal_pythonlib.json_utils.typing_helpers import JsonObjectType
 from cardinal_pythonlib.logs import BraceStyleAdapter
 import cardinal_pythonlib.rnc_web as ws
-from fhirclient.models.address import Address
-from fhirclient.models.contactpoint import ContactPoint
-from fhirclient.models.humanname import HumanName
-from fhirclient.models.fhirreference import FHIRReference
-from fhirclient.models.identifier import Identifier
-from fhirclient.models.patient import Patient as FhirPatient
-import hl7
 import pendulum
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import mapped_column, Mapped, relationship
@@ -121,6 +114,8 @@ from camcops_server.cc_modules.cc_xml import (
 )
 
 if TYPE_CHECKING:
+    from fhirclient.models.identifier import Identifier
+    import hl7
     from sqlalchemy.sql.elements import ColumnElement
 
     from camcops_server.cc_modules.cc_exportrecipient import ExportRecipient
@@ -920,7 +915,7 @@ class Patient(GenericTabletRecordMixin, Base):
 
     def get_hl7_pid_segment(
         self, req: "CamcopsRequest", recipient: "ExportRecipient"
-    ) -> hl7.Segment:
+    ) -> "hl7.Segment":
         """
         Get HL7 patient identifier (PID) segment.
 
@@ -984,6 +979,15 @@ class Patient(GenericTabletRecordMixin, Base):
 
         See https://www.hl7.org/fhir/patient.html.
         """
+        from fhirclient.models.address import Address  # delayed import
+        from fhirclient.models.contactpoint import (
+            ContactPoint,
+        )  # delayed import
+        from fhirclient.models.humanname import HumanName  # delayed import
+        from fhirclient.models.patient import (
+            Patient as FhirPatient,
+        )  # delayed import
+
         # The JSON objects we will build up:
         patient_dict = {}  # type: JsonObjectType
 
@@ -1042,7 +1046,7 @@ class Patient(GenericTabletRecordMixin, Base):
 
     def get_fhir_identifier(
         self, req: "CamcopsRequest", recipient: "ExportRecipient"
-    ) -> Identifier:
+    ) -> "Identifier":
         """
         Returns a FHIR identifier for this patient, as a
         :class:`fhirclient.models.identifier.Identifier` object.
@@ -1053,6 +1057,8 @@ class Patient(GenericTabletRecordMixin, Base):
         For debugging situations, it falls back to a default identifier (using
         the PK on our CamCOPS server).
         """
+        from fhirclient.models.identifier import Identifier  # delayed import
+
         which_idnum = recipient.primary_idnum
         try:
             # For real exports, the fact that the patient does have an ID
@@ -1083,6 +1089,10 @@ class Patient(GenericTabletRecordMixin, Base):
         Returns a FHIRReference (in JSON dict format) used to refer to this
         patient as a "subject" of some other entry (like a questionnaire).
         """
+        from fhirclient.models.fhirreference import (
+            FHIRReference,
+        )  # delayed import
+
         return FHIRReference(
             jsondict={
                 Fc.TYPE: Fc.RESOURCE_TYPE_PATIENT,
@@ -1237,7 +1247,10 @@ class Patient(GenericTabletRecordMixin, Base):
 
 
 def is_candidate_patient_valid_for_group(
-    ptinfo: BarePatientInfo, group: "Group", finalizing: bool
+    ptinfo: BarePatientInfo,
+    group: "Group",
+    finalizing: bool,
+    policy: "TokenizedPolicy" = None,
 ) -> Tuple[bool, str]:
     """
     Is the specified patient acceptable to upload into this group?
@@ -1259,6 +1272,11 @@ def is_candidate_patient_valid_for_group(
             this patient will be uploaded, if allowed
         finalizing:
             finalizing, rather than uploading?
+        policy:
+            the group's tokenized finalize or upload policy (as appropriate
+            for ``finalizing``), if the caller already has it -- e.g. when
+            checking many patients against the same group; otherwise, it is
+            read from the group
 
     Returns:
         tuple: valid, reason
@@ -1268,10 +1286,12 @@ def is_candidate_patient_valid_for_group(
         return False, "Nonexistent group"
 
     if finalizing:
-        if not group.tokenized_finalize_policy().satisfies_id_policy(ptinfo):
+        policy = policy or group.tokenized_finalize_policy()
+        if not policy.satisfies_id_policy(ptinfo):
             return False, "Fails finalizing ID policy"
     else:
-        if not group.tokenized_upload_policy().satisfies_id_policy(ptinfo):
+        policy = policy or group.tokenized_upload_policy()
+        if not policy.satisfies_id_policy(ptinfo):
             return False, "Fails upload ID policy"
 
     # todo: add checks against prevalidated patients here
@@ -33,8 +33,6 @@ camcops_server/cc_modules/cc_pdf.py
 
 from typing import Any, Dict, TYPE_CHECKING
 
-from cardinal_pythonlib.pdf import get_pdf_from_html
-from weasyprint import CSS
 
 from camcops_server.cc_modules.cc_constants import (
     PDF_ENGINE,
@@ -42,6 +40,7 @@ from camcops_server.cc_modules.cc_constants import (
 )
 
 if TYPE_CHECKING:
+    from weasyprint import CSS
     from camcops_server.cc_modules.cc_request import CamcopsRequest
 
 
@@ -61,6 +60,9 @@ def pdf_from_html(
     """
     Create and return a PDF from the HTML provided.
     """
+    # Delayed import; this loads the PDF engines, which are slow to load
+    from cardinal_pythonlib.pdf import get_pdf_from_html
+
     extra_wkhtmltopdf_options = (
         extra_wkhtmltopdf_options or {}
     )  # type: Dict[str, Any]
@@ -84,7 +86,8 @@ def weasyprint_page_stylesheet(
     top_right_content: str = '""',
     bottom_left_content: str = '""',
     bottom_right_content: str = '""',
-) -> CSS:
+) -> "CSS":
+    from weasyprint import CSS  # delayed import
 
     # There are other Margin at-rules if needed:
     # https://developer.mozilla.org/en-US/docs/Web/CSS/Reference/At-rules/@page#margin_at-rules
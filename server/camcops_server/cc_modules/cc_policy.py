@@ -41,7 +41,7 @@ configuration).
 import io
 import logging
 import tokenize
-from typing import Any, Callable, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
 
 from cardinal_pythonlib.dicts import reversedict
 from cardinal_pythonlib.logs import BraceStyleAdapter
@@ -383,6 +383,7 @@ class PatientInfoPresence(object):
 # =============================================================================
 
 CONTENT_TOKEN_PROCESSOR_TYPE = Callable[[int], QuadState]
+PRESENCE_KEY_TYPE = FrozenSet[Tuple[int, QuadState]]
 
 
 # =============================================================================
@@ -405,6 +406,9 @@ class TokenizedPolicy(object):
         self._syntactically_valid = None  # type: Optional[bool]
         self.valid_idnums = None  # type: Optional[List[int]]
         self._valid_for_idnums = None  # type: Optional[bool]
+        self._value_for_presence = (
+            {}
+        )  # type: Dict[PRESENCE_KEY_TYPE, QuadState]
 
     def __str__(self) -> str:
         policy = " ".join(token_to_str(t) for t in self.tokens)
@@ -986,7 +990,17 @@ class TokenizedPolicy(object):
         pip = PatientInfoPresence.make_from_ptinfo(
             ptinfo, self.specifically_mentioned_idnums()
         )
-        return self._value_for_pip(pip)
+        # The value depends only on which kinds of information are present,
+        # and there are few such combinations even when many patients are
+        # checked against the same policy (e.g. when validating a batch), so
+        # each is evaluated only once.
+        presence = frozenset(pip.present.items())
+        try:
+            return self._value_for_presence[presence]
+        except KeyError:
+            value = self._value_for_pip(pip)
+            self._value_for_presence[presence] = value
+            return value
 
     def _value_for_pip(self, pip: PatientInfoPresence) -> QuadState:
         """
@@ -303,9 +303,11 @@ class ViewArg(object):
     HTML = "html"
     ODS = "ods"
     PDF = "pdf"
+    PARQUET_ZIP = "parquet_zip"
     PDFHTML = "pdfhtml"  # the HTML to create a PDF
     R = "r"
     SQL = "sql"
+    SQL_GZ = "sql_gz"
     SQLITE = "sqlite"
     TSV = "tsv"
     TSV_ZIP = "tsv_zip"
@@ -394,6 +396,21 @@ MAKO_LOOKUP = TemplateLookup(
 )
 
 
+def precompile_mako_templates() -> int:
+    """
+    Compiles all the templates known to :data:`MAKO_LOOKUP` (which keeps the
+    compiled templates in memory), so that a process that forks web server
+    workers can share them. Returns the number of templates compiled.
+    """
+    n_templates = 0
+    for directory in MAKO_LOOKUP.directories:
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith(".mako"):
+                MAKO_LOOKUP.get_template(filename)
+                n_templates += 1
+    return n_templates
+
+
 class CamcopsMakoLookupTemplateRenderer(MakoLookupTemplateRenderer):
     r"""
     A Mako template renderer that, when called:
@@ -41,7 +41,6 @@ from typing import (
     Generator,
     List,
     Optional,
-    Set,
     Tuple,
     TYPE_CHECKING,
 )
@@ -54,7 +53,7 @@ from cardinal_pythonlib.datetimefunc import (
     format_datetime,
     pendulum_to_utc_datetime_without_tz,
 )
-from cardinal_pythonlib.fileops import get_directory_contents_size, mkdir_p
+from cardinal_pythonlib.fileops import mkdir_p
 from cardinal_pythonlib.httpconst import HttpMethod
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.plot import (
@@ -62,10 +61,6 @@ from cardinal_pythonlib.plot import (
 )
 import cardinal_pythonlib.rnc_web as ws
 from cardinal_pythonlib.wsgi.constants import WsgiEnvVar
-import lockfile
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
-from matplotlib.font_manager import FontProperties
 from pendulum import Date, DateTime as Pendulum, Duration
 from pendulum.parsing.exceptions import ParserError
 from pyramid.config import Configurator
@@ -86,14 +81,18 @@ from camcops_server.cc_modules.cc_baseconstants import (
     DOCUMENTATION_URL,
     TRANSLATIONS_DIR,
 )
+from camcops_server.cc_modules.cc_cache import get_shared_cache_region
 from camcops_server.cc_modules.cc_config import (
     CamcopsConfig,
     get_config,
     get_config_filename_from_os_env,
 )
 from camcops_server.cc_modules.cc_constants import DateFormat
+from camcops_server.cc_modules.cc_exportlock import (
+    MASTER_EXPORT_RECIPIENT_LOCKNAME,
+)
 from camcops_server.cc_modules.cc_idnumdef import (
-    get_idnum_definitions,
+    get_cached_idnum_definitions,
     IdNumDefinition,
     validate_id_number,
 )
@@ -103,8 +102,6 @@ from camcops_server.cc_modules.cc_language import (
     POSSIBLE_LOCALES,
 )
 
-# noinspection PyUnresolvedReferences
-import camcops_server.cc_modules.cc_plot  # import side effects (configure matplotlib)  # noqa
 from camcops_server.cc_modules.cc_pyramid import (
     camcops_add_mako_renderer,
     CamcopsAuthenticationPolicy,
@@ -121,6 +118,7 @@ from camcops_server.cc_modules.cc_pyramid import (
 )
 from camcops_server.cc_modules.cc_response import camcops_response_factory
 from camcops_server.cc_modules.cc_serversettings import (
+    get_database_title,
     get_server_settings,
     ServerSettings,
 )
@@ -141,6 +139,8 @@ from camcops_server.cc_modules.cc_validators import (
 if TYPE_CHECKING:
     from matplotlib.axis import Axis
     from matplotlib.axes import Axes
+    from matplotlib.figure import Figure
+    from matplotlib.font_manager import FontProperties
     from matplotlib.text import Text
     from camcops_server.cc_modules.cc_exportrecipient import ExportRecipient
     from camcops_server.cc_modules.cc_session import CamcopsSession
@@ -248,6 +248,7 @@ class CamcopsRequest(Request):
         self._pending_export_push_requests = (
             []
         )  # type: List[Tuple[str, str, int]]
+        self._pending_index_updates = False
         self._cached_sstring = {}  # type: Dict[SS, str]
         # Don't make the _camcops_session yet; it will want a Registry, and
         # we may not have one yet; see command_line_request().
@@ -406,6 +407,9 @@ class CamcopsRequest(Request):
         # log.debug("CamcopsRequest.dbsession: caller stack:\n{}",
         #           "\n".join(get_caller_stack_info()))
         _dbsession = self.get_bare_dbsession()
+        # So that changes to cached data, committed by this session, can
+        # invalidate the shared cache:
+        get_shared_cache_region(self.config)
 
         def end_sqlalchemy_session(req: Request) -> None:
             # noinspection PyProtectedMember
@@ -455,6 +459,8 @@ class CamcopsRequest(Request):
             session.commit()
             if self._pending_export_push_requests:
                 self._process_pending_export_push_requests()
+            if self._pending_index_updates:
+                self._process_pending_index_updates()
         if DEBUG_DBSESSION_MANAGEMENT:
             log.debug("Closing SQLAlchemy session")
         session.close()
@@ -1118,6 +1124,22 @@ class CamcopsRequest(Request):
             return None
         return ws.webify(value)
 
+    def get_extra_string_tasks_not_permitted(self) -> List[str]:
+        """
+        Returns the (sorted) names of tasks whose extra strings are restricted,
+        by the :ref:`RESTRICTED_TASKS <RESTRICTED_TASKS>` option, to groups
+        that the current user is not a member of.
+        """
+        restricted_tasks = self.config.restricted_tasks
+        if not restricted_tasks:
+            return []
+        user_group_names = set(self.user.group_names)
+        return sorted(
+            task_xml_name
+            for task_xml_name, group_names in restricted_tasks.items()
+            if not user_group_names.intersection(group_names)
+        )
+
     def get_all_extra_strings(self) -> List[Tuple[str, str, str, str]]:
         """
         Returns all extra strings, as a list of ``task, name, language, value``
@@ -1126,22 +1148,11 @@ class CamcopsRequest(Request):
         2019-09-16: these are filtered according to the :ref:`RESTRICTED_TASKS
         <RESTRICTED_TASKS>` option.
         """
-        restricted_tasks = self.config.restricted_tasks
-        user_group_names = None  # type: Optional[Set[str]]
-
-        def task_permitted(task_xml_name: str) -> bool:
-            nonlocal user_group_names
-            if task_xml_name not in restricted_tasks:
-                return True
-            if user_group_names is None:
-                user_group_names = set(self.user.group_names)
-            permitted_group_names = set(restricted_tasks[task_xml_name])
-            return bool(permitted_group_names.intersection(user_group_names))
-
+        excluded_tasks = set(self.get_extra_string_tasks_not_permitted())
         allstrings = self._all_extra_strings
         rows = []
         for task, taskstrings in allstrings.items():
-            if not task_permitted(task):
+            if task in excluded_tasks:
                 log.debug(
                     f"Skipping extra string download for task {task}: "
                     f"not permitted for user {self.user.username}"
@@ -1275,11 +1286,20 @@ class CamcopsRequest(Request):
         return ws.webify(self.sstring(which_string))
 
     @staticmethod
-    def create_figure(**kwargs: Any) -> Figure:
+    def create_figure(**kwargs: Any) -> "Figure":
         """
         Creates and returns a :class:`matplotlib.figure.Figure` with a canvas.
         The canvas will be available as ``fig.canvas``.
         """
+        # Delayed imports; Matplotlib is slow to load, and is configured (via
+        # the side effects of importing cc_plot) on first use.
+        # noinspection PyUnresolvedReferences
+        import camcops_server.cc_modules.cc_plot  # noqa: F401
+        from matplotlib.backends.backend_agg import (
+            FigureCanvasAgg as FigureCanvas,
+        )  # delayed import
+        from matplotlib.figure import Figure  # delayed import
+
         fig = Figure(**kwargs)
         # noinspection PyUnusedLocal
         canvas = FigureCanvas(fig)  # noqa: F841
@@ -1418,11 +1438,15 @@ class CamcopsRequest(Request):
         )
 
     @reify
-    def fontprops(self) -> FontProperties:
+    def fontprops(self) -> "FontProperties":
         """
         Return a :class:`matplotlib.font_manager.FontProperties` object for
         use with Matplotlib plotting.
         """
+        # noinspection PyUnresolvedReferences
+        import camcops_server.cc_modules.cc_plot  # noqa: F401
+        from matplotlib.font_manager import FontProperties  # delayed import
+
         return FontProperties(**self.fontdict)
 
     def set_figure_font_sizes(
@@ -1442,6 +1466,10 @@ class CamcopsRequest(Request):
             x_ticklabels: if ``True``, modify the X-axis tick labels
             y_ticklabels: if ``True``, modify the Y-axis tick labels
         """
+        # noinspection PyUnresolvedReferences
+        import camcops_server.cc_modules.cc_plot  # noqa: F401
+        from matplotlib.font_manager import FontProperties  # delayed import
+
         final_fontdict = self.fontdict.copy()
         if fontdict:
             final_fontdict.update(fontdict)
@@ -1458,7 +1486,7 @@ class CamcopsRequest(Request):
             ):  # type: Text  # I think!
                 ticklabel.set_fontproperties(fp)
 
-    def get_html_from_pyplot_figure(self, fig: Figure) -> str:
+    def get_html_from_pyplot_figure(self, fig: "Figure") -> str:
         """
         Make HTML (SVG) from pyplot
         :class:`matplotlib.figure.Figure`.
@@ -1496,7 +1524,7 @@ class CamcopsRequest(Request):
         Returns all
         :class:`camcops_server.cc_modules.cc_idnumdef.IdNumDefinition` objects.
         """
-        return get_idnum_definitions(self.dbsession)  # no longer cached
+        return get_cached_idnum_definitions(self)
 
     @reify
     def valid_which_idnums(self) -> List[int]:
@@ -1616,8 +1644,7 @@ class CamcopsRequest(Request):
         """
         Return the database friendly title for the server.
         """
-        ss = self.server_settings
-        return ss.database_title or ""
+        return get_database_title(self)
 
     def set_database_title(self, title: str) -> None:
         """
@@ -1838,11 +1865,9 @@ class CamcopsRequest(Request):
                     final_recipients.append(r)
 
         if save:
-            lockfilename = (
-                self.config.get_master_export_recipient_lockfilename()
-            )
-            with lockfile.FileLock(
-                lockfilename, timeout=None
+            lock_manager = self.config.get_export_lock_manager()
+            with lock_manager.lock(
+                MASTER_EXPORT_RECIPIENT_LOCKNAME, timeout=None
             ):  # waits forever if necessary
                 process_final_recipients(_save=True)
         else:
@@ -1931,6 +1956,38 @@ class CamcopsRequest(Request):
                 task_pk=task_pk,
             )
 
+    def add_pending_index_update(self) -> None:
+        """
+        Notes that this request has recorded index updates for the back end
+        to perform (see
+        :class:`camcops_server.cc_modules.cc_taskindex.PendingIndexUpdate`).
+        As for export push requests, the back end is only told after the
+        COMMIT.
+        """
+        self._pending_index_updates = True
+
+    def _process_pending_index_updates(self) -> None:
+        """
+        Asks the back end to process pending index updates.
+
+        Called after the COMMIT.
+        """
+        from camcops_server.cc_modules.celery import (
+            process_pending_index_updates_backend,
+        )  # delayed import
+
+        log.debug("Submitting background job to process index updates")
+        try:
+            process_pending_index_updates_backend.delay()
+        except Exception as e:
+            # The work is safely recorded in the database, and housekeeping
+            # will pick it up.
+            log.warning(
+                "Failed to submit background job to process index updates: "
+                "{!r}",
+                e,
+            )
+
     # -------------------------------------------------------------------------
     # User downloads
     # -------------------------------------------------------------------------
@@ -1966,12 +2023,16 @@ class CamcopsRequest(Request):
     @reify
     def user_download_bytes_used(self) -> int:
         """
-        Returns the disk space used by this user.
+        Returns the disk space used by this user, according to the ledger of
+        user download files.
         """
-        download_dir = self.user_download_dir
-        if not download_dir:
+        from camcops_server.cc_modules.cc_userdownload import (
+            UserDownloadRecord,
+        )  # delayed import
+
+        if not self.user_download_dir:
             return 0
-        return get_directory_contents_size(download_dir)
+        return UserDownloadRecord.get_bytes_used(self.dbsession, self.user_id)
 
     @property
     def user_download_bytes_available(self) -> int:
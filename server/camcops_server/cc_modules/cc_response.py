@@ -27,15 +27,21 @@ camcops_server/cc_modules/cc_response.py
 
 """
 
-from typing import Any, TYPE_CHECKING
+import os
+from typing import Any, Iterable, Iterator, List, Optional, TYPE_CHECKING
+import zlib
 
+from cardinal_pythonlib.httpconst import MimeType
 from pyramid.response import Response
+from webob.static import FileIter
 
 from camcops_server.cc_modules.cc_baseconstants import (
     DEFORM_SUPPORTS_CSP_NONCE,
 )
+from camcops_server.cc_modules.cc_constants import SendfileMethodNames
 
 if TYPE_CHECKING:
+    from pyramid.request import Request
     from camcops_server.cc_modules.cc_request import CamcopsRequest
 
 
@@ -181,8 +187,331 @@ class CamcopsResponse(Response):
         )
 
 
+class FileAttachmentResponse(Response):
+    """
+    Response class for sending a file on disk to the user as an attachment,
+    without reading the whole file into memory.
+
+    - By default, the file is sent by the WSGI server's ``wsgi.file_wrapper``,
+      if it has one (which may use ``sendfile()``), or otherwise a block at a
+      time.
+
+    - HTTP ``Range`` requests (e.g. to resume an interrupted download) are
+      served by seeking within the file, and conditional requests
+      (``If-Range``, ``If-None-Match``, ``If-Modified-Since``) are honoured.
+
+    - Alternatively, sending the file can be delegated to the front-end web
+      server, via the ``X-Sendfile`` header (e.g. Apache with
+      ``mod_xsendfile``) or the ``X-Accel-Redirect`` header (NGINX). We then
+      send no body, and the front end deals with ranges.
+    """
+
+    BLOCK_SIZE = 256 * 1024  # bytes read at a time
+
+    def __init__(
+        self,
+        request: "Request",
+        fullpath: str,
+        filename: str,
+        content_type: str = MimeType.BINARY,
+        sendfile_method: str = SendfileMethodNames.NONE,
+        accel_redirect_uri: str = "",
+        **kwargs: Any,
+    ) -> None:
+        """
+        Args:
+            request:
+                the Pyramid request
+            fullpath:
+                full path of the file to send
+            filename:
+                filename to offer the user
+            content_type:
+                MIME content type
+            sendfile_method:
+                one of the values in
+                :class:`camcops_server.cc_modules.cc_constants.SendfileMethodNames`
+            accel_redirect_uri:
+                for ``X-Accel-Redirect``: the URI of the file, within an
+                internal location of the front-end web server
+
+        Raises:
+            :exc:`OSError` if the file can't be opened.
+        """
+        super().__init__(
+            content_type=content_type,
+            content_disposition=f"attachment; filename={filename}",
+            **kwargs,
+        )
+        self._file = None  # type: Optional[Any]
+        if sendfile_method == SendfileMethodNames.X_SENDFILE:
+            self.headers["X-Sendfile"] = fullpath
+            self.content_length = None  # the front end will set it
+            return
+        if sendfile_method == SendfileMethodNames.X_ACCEL_REDIRECT:
+            self.headers["X-Accel-Redirect"] = accel_redirect_uri
+            self.content_length = None
+            return
+
+        self._file = open(fullpath, "rb")
+        file_wrapper = request.environ.get("wsgi.file_wrapper")
+        if file_wrapper is not None:
+            self.app_iter = file_wrapper(self._file, self.BLOCK_SIZE)
+        else:
+            self.app_iter = FileIter(self._file).app_iter_range(
+                block_size=self.BLOCK_SIZE
+            )
+        # Set after app_iter, which resets the content length:
+        statinfo = os.fstat(self._file.fileno())
+        self.content_length = statinfo.st_size
+        self.last_modified = statinfo.st_mtime
+        self.etag = f"{statinfo.st_mtime_ns:x}-{statinfo.st_size:x}"
+        self.accept_ranges = "bytes"
+        self.conditional_response = True
+
+    def app_iter_range(self, start: int, stop: int) -> Iterator[bytes]:
+        """
+        Serves part of the file, for a ``Range`` request. We seek, rather
+        than reading and discarding everything before ``start`` (which is
+        what the default implementation would do).
+        """
+        if self._file is None:
+            return super().app_iter_range(start, stop)
+        return FileIter(self._file).app_iter_range(
+            seek=start, limit=stop, block_size=self.BLOCK_SIZE
+        )
+
+
 def camcops_response_factory(request: "CamcopsRequest") -> Response:
     """
     Factory function to make a response object.
     """
     return CamcopsResponse(camcops_request=request)
+
+
+class XmlStreamingResponse(Response):
+    """
+    Response class for returning XML to the user from an iterable of text
+    fragments (e.g. from
+    :func:`camcops_server.cc_modules.cc_xml.gen_xml_document`), encoding and
+    sending them as they are generated, rather than assembling the whole
+    document in memory first. The headers are as for
+    :class:`cardinal_pythonlib.pyramid.responses.XmlResponse`, except that
+    there is no ``Content-Length``.
+    """
+
+    def __init__(self, fragments: Iterable[str], **kwargs: Any) -> None:
+        super().__init__(
+            content_type=MimeType.XML,
+            app_iter=gen_encoded_blocks(fragments),
+            **kwargs,
+        )
+
+
+class StreamingAttachmentResponse(Response):
+    """
+    Response class for sending data to the user as an attachment, from an
+    iterable of blocks of bytes, as they are generated. There is no
+    ``Content-Length``.
+    """
+
+    def __init__(
+        self,
+        app_iter: Iterable[bytes],
+        filename: str,
+        content_type: str = MimeType.BINARY,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(
+            content_type=content_type,
+            content_disposition=f"attachment; filename={filename}",
+            app_iter=app_iter,
+            **kwargs,
+        )
+
+
+# =============================================================================
+# Helpers for streaming responses
+# =============================================================================
+
+GZIP_MIMETYPE = "application/gzip"
+GZIP_WBITS = 16 + zlib.MAX_WBITS  # zlib wbits for gzip format
+STREAMING_BLOCK_SIZE = 64 * 1024  # approximate bytes sent at a time
+
+
+def gen_encoded_blocks(
+    fragments: Iterable[str],
+    encoding: str = "utf-8",
+    block_size: int = STREAMING_BLOCK_SIZE,
+) -> Iterator[bytes]:
+    """
+    Encodes text fragments, and groups them into blocks of about
+    ``block_size`` bytes (since the fragments, e.g. of XML, are often tiny).
+    """
+    block = []  # type: List[bytes]
+    size = 0
+    for fragment in fragments:
+        encoded = fragment.encode(encoding)
+        block.append(encoded)
+        size += len(encoded)
+        if size >= block_size:
+            yield b"".join(block)
+            block = []
+            size = 0
+    if block:
+        yield b"".join(block)
+
+
+def gen_gzipped_blocks(
+    blocks: Iterable[bytes], compresslevel: int = 6
+) -> Iterator[bytes]:
+    """
+    Compresses blocks of bytes on the fly, yielding a gzip file (RFC 1952) a
+    block at a time.
+    """
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, GZIP_WBITS)
+    for block in blocks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+# =============================================================================
+# Precompressed content
+# =============================================================================
+
+
+def request_accepts_gzip(req: "Request") -> bool:
+    """
+    Does the client say that it accepts gzip-compressed responses? (Clients
+    that send no ``Accept-Encoding`` header are not sent compressed content.)
+    """
+    if "Accept-Encoding" not in req.headers:
+        return False
+    return bool(req.accept_encoding.acceptable_offers(["gzip"]))
+
+
+# A minimal gzip member header (RFC 1952): magic, deflate, no flags, no
+# modification time, no extra compression flags, unknown OS.
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+
+class PrecompressedPrefix(object):
+    """
+    Content that is compressed once, and can then be sent (gzip-compressed)
+    many times with different, short, endings, without compressing it again.
+
+    The prefix is deflated and flushed to a byte boundary without ending the
+    deflate stream; each ending is deflated separately and appended, and the
+    gzip trailer is calculated from the combined checksum and length. The
+    result is a single, ordinary, gzip stream.
+    """
+
+    def __init__(self, data: bytes, compresslevel: int = 6) -> None:
+        """
+        Args:
+            data: the content to be precompressed
+            compresslevel: zlib compression level
+        """
+        self.data = data
+        self.compresslevel = compresslevel
+        compressor = self._make_compressor()
+        self.deflated = compressor.compress(data) + compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+        self.crc32 = zlib.crc32(data)
+
+    def _make_compressor(self) -> "zlib._Compress":
+        # Negative wbits: a raw deflate stream, with no header or trailer.
+        return zlib.compressobj(
+            self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS
+        )
+
+    def gzip(self, suffix: bytes = b"") -> bytes:
+        """
+        Returns the gzip-compressed form of the prefix followed by
+        ``suffix``.
+        """
+        compressor = self._make_compressor()
+        tail = compressor.compress(suffix) + compressor.flush()
+        crc32 = zlib.crc32(suffix, self.crc32)
+        size = (len(self.data) + len(suffix)) & 0xFFFFFFFF
+        return b"".join(
+            (
+                GZIP_HEADER,
+                self.deflated,
+                tail,
+                crc32.to_bytes(4, "little"),
+                size.to_bytes(4, "little"),
+            )
+        )
+
+
+# =============================================================================
+# Compressed requests and responses
+# =============================================================================
+
+MIN_GZIP_RESPONSE_SIZE = 1024  # bytes; smaller bodies are sent as they are
+
+
+class DecompressedSizeError(ValueError):
+    """
+    Exception raised when decompressed data would exceed the permitted size.
+    """
+
+    pass
+
+
+def gunzip_with_limit(data: bytes, max_size: int) -> bytes:
+    """
+    Decompresses a gzip stream (RFC 1952), but without ever producing more
+    than ``max_size`` bytes, so that a small "decompression bomb" cannot use
+    up memory.
+
+    Args:
+        data: the compressed data
+        max_size: maximum permitted size of the result, in bytes
+
+    Returns:
+        the decompressed data
+
+    Raises:
+        :exc:`DecompressedSizeError` if the result would be larger than
+        ``max_size``
+
+        :exc:`ValueError` if the data is not a single, complete, gzip stream
+    """
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    try:
+        result = decompressor.decompress(data, max_size + 1)
+    except zlib.error as e:
+        raise ValueError(f"Invalid gzip data: {e}")
+    if len(result) > max_size:
+        raise DecompressedSizeError(
+            f"Decompressed data would exceed {max_size} bytes"
+        )
+    if not decompressor.eof:
+        raise ValueError("Incomplete gzip data")
+    if decompressor.unused_data:
+        raise ValueError("Unexpected data after end of gzip data")
+    return result
+
+
+def gzip_response_if_accepted(
+    req: "Request",
+    response: Response,
+    min_size: int = MIN_GZIP_RESPONSE_SIZE,
+    compresslevel: int = 6,
+) -> Response:
+    """
+    Compresses the body of a response (in place) with gzip, if the client
+    says that it accepts that, and the body is at least ``min_size`` bytes.
+    Returns the response.
+    """
+    response.vary = ("Accept-Encoding",)
+    if len(response.body) >= min_size and request_accepts_gzip(req):
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, GZIP_WBITS)
+        response.body = compressor.compress(response.body) + compressor.flush()
+        response.content_encoding = "gzip"
+    return response
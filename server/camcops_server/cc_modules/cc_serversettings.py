@@ -81,6 +81,10 @@ from sqlalchemy.sql.sqltypes import (
     UnicodeText,
 )
 
+from camcops_server.cc_modules.cc_cache import (
+    get_or_create_shared,
+    replace_generation_on_commit,
+)
 from camcops_server.cc_modules.cc_sqla_coltypes import DatabaseTitleColType
 from camcops_server.cc_modules.cc_sqlalchemy import Base
 
@@ -161,7 +165,7 @@ server_stored_var_table_defunct = Table(
 # =============================================================================
 
 SERVER_SETTINGS_SINGLETON_PK = 1
-# CACHE_KEY_DATABASE_TITLE = "database_title"
+CACHE_GENERATION_SERVER_SETTINGS = "server_settings"
 
 
 class ServerSettings(Base):
@@ -212,6 +216,9 @@ class ServerSettings(Base):
         return pendulum.instance(dt, tz=pendulum.UTC)
 
 
+replace_generation_on_commit(ServerSettings, CACHE_GENERATION_SERVER_SETTINGS)
+
+
 def get_server_settings(req: "CamcopsRequest") -> ServerSettings:
     """
     Gets the
@@ -232,19 +239,13 @@ def get_server_settings(req: "CamcopsRequest") -> ServerSettings:
     return server_settings
 
 
-# def get_database_title(req: "CamcopsRequest") -> str:
-#     def creator() -> str:
-#         server_settings = get_server_settings(req)
-#         return server_settings.database_title or ""
-#
-#     return cache_region_static.get_or_create(CACHE_KEY_DATABASE_TITLE, creator)  # noqa
-
-
-# def clear_database_title_cache() -> None:
-#     cache_region_static.delete(CACHE_KEY_DATABASE_TITLE)
+def get_database_title(req: "CamcopsRequest") -> str:
+    """
+    Returns the database friendly title for the server, via the shared cache.
+    """
 
+    def creator() -> str:
+        server_settings = get_server_settings(req)
+        return server_settings.database_title or ""
 
-# def set_database_title(req: "CamcopsRequest", title: str) -> None:
-#     server_settings = get_server_settings(req)
-#     server_settings.database_title = title
-#     clear_database_title_cache()
+    return get_or_create_shared(req, CACHE_GENERATION_SERVER_SETTINGS, creator)
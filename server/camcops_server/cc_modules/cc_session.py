@@ -32,6 +32,7 @@ import logging
 from typing import Any, Optional, TYPE_CHECKING
 
 from cardinal_pythonlib.datetimefunc import (
+    coerce_to_pendulum,
     format_datetime,
     pendulum_to_utc_datetime_without_tz,
 )
@@ -265,7 +266,7 @@ class CamcopsSession(Base):
         self.is_api_session = True
         if ts.username:
             user = User.get_user_from_username_password(
-                ts.req, ts.username, ts.password
+                ts.req, ts.username, ts.password, use_credential_cache=True
             )
             if DEBUG_CAMCOPS_SESSION_CREATION:
                 log.debug("... looked up User: {!r}", user)
@@ -336,10 +337,11 @@ class CamcopsSession(Base):
             candidate = None
         found = candidate is not None
         if found:
-            candidate.last_activity_utc = now
-            if DEBUG_CAMCOPS_SESSION_CREATION:
-                log.debug("Committing for last_activity_utc")
-            dbsession.commit()  # avoid holding a lock, 2019-03-21
+            if candidate.activity_needs_recording(req):
+                candidate.last_activity_utc = now
+                if DEBUG_CAMCOPS_SESSION_CREATION:
+                    log.debug("Committing for last_activity_utc")
+                dbsession.commit()  # avoid holding a lock, 2019-03-21
             ccsession = candidate
         else:
             new_http_session = cls(ip_addr=ip_addr, last_activity_utc=now)
@@ -354,6 +356,26 @@ class CamcopsSession(Base):
             ccsession = new_http_session
         return ccsession
 
+    def activity_needs_recording(self, req: "CamcopsRequest") -> bool:
+        """
+        Should the current request's time be written to the database as this
+        session's last activity?
+
+        To avoid a database write for every request, activity is only
+        recorded once the recorded time is at least
+        :ref:`SESSION_ACTIVITY_GRANULARITY_S <SESSION_ACTIVITY_GRANULARITY_S>`
+        old. The recorded time may therefore lag behind the true time of last
+        activity by up to that amount, so an idle session may time out that
+        much early; it never outlives the session timeout.
+        """
+        if self.last_activity_utc is None:
+            return True
+        last_activity_utc = coerce_to_pendulum(
+            self.last_activity_utc, assume_local=False
+        )
+        granularity = req.config.session_activity_granularity
+        return req.now_utc - last_activity_utc >= granularity
+
     @classmethod
     def get_oldest_last_activity_allowed(
         cls, req: "CamcopsRequest"
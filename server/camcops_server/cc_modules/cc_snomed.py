@@ -138,9 +138,24 @@ Regarding temporal coding:
 """  # noqa
 
 from collections import OrderedDict
+from contextlib import closing
 import csv
 import logging
-from typing import Dict, List, Optional, Set, Tuple, Union
+import os
+import pathlib
+import sqlite3
+import tempfile
+import threading
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 import xml.etree.cElementTree as ElementTree
 
 from cardinal_pythonlib.athena_ohdsi import (
@@ -1186,18 +1201,29 @@ VALID_SNOMED_LOOKUPS = set(
 @cache_region_static.cache_on_arguments(function_key_generator=fkg)
 def get_all_task_snomed_concepts(
     xml_filename: str,
-) -> Dict[str, SnomedConcept]:
+    compiled_filename: str = "",
+) -> Mapping[str, SnomedConcept]:
     """
     Reads in all SNOMED-CT codes for CamCOPS tasks, from the custom CamCOPS XML
     file for this.
 
     Args:
         xml_filename: XML filename to read
+        compiled_filename: optional compiled (SQLite) copy of the XML file,
+            made by :func:`write_compiled_snomed_concepts`; if it is up to
+            date, concepts are looked up from it on demand, rather than
+            reading the XML
 
     Returns:
-        dict: maps lookup strings to :class:`SnomedConcept` objects
+        dict: maps lookup strings to :class:`SnomedConcept` objects (or a
+        :class:`CompiledSnomedConcepts` mapping that behaves identically)
 
     """
+    compiled = get_compiled_snomed_concepts(
+        compiled_filename, SnomedLookupSet.TASK, xml_filename
+    )
+    if compiled is not None:
+        return compiled
     xml_concepts = get_snomed_concepts_from_xml(xml_filename)
     camcops_concepts = {}  # type: Dict[str, SnomedConcept]
     identifiers_seen = set()  # type: Set[int]
@@ -1759,16 +1785,24 @@ def get_multiple_snomed_concepts_from_xml(
 @cache_region_static.cache_on_arguments(function_key_generator=fkg)
 def get_icd9_snomed_concepts_from_xml(
     xml_filename: str,
-) -> Dict[str, List[SnomedConcept]]:
+    compiled_filename: str = "",
+) -> Mapping[str, List[SnomedConcept]]:
     """
     Reads in all ICD-9-CM SNOMED-CT codes from a custom CamCOPS XML file.
 
     Args:
         xml_filename: filename to read
+        compiled_filename: optional compiled copy of the XML file; see
+            :func:`get_all_task_snomed_concepts`
 
     Returns:
         dict: maps ICD-9-CM codes to lists of :class:`SnomedConcept` objects
     """
+    compiled = get_compiled_snomed_concepts(
+        compiled_filename, SnomedLookupSet.ICD9CM, xml_filename
+    )
+    if compiled is not None:
+        return compiled
     return get_multiple_snomed_concepts_from_xml(
         xml_filename, CLIENT_ICD9CM_CODES
     )
@@ -1777,16 +1811,302 @@ def get_icd9_snomed_concepts_from_xml(
 @cache_region_static.cache_on_arguments(function_key_generator=fkg)
 def get_icd10_snomed_concepts_from_xml(
     xml_filename: str,
-) -> Dict[str, List[SnomedConcept]]:
+    compiled_filename: str = "",
+) -> Mapping[str, List[SnomedConcept]]:
     """
     Reads in all ICD-10 SNOMED-CT codes from a custom CamCOPS XML file.
 
     Args:
         xml_filename: filename to read
+        compiled_filename: optional compiled copy of the XML file; see
+            :func:`get_all_task_snomed_concepts`
 
     Returns:
         dict: maps ICD-10 codes to lists of :class:`SnomedConcept` objects
     """
+    compiled = get_compiled_snomed_concepts(
+        compiled_filename, SnomedLookupSet.ICD10, xml_filename
+    )
+    if compiled is not None:
+        return compiled
     return get_multiple_snomed_concepts_from_xml(
         xml_filename, CLIENT_ICD10_CODES
     )
+
+
+# =============================================================================
+# Compiled lookups
+# =============================================================================
+# Parsing the XML files, and holding the results in every process, costs time
+# at startup and memory in proportion to the size of the files. Instead, the
+# parsed results can be written to an SQLite database, which is then queried
+# as concepts are needed.
+
+
+class SnomedLookupSet(object):
+    """
+    Names of the sets of lookups held in a compiled SNOMED-CT file.
+    """
+
+    TASK = "task"
+    ICD9CM = "icd9cm"
+    ICD10 = "icd10"
+
+
+COMPILED_SNOMED_FORMAT_VERSION = 1
+# ... stored as the SQLite "user_version"; increment if the schema changes
+COMPILED_SNOMED_FILE_MODE = 0o644
+# ... other server processes (e.g. Celery workers) may run as other users
+
+_COMPILED_SNOMED_SCHEMA = """
+CREATE TABLE source (
+    lookup_set TEXT PRIMARY KEY,
+    xml_filename TEXT NOT NULL,
+    xml_mtime_ns INTEGER NOT NULL,
+    xml_size INTEGER NOT NULL
+);
+CREATE TABLE concept (
+    lookup_set TEXT NOT NULL,
+    lookup TEXT NOT NULL,
+    lookup_index INTEGER NOT NULL,
+    concept_index INTEGER NOT NULL,
+    identifier INTEGER NOT NULL,
+    term TEXT NOT NULL,
+    PRIMARY KEY (lookup_set, lookup, concept_index)
+);
+CREATE INDEX ix_concept_order ON concept (lookup_set, lookup_index);
+"""
+
+
+class CompiledSnomedConcepts(Mapping):
+    """
+    Read-only mapping of lookup strings to SNOMED-CT concepts, for one set of
+    lookups in a compiled SNOMED-CT file. It behaves like the dictionary that
+    the corresponding XML function returns (including its ordering, and
+    raising :exc:`KeyError` for unknown lookups), but fetches concepts from
+    disk as they are requested.
+
+    Each thread (in each process) uses its own read-only connection.
+    """
+
+    def __init__(
+        self, compiled_filename: str, lookup_set: str, multiple: bool
+    ) -> None:
+        """
+        Args:
+            compiled_filename:
+                the compiled SNOMED-CT (SQLite) file
+            lookup_set:
+                a :class:`SnomedLookupSet` value
+            multiple:
+                map each lookup to a list of concepts (for ICD codes), rather
+                than a single concept (for tasks)?
+        """
+        self.compiled_filename = compiled_filename
+        self.lookup_set = lookup_set
+        self.multiple = multiple
+        self._local = threading.local()
+
+    def __repr__(self) -> str:
+        return simple_repr(
+            self, ["compiled_filename", "lookup_set", "multiple"]
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Returns a connection for this thread, opening one if necessary (or if
+        the process has forked since it was opened).
+        """
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            uri = pathlib.Path(self.compiled_filename).resolve().as_uri()
+            self._local.connection = sqlite3.connect(
+                f"{uri}?mode=ro", uri=True
+            )
+            self._local.pid = pid
+        return self._local.connection
+
+    def __getitem__(
+        self, lookup: str
+    ) -> Union[SnomedConcept, List[SnomedConcept]]:
+        rows = self._connection().execute(
+            "SELECT identifier, term FROM concept "
+            "WHERE lookup_set = ? AND lookup = ? "
+            "ORDER BY concept_index",
+            (self.lookup_set, lookup),
+        )
+        concepts = [
+            SnomedConcept(identifier, term) for identifier, term in rows
+        ]
+        if not concepts:
+            raise KeyError(lookup)
+        return concepts if self.multiple else concepts[0]
+
+    def __iter__(self) -> Iterator[str]:
+        rows = self._connection().execute(
+            "SELECT DISTINCT lookup, lookup_index FROM concept "
+            "WHERE lookup_set = ? ORDER BY lookup_index",
+            (self.lookup_set,),
+        )
+        return (lookup for lookup, _ in rows.fetchall())
+
+    def __len__(self) -> int:
+        cursor = self._connection().execute(
+            "SELECT COUNT(DISTINCT lookup) FROM concept "
+            "WHERE lookup_set = ?",
+            (self.lookup_set,),
+        )
+        return cursor.fetchone()[0]
+
+
+def _xml_file_signature(xml_filename: str) -> Tuple[int, int]:
+    """
+    Returns the modification time (ns) and size of a file, used to tell if a
+    compiled file is out of date.
+    """
+    statinfo = os.stat(xml_filename)
+    return statinfo.st_mtime_ns, statinfo.st_size
+
+
+def get_compiled_snomed_concepts(
+    compiled_filename: str, lookup_set: str, xml_filename: str
+) -> Optional[CompiledSnomedConcepts]:
+    """
+    Returns a :class:`CompiledSnomedConcepts` mapping for one set of lookups,
+    if there is a compiled file made from the XML file as it is now, or
+    ``None`` (with a warning, if a compiled file is configured), in which case
+    the XML should be read instead.
+
+    Args:
+        compiled_filename: the compiled SNOMED-CT file (may be blank)
+        lookup_set: a :class:`SnomedLookupSet` value
+        xml_filename: the XML file the lookups should have been compiled from
+    """
+    if not compiled_filename:
+        return None
+    try:
+        uri = pathlib.Path(compiled_filename).resolve().as_uri()
+        with closing(
+            sqlite3.connect(f"{uri}?mode=ro", uri=True)
+        ) as connection:
+            (version,) = connection.execute("PRAGMA user_version").fetchone()
+            row = connection.execute(
+                "SELECT xml_filename, xml_mtime_ns, xml_size FROM source "
+                "WHERE lookup_set = ?",
+                (lookup_set,),
+            ).fetchone()
+        current = (
+            os.path.abspath(xml_filename),
+            *_xml_file_signature(xml_filename),
+        )
+    except (OSError, sqlite3.Error) as e:
+        log.warning(
+            "Can't use compiled SNOMED-CT file {!r} ({}); reading {!r}",
+            compiled_filename,
+            e,
+            xml_filename,
+        )
+        return None
+    if version != COMPILED_SNOMED_FORMAT_VERSION or row != current:
+        log.warning(
+            "Compiled SNOMED-CT file {!r} is out of date for {!r} (rebuild "
+            "it with 'camcops_server compile_snomed'); reading the XML",
+            compiled_filename,
+            xml_filename,
+        )
+        return None
+    return CompiledSnomedConcepts(
+        compiled_filename,
+        lookup_set,
+        multiple=lookup_set != SnomedLookupSet.TASK,
+    )
+
+
+def write_compiled_snomed_concepts(
+    compiled_filename: str,
+    task_xml_filename: str = "",
+    icd9_xml_filename: str = "",
+    icd10_xml_filename: str = "",
+) -> None:
+    """
+    Reads SNOMED-CT concepts from the CamCOPS XML files (exactly as the
+    server does) and writes them to a compiled (SQLite) file. The file is
+    replaced atomically, so running servers are unaffected until they
+    restart.
+
+    Args:
+        compiled_filename: compiled file to write
+        task_xml_filename: XML file of SNOMED-CT concepts for tasks
+        icd9_xml_filename: XML file of SNOMED-CT concepts for ICD-9-CM codes
+        icd10_xml_filename: XML file of SNOMED-CT concepts for ICD-10 codes
+    """
+    sources = [
+        (
+            SnomedLookupSet.TASK,
+            task_xml_filename,
+            get_all_task_snomed_concepts,
+        ),
+        (
+            SnomedLookupSet.ICD9CM,
+            icd9_xml_filename,
+            get_icd9_snomed_concepts_from_xml,
+        ),
+        (
+            SnomedLookupSet.ICD10,
+            icd10_xml_filename,
+            get_icd10_snomed_concepts_from_xml,
+        ),
+    ]
+    compiled_filename = os.path.abspath(compiled_filename)
+    fd, tmp_filename = tempfile.mkstemp(
+        dir=os.path.dirname(compiled_filename), suffix=".tmp"
+    )
+    os.close(fd)
+    try:
+        with closing(sqlite3.connect(tmp_filename)) as connection:
+            connection.executescript(_COMPILED_SNOMED_SCHEMA)
+            connection.execute(
+                f"PRAGMA user_version = {COMPILED_SNOMED_FORMAT_VERSION}"
+            )
+            for lookup_set, xml_filename, reader in sources:
+                if not xml_filename:
+                    continue
+                signature = _xml_file_signature(xml_filename)
+                # Not via the cache, which may hold an older version:
+                concepts = reader.original(xml_filename)
+                connection.executemany(
+                    "INSERT INTO concept VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        (
+                            lookup_set,
+                            lookup,
+                            lookup_index,
+                            concept_index,
+                            concept.identifier,
+                            concept.term,
+                        )
+                        for lookup_index, (lookup, value) in enumerate(
+                            concepts.items()
+                        )
+                        for concept_index, concept in enumerate(
+                            value if isinstance(value, list) else [value]
+                        )
+                    ),
+                )
+                connection.execute(
+                    "INSERT INTO source VALUES (?, ?, ?, ?)",
+                    (lookup_set, os.path.abspath(xml_filename), *signature),
+                )
+                log.info(
+                    "Compiled {} SNOMED-CT lookups from {!r}",
+                    len(concepts),
+                    xml_filename,
+                )
+            connection.commit()
+        # mkstemp() makes the file readable only by its owner.
+        os.chmod(tmp_filename, COMPILED_SNOMED_FILE_MODE)
+        os.replace(tmp_filename, compiled_filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+    log.info("Wrote compiled SNOMED-CT file {!r}", compiled_filename)
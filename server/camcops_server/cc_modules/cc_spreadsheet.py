@@ -28,25 +28,42 @@ camcops_server/cc_modules/cc_spreadsheet.py
 
 """
 
+from abc import ABC, abstractmethod
 from collections import OrderedDict
 import csv
+import datetime
+from decimal import Decimal
 import io
+from itertools import islice
 import logging
 import os
+import pickle
 import random
 import re
+import tempfile
+import time
 from typing import (
     Any,
     BinaryIO,
     Callable,
     Container,
     Dict,
+    Generator,
+    IO,
     Iterable,
     List,
     Optional,
     Sequence,
+    Set,
+    TextIO,
+    Tuple,
+    Type,
+    TYPE_CHECKING,
     Union,
 )
+from types import TracebackType
+import uuid
+from xml.sax.saxutils import escape
 import zipfile
 
 from cardinal_pythonlib.datetimefunc import (
@@ -58,6 +75,9 @@ from cardinal_pythonlib.excel import (
     convert_for_pyexcel_ods3,
 )
 from cardinal_pythonlib.logs import BraceStyleAdapter
+from numpy import float64
+from pendulum.datetime import DateTime as Pendulum
+from semantic_version import Version
 from sqlalchemy.engine import Result
 
 from camcops_server.cc_modules.cc_constants import DateFormat
@@ -84,154 +104,125 @@ else:
 
     pyexcel_xlsx = None
 
+if TYPE_CHECKING:
+    from pyarrow import DataType
+
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
+PARQUET_BATCH_SIZE = 10000  # number of rows per Parquet row group
+
 
 # =============================================================================
 # Spreadsheet output holding structures
 # =============================================================================
 
 
-class SpreadsheetPage(object):
+class _MissingCell(object):
     """
-    Represents a single "spreadsheet" page, e.g. for TSV/Excel/ODS output.
+    Marks a cell for which a row had no value (as opposed to a value of
+    ``None``).
     """
 
-    def __init__(
-        self, name: str, rows: List[Union[Dict[str, Any], OrderedDict]]
-    ) -> None:
+    def __repr__(self) -> str:
+        return "<missing>"
+
+
+MISSING_CELL = _MissingCell()
+
+
+class BaseSpreadsheetPage(ABC):
+    """
+    Base class for a single "spreadsheet" page, e.g. for TSV/Excel/ODS output:
+    a name, some headings, and some rows. Subclasses decide how the rows are
+    stored and added.
+    """
+
+    def __init__(self, name: str) -> None:
         """
         Args:
             name: name for the whole sheet
-            rows: list of rows, where each row is a dictionary mapping
-                column name to value
         """
         assert name, "Missing name"
         self.name = name
-        self.rows = rows
-        self.headings = []  # type: List[str]
-        for row in rows:
-            self._add_headings_if_absent(row.keys())
+        self._headings = []  # type: List[str]
+        self._heading_set = set()  # type: Set[str]
+        self._n_rows = 0
 
     def __str__(self) -> str:
         return f"SpreadsheetPage: name={self.name}\n{self.get_tsv()}"
 
-    @classmethod
-    def from_headings_rows(
-        cls, name: str, headings: List[str], rows: List[Sequence[Any]]
-    ) -> "SpreadsheetPage":
+    @property
+    def headings(self) -> List[str]:
         """
-        Creates a SpreadsheetPage object using a list of headings and the row
-        data as a list of lists.
+        Our column headings, in order.
         """
-        page = cls(name=name, rows=[])
-        n_cols = len(headings)
-        page.headings = headings
-        for row in rows:
-            assert len(row) == n_cols
-            page.rows.append(dict(zip(headings, row)))
-        return page
+        return self._headings
 
-    @classmethod
-    def from_result(cls, name: str, rp: Result) -> "SpreadsheetPage":
+    @headings.setter
+    def headings(self, headings: List[str]) -> None:
+        self._headings = headings
+        self._heading_set = set(headings)
+
+    @property
+    @abstractmethod
+    def rows(self) -> List[Dict[str, Any]]:
         """
-        Creates a SpreadsheetPage object from an SQLAlchemy Result.
+        Returns a list of rows, where each row is a dictionary mapping column
+        name to value (for the columns for which that row has a value).
 
-        Args:
-            rp:
-                A :class:` sqlalchemy.engine.Result`.
-            name:
-                Name for this sheet.
+        Compare :attr:`plainrows`.
         """
-        column_names = rp.keys()
-        rows = rp.fetchall()
-        return cls.from_headings_rows(
-            name=name, headings=column_names, rows=rows  # type: ignore[arg-type]  # noqa: E501
-        )
+        pass
 
     @property
     def empty(self) -> bool:
         """
         Do we have zero rows?
         """
-        return len(self.rows) == 0
+        return self._n_rows == 0
 
     def _add_headings_if_absent(self, headings: Iterable[str]) -> None:
         """
         Add any headings we've not yet seen to our list of headings.
         """
         for h in headings:
-            if h not in self.headings:
-                self.headings.append(h)
-
-    def add_or_set_value(self, heading: str, value: Any) -> None:
-        """
-        If we contain only a single row, this function will set the value
-        for a given column (``heading``) to ``value``.
-
-        Raises:
-            :exc:`AssertionError` if we don't have exactly 1 row
-        """
-        assert len(self.rows) == 1, "add_value can only be used if #rows == 1"
-        self._add_headings_if_absent([heading])
-        self.rows[0][heading] = value
-
-    def add_or_set_column(self, heading: str, values: List[Any]) -> None:
-        """
-        Set the column labelled ``heading`` so it contains the values specified
-        in ``values``. The length of ``values`` must equal the number of rows
-        that we already contain.
-
-        Raises:
-            :exc:`AssertionError` if the number of values doesn't match
-            the number of existing rows
-        """
-        assert len(values) == len(self.rows), "#values != #existing rows"
-        self._add_headings_if_absent([heading])
-        for i, row in enumerate(self.rows):
-            row[heading] = values[i]
-
-    def add_or_set_columns_from_page(self, other: "SpreadsheetPage") -> None:
-        """
-        This function presupposes that ``self`` and ``other`` are two pages
-        ("spreadsheets") with *matching* rows.
-
-        It updates values or creates columns in ``self`` such that the values
-        from all columns in ``other`` are written to the corresponding rows of
-        ``self``.
-
-        Raises:
-            :exc:`AssertionError` if the two pages (sheets) don't have
-            the same number of rows.
-        """
-        assert len(self.rows) == len(other.rows), "Mismatched #rows"
-        self._add_headings_if_absent(other.headings)
-        for i, row in enumerate(self.rows):
-            for k, v in other.rows[i].items():
-                row[k] = v
+            if h not in self._heading_set:
+                self._headings.append(h)
+                self._heading_set.add(h)
 
+    @abstractmethod
     def add_rows_from_page(self, other: "SpreadsheetPage") -> None:
         """
         Add all rows from ``other`` to ``self``.
         """
-        self._add_headings_if_absent(other.headings)
-        self.rows.extend(other.rows)
+        pass
 
     def sort_headings(self) -> None:
         """
         Sort our headings internally.
         """
-        self.headings.sort()
+        self._headings.sort()
 
     def delete_columns(self, headings: Container[str]) -> None:
         """
         Removes columns with the specified heading names.
         Used to simplify spreadsheets.
 
-        Since our rows are a dictionary, and our export functions are based on
-        the headings, all we have to do is to delete the unwanted headings.
+        Since our export functions are based on the headings, all we have to
+        do is to delete the unwanted headings.
         """
-        self.headings = [h for h in self.headings if h not in headings]
+        self.headings = [h for h in self._headings if h not in headings]
+
+    @abstractmethod
+    def _gen_value_rows(
+        self, converter: Callable[[Any], Any] = None
+    ) -> Iterable[Sequence[Any]]:
+        """
+        Returns an iterable of rows (without a header row), each a sequence
+        of values in heading order, optionally passed through a converter
+        function.
+        """
+        pass
 
     @property
     def plainrows(self) -> List[List[Any]]:
@@ -241,10 +232,7 @@ class SpreadsheetPage(object):
 
         Compare :attr:`rows`, which is a list of dictionaries.
         """
-        rows = []
-        for row in self.rows:
-            rows.append([row.get(h) for h in self.headings])
-        return rows
+        return [list(row) for row in self._gen_value_rows()]
 
     def spreadsheetrows(
         self, converter: Callable[[Any], Any]
@@ -254,10 +242,17 @@ class SpreadsheetPage(object):
         value that can be sent to a spreadsheet converted (e.g. ODS, XLSX), and
         (b) includes a header row.
         """
-        rows = [self.headings.copy()]
-        for row in self.rows:
-            rows.append([converter(row.get(h)) for h in self.headings])
-        return rows
+        return list(self.gen_spreadsheetrows(converter))
+
+    def gen_spreadsheetrows(
+        self, converter: Callable[[Any], Any]
+    ) -> Generator[List[Any], None, None]:
+        """
+        Generates the rows of :meth:`spreadsheetrows`, one at a time.
+        """
+        yield self.headings.copy()
+        for row in self._gen_value_rows(converter):
+            yield list(row)
 
     def get_tsv(self, dialect: str = "excel-tab") -> str:
         r"""
@@ -293,21 +288,25 @@ class SpreadsheetPage(object):
 
         """  # noqa
         f = io.StringIO()
+        self.write_tsv(f, dialect=dialect)
+        return f.getvalue()
+
+    def write_tsv(self, f: TextIO, dialect: str = "excel-tab") -> None:
+        """
+        Writes the entire page (sheet) as TSV to a text file; see
+        :meth:`get_tsv`.
+        """
         writer = csv.writer(f, dialect=dialect)
         writer.writerow(self.headings)
-        for row in self.rows:
-            writer.writerow([row.get(h) for h in self.headings])
-        return f.getvalue()
+        writer.writerows(self._gen_value_rows())
 
     def write_to_openpyxl_xlsx_worksheet(self, ws: "XLWorksheet") -> None:  # type: ignore[valid-type]  # noqa: E501
         """
         Writes data from this page to an existing ``openpyxl`` XLSX worksheet.
         """
         ws.append(self.headings)  # type: ignore[attr-defined]
-        for row in self.rows:
-            ws.append(  # type: ignore[attr-defined]
-                [convert_for_openpyxl(row.get(h)) for h in self.headings]
-            )
+        for row in self._gen_value_rows(convert_for_openpyxl):
+            ws.append(list(row))  # type: ignore[attr-defined]
 
     def write_to_odswriter_ods_worksheet(self, ws: "ODSSheet") -> None:  # type: ignore[valid-type]  # noqa: E501
         """
@@ -315,9 +314,58 @@ class SpreadsheetPage(object):
         """
         # noinspection PyUnresolvedReferences
         ws.writerow(self.headings)  # type: ignore[attr-defined]
-        for row in self.rows:
+        for row in self._gen_value_rows():
             # noinspection PyUnresolvedReferences
-            ws.writerow([row.get(h) for h in self.headings])  # type: ignore[attr-defined]  # noqa: E501
+            ws.writerow(list(row))  # type: ignore[attr-defined]
+
+    def write_ods_table(self, f: TextIO, title: str) -> None:
+        """
+        Writes data from this page to a text file, as the XML for one table of
+        an ODS ``content.xml`` file; see :func:`write_ods_sheets`.
+        """
+        f.write(f"<table:table table:name={_ods_attribute(title)}>")
+        if self.headings:
+            f.write(
+                "<table:table-column "
+                f'table:number-columns-repeated="{len(self.headings)}"/>'
+            )
+        f.write(_ods_row(self.headings))
+        for row in self._gen_value_rows(convert_for_pyexcel_ods3):
+            f.write(_ods_row(row))
+        f.write("</table:table>")
+
+    def write_parquet(self, file: IO[bytes]) -> None:
+        """
+        Writes data from this page to a file in Apache Parquet format, a batch
+        of rows at a time. Each column's type is inferred from its values (see
+        :func:`get_parquet_type`); all columns are nullable.
+        """
+        import pyarrow  # delayed import; large
+        import pyarrow.parquet  # delayed import; large
+
+        # First pass: infer column types.
+        kinds = [set() for _ in self.headings]  # type: List[Set[str]]
+        for row in self._gen_value_rows(convert_for_parquet):
+            for column_kinds, value in zip(kinds, row):
+                if value is not None:
+                    column_kinds.add(get_parquet_kind(value))
+        types = [get_parquet_type(column_kinds) for column_kinds in kinds]
+        schema = pyarrow.schema(list(zip(self.headings, types)))
+
+        # Second pass: write data.
+        with pyarrow.parquet.ParquetWriter(file, schema) as writer:
+            if not self.headings:
+                return
+            rows = iter(self._gen_value_rows(convert_for_parquet))
+            while True:
+                batch = list(islice(rows, PARQUET_BATCH_SIZE))
+                if not batch:
+                    break
+                arrays = [
+                    make_parquet_array(values, datatype)
+                    for values, datatype in zip(zip(*batch), types)
+                ]
+                writer.write_batch(pyarrow.record_batch(arrays, schema=schema))
 
     def r_object_name(self) -> str:
         """
@@ -345,6 +393,294 @@ class SpreadsheetPage(object):
         return f"{object_name} <- {definition}"
 
 
+class SpreadsheetPage(BaseSpreadsheetPage):
+    """
+    Represents a single "spreadsheet" page, e.g. for TSV/Excel/ODS output.
+
+    Data is stored by column (a list of values per heading), with a set of
+    headings for fast lookup, so that building and combining large, wide pages
+    is quick and doesn't need a dictionary per row.
+    """
+
+    def __init__(
+        self, name: str, rows: List[Union[Dict[str, Any], OrderedDict]]
+    ) -> None:
+        """
+        Args:
+            name: name for the whole sheet
+            rows: list of rows, where each row is a dictionary mapping
+                column name to value
+        """
+        super().__init__(name)
+        # Column values by name, including columns whose headings have been
+        # deleted. Cells without a value contain MISSING_CELL.
+        self._columns = {}  # type: Dict[str, List[Any]]
+        for row in rows:
+            self._append_row(row)
+
+    @classmethod
+    def from_headings_rows(
+        cls, name: str, headings: List[str], rows: List[Sequence[Any]]
+    ) -> "SpreadsheetPage":
+        """
+        Creates a SpreadsheetPage object using a list of headings and the row
+        data as a list of lists.
+        """
+        page = cls(name=name, rows=[])
+        n_cols = len(headings)
+        page.headings = list(headings)
+        columns = [[] for _ in range(n_cols)]  # type: List[List[Any]]
+        for row in rows:
+            assert len(row) == n_cols
+            for column, value in zip(columns, row):
+                column.append(value)
+        for heading, column in zip(headings, columns):
+            # As for a dictionary per row, a later duplicate heading wins.
+            page._columns[heading] = column
+        page._n_rows = len(rows)
+        return page
+
+    @classmethod
+    def from_result(cls, name: str, rp: Result) -> "SpreadsheetPage":
+        """
+        Creates a SpreadsheetPage object from an SQLAlchemy Result.
+
+        Args:
+            rp:
+                A :class:` sqlalchemy.engine.Result`.
+            name:
+                Name for this sheet.
+        """
+        column_names = rp.keys()
+        rows = rp.fetchall()
+        return cls.from_headings_rows(
+            name=name, headings=column_names, rows=rows  # type: ignore[arg-type]  # noqa: E501
+        )
+
+    @property
+    def rows(self) -> List[Dict[str, Any]]:
+        """
+        Returns a list of rows, where each row is a dictionary mapping column
+        name to value (for the columns for which that row has a value).
+
+        Compare :attr:`plainrows`.
+        """
+        rows = []  # type: List[Dict[str, Any]]
+        for i in range(self._n_rows):
+            row = {}  # type: Dict[str, Any]
+            for heading, column in self._columns.items():
+                value = column[i]
+                if value is not MISSING_CELL:
+                    row[heading] = value
+            rows.append(row)
+        return rows
+
+    def _get_or_create_column(self, heading: str) -> List[Any]:
+        """
+        Returns the values for a column, creating an empty column (with
+        :data:`MISSING_CELL` values for existing rows) if there isn't one.
+        """
+        column = self._columns.get(heading)
+        if column is None:
+            column = [MISSING_CELL] * self._n_rows
+            self._columns[heading] = column
+        return column
+
+    def _append_row(self, row: Dict[str, Any]) -> None:
+        """
+        Adds a row, and any headings we've not yet seen.
+        """
+        self._add_headings_if_absent(row.keys())
+        columns = self._columns
+        for heading, value in row.items():
+            column = columns.get(heading)
+            if column is None:
+                column = self._get_or_create_column(heading)
+            column.append(value)
+        self._n_rows += 1
+        if len(row) < len(self._columns):
+            for column in self._columns.values():
+                if len(column) < self._n_rows:
+                    column.append(MISSING_CELL)
+
+    def add_or_set_value(self, heading: str, value: Any) -> None:
+        """
+        If we contain only a single row, this function will set the value
+        for a given column (``heading``) to ``value``.
+
+        Raises:
+            :exc:`AssertionError` if we don't have exactly 1 row
+        """
+        assert self._n_rows == 1, "add_value can only be used if #rows == 1"
+        self._add_headings_if_absent([heading])
+        self._columns[heading] = [value]
+
+    def add_or_set_column(self, heading: str, values: List[Any]) -> None:
+        """
+        Set the column labelled ``heading`` so it contains the values specified
+        in ``values``. The length of ``values`` must equal the number of rows
+        that we already contain.
+
+        Raises:
+            :exc:`AssertionError` if the number of values doesn't match
+            the number of existing rows
+        """
+        assert len(values) == self._n_rows, "#values != #existing rows"
+        self._add_headings_if_absent([heading])
+        self._columns[heading] = list(values)
+
+    def add_or_set_columns_from_page(self, other: "SpreadsheetPage") -> None:
+        """
+        This function presupposes that ``self`` and ``other`` are two pages
+        ("spreadsheets") with *matching* rows.
+
+        It updates values or creates columns in ``self`` such that the values
+        from all columns in ``other`` are written to the corresponding rows of
+        ``self``.
+
+        Raises:
+            :exc:`AssertionError` if the two pages (sheets) don't have
+            the same number of rows.
+        """
+        assert self._n_rows == other._n_rows, "Mismatched #rows"
+        self._add_headings_if_absent(other.headings)
+        for heading, other_column in other._columns.items():
+            column = self._columns.get(heading)
+            if column is None:
+                self._columns[heading] = list(other_column)
+            else:
+                self._columns[heading] = [
+                    mine if theirs is MISSING_CELL else theirs
+                    for mine, theirs in zip(column, other_column)
+                ]
+
+    def add_rows_from_page(self, other: "SpreadsheetPage") -> None:
+        """
+        Add all rows from ``other`` to ``self``.
+        """
+        self._add_headings_if_absent(other.headings)
+        for heading, other_column in other._columns.items():
+            self._get_or_create_column(heading).extend(other_column)
+        self._n_rows += other._n_rows
+        if len(other._columns) < len(self._columns):
+            for column in self._columns.values():
+                if len(column) < self._n_rows:
+                    column.extend(
+                        [MISSING_CELL] * (self._n_rows - len(column))
+                    )
+
+    def _value_columns(
+        self, converter: Callable[[Any], Any] = None
+    ) -> List[List[Any]]:
+        """
+        Returns our columns in heading order, with ``None`` for missing
+        values, optionally passed through a converter function.
+        """
+        columns = []  # type: List[List[Any]]
+        for heading in self._headings:
+            column = self._columns.get(heading)
+            if column is None:
+                column = [None] * self._n_rows
+            else:
+                column = [
+                    None if value is MISSING_CELL else value
+                    for value in column
+                ]
+            if converter is not None:
+                column = [converter(value) for value in column]
+            columns.append(column)
+        return columns
+
+    def _gen_value_rows(
+        self, converter: Callable[[Any], Any] = None
+    ) -> Iterable[Sequence[Any]]:
+        """
+        Returns an iterable of rows (without a header row), each a sequence
+        of values in heading order; see :meth:`_value_columns`.
+        """
+        if not self._headings:
+            return [()] * self._n_rows
+        return zip(*self._value_columns(converter))
+
+
+class SpooledSpreadsheetPage(BaseSpreadsheetPage):
+    """
+    A spreadsheet page whose rows are kept in a temporary file rather than in
+    memory, so that very large pages can be built and written with bounded
+    memory. Rows can be added (:meth:`add_rows_from_page`), and headings
+    sorted or deleted, but existing rows can't be altered.
+    """
+
+    def __init__(self, name: str, directory: str = None) -> None:
+        """
+        Args:
+            name: name for the whole sheet
+            directory: directory for the temporary file (by default, the
+                system's temporary directory)
+        """
+        super().__init__(name)
+        # Each item pickled to the spool file is a list of rows, each a
+        # dictionary mapping column name to value.
+        self._spool = tempfile.TemporaryFile(dir=directory)
+
+    def close(self) -> None:
+        """
+        Closes (and so deletes) our temporary file.
+        """
+        self._spool.close()
+
+    @property
+    def spool_size(self) -> int:
+        """
+        Size of our temporary file, in bytes. (Not valid while rows are being
+        read from it; otherwise, we are always at its end.)
+        """
+        return self._spool.tell()
+
+    def _gen_spooled_rows(self) -> Generator[Dict[str, Any], None, None]:
+        """
+        Generates our rows, as dictionaries, from the temporary file.
+        """
+        spool = self._spool
+        spool.seek(0)
+        try:
+            while True:
+                try:
+                    rows = pickle.load(spool)
+                except EOFError:
+                    return
+                yield from rows
+        finally:
+            spool.seek(0, os.SEEK_END)
+
+    @property
+    def rows(self) -> List[Dict[str, Any]]:
+        """
+        Returns a list of all our rows (in memory); see
+        :attr:`BaseSpreadsheetPage.rows`.
+        """
+        return list(self._gen_spooled_rows())
+
+    def add_rows_from_page(self, other: "SpreadsheetPage") -> None:
+        """
+        Add all rows from ``other`` to ``self``, writing them to our temporary
+        file.
+        """
+        self._add_headings_if_absent(other.headings)
+        pickle.dump(other.rows, self._spool, protocol=pickle.HIGHEST_PROTOCOL)
+        self._n_rows += other._n_rows
+
+    def _gen_value_rows(
+        self, converter: Callable[[Any], Any] = None
+    ) -> Iterable[Sequence[Any]]:
+        headings = self._headings
+        for row in self._gen_spooled_rows():
+            values = [row.get(h) for h in headings]
+            if converter is not None:
+                values = [converter(value) for value in values]
+            yield values
+
+
 class SpreadsheetCollection(object):
     """
     A collection of
@@ -352,8 +688,12 @@ class SpreadsheetCollection(object):
     (spreadsheets), like an Excel workbook.
     """
 
+    # Write TSV files to ZIP files with ZIP64 extensions (needed if a file
+    # might exceed 2 GiB; we don't know a file's size before writing it).
+    FORCE_ZIP64 = False
+
     def __init__(self) -> None:
-        self.pages = []  # type: List[SpreadsheetPage]
+        self.pages = []  # type: List[BaseSpreadsheetPage]
 
     def __str__(self) -> str:
         return "SpreadsheetCollection:\n" + "\n\n".join(
@@ -364,7 +704,7 @@ class SpreadsheetCollection(object):
     # Pages
     # -------------------------------------------------------------------------
 
-    def page_with_name(self, page_name: str) -> Optional[SpreadsheetPage]:
+    def page_with_name(self, page_name: str) -> Optional[BaseSpreadsheetPage]:
         """
         Returns the page with the specific name, or ``None`` if no such
         page exists.
@@ -482,13 +822,19 @@ class SpreadsheetCollection(object):
             with open(file, "wb") as binaryfile:
                 return self.write_zip(binaryfile, encoding)  # recurse once
         with zipfile.ZipFile(file, mode="w", compression=compression) as z:
-            # Write to ZIP.
+            # Write to ZIP, one TSV file at a time.
             # If there are no valid task instances, there'll be no TSV;
             # that's OK.
-            for filename_stem in self.get_page_names():
-                tsv_filename = filename_stem + ".tsv"
-                tsv_contents = self.get_tsv_file(page_name=filename_stem)
-                z.writestr(tsv_filename, tsv_contents.encode(encoding))
+            for page in self.pages:
+                tsv_filename = page.name + ".tsv"
+                with io.TextIOWrapper(
+                    z.open(
+                        tsv_filename, mode="w", force_zip64=self.FORCE_ZIP64
+                    ),
+                    encoding=encoding,
+                    newline="",
+                ) as tsvfile:
+                    page.write_tsv(tsvfile)
 
     def as_zip(self, encoding: str = "utf-8") -> bytes:
         """
@@ -536,9 +882,9 @@ class SpreadsheetCollection(object):
         return contents
 
     @staticmethod
-    def get_sheet_title(page: SpreadsheetPage) -> str:
+    def get_sheet_title(page: BaseSpreadsheetPage) -> str:
         r"""
-        Returns a worksheet name for a :class:`SpreadsheetPage`.
+        Returns a worksheet name for a :class:`BaseSpreadsheetPage`.
 
         See ``openpyxl/workbook/child.py``.
 
@@ -555,15 +901,17 @@ class SpreadsheetCollection(object):
 
     def _get_pyexcel_data(
         self, converter: Callable[[Any], Any]
-    ) -> Dict[str, List[List[Any]]]:
+    ) -> "OrderedDict[str, Iterable[List[Any]]]":
         """
         Returns data in the format expected by ``pyexcel``, which is an ordered
-        dictionary mapping sheet names to a list of rows, where each row is a
-        list of cell values.
+        dictionary mapping sheet names to an iterable of rows, where each row
+        is a list of cell values. Rows are generated as they are written.
         """
-        data = OrderedDict()
+        data = OrderedDict()  # type: OrderedDict[str, Iterable[List[Any]]]
         for page in self.pages:
-            data[self.get_sheet_title(page)] = page.spreadsheetrows(converter)
+            data[self.get_sheet_title(page)] = page.gen_spreadsheetrows(
+                converter
+            )
         return data
 
     def write_ods(self, file: Union[str, BinaryIO]) -> None:
@@ -587,6 +935,17 @@ class SpreadsheetCollection(object):
                     sheet = odsfile.new_sheet(name=title)
                     page.write_to_odswriter_ods_worksheet(sheet)
 
+    def write_streaming_ods(self, file: Union[str, BinaryIO]) -> None:
+        """
+        Writes an ODS file, like :meth:`write_ods`, but one row at a time, so
+        that memory use doesn't grow with the size of the file; see
+        :func:`write_ods_sheets`.
+
+        Args:
+            file: filename or file-like object
+        """
+        write_ods_sheets(file, self.get_pages_with_valid_sheet_names().items())
+
     def as_ods(self) -> bytes:
         """
         Returns the TSV collection as an ODS (OpenOffice spreadsheet document)
@@ -597,9 +956,11 @@ class SpreadsheetCollection(object):
             contents = memfile.getvalue()
         return contents
 
-    def get_pages_with_valid_sheet_names(self) -> Dict[SpreadsheetPage, str]:
+    def get_pages_with_valid_sheet_names(
+        self,
+    ) -> Dict[BaseSpreadsheetPage, str]:
         """
-        Returns an ordered mapping from :class:`SpreadsheetPage` objects to
+        Returns an ordered mapping from :class:`BaseSpreadsheetPage` objects to
         their sheet names.
         """
         name_dict = OrderedDict()
@@ -612,9 +973,11 @@ class SpreadsheetCollection(object):
         return name_dict
 
     @staticmethod
-    def make_sheet_names_unique(name_dict: Dict[SpreadsheetPage, str]) -> None:
+    def make_sheet_names_unique(
+        name_dict: Dict[BaseSpreadsheetPage, str],
+    ) -> None:
         """
-        Modifies (in place) a mapping from :class:`SpreadsheetPage` to
+        Modifies (in place) a mapping from :class:`BaseSpreadsheetPage` to
         worksheet names, such that all page names are unique.
 
         - See also :func:`avoid_duplicate_name` in
@@ -647,6 +1010,45 @@ class SpreadsheetCollection(object):
             name_dict[page] = name
             unique_names.append(name.lower())
 
+    # -------------------------------------------------------------------------
+    # ZIP of Parquet files
+    # -------------------------------------------------------------------------
+
+    def write_parquet_zip(self, file: Union[str, BinaryIO]) -> None:
+        """
+        Writes data to a file, as a ZIP file of Apache Parquet files (one per
+        page), with column types preserved; see
+        :meth:`BaseSpreadsheetPage.write_parquet`.
+
+        The Parquet files are compressed internally, so are stored in the ZIP
+        file without further compression.
+
+        Args:
+            file: filename or file-like object
+        """
+        if isinstance(file, str):  # it's a filename
+            with open(file, "wb") as binaryfile:
+                return self.write_parquet_zip(binaryfile)  # recurse once
+        with zipfile.ZipFile(
+            file, mode="w", compression=zipfile.ZIP_STORED
+        ) as z:
+            for page in self.pages:
+                with z.open(
+                    page.name + ".parquet",
+                    mode="w",
+                    force_zip64=self.FORCE_ZIP64,
+                ) as parquetfile:
+                    page.write_parquet(parquetfile)
+
+    def as_parquet_zip(self) -> bytes:
+        """
+        Returns the collection as a ZIP file containing Apache Parquet files.
+        """
+        with io.BytesIO() as memfile:
+            self.write_parquet_zip(memfile)
+            contents = memfile.getvalue()
+        return contents
+
     # -------------------------------------------------------------------------
     # R
     # -------------------------------------------------------------------------
@@ -696,6 +1098,381 @@ library(data.table)
             f.write(self.as_r())
 
 
+class SpoolTooLargeError(Exception):
+    """
+    Exception raised when the temporary files of a
+    :class:`SpooledSpreadsheetCollection` would exceed the size permitted.
+    """
+
+    pass
+
+
+class SpooledSpreadsheetCollection(SpreadsheetCollection):
+    """
+    A :class:`SpreadsheetCollection` whose pages keep their rows in temporary
+    files (see :class:`SpooledSpreadsheetPage`), and which writes its output
+    files a row at a time, so that memory use stays roughly constant however
+    many rows are added. Used to create large downloads.
+
+    Use as a context manager, or call :meth:`close`, to delete the temporary
+    files.
+    """
+
+    FORCE_ZIP64 = True
+
+    def __init__(self, directory: str = None, max_size: int = None) -> None:
+        """
+        Args:
+            directory: directory for temporary files (by default, the
+                system's temporary directory)
+            max_size: if set, the maximum permitted total size of the
+                temporary files, in bytes
+
+        Raises:
+            :exc:`SpoolTooLargeError` from :meth:`add_page`, if the temporary
+            files would exceed ``max_size``
+        """
+        super().__init__()
+        self.directory = directory
+        self.max_size = max_size
+        self.spool_size = 0  # total size of temporary files, in bytes
+
+    def __enter__(self) -> "SpooledSpreadsheetCollection":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Deletes the temporary files for all our pages.
+        """
+        for page in self.pages:
+            if isinstance(page, SpooledSpreadsheetPage):
+                page.close()
+
+    def add_page(self, page: SpreadsheetPage) -> None:
+        """
+        Adds a new page to our collection, copying its rows to the temporary
+        file of a :class:`SpooledSpreadsheetPage` with the same name (which
+        is created if necessary). Does nothing if the new page is empty.
+        """
+        if page.empty:
+            return
+        existing_page = self.page_with_name(page.name)
+        if existing_page is None:
+            existing_page = SpooledSpreadsheetPage(
+                name=page.name, directory=self.directory
+            )
+            self.pages.append(existing_page)
+        assert isinstance(existing_page, SpooledSpreadsheetPage)
+        size_before = existing_page.spool_size
+        existing_page.add_rows_from_page(page)
+        self.spool_size += existing_page.spool_size - size_before
+        if self.max_size is not None and self.spool_size > self.max_size:
+            raise SpoolTooLargeError(
+                f"Temporary files would exceed {self.max_size} bytes"
+            )
+
+    def write_ods(self, file: Union[str, BinaryIO]) -> None:
+        """
+        Writes an ODS file, a row at a time; see :meth:`write_streaming_ods`.
+        """
+        self.write_streaming_ods(file)
+
+
+# =============================================================================
+# Streaming ODS output
+# =============================================================================
+
+ODS_MIMETYPE = "application/vnd.oasis.opendocument.spreadsheet"
+
+_ODS_NAMESPACES = (
+    'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"'
+)
+_ODS_MANIFEST_XML = (
+    "<?xml version='1.0' encoding='UTF-8'?>"
+    "<manifest:manifest "
+    'xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" '
+    'manifest:version="1.2">'
+    '<manifest:file-entry manifest:full-path="/" '
+    f'manifest:media-type="{ODS_MIMETYPE}"/>'
+    '<manifest:file-entry manifest:full-path="styles.xml" '
+    'manifest:media-type="text/xml"/>'
+    '<manifest:file-entry manifest:full-path="content.xml" '
+    'manifest:media-type="text/xml"/>'
+    "</manifest:manifest>"
+)
+_ODS_STYLES_XML = (
+    "<?xml version='1.0' encoding='UTF-8'?>"
+    f'<office:document-styles {_ODS_NAMESPACES} office:version="1.2">'
+    "<office:styles/></office:document-styles>"
+)
+_ODS_CONTENT_XML_START = (
+    "<?xml version='1.0' encoding='UTF-8'?>"
+    f'<office:document-content {_ODS_NAMESPACES} office:version="1.2">'
+    "<office:body><office:spreadsheet>"
+)
+_ODS_CONTENT_XML_END = (
+    "</office:spreadsheet></office:body></office:document-content>"
+)
+
+# Characters that are not allowed in XML 1.0 documents:
+_XML_INVALID_CHARS_REGEX = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+# Whitespace needing special treatment within ODS text:
+_ODS_WHITESPACE_REGEX = re.compile(r"  +|\t|\n")
+
+
+def _ods_whitespace(match: re.Match) -> str:
+    """
+    Represents tabs, newlines, and multiple spaces in ODS text (where they
+    would otherwise be collapsed into single spaces), as ``ezodf`` does.
+    """
+    whitespace = match.group(0)
+    if whitespace == "\t":
+        return "<text:tab/>"
+    if whitespace == "\n":
+        return "<text:line-break/>"
+    n_extra = len(whitespace) - 1
+    if n_extra == 1:
+        return " <text:s/>"
+    return f' <text:s text:c="{n_extra}"/>'
+
+
+def _ods_text(text: str) -> str:
+    """
+    Returns the XML for a string within ODS text.
+    """
+    text = escape(_XML_INVALID_CHARS_REGEX.sub("", text))
+    return _ODS_WHITESPACE_REGEX.sub(_ods_whitespace, text)
+
+
+def _ods_attribute(value: str) -> str:
+    """
+    Returns a quoted XML attribute value.
+    """
+    value = _XML_INVALID_CHARS_REGEX.sub("", value)
+    return '"' + escape(value, {'"': "&quot;"}) + '"'
+
+
+def _ods_cell(value: Any) -> str:
+    """
+    Returns the XML for a single ODS cell, typed as ``pyexcel_ods3`` would
+    type it. Values should already have been converted with
+    :func:`cardinal_pythonlib.excel.convert_for_pyexcel_ods3`; any unknown
+    types are written as strings.
+    """
+    if isinstance(value, bool):
+        v = "true" if value else "false"
+        return (
+            f'<table:table-cell office:value-type="boolean" '
+            f'office:boolean-value="{v}"/>'
+        )
+    if isinstance(value, (int, float, Decimal)):
+        return (
+            f'<table:table-cell office:value-type="float" '
+            f'office:value="{value}"/>'
+        )
+    if isinstance(value, datetime.date):
+        return (
+            f'<table:table-cell office:value-type="date" '
+            f'office:date-value="{value.isoformat()}"/>'
+        )
+    if isinstance(value, datetime.time):
+        return (
+            f'<table:table-cell office:value-type="time" '
+            f'office:time-value="{value.strftime("PT%HH%MM%SS")}"/>'
+        )
+    if isinstance(value, datetime.timedelta):
+        hours = value.days * 24 + value.seconds // 3600
+        minutes = (value.seconds // 60) % 60
+        seconds = value.seconds % 60
+        return (
+            f'<table:table-cell office:value-type="time" '
+            f'office:time-value="PT{hours:02d}H{minutes:02d}M{seconds:02d}S"/>'
+        )
+    text = value if isinstance(value, str) else str(value)
+    if not text:
+        return (
+            '<table:table-cell office:value-type="string"><text:p/>'
+            "</table:table-cell>"
+        )
+    return (
+        f'<table:table-cell office:value-type="string">'
+        f"<text:p>{_ods_text(text)}</text:p></table:table-cell>"
+    )
+
+
+def _ods_row(values: Iterable[Any]) -> str:
+    """
+    Returns the XML for a row of ODS cells.
+    """
+    cells = "".join(_ods_cell(value) for value in values)
+    return f"<table:table-row>{cells}</table:table-row>"
+
+
+def write_ods_sheets(
+    file: Union[str, BinaryIO],
+    pages_and_titles: Iterable[Tuple[BaseSpreadsheetPage, str]],
+) -> None:
+    """
+    Writes an ODS (OpenOffice spreadsheet document) file from spreadsheet
+    pages, one row at a time, writing straight to a ZIP file (rather than
+    building the whole document in memory, as ``pyexcel_ods3`` does).
+
+    Args:
+        file: filename or file-like object
+        pages_and_titles: the pages, each with its (valid and unique) sheet
+            name
+    """
+    with zipfile.ZipFile(
+        file, mode="w", compression=zipfile.ZIP_DEFLATED
+    ) as z:
+        # The MIME type must come first, and be uncompressed.
+        z.writestr("mimetype", ODS_MIMETYPE, compress_type=zipfile.ZIP_STORED)
+        z.writestr("META-INF/manifest.xml", _ODS_MANIFEST_XML)
+        z.writestr("styles.xml", _ODS_STYLES_XML)
+        with io.TextIOWrapper(
+            z.open("content.xml", mode="w", force_zip64=True),
+            encoding="utf-8",
+        ) as contentfile:
+            contentfile.write(_ODS_CONTENT_XML_START)
+            for page, title in pages_and_titles:
+                page.write_ods_table(contentfile, title)
+            contentfile.write(_ODS_CONTENT_XML_END)
+
+
+# =============================================================================
+# Parquet output
+# =============================================================================
+
+_PARQUET_INT64_MIN = -(2**63)
+_PARQUET_INT64_MAX = 2**63 - 1
+
+
+def convert_for_parquet(x: Any) -> Any:
+    """
+    Converts known "unusual" data types to formats suitable for Apache Parquet
+    files (via ``pyarrow``). Specifically:
+
+    - :class:`pendulum.datetime.DateTime`, and other time-zone-aware
+      :class:`datetime.datetime` values, become UTC
+      :class:`datetime.datetime` values (Parquet timestamps are stored in
+      UTC);
+    - :class:`semantic_version.Version` and :class:`uuid.UUID` values become
+      strings;
+    - :class:`numpy.float64` values become floats;
+    - subclasses of ``str`` become plain strings.
+    """
+    if isinstance(x, datetime.datetime):
+        if x.tzinfo is None:
+            return x
+        utc = x.astimezone(datetime.timezone.utc)
+        if isinstance(x, Pendulum):
+            return datetime.datetime(
+                utc.year,
+                utc.month,
+                utc.day,
+                utc.hour,
+                utc.minute,
+                utc.second,
+                utc.microsecond,
+                tzinfo=datetime.timezone.utc,
+            )
+        return utc
+    elif isinstance(x, (Version, uuid.UUID)):
+        return str(x)
+    elif isinstance(x, float64):
+        return float(x)
+    elif isinstance(x, str):
+        return str(x)
+    else:
+        return x
+
+
+def get_parquet_kind(value: Any) -> str:
+    """
+    Returns a description of the kind of a (non-``None``) value, already
+    converted by :func:`convert_for_parquet`, for working out the Parquet
+    type of a column (see :func:`get_parquet_type`).
+    """
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        if _PARQUET_INT64_MIN <= value <= _PARQUET_INT64_MAX:
+            return "int"
+        return "str"  # too big for a Parquet integer
+    if isinstance(value, (float, Decimal)):
+        return "float"
+    if isinstance(value, datetime.datetime):
+        return "datetime" if value.tzinfo is None else "datetime_utc"
+    if isinstance(value, datetime.date):
+        return "date"
+    if isinstance(value, datetime.time):
+        return "time"
+    if isinstance(value, datetime.timedelta):
+        return "timedelta"
+    if isinstance(value, bytes):
+        return "bytes"
+    return "str"
+
+
+def get_parquet_type(kinds: Set[str]) -> "DataType":
+    """
+    Returns the ``pyarrow`` data type for a column containing (non-``None``)
+    values of the kinds specified (see :func:`get_parquet_kind`). Integers
+    mixed with floats become floats; any other mixture becomes strings.
+    """
+    import pyarrow  # delayed import; large
+
+    if not kinds:
+        return pyarrow.null()
+    if kinds == {"int", "float"}:
+        return pyarrow.float64()
+    if len(kinds) > 1:
+        return pyarrow.string()
+    kind = next(iter(kinds))
+    return {
+        "bool": pyarrow.bool_(),
+        "int": pyarrow.int64(),
+        "float": pyarrow.float64(),
+        "datetime": pyarrow.timestamp("us"),
+        "datetime_utc": pyarrow.timestamp("us", tz="UTC"),
+        "date": pyarrow.date32(),
+        "time": pyarrow.time64("us"),
+        "timedelta": pyarrow.duration("us"),
+        "bytes": pyarrow.binary(),
+    }.get(kind, pyarrow.string())
+
+
+def make_parquet_array(values: Sequence[Any], datatype: "DataType") -> Any:
+    """
+    Returns a ``pyarrow`` array of the specified type from values converted
+    by :func:`convert_for_parquet`.
+    """
+    import pyarrow  # delayed import; large
+
+    if datatype == pyarrow.string():
+        values = [
+            v if v is None or isinstance(v, str) else str(v) for v in values
+        ]
+    elif datatype == pyarrow.float64():
+        values = [None if v is None else float(v) for v in values]
+    return pyarrow.array(values, type=datatype)
+
+
+# =============================================================================
+# Benchmarking
+# =============================================================================
+
+
 def _make_benchmarking_collection(
     nsheets: int = 100,
     nrows: int = 200,
@@ -722,6 +1499,30 @@ def _make_benchmarking_collection(
     return coll
 
 
+def _benchmark_wide_page(nrows: int = 20000, ncols: int = 150) -> None:
+    """
+    Times building a wide page from many single-row pages, as happens when
+    tasks are exported, and writing it as TSV.
+    """
+    rows = [
+        {f"c{colnum}": random.randint(0, 1000000) for colnum in range(ncols)}
+        for _ in range(nrows)
+    ]
+    log.info(
+        f"Building a page from {nrows} single-row pages with {ncols} "
+        f"columns..."
+    )
+    start = time.perf_counter()
+    coll = SpreadsheetCollection()
+    for row in rows:
+        coll.add_page(SpreadsheetPage(name="wide", rows=[row]))
+    log.info(f"... done in {time.perf_counter() - start:.3f} s.")
+    log.info("Writing it as TSV...")
+    start = time.perf_counter()
+    coll.get_tsv_file("wide")
+    log.info(f"... done in {time.perf_counter() - start:.3f} s.")
+
+
 def file_size(filename: str) -> int:
     """
     Returns a file's size in bytes.
@@ -758,7 +1559,15 @@ def benchmark_save(
     - XLSX (via pyexcel_xlsx): about 4.6 Mb, 16 seconds.
     - ODS (via odswriter): about 53 Mb, 56 seconds.
     - ODS (via pyexcel_ods3): about 2.8 Mb, 29 seconds.
+
+    Building a 20,000-row, 150-column page from single-row pages (as for a
+    task export), Oct 2026:
+
+    - storing a dictionary per row: about 9 s (plus 1.2 s to write TSV).
+    - storing data by column: about 2 s (plus 0.9 s to write TSV).
     """
+    _benchmark_wide_page()
+
     coll = _make_benchmarking_collection()
 
     log.info("Writing TSV ZIP...")
@@ -55,7 +55,7 @@ A few random notes:
 from io import StringIO
 import logging
 import sqlite3
-from typing import Any
+from typing import Any, Generator
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.sqlalchemy.dialect import (
@@ -254,13 +254,25 @@ def sql_from_sqlite_database(connection: sqlite3.Connection) -> str:
 
     """
     with StringIO() as f:
-        # noinspection PyTypeChecker
-        for line in connection.iterdump():
-            f.write(line + "\n")
-        f.flush()
+        f.writelines(gen_sql_from_sqlite_database(connection))
         return f.getvalue()
 
 
+def gen_sql_from_sqlite_database(
+    connection: sqlite3.Connection,
+) -> Generator[str, None, None]:
+    """
+    Generates SQL to describe an SQLite database, a statement (with its
+    terminating newline) at a time.
+
+    Args:
+        connection: connection to SQLite database via ``sqlite3`` module
+    """
+    # noinspection PyTypeChecker
+    for line in connection.iterdump():
+        yield line + "\n"
+
+
 @cache_region_static.cache_on_arguments(function_key_generator=fkg)
 def get_all_ddl(dialect_name: str = SqlaDialectName.MYSQL) -> str:
     """
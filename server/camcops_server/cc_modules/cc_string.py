@@ -29,8 +29,12 @@ uses these for displaying tasks, and provides them to client devices.**
 """
 
 import glob
+import hashlib
+import json
 import logging
-from typing import Dict, List
+import os
+import tempfile
+from typing import Dict, List, Optional, Tuple
 import xml.etree.cElementTree as ElementTree
 
 # ... cElementTree is a faster implementation
@@ -51,6 +55,11 @@ log = BraceStyleAdapter(logging.getLogger(__name__))
 APPSTRING_TASKNAME = "camcops"
 MISSING_LOCALE = ""
 
+EXTRA_STRINGS_COMPILED_FORMAT_VERSION = 2
+# ... increment if the structure of the compiled extra strings file changes
+EXTRA_STRINGS_COMPILED_FILE_MODE = 0o644
+# ... other server processes (e.g. Celery workers) may run as other users
+
 
 # =============================================================================
 # XML helper functions
@@ -332,6 +341,36 @@ def all_extra_strings_as_dicts(
             "No CamCOPS extra string files specified; "
             "config is misconfigured; aborting"
         )
+    compiled_filename = cfg.extra_strings_compiled_filename
+    allstrings = None  # type: Optional[Dict[str, Dict[str, Dict[str, str]]]]
+    if compiled_filename:
+        allstrings = read_compiled_extra_strings(compiled_filename, filenames)
+    if allstrings is None:
+        allstrings = read_extra_strings_from_xml(filenames)
+        if compiled_filename:
+            write_compiled_extra_strings(
+                compiled_filename, filenames, allstrings
+            )
+
+    if APPSTRING_TASKNAME not in allstrings:
+        raise_runtime_error(
+            "Extra string files do not contain core CamCOPS strings; "
+            "config is misconfigured; aborting"
+        )
+
+    return allstrings
+
+
+def read_extra_strings_from_xml(
+    filenames: List[str],
+) -> Dict[str, Dict[str, Dict[str, str]]]:
+    """
+    Reads extra strings from XML files, in the format described in
+    :func:`all_extra_strings_as_dicts`. Later files take precedence.
+
+    Args:
+        filenames: XML filenames
+    """
     allstrings = {}  # type: Dict[str, Dict[str, Dict[str, str]]]
     for filename in filenames:
         log.info("Loading string XML file: {}", filename)
@@ -357,11 +396,144 @@ def all_extra_strings_as_dicts(
                     stringname, {}
                 )  # type: Dict[str, str]
                 langversions[locale] = final_string
+    return allstrings
 
-    if APPSTRING_TASKNAME not in allstrings:
-        raise_runtime_error(
-            "Extra string files do not contain core CamCOPS strings; "
-            "config is misconfigured; aborting"
-        )
 
+# =============================================================================
+# Compiled extra strings
+# =============================================================================
+# Parsing the XML takes a noticeable time, in every process. So, optionally
+# (see EXTRA_STRINGS_COMPILED_FILENAME), the parsed strings are kept in a
+# JSON file, along with the name, modification time, size and SHA-256 hash of
+# each XML file they came from. The file is used for as long as those match
+# the XML files (comparing hashes only if the times or sizes differ), and
+# otherwise is rebuilt from the XML. (JSON, not pickle, so that reading the
+# file can't run code, whoever has written to it.)
+#
+# The file has two lines: a header, ``{"version": ..., "sources": [...]}``,
+# then the strings. The header can be checked without parsing the strings.
+
+
+def _xml_source(
+    filename: str, sha256: str = None
+) -> Tuple[str, int, int, str]:
+    """
+    Returns ``filename, mtime_ns, size, sha256`` for an extra strings XML
+    file. The hash is calculated unless it is supplied.
+    """
+    statinfo = os.stat(filename)
+    if sha256 is None:
+        with open(filename, "rb") as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+    return filename, statinfo.st_mtime_ns, statinfo.st_size, sha256
+
+
+def read_compiled_extra_strings(
+    compiled_filename: str, filenames: List[str]
+) -> Optional[Dict[str, Dict[str, Dict[str, str]]]]:
+    """
+    Reads extra strings from a compiled file written by
+    :func:`write_compiled_extra_strings`, if it was made from the current
+    contents of the XML files; otherwise, returns ``None``.
+
+    Args:
+        compiled_filename: the compiled extra strings file
+        filenames: the XML files the strings should come from
+    """
+    try:
+        with open(compiled_filename, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != EXTRA_STRINGS_COMPILED_FORMAT_VERSION:
+                log.info("Rebuilding extra strings (new format)")
+                return None
+            sources = [
+                (filename, mtime_ns, size, sha256)
+                for filename, mtime_ns, size, sha256 in header["sources"]
+            ]  # type: List[Tuple[str, int, int, str]]
+            if [source[0] for source in sources] != filenames:
+                log.info("Rebuilding extra strings (new files)")
+                return None
+            changed = False
+            for i, (filename, mtime_ns, size, sha256) in enumerate(sources):
+                current = _xml_source(filename, sha256)
+                if current == sources[i]:
+                    continue
+                # The time or size differs; has the content changed?
+                current = _xml_source(filename)
+                if current[3] != sha256:
+                    log.info("Rebuilding extra strings ({} changed)", filename)
+                    return None
+                sources[i] = current
+                changed = True
+            allstrings = json.loads(f.readline())
+    except FileNotFoundError:
+        return None
+    except (AttributeError, KeyError, OSError, TypeError, ValueError) as e:
+        # ValueError includes JSON and Unicode decoding errors; the others
+        # arise from JSON that isn't in our format.
+        log.warning(
+            "Can't read compiled extra strings file {!r}: {}",
+            compiled_filename,
+            e,
+        )
+        return None
+    if changed:
+        # Same content, new times: record them, to save hashing next time.
+        _write_compiled_extra_strings(compiled_filename, sources, allstrings)
+    log.debug("Loaded extra strings from {}", compiled_filename)
     return allstrings
+
+
+def write_compiled_extra_strings(
+    compiled_filename: str,
+    filenames: List[str],
+    allstrings: Dict[str, Dict[str, Dict[str, str]]],
+) -> None:
+    """
+    Writes extra strings (as read from XML files) to a compiled file.
+
+    Args:
+        compiled_filename: the compiled extra strings file
+        filenames: the XML files the strings came from
+        allstrings: the strings, as from :func:`read_extra_strings_from_xml`
+    """
+    sources = [_xml_source(filename) for filename in filenames]
+    _write_compiled_extra_strings(compiled_filename, sources, allstrings)
+
+
+def _write_compiled_extra_strings(
+    compiled_filename: str,
+    sources: List[Tuple[str, int, int, str]],
+    allstrings: Dict[str, Dict[str, Dict[str, str]]],
+) -> None:
+    """
+    Writes the compiled extra strings file, replacing any previous one
+    atomically (so that other processes reading it are unaffected). Failure
+    is not fatal, since the strings can always be read from XML.
+    """
+    tmp_filename = None
+    try:
+        fd, tmp_filename = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(compiled_filename)),
+            suffix=".tmp",
+        )
+        with os.fdopen(fd, "wt", encoding="utf-8") as f:
+            # JSON escapes newlines within strings, so each is one line.
+            header = {
+                "version": EXTRA_STRINGS_COMPILED_FORMAT_VERSION,
+                "sources": sources,
+            }
+            f.write(json.dumps(header) + "\n")
+            f.write(json.dumps(allstrings, ensure_ascii=False) + "\n")
+        # mkstemp() makes the file readable only by its owner.
+        os.chmod(tmp_filename, EXTRA_STRINGS_COMPILED_FILE_MODE)
+        os.replace(tmp_filename, compiled_filename)
+        log.info("Wrote compiled extra strings file {}", compiled_filename)
+    except OSError as e:
+        log.warning(
+            "Can't write compiled extra strings file {!r}: {}",
+            compiled_filename,
+            e,
+        )
+        if tmp_filename and os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
@@ -78,23 +78,6 @@ from cardinal_pythonlib.sqlalchemy.schema import (
     is_sqlatype_string,
 )
 from cardinal_pythonlib.stringfunc import mangle_unicode_to_ascii
-from fhirclient.models.attachment import Attachment
-from fhirclient.models.bundle import Bundle
-from fhirclient.models.codeableconcept import CodeableConcept
-from fhirclient.models.coding import Coding
-from fhirclient.models.contactpoint import ContactPoint
-from fhirclient.models.documentreference import (
-    DocumentReference,
-    DocumentReferenceContent,
-)
-from fhirclient.models.fhirreference import FHIRReference
-from fhirclient.models.humanname import HumanName
-from fhirclient.models.identifier import Identifier
-from fhirclient.models.observation import Observation
-from fhirclient.models.practitioner import Practitioner
-from fhirclient.models.questionnaire import Questionnaire
-from fhirclient.models.questionnaireresponse import QuestionnaireResponse
-import hl7
 from pendulum import Date as PendulumDate, DateTime as Pendulum
 from pyramid.renderers import render
 from semantic_version import Version
@@ -113,7 +96,6 @@ from sqlalchemy.sql.sqltypes import (
     Text,
     Time,
 )
-from weasyprint import CSS
 
 from camcops_server.cc_modules.cc_audit import audit
 from camcops_server.cc_modules.cc_baseconstants import DOCUMENTATION_URL
@@ -200,6 +182,7 @@ from camcops_server.cc_modules.cc_version import (
     MINIMUM_TABLET_VERSION,
 )
 from camcops_server.cc_modules.cc_xml import (
+    gen_xml_document,
     get_xml_document,
     XML_COMMENT_ANCILLARY,
     XML_COMMENT_ANONYMOUS,
@@ -214,6 +197,10 @@ from camcops_server.cc_modules.cc_xml import (
 )
 
 if TYPE_CHECKING:
+    from fhirclient.models.bundle import Bundle
+    from fhirclient.models.identifier import Identifier
+    from weasyprint import CSS
+    import hl7
     from camcops_server.cc_modules.cc_ctvinfo import CtvInfo
     from camcops_server.cc_modules.cc_exportrecipient import (
         ExportRecipient,
@@ -1404,7 +1391,7 @@ class Task(GenericTabletRecordMixin, Base):
 
     def get_patient_hl7_pid_segment(
         self, req: "CamcopsRequest", recipient_def: "ExportRecipient"
-    ) -> Union[hl7.Segment, str]:
+    ) -> "Union[hl7.Segment, str]":
         """
         Get an HL7 PID segment for the patient, or "".
         """
@@ -1420,7 +1407,7 @@ class Task(GenericTabletRecordMixin, Base):
 
     def get_hl7_data_segments(
         self, req: "CamcopsRequest", recipient_def: "ExportRecipient"
-    ) -> List[hl7.Segment]:
+    ) -> "List[hl7.Segment]":
         """
         Returns a list of HL7 data segments.
 
@@ -1448,7 +1435,7 @@ class Task(GenericTabletRecordMixin, Base):
     # noinspection PyMethodMayBeStatic,PyUnusedLocal
     def get_hl7_extra_data_segments(
         self, recipient_def: "ExportRecipient"
-    ) -> List[hl7.Segment]:
+    ) -> "List[hl7.Segment]":
         """
         Return a list of any extra HL7 data segments. (See
         :func:`get_hl7_data_segments`, which calls this function.)
@@ -1466,11 +1453,13 @@ class Task(GenericTabletRecordMixin, Base):
         req: "CamcopsRequest",
         recipient: "ExportRecipient",
         skip_docs_if_other_content: bool = DEBUG_SKIP_FHIR_DOCS,
-    ) -> Bundle:
+    ) -> "Bundle":
         """
         Get a single FHIR Bundle with all entries. See
         :meth:`get_fhir_bundle_entries`.
         """
+        from fhirclient.models.bundle import Bundle  # delayed import
+
         # Get the content:
         bundle_entries = self.get_fhir_bundle_entries(
             req,
@@ -1611,6 +1600,11 @@ class Task(GenericTabletRecordMixin, Base):
         observations depends on whether it is conceptually independent. For
         example, for BMI, height and weight should be separate.
         """
+        from fhirclient.models.codeableconcept import (
+            CodeableConcept,
+        )  # delayed import
+        from fhirclient.models.coding import Coding  # delayed import
+
         bundle_entries = []  # type: List[Dict]
 
         # SNOMED, as one observation with several components:
@@ -1676,11 +1670,13 @@ class Task(GenericTabletRecordMixin, Base):
         req: "CamcopsRequest",
         route_name: str,
         value_within_task_class: Union[int, str],
-    ) -> Identifier:
+    ) -> "Identifier":
         """
         For when we want to refer to something within a specific task class, in
         the abstract. The URL refers to the task class, not the task instance.
         """
+        from fhirclient.models.identifier import Identifier  # delayed import
+
         return Identifier(
             jsondict={
                 Fc.SYSTEM: req.route_url(
@@ -1696,7 +1692,7 @@ class Task(GenericTabletRecordMixin, Base):
         req: "CamcopsRequest",
         route_name: str,
         value_within_task_instance: Union[int, str],
-    ) -> Identifier:
+    ) -> "Identifier":
         """
         A number of FHIR identifiers refer to "this task" and nothing very much
         more specific (because they represent a type of thing of which there
@@ -1705,6 +1701,8 @@ class Task(GenericTabletRecordMixin, Base):
         function for them. The intention is to route to the specific task
         instance concerned.
         """
+        from fhirclient.models.identifier import Identifier  # delayed import
+
         return Identifier(
             jsondict={
                 Fc.SYSTEM: req.route_url(
@@ -1720,7 +1718,7 @@ class Task(GenericTabletRecordMixin, Base):
 
     def _get_fhir_condition_id(
         self, req: "CamcopsRequest", name: Union[int, str]
-    ) -> Identifier:
+    ) -> "Identifier":
         """
         Returns a FHIR Identifier for an Observation, representing this task
         instance and a named observation within it.
@@ -1731,7 +1729,7 @@ class Task(GenericTabletRecordMixin, Base):
 
     def _get_fhir_docref_id(
         self, req: "CamcopsRequest", task_format: str
-    ) -> Identifier:
+    ) -> "Identifier":
         """
         Returns a FHIR Identifier (e.g. for a DocumentReference collection)
         representing the view of this task.
@@ -1742,7 +1740,7 @@ class Task(GenericTabletRecordMixin, Base):
 
     def _get_fhir_observation_id(
         self, req: "CamcopsRequest", name: str
-    ) -> Identifier:
+    ) -> "Identifier":
         """
         Returns a FHIR Identifier for an Observation, representing this task
         instance and a named observation within it.
@@ -1751,7 +1749,7 @@ class Task(GenericTabletRecordMixin, Base):
             req, Routes.FHIR_OBSERVATION, name
         )
 
-    def _get_fhir_practitioner_id(self, req: "CamcopsRequest") -> Identifier:
+    def _get_fhir_practitioner_id(self, req: "CamcopsRequest") -> "Identifier":
         """
         Returns a FHIR Identifier for the clinician. (Clinicians are not
         sensibly made unique across tasks, but are task-specific.)
@@ -1762,7 +1760,9 @@ class Task(GenericTabletRecordMixin, Base):
             Fc.CAMCOPS_VALUE_CLINICIAN_WITHIN_TASK,
         )
 
-    def _get_fhir_questionnaire_id(self, req: "CamcopsRequest") -> Identifier:
+    def _get_fhir_questionnaire_id(
+        self, req: "CamcopsRequest"
+    ) -> "Identifier":
         """
         Returns a FHIR Identifier (e.g. for a Questionnaire) representing this
         task, in the abstract.
@@ -1771,6 +1771,8 @@ class Task(GenericTabletRecordMixin, Base):
         formatting of question text) changes, a new version will be stored
         despite the "ifNoneExist" clause.
         """
+        from fhirclient.models.identifier import Identifier  # delayed import
+
         return Identifier(
             jsondict={
                 Fc.SYSTEM: req.route_url(Routes.FHIR_QUESTIONNAIRE_SYSTEM),
@@ -1780,7 +1782,7 @@ class Task(GenericTabletRecordMixin, Base):
 
     def _get_fhir_questionnaire_response_id(
         self, req: "CamcopsRequest"
-    ) -> Identifier:
+    ) -> "Identifier":
         """
         Returns a FHIR Identifier (e.g. for a QuestionnaireResponse collection)
         representing this task instance. QuestionnaireResponse items are
@@ -1811,6 +1813,10 @@ class Task(GenericTabletRecordMixin, Base):
         """
         Returns a reference to the clinician, for "practitioner" fields.
         """
+        from fhirclient.models.fhirreference import (
+            FHIRReference,
+        )  # delayed import
+
         assert self.has_clinician, (
             "Don't call Task._get_fhir_clinician_ref() "
             "for tasks without a clinician"
@@ -1848,6 +1854,11 @@ class Task(GenericTabletRecordMixin, Base):
         - https://build.fhir.org/ig/HL7/US-Core/StructureDefinition-us-core-documentreference.html
         - https://build.fhir.org/ig/HL7/US-Core/clinical-notes-guidance.html
         """  # noqa
+        from fhirclient.models.attachment import Attachment  # delayed import
+        from fhirclient.models.documentreference import (
+            DocumentReference,
+            DocumentReferenceContent,
+        )  # delayed import
 
         # Establish content_type and binary_data
         task_format = recipient.task_format
@@ -1934,6 +1945,8 @@ class Task(GenericTabletRecordMixin, Base):
         task (by adding "when", "who", and status information) and return the
         Observation (as a dict in JSON format).
         """
+        from fhirclient.models.observation import Observation  # delayed import
+
         obs_dict.update(
             {
                 Fc.EFFECTIVE_DATE_TIME: self.fhir_when_task_created,
@@ -1957,6 +1970,14 @@ class Task(GenericTabletRecordMixin, Base):
         Supplies information on the clinician associated with this task, as a
         FHIR Practitioner object (within a bundle).
         """
+        from fhirclient.models.contactpoint import (
+            ContactPoint,
+        )  # delayed import
+        from fhirclient.models.humanname import HumanName  # delayed import
+        from fhirclient.models.practitioner import (
+            Practitioner,
+        )  # delayed import
+
         assert self.has_clinician, (
             "Don't call Task._get_fhir_practitioner_bundle_entry() "
             "for tasks without a clinician"
@@ -2037,6 +2058,10 @@ class Task(GenericTabletRecordMixin, Base):
         from supplied Questionnaire items. Note: here we mean "abstract task",
         not "task instance".
         """
+        from fhirclient.models.questionnaire import (
+            Questionnaire,
+        )  # delayed import
+
         # FHIR supports versioning of questionnaires. Might be useful if the
         # wording of questions change. Could either use FHIR's version
         # field or include the version in the identifier below. Either way
@@ -2076,6 +2101,10 @@ class Task(GenericTabletRecordMixin, Base):
         Make a bundle entry from FHIR QuestionnaireResponse items (e.g. one for
         the response to each question in a quesionnaire-style task).
         """
+        from fhirclient.models.questionnaireresponse import (
+            QuestionnaireResponse,
+        )  # delayed import
+
         q_identifier = self._get_fhir_questionnaire_id(req)
         qr_identifier = self._get_fhir_questionnaire_response_id(req)
 
@@ -2563,6 +2592,30 @@ class Task(GenericTabletRecordMixin, Base):
             include_comments=options.xml_include_comments,
         )
 
+    def gen_xml(
+        self,
+        req: "CamcopsRequest",
+        options: TaskExportOptions = None,
+        indent_spaces: int = 4,
+        eol: str = "\n",
+    ) -> Iterable[str]:
+        """
+        As for :meth:`get_xml`, but returns the XML as an iterable of text
+        fragments, for writing to a file or HTTP response without building
+        the whole document (with its base-64-encoded BLOBs) in memory.
+
+        The XML tree is built (i.e. the database is read) when this is
+        called, not as the fragments are consumed.
+        """
+        options = options or TaskExportOptions()
+        tree = self.get_xml_root(req=req, options=options)
+        return gen_xml_document(
+            tree,
+            indent_spaces=indent_spaces,
+            eol=eol,
+            include_comments=options.xml_include_comments,
+        )
+
     def get_xml_root(
         self, req: "CamcopsRequest", options: TaskExportOptions
     ) -> XmlElement:
@@ -2818,7 +2871,7 @@ class Task(GenericTabletRecordMixin, Base):
                 },
             )
 
-    def get_weasyprint_stylesheet(self, req: "CamcopsRequest") -> CSS:
+    def get_weasyprint_stylesheet(self, req: "CamcopsRequest") -> "CSS":
         _ = req.gettext
         top_left_text = self.get_weasyprint_top_left_text(req)
         top_left_content = f'"{top_left_text}"'
@@ -44,22 +44,26 @@ from typing import (
     Union,
 )
 
+from cardinal_pythonlib.datetimefunc import get_now_utc_datetime
 from cardinal_pythonlib.json_utils.serialize import (
     register_class_for_json,
     register_enum_for_json,
 )
+from cardinal_pythonlib.lists import chunks
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.reprfunc import auto_repr, auto_str
 from cardinal_pythonlib.sort import MINTYPE_SINGLETON, MinType
 from kombu.serialization import dumps, loads
 from pendulum import DateTime as Pendulum
+from sqlalchemy import inspect
 from sqlalchemy.orm import Query
 from sqlalchemy.orm.session import Session as SqlASession
 from sqlalchemy.sql.functions import func
-from sqlalchemy.sql.expression import and_, exists, or_
+from sqlalchemy.sql.expression import and_, or_, select
 
 from camcops_server.cc_modules.cc_constants import ERA_NOW
 from camcops_server.cc_modules.cc_exportrecipient import ExportRecipient
+from camcops_server.cc_modules.cc_patientidnum import PatientIdNum
 from camcops_server.cc_modules.cc_task import (
     tablename_to_task_class_dict,
     Task,
@@ -68,7 +72,10 @@ from camcops_server.cc_modules.cc_taskfactory import (
     task_query_restricted_to_permitted_users,
 )
 from camcops_server.cc_modules.cc_taskfilter import TaskFilter
-from camcops_server.cc_modules.cc_taskindex import TaskIndexEntry
+from camcops_server.cc_modules.cc_taskindex import (
+    any_pending_index_updates,
+    TaskIndexEntry,
+)
 
 if TYPE_CHECKING:
     from sqlalchemy.sql.elements import ClauseElement, ColumnElement
@@ -87,11 +94,29 @@ if DEBUG_QUERY_TIMING:
     log.warning("Debugging options enabled!")
 
 
+# =============================================================================
+# Constants
+# =============================================================================
+
+TASK_CHUNK_SIZE = 500  # tasks per chunk, for chunked fetching
+TASK_KEY_YIELD_PER = 5000  # rows per batch, when fetching task sort keys
+
+
 # =============================================================================
 # Sorting helpers
 # =============================================================================
 
 
+def when_created_sort_key(
+    created: Optional[Pendulum], uploaded: Optional[datetime.datetime]
+) -> Union[Tuple[Pendulum, datetime.datetime], MinType]:
+    """
+    Sort key for a task, given its creation date/time and its upload
+    date/time (the latter as a tiebreak for consistent ordering).
+    """
+    return MINTYPE_SINGLETON if created is None else (created, uploaded)
+
+
 def task_when_created_sorter(
     task: Task,
 ) -> Union[Tuple[Pendulum, datetime.datetime], MinType]:
@@ -100,10 +125,8 @@ def task_when_created_sorter(
     as a tiebreak for consistent ordering).
     """
     # For sorting of tasks
-    created = task.when_created
     # noinspection PyProtectedMember
-    uploaded = task._when_added_batch_utc
-    return MINTYPE_SINGLETON if created is None else (created, uploaded)
+    return when_created_sort_key(task.when_created, task._when_added_batch_utc)
 
 
 @register_enum_for_json
@@ -134,6 +157,35 @@ def sort_tasks_in_place(
         tasklist.sort(key=task_when_created_sorter, reverse=True)
 
 
+# A task's PK, when_created, and when_added_batch_utc:
+TaskSortKeyType = Tuple[int, Optional[Pendulum], Optional[datetime.datetime]]
+
+
+def sort_task_pks(
+    task_keys: List[TaskSortKeyType], sortmethod: TaskSortMethod
+) -> List[int]:
+    """
+    Returns task PKs, in the order that :func:`sort_tasks_in_place` would put
+    the corresponding tasks, without fetching the tasks themselves. Ties are
+    broken by PK.
+
+    Args:
+        task_keys: a list of ``pk, when_created, when_added_batch_utc``
+            tuples, one per task; sorted in place
+        sortmethod: a :class:`TaskSortMethod` enum
+    """
+    task_keys.sort(key=lambda k: k[0])
+    if sortmethod in (
+        TaskSortMethod.CREATION_DATE_ASC,
+        TaskSortMethod.CREATION_DATE_DESC,
+    ):
+        task_keys.sort(
+            key=lambda k: when_created_sort_key(k[1], k[2]),
+            reverse=sortmethod == TaskSortMethod.CREATION_DATE_DESC,
+        )
+    return [k[0] for k in task_keys]
+
+
 # =============================================================================
 # Parallel fetch helper
 # =============================================================================
@@ -227,6 +279,7 @@ class TaskCollection(object):
         current_only: bool = True,
         via_index: bool = True,
         export_recipient: "ExportRecipient" = None,
+        snapshot_utc: datetime.datetime = None,
     ) -> None:
         """
         Args:
@@ -250,9 +303,19 @@ class TaskCollection(object):
                 Restrict to ``_current`` tasks only?
             via_index:
                 Use the server's index (faster)? (Not possible with
-                ``current_only=False``.)
+                ``current_only=False``, or while recent uploads are waiting for
+                their index updates; see
+                :func:`camcops_server.cc_modules.cc_taskindex.any_pending_index_updates`.)
             export_recipient:
                 A :class:`camcops_server.cc_modules.cc_exportrecipient.ExportRecipient`
+            snapshot_utc:
+                Optional date/time (UTC, without timezone information). If
+                set, select tasks as they were at that moment: records
+                uploaded later are excluded, and (with ``current_only``)
+                records that were current then but have since been replaced
+                or removed are included. The index only describes current
+                tasks, so it is used only if none of the tasks we might want
+                have been replaced or removed since the snapshot.
         """  # noqa
         if via_index and not current_only:
             log.warning("Can't use index for non-current tasks")
@@ -265,7 +328,9 @@ class TaskCollection(object):
         self._sort_method_global = sort_method_global
         self._current_only = current_only
         self._via_index = via_index
+        self._via_index_checked = False
         self.export_recipient = export_recipient
+        self._snapshot_utc = snapshot_utc
 
         if export_recipient:
             # We create a new filter to reflect the export recipient.
@@ -333,11 +398,62 @@ class TaskCollection(object):
         """
         return self._filter.task_classes
 
+    def _using_index(self) -> bool:
+        """
+        Are we fetching tasks via the index? We may not be, even if that was
+        requested, if the index can't give the right answer; that is decided
+        when the tasks are first fetched (so it applies however the request
+        was supplied; see :meth:`set_request`).
+        """
+        if self._via_index and not self._via_index_checked:
+            self._via_index_checked = True
+            req = self.req
+            if (
+                req.config.index_uploads_in_background
+                and self._any_pending_index_updates(req.dbsession)
+            ):
+                log.debug("Not using index: uploads awaiting index updates")
+                self._via_index = False
+            elif (
+                self._snapshot_utc is not None
+                and self._changed_since_snapshot(req.dbsession)
+            ):
+                log.debug("Not using index: tasks changed since snapshot")
+                self._via_index = False
+        return self._via_index
+
+    def _changed_since_snapshot(self, dbsession: SqlASession) -> bool:
+        """
+        Have any tasks of the types we want been replaced or removed since
+        our snapshot? If so, the index no longer describes them as they were
+        then.
+        """
+        for task_class in self._filter.task_classes:
+            # noinspection PyProtectedMember
+            q = select(task_class._pk).where(
+                task_class._when_removed_batch_utc > self._snapshot_utc
+            )
+            if dbsession.execute(select(q.exists())).scalar():
+                return True
+        return False
+
+    def _any_pending_index_updates(self, dbsession: SqlASession) -> bool:
+        """
+        Are any uploads to the tables we're querying awaiting their index
+        updates? See
+        :func:`camcops_server.cc_modules.cc_taskindex.any_pending_index_updates`.
+        """  # noqa
+        tablenames = [tc.__tablename__ for tc in self._filter.task_classes]
+        if self._filter.any_patient_filtering():
+            # ID number filters use the ID number index.
+            tablenames.append(PatientIdNum.__tablename__)
+        return any_pending_index_updates(dbsession, tablenames=tablenames)
+
     def tasks_for_task_class(self, task_class: Type[Task]) -> List[Task]:
         """
         Returns all appropriate task instances for a specific task type.
         """
-        if self._via_index:
+        if self._using_index():
             self._ensure_everything_fetched_via_index()
         else:
             self._fetch_task_class(task_class)
@@ -350,7 +466,7 @@ class TaskCollection(object):
         Returns a list of all appropriate task instances.
         """
         if self._all_tasks is None:
-            if self._via_index:
+            if self._using_index():
                 self._ensure_everything_fetched_via_index()
             else:
                 self._fetch_all_tasks_without_index()
@@ -372,7 +488,7 @@ class TaskCollection(object):
         - More efficient still is to fetch the 20 indexes we need, and then
           their task.
         """
-        if not self._via_index:
+        if not self._using_index():
             return self.all_tasks
 
         self._build_index_query()  # ensure self._all_indexes is set
@@ -414,6 +530,35 @@ class TaskCollection(object):
             for task in self.tasks_for_task_class(cls):
                 yield task
 
+    def gen_tasks_by_class_chunked(
+        self, chunk_size: int = TASK_CHUNK_SIZE
+    ) -> Generator[Task, None, None]:
+        """
+        Generates all tasks, class-wise, in the same order as
+        :meth:`gen_tasks_by_class`, but fetching them in chunks and expunging
+        each chunk from the session once the caller has moved on to the next
+        (see :meth:`gen_task_chunks_for_task_class`), so that memory use is
+        bounded.
+        """
+        for cls in self.task_classes():
+            for task in self.gen_tasks_for_task_class_chunked(cls, chunk_size):
+                yield task
+
+    def gen_tasks_for_task_class_chunked(
+        self, task_class: Type[Task], chunk_size: int = TASK_CHUNK_SIZE
+    ) -> Generator[Task, None, None]:
+        """
+        Generates all appropriate tasks for a specific task type, in the same
+        order as :meth:`tasks_for_task_class`, fetching them in chunks and
+        expunging each chunk from the session once the caller has moved on to
+        the next.
+        """
+        for chunk in self.gen_task_chunks_for_task_class(
+            task_class, chunk_size, expunge=True
+        ):
+            for task in chunk:
+                yield task
+
     def gen_tasks_in_global_order(self) -> Generator[Task, None, None]:
         """
         Generates all tasks, in the global order.
@@ -421,6 +566,119 @@ class TaskCollection(object):
         for task in self.all_tasks:
             yield task
 
+    def gen_task_chunks_for_task_class(
+        self,
+        task_class: Type[Task],
+        chunk_size: int = TASK_CHUNK_SIZE,
+        expunge: bool = False,
+    ) -> Generator[List[Task], None, None]:
+        """
+        Generates all appropriate tasks for a specific task type, in lists of
+        up to ``chunk_size`` tasks, in the same order as
+        :meth:`tasks_for_task_class` (ties, and all tasks if there is no sort
+        method, are in PK order), without retaining them.
+
+        The PKs and sort keys of all the tasks are fetched first, in a single
+        query whose results are streamed (``yield_per``), and sorted. Each
+        chunk of tasks is then fetched by PK alone, in a separate query, so
+        no database cursor is held open while the caller works on the tasks
+        (which would break e.g. MySQL lazy loading, and commits).
+
+        If the tasks have already been fetched, those are used instead.
+
+        Args:
+            task_class: the task class
+            chunk_size: the maximum number of tasks per chunk
+            expunge: expunge each chunk of tasks from the session when the
+                caller asks for the next chunk (or finishes), so they can be
+                garbage-collected? (Tasks that were already in the session
+                before the chunk was fetched are left alone.)
+        """
+        if self._using_index():
+            self._build_index_query()
+        if task_class in self._tasks_by_class:
+            for chunk in chunks(self._tasks_by_class[task_class], chunk_size):
+                yield chunk
+            return
+        dbsession = self.req.dbsession
+        task_pks = self._get_sorted_task_pks(task_class)
+        for pk_chunk in chunks(task_pks, chunk_size):
+            # The PKs are already filtered (except by text contents, for the
+            # index), so there's no need to rebuild the full query.
+            qtask = dbsession.query(task_class)
+            if self._via_index:
+                qtask = self._filter_query_for_text_contents(qtask, task_class)
+            if expunge:
+                preexisting_keys = set(dbsession.identity_map.keys())
+            # noinspection PyProtectedMember
+            tasks_by_pk = {
+                task.pk: task
+                for task in qtask.filter(task_class._pk.in_(pk_chunk))
+            }  # type: Dict[int, Task]
+            tasks = [tasks_by_pk[pk] for pk in pk_chunk if pk in tasks_by_pk]
+            if not self._via_index:
+                tasks = self._filter_through_python(tasks)
+            if tasks:
+                yield tasks
+            if expunge:
+                # The caller has finished with this chunk.
+                # noinspection PyUnboundLocalVariable
+                for task in tasks_by_pk.values():
+                    state = inspect(task)
+                    if (
+                        state.session_id is not None
+                        and state.key not in preexisting_keys
+                    ):
+                        dbsession.expunge(task)
+
+    def _get_sorted_task_pks(self, task_class: Type[Task]) -> List[int]:
+        """
+        Returns the PKs of all appropriate tasks for a specific task type, in
+        the same order as :meth:`tasks_for_task_class`, without fetching the
+        tasks themselves. (The "complete only" part of the filter, which needs
+        the tasks, is not applied.)
+        """
+        task_keys = []  # type: List[TaskSortKeyType]
+        if self._via_index:
+            # The index holds the sort keys too.
+            tablename = task_class.__tablename__
+            indexes = self._all_indexes
+            if indexes is None:
+                return []
+            if isinstance(indexes, Query):
+                task_keys = [
+                    (pk, when_created, when_added)
+                    for pk, when_created, when_added in indexes.filter(
+                        TaskIndexEntry.task_table_name == tablename
+                    )
+                    .with_entities(
+                        TaskIndexEntry.task_pk,
+                        TaskIndexEntry.when_created_iso,
+                        TaskIndexEntry.when_added_batch_utc,
+                    )
+                    .yield_per(TASK_KEY_YIELD_PER)
+                ]
+            else:
+                task_keys = [
+                    (i.task_pk, i.when_created_iso, i.when_added_batch_utc)
+                    for i in indexes
+                    if i.task_table_name == tablename
+                ]
+        else:
+            q = self._serial_query(task_class)
+            if q is None:
+                return []
+            # noinspection PyProtectedMember
+            task_keys = [
+                (pk, when_created, when_added)
+                for pk, when_created, when_added in q.with_entities(
+                    task_class._pk,
+                    task_class.when_created,
+                    task_class._when_added_batch_utc,
+                ).yield_per(TASK_KEY_YIELD_PER)
+            ]
+        return sort_task_pks(task_keys, self._sort_method_by_class)
+
     @property
     def dbsession(self) -> SqlASession:
         """
@@ -505,11 +763,27 @@ class TaskCollection(object):
         """
         q = dbsession.query(task_class)
 
+        # Restrict to a snapshot in time?
+        snapshot_utc = self._snapshot_utc
+        if snapshot_utc is not None:
+            # noinspection PyProtectedMember
+            q = q.filter(task_class._when_added_batch_utc <= snapshot_utc)
+
         # Restrict to what the web front end will supply
         # noinspection PyProtectedMember
         if self._current_only:
-            # noinspection PyProtectedMember
-            q = q.filter(task_class._current == True)  # noqa: E712
+            if snapshot_utc is None:
+                # noinspection PyProtectedMember
+                q = q.filter(task_class._current == True)  # noqa: E712
+            else:
+                # Current at the time of the snapshot:
+                # noinspection PyProtectedMember
+                q = q.filter(
+                    or_(
+                        task_class._current == True,  # noqa: E712
+                        task_class._when_removed_batch_utc > snapshot_utc,
+                    )
+                )
 
         # Restrict to what is PERMITTED
         q = task_query_restricted_to_permitted_users(
@@ -659,25 +933,15 @@ class TaskCollection(object):
         if not r.is_incremental():
             # Full database export; no restrictions
             return q
-        # Otherwise, restrict to tasks not yet sent to this recipient.
-        # noinspection PyUnresolvedReferences
+        # Otherwise, restrict to tasks not yet sent to this recipient, via an
+        # anti-join against the export log.
+        # noinspection PyProtectedMember
         q = q.filter(
             # "There is not a successful export record for this task/recipient"
-            ~exists()
-            .select_from(
-                ExportedTask.__table__.join(
-                    ExportRecipient.__table__,
-                    ExportedTask.recipient_id == ExportRecipient.id,
-                )
-            )
-            .where(
-                and_(
-                    ExportRecipient.recipient_name == r.recipient_name,
-                    ExportedTask.basetable == cls.__tablename__,
-                    ExportedTask.task_server_pk == cls._pk,
-                    ExportedTask.success == True,  # noqa: E712
-                    ExportedTask.cancelled == False,  # noqa: E712
-                )
+            ~ExportedTask.successful_export_exists(
+                recipient_name=r.recipient_name,
+                basetable=cls.__tablename__,
+                task_pk=cls._pk,
             )
         )
         return q
@@ -851,6 +1115,11 @@ class TaskCollection(object):
         dbsession = self.req.dbsession
         q = dbsession.query(TaskIndexEntry)
 
+        # Restrict to a snapshot in time? (See __init__.)
+        snapshot_utc = self._snapshot_utc
+        if snapshot_utc is not None:
+            q = q.filter(TaskIndexEntry.when_added_batch_utc <= snapshot_utc)
+
         # Restrict to what the web front end will supply
         assert self._current_only, "_current_only must be true to use index"
 
@@ -1029,28 +1298,17 @@ class TaskCollection(object):
         if not r.is_incremental():
             # Full database export; no restrictions
             return q
-        # Otherwise, restrict to tasks not yet sent to this recipient.
+        # Otherwise, restrict to tasks not yet sent to this recipient, via an
+        # anti-join against the export log.
         # Remember: q is a query on TaskIndexEntry.
-        # noinspection PyUnresolvedReferences
         q = q.filter(
             # "There is not a successful export record for this task/recipient"
-            ~exists()
-            .select_from(
-                ExportedTask.__table__.join(
-                    ExportRecipient.__table__,
-                    ExportedTask.recipient_id == ExportRecipient.id,
-                )
-            )
-            .where(
-                and_(
-                    ExportRecipient.recipient_name == r.recipient_name,
-                    ExportedTask.basetable == TaskIndexEntry.task_table_name,
-                    # ... don't use ".tablename" as a property doesn't play
-                    # nicely with SQLAlchemy here
-                    ExportedTask.task_server_pk == TaskIndexEntry.task_pk,
-                    ExportedTask.success == True,  # noqa: E712
-                    ExportedTask.cancelled == False,  # noqa: E712
-                )
+            ~ExportedTask.successful_export_exists(
+                recipient_name=r.recipient_name,
+                basetable=TaskIndexEntry.task_table_name,
+                # ... don't use ".tablename" as a property doesn't play
+                # nicely with SQLAlchemy here
+                task_pk=TaskIndexEntry.task_pk,
             )
         )
         return q
@@ -1061,15 +1319,24 @@ def encode_task_collection(coll: TaskCollection) -> Dict:
     """
     Serializes a :class:`TaskCollection`.
 
+    Only the definition of the collection is serialized (the filter, plus a
+    snapshot time, which is "now" unless the collection already has one), not
+    any tasks; the back end fetches the tasks itself, as they were at the
+    snapshot time.
+
     The request is not serialized and must be rebuilt in another way; see e.g.
     :func:`camcops_server.cc_modules.celery.email_basic_dump`.
     """
+    snapshot_utc = coll._snapshot_utc or get_now_utc_datetime().replace(
+        tzinfo=None
+    )
     return {
         "taskfilter": dumps(coll._filter, serializer="json"),
         "as_dump": coll._as_dump,
         "sort_method_by_class": dumps(
             coll._sort_method_by_class, serializer="json"
         ),
+        "snapshot_utc": snapshot_utc.isoformat(),
     }
 
 
@@ -1088,6 +1355,10 @@ def decode_task_collection(d: Dict, cls: Type) -> TaskCollection:
             *reorder_args(*d["sort_method_by_class"])
         ),
     }
+    if d.get("snapshot_utc"):  # absent in messages from older versions
+        kwargs["snapshot_utc"] = datetime.datetime.fromisoformat(
+            d["snapshot_utc"]
+        )
     return TaskCollection(req=None, **kwargs)
 
 
@@ -33,7 +33,16 @@ it caches ``is_complete()`` information).
 
 import datetime
 import logging
-from typing import Any, List, Optional, Type, TYPE_CHECKING
+from typing import (
+    Any,
+    Collection,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Type,
+    TYPE_CHECKING,
+)
 
 from cardinal_pythonlib.datetimefunc import pendulum_to_datetime
 from cardinal_pythonlib.logs import BraceStyleAdapter
@@ -67,6 +76,7 @@ from camcops_server.cc_modules.cc_patientidnum import PatientIdNum
 from camcops_server.cc_modules.cc_sqla_coltypes import (
     EraColType,
     isotzdatetime_to_utcdatetime,
+    JsonColType,
     PendulumDateTimeAsIsoTextColType,
     TableNameColType,
 )
@@ -302,7 +312,10 @@ class PatientIdNumIndexEntry(Base):
     # -------------------------------------------------------------------------
     @classmethod
     def check_index(
-        cls, session: SqlASession, show_all_bad: bool = False
+        cls,
+        session: SqlASession,
+        show_all_bad: bool = False,
+        pending_pks: Dict[str, Set[int]] = None,
     ) -> bool:
         """
         Checks the index.
@@ -312,10 +325,15 @@ class PatientIdNumIndexEntry(Base):
                 an SQLAlchemy Session
             show_all_bad:
                 show all bad entries? (If false, return upon the first)
+            pending_pks:
+                server PKs, by table name, of records whose index updates are
+                still pending (see :class:`PendingIndexUpdate`); their index
+                entries may legitimately be out of date, so are not checked
 
         Returns:
             bool: is the index OK?
         """
+        pending_pks = pending_pks or {}
         ok = True
 
         log.info(
@@ -345,7 +363,10 @@ class PatientIdNumIndexEntry(Base):
                 )
             )
         )
+        pending_idnum_pks = pending_pks.get(PatientIdNum.__tablename__, set())
         for index in q_idx_without_original:
+            if index.idnum_pk in pending_idnum_pks:
+                continue
             log.error(
                 "Patient ID number index without matching " "original: {!r}",
                 index,
@@ -372,6 +393,9 @@ class PatientIdNumIndexEntry(Base):
             ),
         )
         for orig in q_original_with_idx:
+            # noinspection PyProtectedMember
+            if orig._pk in pending_idnum_pks:
+                continue
             log.error("ID number without index entry: {!r}", orig)
             ok = False
             if not show_all_bad:
@@ -389,6 +413,7 @@ class PatientIdNumIndexEntry(Base):
         session: SqlASession,
         indexed_at_utc: Pendulum,
         tablechanges: UploadTableChanges,
+        replace_existing: bool = False,
     ) -> None:
         """
         Updates the index for a device's upload.
@@ -407,6 +432,10 @@ class PatientIdNumIndexEntry(Base):
             tablechanges:
                 a :class:`camcops_server.cc_modules.cc_client_api_core.UploadTableChanges`
                 object describing the changes to a table
+            replace_existing:
+                also delete any existing index entries for records on the way
+                in, so that the update can safely be applied more than once
+                (see :class:`PendingIndexUpdate`)
         """  # noqa
         # noinspection PyUnresolvedReferences
         indextable = PatientIdNumIndexEntry.__table__  # type: ignore[assignment]  # noqa: E501
@@ -420,6 +449,10 @@ class PatientIdNumIndexEntry(Base):
 
         # Delete the old
         removal_pks = tablechanges.idnum_delete_index_pks
+        if replace_existing:
+            removal_pks = sorted(
+                set(removal_pks) | set(tablechanges.idnum_add_index_pks)
+            )
         if removal_pks:
             log.debug(
                 "Deleting old ID number indexes: server PKs {}", removal_pks
@@ -469,6 +502,7 @@ class PatientIdNumIndexEntry(Base):
                             )
                         )
                         .where(idnumcols._pk.in_(addition_pks))
+                        .where(idnumcols._current == True)  # noqa: E712
                         .where(patientcols._current == True)  # noqa: E712
                     ),
                 )
@@ -864,6 +898,7 @@ class TaskIndexEntry(Base):
         session: SqlASession,
         tablechanges: UploadTableChanges,
         indexed_at_utc: Pendulum,
+        replace_existing: bool = False,
     ) -> None:
         """
         Updates the index for a device's upload.
@@ -880,6 +915,10 @@ class TaskIndexEntry(Base):
                 object describing the changes to a table
             indexed_at_utc:
                 current time in UTC
+            replace_existing:
+                also delete any existing index entries for records on the way
+                in, so that the update can safely be applied more than once
+                (see :class:`PendingIndexUpdate`)
         """  # noqa
         tasktablename = tablechanges.tablename
         d = tablename_to_task_class_dict()
@@ -894,6 +933,10 @@ class TaskIndexEntry(Base):
 
         # Delete the old.
         delete_index_pks = tablechanges.task_delete_index_pks
+        if replace_existing:
+            delete_index_pks = sorted(
+                set(delete_index_pks) | set(tablechanges.task_reindex_pks)
+            )
         if delete_index_pks:
             log.debug(
                 "Deleting old task indexes: {}, server PKs {}",
@@ -916,7 +959,10 @@ class TaskIndexEntry(Base):
                 reindex_pks,
             )
             # noinspection PyUnboundLocalVariable,PyProtectedMember
-            q = session.query(taskclass).filter(taskclass._pk.in_(reindex_pks))
+            q = session.query(taskclass).filter(
+                taskclass._pk.in_(reindex_pks),
+                taskclass._current == True,  # noqa: E712
+            )
             for task in q:
                 cls.index_task(task, session, indexed_at_utc=indexed_at_utc)
 
@@ -925,7 +971,10 @@ class TaskIndexEntry(Base):
     # -------------------------------------------------------------------------
     @classmethod
     def check_index(
-        cls, session: SqlASession, show_all_bad: bool = False
+        cls,
+        session: SqlASession,
+        show_all_bad: bool = False,
+        pending_pks: Dict[str, Set[int]] = None,
     ) -> bool:
         """
         Checks the index.
@@ -935,10 +984,15 @@ class TaskIndexEntry(Base):
                 an SQLAlchemy Session
             show_all_bad:
                 show all bad entries? (If false, return upon the first)
+            pending_pks:
+                server PKs, by table name, of records whose index updates are
+                still pending (see :class:`PendingIndexUpdate`); their index
+                entries may legitimately be out of date, so are not checked
 
         Returns:
             bool: is the index OK?
         """
+        pending_pks = pending_pks or {}
         ok = True
 
         log.info("Checking all task indexes represent valid entries")
@@ -958,7 +1012,10 @@ class TaskIndexEntry(Base):
                 ),
             )
             # No check for a valid patient at this time.
+            pending_task_pks = pending_pks.get(tasktablename, set())
             for index in q_idx_without_original:
+                if index.task_pk in pending_task_pks:
+                    continue
                 log.error("Task index without matching original: {!r}", index)
                 ok = False
                 if not show_all_bad:
@@ -980,7 +1037,10 @@ class TaskIndexEntry(Base):
                     )
                 ),
             )
+            pending_task_pks = pending_pks.get(tasktablename, set())
             for orig in q_original_with_idx:
+                if orig.pk in pending_task_pks:
+                    continue
                 log.error("Task without index entry: {!r}", orig)
                 ok = False
                 if not show_all_bad:
@@ -989,6 +1049,112 @@ class TaskIndexEntry(Base):
         return ok
 
 
+# =============================================================================
+# PendingIndexUpdate
+# =============================================================================
+
+
+class PendingIndexUpdate(Base):
+    """
+    Represents index updates (and "push" exports) for one table of an upload,
+    still to be performed by a back-end worker.
+
+    - Used if the ``INDEX_UPLOADS_IN_BACKGROUND`` config option is set; see
+      :func:`update_indexes_and_push_exports`.
+    - Written in the same transaction as the upload itself, so the work
+      cannot be lost between the upload and the back end: if the message to
+      the back end goes astray, housekeeping picks the work up.
+    - While an entry exists, the upload is "pending index", and the index
+      cannot be relied on; see :func:`any_pending_index_updates`.
+    """
+
+    __tablename__ = "_pending_index_updates"
+
+    id: Mapped[int] = mapped_column(
+        primary_key=True,
+        autoincrement=True,
+        comment="Arbitrary primary key (in order of upload)",
+    )
+    device_id: Mapped[int] = mapped_column(
+        ForeignKey("_security_devices.id"),
+        index=True,
+        comment="ID of the uploading device",
+    )
+    group_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("_security_groups.id"),
+        comment="ID of the group into which the upload was made",
+    )
+    batch_utc: Mapped[datetime.datetime] = mapped_column(
+        comment="Time of the upload batch (UTC); used as the indexing time",
+    )
+    tablename: Mapped[str] = mapped_column(
+        TableNameColType,
+        comment="Name of the table uploaded to",
+    )
+    table_changes: Mapped[Dict[str, List[int]]] = mapped_column(
+        JsonColType,
+        comment="Server PKs added, removed, preserved, and current (JSON)",
+    )
+
+    def __repr__(self) -> str:
+        return simple_repr(
+            self, ["id", "device_id", "group_id", "batch_utc", "tablename"]
+        )
+
+    def get_table_changes(self) -> UploadTableChanges:
+        """
+        Returns the
+        :class:`camcops_server.cc_modules.cc_client_api_core.UploadTableChanges`
+        to process.
+        """
+        table = Base.metadata.tables[self.tablename]
+        return UploadTableChanges.from_pks_dict(table, self.table_changes)
+
+
+def any_pending_index_updates(
+    session: SqlASession, tablenames: Collection[str] = None
+) -> bool:
+    """
+    Are any uploads waiting for their index updates? If so, the indexes may
+    be missing recent tasks or ID numbers (or may still refer to records that
+    are no longer current), so should not be used to find tasks.
+
+    (Pending updates only exist if the ``INDEX_UPLOADS_IN_BACKGROUND`` config
+    option is set, so callers can skip this query otherwise.)
+
+    Args:
+        session: an SQLAlchemy Session
+        tablenames: if specified, only consider updates to these tables
+            (e.g. the task tables being queried, plus the
+            :class:`camcops_server.cc_modules.cc_patientidnum.PatientIdNum`
+            table if filtering by ID number)
+    """
+    q = select(PendingIndexUpdate.id)
+    if tablenames is not None:
+        q = q.where(PendingIndexUpdate.tablename.in_(tablenames))
+    return bool(session.execute(select(q.exists())).scalar())
+
+
+def get_pending_index_pks(session: SqlASession) -> Dict[str, Set[int]]:
+    """
+    Returns the server PKs of records whose index entries will change when
+    pending index updates are processed, as a dictionary mapping table names
+    to sets of PKs.
+
+    Args:
+        session: an SQLAlchemy Session
+    """
+    pending_pks = {}  # type: Dict[str, Set[int]]
+    for pending in session.query(PendingIndexUpdate):
+        tablechanges = pending.get_table_changes()
+        pending_pks.setdefault(pending.tablename, set()).update(
+            tablechanges.addition_pks
+            + tablechanges.removal_pks
+            + tablechanges.preservation_pks
+        )
+    return pending_pks
+
+
 # =============================================================================
 # Wide-ranging index update functions
 # =============================================================================
@@ -1027,6 +1193,11 @@ def update_indexes_and_push_exports(
 
     Also triggers background jobs to export "new arrivals", if required.
 
+    If the ``INDEX_UPLOADS_IN_BACKGROUND`` config option is set, this work is
+    instead recorded as a :class:`PendingIndexUpdate`, to be done by the back
+    end once the upload has been committed; see
+    :func:`process_pending_index_updates`.
+
     Args:
         req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
         batchdetails: the :class:`BatchDetails`
@@ -1035,32 +1206,137 @@ def update_indexes_and_push_exports(
             object describing the changes to a table
     """  # noqa
     tablename = tablechanges.tablename
+    if (
+        tablename != PatientIdNum.__tablename__
+        and tablename not in all_task_tablenames()
+    ):
+        return
+    if req.config.index_uploads_in_background:
+        if not tablechanges.any_changes:
+            return
+        req.dbsession.add(
+            PendingIndexUpdate(
+                device_id=req.tabletsession.device_id,
+                group_id=req.user.upload_group_id,
+                batch_utc=batchdetails.batchtime,
+                tablename=tablename,
+                table_changes=tablechanges.pks_as_dict(),
+            )
+        )
+        req.add_pending_index_update()
+        # ... the back end is told *after* the request performs COMMIT
+        return
+    _update_indexes_and_push_exports(
+        req,
+        tablechanges,
+        indexed_at_utc=batchdetails.batchtime,
+        uploading_group_id=req.user.upload_group_id,
+    )
+
+
+def _update_indexes_and_push_exports(
+    req: "CamcopsRequest",
+    tablechanges: UploadTableChanges,
+    indexed_at_utc: Pendulum,
+    uploading_group_id: Optional[int],
+    replace_existing: bool = False,
+) -> None:
+    """
+    Updates server indexes and queues "push" exports for changes to one table.
+    See :func:`update_indexes_and_push_exports`.
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        tablechanges:
+            a :class:`camcops_server.cc_modules.cc_client_api_core.UploadTableChanges`
+            object describing the changes to a table
+        indexed_at_utc:
+            time of the upload batch, in UTC
+        uploading_group_id:
+            the ID of the group into which the upload was made
+        replace_existing:
+            replace any existing index entries for records being indexed?
+    """  # noqa
+    tablename = tablechanges.tablename
     if tablename == PatientIdNum.__tablename__:
         # Update idnum index
         PatientIdNumIndexEntry.update_idnum_index_for_upload(
             session=req.dbsession,
-            indexed_at_utc=batchdetails.batchtime,
+            indexed_at_utc=indexed_at_utc,
             tablechanges=tablechanges,
+            replace_existing=replace_existing,
         )
     elif tablename in all_task_tablenames():
         # Update task index
         TaskIndexEntry.update_task_index_for_upload(
             session=req.dbsession,
             tablechanges=tablechanges,
-            indexed_at_utc=batchdetails.batchtime,
+            indexed_at_utc=indexed_at_utc,
+            replace_existing=replace_existing,
         )
         # Push exports
         recipients = req.all_push_recipients
-        uploading_group_id = req.user.upload_group_id
         for recipient in recipients:
             recipient_name = recipient.recipient_name
             for pk in tablechanges.get_task_push_export_pks(
-                recipient=recipient, uploading_group_id=uploading_group_id
+                recipient=recipient, uploading_group_id=uploading_group_id  # type: ignore[arg-type]  # noqa: E501
             ):
                 req.add_export_push_request(recipient_name, tablename, pk)
                 # ... will be transmitted *after* the request performs COMMIT
 
 
+def process_pending_index_updates(req: "CamcopsRequest") -> int:
+    """
+    Performs the index updates and queues the "push" exports for uploads that
+    were recorded as :class:`PendingIndexUpdate` entries, in order of upload.
+    Called by the back end.
+
+    Each entry is claimed by deleting it, within the same transaction as the
+    work it describes; if two workers try to process the same entry, only one
+    will succeed in deleting it, and the other skips it. The index updates
+    replace any existing index entries and only index current records, so
+    they give the same result if an entry is processed again (e.g. after a
+    failure) or if entries are processed out of order.
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+
+    Returns:
+        the number of entries processed
+    """
+    dbsession = req.dbsession
+    # noinspection PyUnresolvedReferences
+    pending_table = PendingIndexUpdate.__table__
+    n_processed = 0
+    for pending in (
+        dbsession.query(PendingIndexUpdate).order_by(PendingIndexUpdate.id)
+    ).all():
+        tablechanges = pending.get_table_changes()
+        indexed_at_utc = pending.batch_utc
+        uploading_group_id = pending.group_id
+        result = dbsession.execute(
+            pending_table.delete().where(  # type: ignore[attr-defined]
+                pending_table.c.id == pending.id
+            )
+        )
+        dbsession.expunge(pending)
+        if result.rowcount != 1:  # type: ignore[attr-defined]
+            # Another worker got there first.
+            continue
+        log.debug("Processing pending index update: {!r}", pending)
+        _update_indexes_and_push_exports(
+            req,
+            tablechanges,
+            indexed_at_utc=indexed_at_utc,
+            uploading_group_id=uploading_group_id,
+            replace_existing=True,
+        )
+        n_processed += 1
+    if n_processed:
+        log.info("Processed {} pending index update(s)", n_processed)
+    return n_processed
+
+
 def check_indexes(session: SqlASession, show_all_bad: bool = False) -> bool:
     """
     Checks all server index tables.
@@ -1074,14 +1350,24 @@ def check_indexes(session: SqlASession, show_all_bad: bool = False) -> bool:
     Returns:
         bool: are the indexes OK?
     """
-    p_ok = PatientIdNumIndexEntry.check_index(session, show_all_bad)
+    pending_pks = get_pending_index_pks(session)
+    if pending_pks:
+        log.info(
+            "Some uploads are still waiting for their index updates; not "
+            "checking the indexes for their records"
+        )
+    p_ok = PatientIdNumIndexEntry.check_index(
+        session, show_all_bad, pending_pks=pending_pks
+    )
     if p_ok:
         log.info("Patient ID number index is good")
     else:
         log.error("Patient ID number index is bad")
         if not show_all_bad:
             return False
-    t_ok = TaskIndexEntry.check_index(session, show_all_bad)
+    t_ok = TaskIndexEntry.check_index(
+        session, show_all_bad, pending_pks=pending_pks
+    )
     if t_ok:
         log.info("Task index is good")
     else:
@@ -67,8 +67,11 @@ from camcops_server.cc_modules.cc_reportschema import (
     DEFAULT_BY_YEAR,
 )
 
-from camcops_server.cc_modules.cc_task import Task
-from camcops_server.cc_modules.cc_taskindex import TaskIndexEntry
+from camcops_server.cc_modules.cc_task import all_task_tablenames, Task
+from camcops_server.cc_modules.cc_taskindex import (
+    any_pending_index_updates,
+    TaskIndexEntry,
+)
 from camcops_server.cc_modules.cc_user import User
 
 if TYPE_CHECKING:
@@ -152,6 +155,15 @@ class TaskCountReport(Report):
         self.by_task = req.get_bool_param(ViewParam.BY_TASK, DEFAULT_BY_TASK)
         self.by_user = req.get_bool_param(ViewParam.BY_USER, DEFAULT_BY_USER)
         via_index = req.get_bool_param(ViewParam.VIA_INDEX, True)
+        if (
+            via_index
+            and req.config.index_uploads_in_background
+            and any_pending_index_updates(
+                self.dbsession, tablenames=all_task_tablenames()
+            )
+        ):
+            # Recent uploads are not yet in the index.
+            via_index = False
 
         if via_index:
             # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
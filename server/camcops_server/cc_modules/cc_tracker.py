@@ -29,7 +29,16 @@ showing text that a clinician might care about.**
 """
 
 import logging
-from typing import Any, Dict, List, Optional, Set, Tuple, TYPE_CHECKING
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+)
 
 from cardinal_pythonlib.datetimefunc import format_datetime
 from cardinal_pythonlib.logs import BraceStyleAdapter
@@ -45,7 +54,6 @@ from camcops_server.cc_modules.cc_constants import (
     PlotDefaults,
 )
 from camcops_server.cc_modules.cc_filename import get_export_filename
-from camcops_server.cc_modules.cc_plot import matplotlib
 from camcops_server.cc_modules.cc_pdf import (
     pdf_from_html,
     weasyprint_page_stylesheet,
@@ -59,15 +67,13 @@ from camcops_server.cc_modules.cc_taskcollection import (
     TaskSortMethod,
 )
 from camcops_server.cc_modules.cc_xml import (
-    get_xml_document,
+    gen_xml_document,
     XmlDataTypes,
     XmlElement,
 )
 
-import matplotlib.dates  # delayed until after the cc_plot import
-from weasyprint import CSS
-
 if TYPE_CHECKING:
+    from weasyprint import CSS
     from camcops_server.cc_modules.cc_patient import Patient  # noqa: F401
     from camcops_server.cc_modules.cc_patientidnum import (
         PatientIdNum,
@@ -434,6 +440,24 @@ class TrackerCtvCommon(object):
         Returns:
             an XML UTF-8 document representing our object.
         """
+        return "".join(
+            self.gen_xml(
+                indent_spaces=indent_spaces,
+                eol=eol,
+                include_comments=include_comments,
+            )
+        )
+
+    def gen_xml(
+        self,
+        indent_spaces: int = 4,
+        eol: str = "\n",
+        include_comments: bool = False,
+    ) -> Iterable[str]:
+        """
+        As for :meth:`get_xml`, but returns the XML as an iterable of text
+        fragments. The XML tree is built when this is called.
+        """
         raise NotImplementedError("implement in subclass")
 
     def _get_html(self) -> str:
@@ -452,16 +476,17 @@ class TrackerCtvCommon(object):
     # XML view
     # -------------------------------------------------------------------------
 
-    def _get_xml(
+    def _gen_xml(
         self,
         audit_string: str,
         xml_name: str,
         indent_spaces: int = 4,
         eol: str = "\n",
         include_comments: bool = False,
-    ) -> str:
+    ) -> Iterable[str]:
         """
-        Returns an XML document representing this object.
+        Returns an XML document representing this object, as text fragments
+        (see :func:`camcops_server.cc_modules.cc_xml.gen_xml_document`).
 
         Args:
             audit_string: description used to audit access to this information
@@ -529,7 +554,7 @@ class TrackerCtvCommon(object):
                 patient_server_pk=t.get_patient_server_pk(),
             )
         tree = XmlElement(name=xml_name, value=branches)
-        return get_xml_document(
+        return gen_xml_document(
             tree,
             indent_spaces=indent_spaces,
             eol=eol,
@@ -599,7 +624,7 @@ class TrackerCtvCommon(object):
                 extra_wkhtmltopdf_options={"orientation": "Portrait"},
             )
 
-    def get_weasyprint_stylesheet(self, req: "CamcopsRequest") -> CSS:
+    def get_weasyprint_stylesheet(self, req: "CamcopsRequest") -> "CSS":
         _ = req.gettext
         top_left_text = self.get_weasyprint_top_left_text(req)
         top_left_content = f'"{top_left_text}"'
@@ -672,13 +697,13 @@ class Tracker(TrackerCtvCommon):
             req=req, taskfilter=taskfilter, as_ctv=False, via_index=via_index
         )
 
-    def get_xml(
+    def gen_xml(
         self,
         indent_spaces: int = 4,
         eol: str = "\n",
         include_comments: bool = False,
-    ) -> str:
-        return self._get_xml(
+    ) -> Iterable[str]:
+        return self._gen_xml(
             audit_string="Tracker XML accessed",
             xml_name="tracker",
             indent_spaces=indent_spaces,
@@ -746,6 +771,10 @@ class Tracker(TrackerCtvCommon):
         """
         HTML for a single figure.
         """
+        # Delayed imports; plotting is loaded on first use
+        from camcops_server.cc_modules.cc_plot import matplotlib
+        import matplotlib.dates  # after the cc_plot import
+
         nonblank_values = [x for x in values if x is not None]
         # NB DIFFERENT to list(filter(None, values)), which implements the
         # test "if x", not "if x is not None" -- thus eliminating zero values!
@@ -911,13 +940,13 @@ class ClinicalTextView(TrackerCtvCommon):
             req=req, taskfilter=taskfilter, as_ctv=True, via_index=via_index
         )
 
-    def get_xml(
+    def gen_xml(
         self,
         indent_spaces: int = 4,
         eol: str = "\n",
         include_comments: bool = False,
-    ) -> str:
-        return self._get_xml(
+    ) -> Iterable[str]:
+        return self._gen_xml(
             audit_string="Clinical text view XML accessed",
             xml_name="ctv",
             indent_spaces=indent_spaces,
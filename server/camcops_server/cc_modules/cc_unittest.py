@@ -45,6 +45,7 @@ import pytest
 from sqlalchemy.engine.base import Engine
 
 from camcops_server.cc_modules.cc_baseconstants import ENVVAR_CONFIG_FILE
+from camcops_server.cc_modules.cc_cache import cache_region_shared
 from camcops_server.cc_modules.cc_device import Device
 from camcops_server.cc_modules.cc_exportrecipient import ExportRecipient
 from camcops_server.cc_modules.cc_request import (
@@ -144,6 +145,12 @@ class DemoRequestTestCase(ExtendedTestCase):
         for factory in all_subclasses(BaseFactory):
             factory._meta.sqlalchemy_session = self.dbsession
 
+        # Database-derived data must not persist from one test to the next
+        # (and tests of the shared cache configure it themselves).
+        cache_region_shared.configure(
+            backend="dogpile.cache.null", replace_existing_backend=True
+        )
+
         # config file has already been set up for the session in conftest.py
         os.environ[ENVVAR_CONFIG_FILE] = self.config_file
         self.req = get_unittest_request(self.dbsession)
@@ -27,9 +27,15 @@ camcops_server/cc_modules/cc_user.py
 
 """
 
+from collections import OrderedDict
 import datetime
+import hashlib
+import hmac
 import logging
 import re
+import secrets
+import threading
+import time
 from typing import Any, List, Optional, Set, Tuple, TYPE_CHECKING
 
 import cardinal_pythonlib.crypto as rnc_crypto
@@ -109,6 +115,98 @@ CLEAR_DUMMY_LOGIN_PERIOD = datetime.timedelta(
     days=CLEAR_DUMMY_LOGIN_FREQUENCY_DAYS
 )
 
+VERIFIED_CREDENTIAL_CACHE_TTL_S = 300
+VERIFIED_CREDENTIAL_CACHE_MAX_ENTRIES = 10000
+
+
+# =============================================================================
+# VerifiedCredentialCache
+# =============================================================================
+
+
+class VerifiedCredentialCache(object):
+    """
+    A short-lived, per-process record of successful password checks, so that
+    repeated API requests with the same credentials (e.g. a burst of tablet
+    uploads) needn't each run bcrypt.
+
+    Entries are keyed on a keyed hash (HMAC, with a random per-process key) of
+    the username, the password, and the user's stored password hash, so
+    neither passwords nor anything that could be used to check guesses
+    against them are kept, and changing a password (in any process)
+    invalidates the old entries. Only successful checks are recorded.
+    """
+
+    def __init__(
+        self,
+        ttl_s: float = VERIFIED_CREDENTIAL_CACHE_TTL_S,
+        max_entries: int = VERIFIED_CREDENTIAL_CACHE_MAX_ENTRIES,
+    ) -> None:
+        """
+        Args:
+            ttl_s: how long a verification is remembered for (seconds)
+            max_entries: maximum number of verifications remembered
+        """
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._key = secrets.token_bytes(32)
+        self._entries = (
+            OrderedDict()
+        )  # type: OrderedDict[bytes, Tuple[str, float]]
+        self._lock = threading.Lock()
+
+    def _digest(self, username: str, password: str, hashedpw: str) -> bytes:
+        msg = "\0".join((username, password, hashedpw)).encode("utf-8")
+        return hmac.new(self._key, msg, hashlib.sha256).digest()
+
+    def is_verified(self, username: str, password: str, hashedpw: str) -> bool:
+        """
+        Has this password recently been verified against this stored
+        password hash for this user?
+        """
+        digest = self._digest(username, password, hashedpw)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return False
+            if entry[1] <= time.monotonic():
+                del self._entries[digest]
+                return False
+            return True
+
+    def add(self, username: str, password: str, hashedpw: str) -> None:
+        """
+        Records a successful password check.
+        """
+        digest = self._digest(username, password, hashedpw)
+        expires = time.monotonic() + self.ttl_s
+        with self._lock:
+            self._entries[digest] = (username, expires)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, username: str) -> None:
+        """
+        Forgets all verifications for a user (e.g. on password change or
+        lockout).
+        """
+        with self._lock:
+            for digest in [
+                d for d, (u, _) in self._entries.items() if u == username
+            ]:
+                del self._entries[digest]
+
+    def clear(self) -> None:
+        """
+        Forgets all verifications.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+VERIFIED_CREDENTIALS = VerifiedCredentialCache()
+
 
 # =============================================================================
 # SecurityAccountLockout
@@ -209,6 +307,7 @@ class SecurityAccountLockout(Base):
         # noinspection PyArgumentList
         lock = cls(username=username, locked_until=lock_until)
         dbsession.add(lock)
+        VERIFIED_CREDENTIALS.invalidate_user(username)
         audit(
             req, f"Account {username} locked out for {lockout_minutes} minutes"
         )
@@ -614,6 +713,7 @@ class User(Base):
         username: str,
         password: str,
         take_time_for_nonexistent_user: bool = True,
+        use_credential_cache: bool = False,
     ) -> Optional["User"]:
         """
         Retrieve a User object from the supplied username, if the password is
@@ -628,6 +728,10 @@ class User(Base):
                 the time we spend doing deliberately wasteful password
                 encryption (to prevent attackers from discovering real
                 usernames via timing attacks).
+            use_credential_cache: if ``True``, a recent successful check of
+                the same password (in this process; see
+                :class:`VerifiedCredentialCache`) is accepted without
+                checking the password again, unless the user is locked out.
         """
         dbsession = req.dbsession
         user = cls.get_user_by_name(dbsession, username)
@@ -639,8 +743,15 @@ class User(Base):
                 # time:
                 cls.take_some_time_mimicking_password_encryption()
             return None
+        cache_usable = use_credential_cache and not user.is_locked_out(req)
+        if cache_usable and VERIFIED_CREDENTIALS.is_verified(
+            username, password, user.hashedpw
+        ):
+            return user
         if not user.is_password_correct(password):
             return None
+        if cache_usable:
+            VERIFIED_CREDENTIALS.add(username, password, user.hashedpw)
         return user
 
     @classmethod
@@ -693,6 +804,7 @@ class User(Base):
         )
         self.last_password_change_utc = req.now_utc_no_tzinfo
         self.must_change_password = False
+        VERIFIED_CREDENTIALS.invalidate_user(self.username)
         audit(req, "Password changed for user " + self.username)
 
     def is_password_correct(self, password: str) -> bool:
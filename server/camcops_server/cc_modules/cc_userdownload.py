@@ -0,0 +1,281 @@
+"""
+camcops_server/cc_modules/cc_userdownload.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Ledger of files in users' download areas.**
+
+Each file created for a user to download later is recorded here, with its
+owner, size, and expiry time, so that quota checks and expiry sweeps are
+database lookups rather than walks of the download directory tree. The
+ledger is updated when downloads are created and deleted; files that appear
+or disappear by other means (including files created before the ledger
+existed) are picked up by :func:`reconcile_user_downloads`, which runs on
+each back-end process's first housekeeping pass and as the
+``reconcile_user_downloads`` command.
+
+"""
+
+import datetime
+import logging
+import os
+from typing import Dict, Set, Tuple, TYPE_CHECKING
+
+from cardinal_pythonlib.datetimefunc import get_now_utc_datetime
+from cardinal_pythonlib.logs import BraceStyleAdapter
+import pendulum
+from sqlalchemy.orm import Mapped, mapped_column, Session as SqlASession
+from sqlalchemy.schema import ForeignKey
+from sqlalchemy.sql.expression import delete, func, select
+from sqlalchemy.sql.sqltypes import BigInteger
+
+from camcops_server.cc_modules.cc_sqla_coltypes import FileSpecColType
+from camcops_server.cc_modules.cc_sqlalchemy import Base
+
+if TYPE_CHECKING:
+    from camcops_server.cc_modules.cc_request import CamcopsRequest
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+
+# =============================================================================
+# UserDownloadRecord
+# =============================================================================
+
+
+class UserDownloadRecord(Base):
+    """
+    Represents a file in a user's download area.
+    """
+
+    __tablename__ = "_user_downloads"
+
+    id: Mapped[int] = mapped_column(
+        primary_key=True,
+        autoincrement=True,
+        comment="Arbitrary primary key",
+    )
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("_security_users.id", ondelete="CASCADE"),
+        index=True,
+        comment="User ID (owner of the file)",
+    )
+    filename: Mapped[str] = mapped_column(
+        FileSpecColType,
+        comment="Filename, relative to the user's download directory",
+    )
+    size_bytes: Mapped[int] = mapped_column(
+        BigInteger, comment="File size (bytes)"
+    )
+    created_at_utc: Mapped[datetime.datetime] = mapped_column(
+        comment="Time the file was created (UTC)"
+    )
+    expires_at_utc: Mapped[datetime.datetime] = mapped_column(
+        index=True,
+        comment="Time after which the file may be deleted (UTC)",
+    )
+
+    @classmethod
+    def record_file(
+        cls,
+        req: "CamcopsRequest",
+        user_id: int,
+        filename: str,
+        size_bytes: int,
+    ) -> "UserDownloadRecord":
+        """
+        Records a newly created file (replacing any previous record for a
+        file of the same name).
+
+        Args:
+            req:
+                a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+            user_id:
+                the owner's user ID
+            filename:
+                filename, relative to the owner's download directory
+            size_bytes:
+                file size
+        """
+        cls.forget_file(req.dbsession, user_id, filename)
+        now = get_now_utc_datetime()
+        record = cls(
+            user_id=user_id,
+            filename=filename,
+            size_bytes=size_bytes,
+            created_at_utc=now,
+            expires_at_utc=now + req.user_download_lifetime_duration,
+        )
+        req.dbsession.add(record)
+        return record
+
+    @classmethod
+    def forget_file(
+        cls, dbsession: SqlASession, user_id: int, filename: str
+    ) -> None:
+        """
+        Removes the record of a file (e.g. because it has been deleted).
+        """
+        dbsession.execute(
+            delete(cls)
+            .where(cls.user_id == user_id)
+            .where(cls.filename == filename)
+        )
+
+    @classmethod
+    def get_bytes_used(cls, dbsession: SqlASession, user_id: int) -> int:
+        """
+        Returns the total size of the files recorded for a user.
+        """
+        return dbsession.execute(
+            select(func.coalesce(func.sum(cls.size_bytes), 0)).where(
+                cls.user_id == user_id
+            )
+        ).scalar_one()
+
+    def get_fullpath(self, user_download_dir: str) -> str:
+        """
+        Returns the full path of the file.
+
+        Args:
+            user_download_dir:
+                the root user download directory (the ``USER_DOWNLOAD_DIR``
+                config parameter)
+        """
+        return os.path.join(
+            user_download_dir, str(self.user_id), self.filename
+        )
+
+
+# =============================================================================
+# Housekeeping
+# =============================================================================
+
+
+def delete_expired_user_downloads(req: "CamcopsRequest") -> int:
+    """
+    Deletes user download files that are past their expiry time, and their
+    records. Returns the number of files deleted.
+
+    Args:
+        req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+    """
+    dbsession = req.dbsession
+    basedir = req.config.user_download_dir
+    now = get_now_utc_datetime()
+    log.debug(f"Deleting any user download files that expired before {now}")
+    expired = dbsession.execute(
+        select(UserDownloadRecord).where(
+            UserDownloadRecord.expires_at_utc < now
+        )
+    ).scalars()
+    n_deleted = 0
+    for record in expired:
+        fullpath = record.get_fullpath(basedir)
+        try:
+            os.remove(fullpath)
+            log.info(f"Deleted file: {fullpath}")
+        except FileNotFoundError:
+            pass
+        except OSError:
+            log.exception(f"Failed to delete file: {fullpath}")
+            continue
+        dbsession.delete(record)
+        n_deleted += 1
+    return n_deleted
+
+
+def reconcile_user_downloads(req: "CamcopsRequest") -> Tuple[int, int, int]:
+    """
+    Brings the ledger of user download files into line with the files on
+    disk: records unrecorded files (with an expiry time based on their
+    modification time), updates sizes that have changed, and removes records
+    of files that no longer exist. Files that are not within an existing
+    user's download directory are reported but left alone.
+
+    Args:
+        req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+
+    Returns:
+        tuple: ``n_added, n_updated, n_removed``
+    """
+    from camcops_server.cc_modules.cc_user import User  # delayed import
+
+    dbsession = req.dbsession
+    basedir = req.config.user_download_dir
+    if not basedir:
+        log.warning("No user download directory is configured")
+        return 0, 0, 0
+    user_ids = set(dbsession.execute(select(User.id)).scalars())
+    records = {
+        (r.user_id, r.filename): r
+        for r in dbsession.execute(select(UserDownloadRecord)).scalars()
+    }  # type: Dict[Tuple[int, str], UserDownloadRecord]
+    lifetime = req.user_download_lifetime_duration
+    on_disk = set()  # type: Set[Tuple[int, str]]
+    n_added = n_updated = n_removed = 0
+
+    for root, dirs, files in os.walk(basedir):
+        for f in files:
+            fullpath = os.path.join(root, f)
+            owner, _, filename = os.path.relpath(fullpath, basedir).partition(
+                os.sep
+            )
+            if not (filename and owner.isdigit() and int(owner) in user_ids):
+                log.warning(
+                    f"Ignoring file not in a user's download directory: "
+                    f"{fullpath}"
+                )
+                continue
+            key = (int(owner), filename)
+            on_disk.add(key)
+            statinfo = os.stat(fullpath)
+            record = records.get(key)
+            if record is None:
+                created = datetime.datetime.fromtimestamp(
+                    statinfo.st_mtime, tz=pendulum.UTC
+                )
+                dbsession.add(
+                    UserDownloadRecord(
+                        user_id=key[0],
+                        filename=filename,
+                        size_bytes=statinfo.st_size,
+                        created_at_utc=created,
+                        expires_at_utc=created + lifetime,
+                    )
+                )
+                n_added += 1
+            elif record.size_bytes != statinfo.st_size:
+                record.size_bytes = statinfo.st_size
+                n_updated += 1
+
+    for key, record in records.items():
+        if key not in on_disk:
+            dbsession.delete(record)
+            n_removed += 1
+
+    log.info(
+        f"Reconciled user downloads with {basedir}: "
+        f"{n_added} added, {n_updated} updated, {n_removed} removed"
+    )
+    return n_added, n_updated, n_removed
@@ -30,7 +30,14 @@ camcops_server/cc_modules/cc_xml.py
 import base64
 import datetime
 import logging
-from typing import Any, List, Optional, TYPE_CHECKING, Union
+from typing import (
+    Any,
+    Generator,
+    List,
+    Optional,
+    TYPE_CHECKING,
+    Union,
+)
 import xml.sax.saxutils
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
@@ -78,6 +85,10 @@ XML_IGNORE_NAMESPACES = [
 # http://www.w3.org/TR/xmlschema-1/
 # http://www.w3.org/TR/2004/REC-xmlschema-2-20041028/datatypes.html
 
+XML_BASE64_CHUNK_BYTES = 3 * 16384
+# ... raw bytes per chunk of base-64 text, when writing BLOBs; a multiple of 3,
+# so that the chunks' encodings concatenate to the encoding of the whole
+
 
 class XmlDataTypes(object):
     """
@@ -147,6 +158,30 @@ class XmlLiteral(XmlElement):
         super().__init__(name="", literal=literal)
 
 
+class XmlBinaryValue(object):
+    """
+    Represents the value of an XML element containing binary data (e.g. a
+    BLOB), which is written as base-64 text. The encoding is done as the XML
+    is written, a chunk at a time, so that the whole base-64 string never
+    exists in memory.
+    """
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__}: {len(self.data)} bytes>"
+
+    def gen_base64(self) -> Generator[str, None, None]:
+        """
+        Generates the base-64 encoding of the data, in chunks.
+        """
+        data = memoryview(self.data)
+        for start in range(0, len(data), XML_BASE64_CHUNK_BYTES):
+            chunk = data[start : start + XML_BASE64_CHUNK_BYTES]  # noqa: E203
+            yield base64.b64encode(chunk).decode("ascii")
+
+
 # =============================================================================
 # Some literals
 # =============================================================================
@@ -329,13 +364,8 @@ def get_xml_blob_element(
         blobdata: the raw binary, or ``None``
         comment: XML comment
     """
-    if blobdata:
-        # blobdata is raw binary
-        b64bytes = base64.b64encode(blobdata)
-        b64str = b64bytes.decode("ascii")
-        value = b64str
-    else:
-        value = None
+    # blobdata is raw binary; it's encoded as the XML is written.
+    value = XmlBinaryValue(blobdata) if blobdata else None
     return XmlElement(
         name=name,
         value=value,
@@ -372,9 +402,39 @@ def get_xml_tree(
     eol: str = "\n",
     include_comments: bool = False,
 ) -> str:
-    # noinspection HttpUrlsUsage
     """
     Returns an :class:`camcops_server.cc_modules.cc_xml.XmlElement` as text.
+    See :func:`gen_xml_tree`, which this joins up, for the arguments.
+    """
+    return "".join(
+        gen_xml_tree(
+            element,
+            level=level,
+            indent_spaces=indent_spaces,
+            eol=eol,
+            include_comments=include_comments,
+        )
+    )
+
+
+def gen_xml_tree(
+    element: Union[
+        XmlElement,
+        XmlSimpleValue,
+        XmlBinaryValue,
+        List[Union[XmlElement, XmlSimpleValue]],
+    ],
+    level: int = 0,
+    indent_spaces: int = 4,
+    eol: str = "\n",
+    include_comments: bool = False,
+) -> Generator[str, None, None]:
+    # noinspection HttpUrlsUsage
+    """
+    Generates the text of an
+    :class:`camcops_server.cc_modules.cc_xml.XmlElement`, in fragments (so
+    that a large tree, e.g. one with many BLOBs, can be written to a file or
+    HTTP response without assembling the whole text in memory).
 
     Args:
         element: root :class:`camcops_server.cc_modules.cc_xml.XmlElement`
@@ -405,14 +465,13 @@ def get_xml_tree(
       too).
 
     """  # noqa
-    xmltext = ""
     prefix = " " * level * indent_spaces
 
     if isinstance(element, XmlElement):
 
         if element.literal:
             # A user-inserted piece of XML. Insert, but indent.
-            xmltext += prefix + element.literal + eol
+            yield prefix + element.literal + eol
 
         else:
 
@@ -437,7 +496,7 @@ def get_xml_tree(
             # Assemble
             if element.value is None:
                 # NULL handling
-                xmltext += (
+                yield (
                     f"{prefix}<{element.name}{attributes} "
                     f'xsi:nil="true"/>{eol}'
                 )
@@ -445,31 +504,28 @@ def get_xml_tree(
                 complex_value = isinstance(
                     element.value, XmlElement
                 ) or isinstance(element.value, list)
-                value_to_recurse = (
-                    element.value
-                    if complex_value
-                    else XmlSimpleValue(element.value)
-                )
+                if complex_value or isinstance(element.value, XmlBinaryValue):
+                    value_to_recurse = element.value
+                else:
+                    value_to_recurse = XmlSimpleValue(element.value)
                 # ... XmlSimpleValue is a marker that subsequently
                 # distinguishes things that were part of an XmlElement from
                 # user-inserted raw XML.
                 nl = eol if complex_value else ""
                 pr2 = prefix if complex_value else ""
-                v = get_xml_tree(
+                yield f"{prefix}<{element.name}{attributes}>{nl}"
+                yield from gen_xml_tree(
                     value_to_recurse,
                     level=level + 1,
                     indent_spaces=indent_spaces,
                     eol=eol,
                     include_comments=include_comments,
                 )
-                xmltext += (
-                    f"{prefix}<{element.name}{attributes}>{nl}"
-                    f"{v}{pr2}</{element.name}>{eol}"
-                )
+                yield f"{pr2}</{element.name}>{eol}"
 
     elif isinstance(element, list):
         for subelement in element:
-            xmltext += get_xml_tree(
+            yield from gen_xml_tree(
                 subelement,
                 level,
                 indent_spaces=indent_spaces,
@@ -480,12 +536,14 @@ def get_xml_tree(
 
     elif isinstance(element, XmlSimpleValue):
         # The lowest-level thing a value. No extra indent.
-        xmltext += xml_escape_value(str(element.value))
+        yield xml_escape_value(str(element.value))
 
-    else:
-        raise ValueError(f"Bad value to get_xml_tree: {element!r}")
+    elif isinstance(element, XmlBinaryValue):
+        # Base-64 text needs no escaping.
+        yield from element.gen_base64()
 
-    return xmltext
+    else:
+        raise ValueError(f"Bad value to gen_xml_tree: {element!r}")
 
 
 def get_xml_document(
@@ -498,6 +556,33 @@ def get_xml_document(
     Returns an entire XML document as text, given the root
     :class:`camcops_server.cc_modules.cc_xml.XmlElement`.
 
+    Args:
+        root: root :class:`camcops_server.cc_modules.cc_xml.XmlElement`
+        indent_spaces: number of spaces to indent formatted XML
+        eol: end-of-line string
+        include_comments: include comments describing each field?
+    """
+    return "".join(
+        gen_xml_document(
+            root,
+            indent_spaces=indent_spaces,
+            eol=eol,
+            include_comments=include_comments,
+        )
+    )
+
+
+def gen_xml_document(
+    root: XmlElement,
+    indent_spaces: int = 4,
+    eol: str = "\n",
+    include_comments: bool = False,
+) -> Generator[str, None, None]:
+    """
+    Generates an entire XML document as text fragments, given the root
+    :class:`camcops_server.cc_modules.cc_xml.XmlElement`. Joined up, they are
+    the same as :func:`get_xml_document`.
+
     Args:
         root: root :class:`camcops_server.cc_modules.cc_xml.XmlElement`
         indent_spaces: number of spaces to indent formatted XML
@@ -509,7 +594,8 @@ def get_xml_document(
             "get_xml_document: root not an XmlElement; "
             "XML requires a single root"
         )
-    return xml_header(eol) + get_xml_tree(
+    yield xml_header(eol)
+    yield from gen_xml_tree(
         root,
         indent_spaces=indent_spaces,
         eol=eol,
@@ -110,7 +110,6 @@ Task decorator options:
 
 from contextlib import contextmanager
 import logging
-import os
 from typing import Any, Dict, Generator, TYPE_CHECKING
 
 from cardinal_pythonlib.json_utils.serialize import json_encode, json_decode
@@ -430,6 +429,77 @@ def export_task_backend(
             export_task(req, recipient, task)
 
 
+@celery_app.task(
+    bind=True,
+    ignore_result=True,
+    max_retries=MAX_RETRIES,
+    soft_time_limit=CELERY_SOFT_TIME_LIMIT_SEC,
+)
+def export_database_shard_backend(self: "CeleryTask", shard_id: int) -> None:
+    """
+    Copies one shard of a sharded database export. If that was the last
+    unfinished shard, schedules the final step,
+    :func:`export_database_shared_objects_backend`.
+
+    - Calls :func:`camcops_server.cc_modules.cc_export.export_database_shard`.
+
+    Args:
+        self: the Celery task, :class:`celery.app.task.Task`
+        shard_id: ID of the
+            :class:`camcops_server.cc_modules.cc_exportmodels.ExportedDatabaseShard`
+    """  # noqa
+    from camcops_server.cc_modules.cc_export import (
+        export_database_shard,
+    )  # delayed import
+    from camcops_server.cc_modules.cc_exportmodels import (
+        ExportedDatabaseShard,
+    )  # delayed import
+    from camcops_server.cc_modules.cc_request import (
+        command_line_request_context,
+    )  # delayed import
+
+    with retry_backoff_if_raises(self):
+        with command_line_request_context() as req:
+            if export_database_shard(req, shard_id):
+                shard = req.dbsession.get(ExportedDatabaseShard, shard_id)
+                export_database_shared_objects_backend.delay(
+                    run_id=shard.run_id
+                )
+
+
+@celery_app.task(
+    bind=True,
+    ignore_result=True,
+    max_retries=MAX_RETRIES,
+    soft_time_limit=CELERY_SOFT_TIME_LIMIT_SEC,
+)
+def export_database_shared_objects_backend(
+    self: "CeleryTask", run_id: int
+) -> None:
+    """
+    Final step of a sharded database export: copies the objects shared
+    between tasks, and marks the export as finished.
+
+    - Calls
+      :func:`camcops_server.cc_modules.cc_export.export_database_shared_objects`.
+
+    Args:
+        self: the Celery task, :class:`celery.app.task.Task`
+        run_id: ID of the
+            :class:`camcops_server.cc_modules.cc_exportmodels.ExportedDatabaseRun`
+    """  # noqa
+    from camcops_server.cc_modules.cc_export import (
+        export_database_shared_objects,
+    )  # delayed import
+    from camcops_server.cc_modules.cc_request import (
+        command_line_request_context,
+    )  # delayed import
+
+    with retry_backoff_if_raises(self):
+        with command_line_request_context() as req:
+            export_database_shared_objects(req, run_id)
+
+
 @celery_app.task(
     bind=True,
     ignore_result=True,
@@ -458,15 +528,16 @@ def export_to_recipient_backend(
       was to use ``schedule_via_backend=True``.
     - However, that led to database deadlocks (multiple processes trying to
       write a new ExportRecipient).
-    - With some bugfixes to equality checking and a global lock (see
-      :meth:`camcops_server.cc_modules.cc_config.CamcopsConfig.get_master_export_recipient_lockfilename`),
+    - With some bugfixes to equality checking and a global export lock (see
+      :data:`camcops_server.cc_modules.cc_exportlock.MASTER_EXPORT_RECIPIENT_LOCKNAME`
+      and :meth:`camcops_server.cc_modules.cc_request.CamcopsRequest.get_export_recipients`),
       we can try again with ``True``.
     - Yup, works nicely.
 
     Args:
         self: the Celery task, :class:`celery.app.task.Task`
         recipient_name: export recipient name (as per the config file)
-    """
+    """  # noqa
     from camcops_server.cc_modules.cc_export import export  # delayed import
     from camcops_server.cc_modules.cc_request import (
         command_line_request_context,
@@ -564,31 +635,72 @@ def create_user_download(
             exporter.create_user_download_and_email()
 
 
+# =============================================================================
+# Upload processing
+# =============================================================================
+
+
+@celery_app.task(
+    bind=True,
+    ignore_result=True,
+    max_retries=MAX_RETRIES,
+    soft_time_limit=CELERY_SOFT_TIME_LIMIT_SEC,
+)
+def process_pending_index_updates_backend(self: "CeleryTask") -> None:
+    """
+    Performs index updates (and queues "push" exports) for recent uploads, if
+    the server is configured to do these in the background.
+
+    - Calls
+      :func:`camcops_server.cc_modules.cc_taskindex.process_pending_index_updates`.
+
+    Args:
+        self: the Celery task, :class:`celery.app.task.Task`
+    """  # noqa
+    from camcops_server.cc_modules.cc_request import (
+        command_line_request_context,
+    )  # delayed import
+    from camcops_server.cc_modules.cc_taskindex import (
+        process_pending_index_updates,
+    )  # delayed import
+
+    with retry_backoff_if_raises(self):
+        with command_line_request_context() as req:
+            process_pending_index_updates(req)
+
+
 # =============================================================================
 # Housekeeping
 # =============================================================================
 
 
+# Has this process brought the ledger of user download files into line with
+# the files on disk yet? See delete_old_user_downloads().
+_user_downloads_reconciled = False
+
+
 def delete_old_user_downloads(req: "CamcopsRequest") -> None:
     """
-    Deletes user download files that are past their expiry time.
+    Deletes user download files that are past their expiry time (as recorded
+    in the ledger of user download files).
+
+    The first time this runs in a process, the ledger is first reconciled
+    with the download directory, so that files the ledger doesn't know about
+    (e.g. those created before it existed) are recorded, and so expire.
 
     Args:
         req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
     """
-    from camcops_server.cc_modules.cc_export import (
-        UserDownloadFile,
+    from camcops_server.cc_modules.cc_userdownload import (
+        delete_expired_user_downloads,
+        reconcile_user_downloads,
     )  # delayed import
 
-    now = req.now
-    lifetime = req.user_download_lifetime_duration
-    oldest_allowed = now - lifetime
-    log.debug(f"Deleting any user download files older than {oldest_allowed}")
-    for root, dirs, files in os.walk(req.config.user_download_dir):
-        for f in files:
-            udf = UserDownloadFile(filename=f, directory=root)
-            if udf.older_than(oldest_allowed):
-                udf.delete()
+    global _user_downloads_reconciled
+    if not _user_downloads_reconciled:
+        reconcile_user_downloads(req)
+        _user_downloads_reconciled = True
+    delete_expired_user_downloads(req)
 
 
 @celery_app.task(
@@ -609,6 +721,9 @@ def housekeeping() -> None:
     from camcops_server.cc_modules.cc_session import (
         CamcopsSession,
     )  # delayed import
+    from camcops_server.cc_modules.cc_taskindex import (
+        process_pending_index_updates,
+    )  # delayed import
     from camcops_server.cc_modules.cc_user import (
         SecurityAccountLockout,
         SecurityLoginFailure,
@@ -626,3 +741,5 @@ def housekeeping() -> None:
         SecurityAccountLockout.delete_old_account_lockouts(req)
         SecurityLoginFailure.clear_dummy_login_failures_if_necessary(req)
         delete_old_user_downloads(req)
+        # Catch any index updates whose own background job went astray:
+        process_pending_index_updates(req)
@@ -113,6 +113,13 @@ step (faster; for use if the network packets are not excessively large).
 
 - Code relating to this uses ``batchdetails.onestep``.
 
+**Compression**
+
+Clients may compress the body of any request with gzip, saying so with a
+``Content-Encoding: gzip`` header; see :func:`decompress_request_body`. Replies
+are gzip-compressed for clients that send ``Accept-Encoding: gzip``. Clients
+that do neither (such as older ones) are unaffected.
+
 **Setup for the upload code**
 
 - Fire up a CamCOPS client with an empty database, e.g. from the build
@@ -331,10 +338,14 @@ During any MySQL debugging, remember:
 # Imports
 # =============================================================================
 
+import base64
+import gzip
+import hashlib
 import logging
 import json
 
 # from pprint import pformat
+import random
 import secrets
 import string
 import time
@@ -354,7 +365,7 @@ from cardinal_pythonlib.datetimefunc import (
     coerce_to_pendulum_date,
     format_datetime,
 )
-from cardinal_pythonlib.httpconst import HttpMethod
+from cardinal_pythonlib.httpconst import HttpMethod, MimeType
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.pyramid.responses import TextResponse
 from cardinal_pythonlib.sqlalchemy.core_query import (
@@ -458,6 +469,13 @@ from camcops_server.cc_modules.cc_proquint import (
     uuid_from_proquint,
 )
 from camcops_server.cc_modules.cc_pyramid import Routes
+from camcops_server.cc_modules.cc_response import (
+    DecompressedSizeError,
+    gunzip_with_limit,
+    gzip_response_if_accepted,
+    PrecompressedPrefix,
+    request_accepts_gzip,
+)
 from camcops_server.cc_modules.cc_simpleobjects import (
     BarePatientInfo,
     IdNumReference,
@@ -481,6 +499,7 @@ from camcops_server.cc_modules.cc_version import (
 )
 
 if TYPE_CHECKING:
+    from camcops_server.cc_modules.cc_policy import TokenizedPolicy
     from camcops_server.cc_modules.cc_request import CamcopsRequest
 
 log = BraceStyleAdapter(logging.getLogger(__name__))
@@ -496,6 +515,8 @@ INSERT_FAILED = "Failed to insert record"
 SUCCESS_MSG = "Success"
 SUCCESS_CODE = "1"
 FAILURE_CODE = "0"
+UNCHANGED_RESULT = "unchanged"
+CLIENT_API_ENCODING = "utf-8"
 
 DEBUG_UPLOAD = False
 
@@ -526,6 +547,65 @@ def all_tables_with_min_client_version() -> Dict[str, Version]:
     return d
 
 
+class PreformattedReply(dict):
+    """
+    A reply dictionary for :func:`client_api`, whose text is preceded by reply
+    lines that have already been formatted, encoded, and compressed (for
+    large replies that rarely change).
+    """
+
+    def __init__(
+        self, prefix: PrecompressedPrefix, *args: Any, **kwargs: Any
+    ) -> None:
+        """
+        Args:
+            prefix: the preformatted reply lines
+        """
+        super().__init__(*args, **kwargs)
+        self.prefix = prefix
+
+
+class ExtraStringsPayload(object):
+    """
+    The extra strings, formatted once as a SELECT-style reply (see
+    :func:`get_select_reply`), compressed, and identified by a hash of their
+    content, so that clients can ask whether theirs are up to date.
+    """
+
+    def __init__(self, rows: Sequence[Sequence[str]]) -> None:
+        """
+        Args:
+            rows: ``task, name, language, value`` rows
+        """
+        fields = [
+            ExtraStringFieldNames.TASK,
+            ExtraStringFieldNames.NAME,
+            ExtraStringFieldNames.LANGUAGE,
+            ExtraStringFieldNames.VALUE,
+        ]
+        encoded = reply_dict_to_text(get_select_reply(fields, rows)).encode(
+            CLIENT_API_ENCODING
+        )
+        self.content_hash = hashlib.sha256(encoded).hexdigest()
+        self.prefix = PrecompressedPrefix(encoded)
+
+
+def get_extra_strings_payload(req: "CamcopsRequest") -> ExtraStringsPayload:
+    """
+    Returns the extra strings that the current user may download, as a cached
+    :class:`ExtraStringsPayload`. (The strings differ only by which tasks are
+    restricted from the user; see :ref:`RESTRICTED_TASKS
+    <RESTRICTED_TASKS>`.)
+    """
+    excluded_tasks = req.get_extra_string_tasks_not_permitted()
+    key = "extra_strings_payload:{}:{}".format(
+        req.config_filename, ",".join(excluded_tasks)
+    )
+    return cache_region_static.get_or_create(
+        key, lambda: ExtraStringsPayload(req.get_all_extra_strings())
+    )
+
+
 # =============================================================================
 # Validators
 # =============================================================================
@@ -606,7 +686,11 @@ def ensure_string(value: Any, allow_none: bool = True) -> None:
 
 
 def ensure_valid_patient_json(
-    req: "CamcopsRequest", group: Group, pt_dict: Dict[str, Any]
+    req: "CamcopsRequest",
+    group: Group,
+    pt_dict: Dict[str, Any],
+    upload_policy: "TokenizedPolicy" = None,
+    finalize_policy: "TokenizedPolicy" = None,
 ) -> None:
     """
     Ensures that the JSON dictionary contains valid patient details (valid for
@@ -621,6 +705,10 @@ def ensure_valid_patient_json(
             the upload is going
         pt_dict:
             a JSON dictionary from the client
+        upload_policy:
+            the group's tokenized upload policy, if already known
+        finalize_policy:
+            the group's tokenized finalize policy, if already known
 
     Raises:
         :exc:`UserErrorException` if invalid
@@ -720,7 +808,10 @@ def ensure_valid_patient_json(
         fail_user_error(f"Missing {TabletParam.FINALIZING!r} JSON key")
 
     pt_ok, reason = is_candidate_patient_valid_for_group(
-        ptinfo, group, finalizing
+        ptinfo,
+        group,
+        finalizing,
+        policy=finalize_policy if finalizing else upload_policy,
     )
     if not pt_ok:
         errors.append(f"{ptinfo} -> {reason}")
@@ -735,6 +826,46 @@ def ensure_valid_patient_json(
 # Extracting information from the POST request
 # =============================================================================
 
+GZIP_CONTENT_ENCODINGS = ("gzip", "x-gzip")
+IDENTITY_CONTENT_ENCODINGS = ("", "identity")
+
+
+def decompress_request_body(req: "CamcopsRequest") -> None:
+    """
+    If the client has compressed the request body, saying so with a
+    ``Content-Encoding: gzip`` header, replaces the body with its decompressed
+    form, so that the request's parameters can then be read as usual.
+    Uncompressed requests (e.g. from older clients) are left alone.
+
+    The decompressed body may not exceed :ref:`CLIENT_API_MAX_DECOMPRESSED_MB
+    <CLIENT_API_MAX_DECOMPRESSED_MB>`.
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+
+    Raises:
+        :exc:`camcops_server.cc_modules.cc_response.DecompressedSizeError` if
+        the decompressed body would be too large
+
+        :exc:`ValueError` if the body is not valid gzip data, or uses an
+        encoding that we don't support
+    """
+    content_encoding = req.headers.get("Content-Encoding", "").strip().lower()
+    if content_encoding in IDENTITY_CONTENT_ENCODINGS:
+        return
+    if content_encoding not in GZIP_CONTENT_ENCODINGS:
+        raise ValueError(f"Unsupported Content-Encoding: {content_encoding}")
+    max_size = req.config.client_api_max_decompressed_mb * 1024 * 1024
+    compressed = req.body
+    body = gunzip_with_limit(compressed, max_size)
+    log.debug(
+        "Decompressed request body from {} to {} bytes",
+        len(compressed),
+        len(body),
+    )
+    del req.headers["Content-Encoding"]
+    req.body = body
+
 
 def get_str_var(
     req: "CamcopsRequest",
@@ -2703,20 +2834,36 @@ def op_get_extra_strings(req: "CamcopsRequest") -> Dict[str, str]:
     """
     Fetch all local extra strings from the server.
 
+    The reply includes a hash of the strings. If the client sends the hash of
+    the strings it already has, and they are still current, the reply is just
+    ``result:unchanged`` and that hash. Otherwise, it's a SELECT-style reply
+    (see :func:`get_select_reply`) for the extra-string table, which is
+    precomputed and sent gzip-compressed if the client accepts that.
+
     Returns:
-        a SELECT-style reply (see :func:`get_select_reply`) for the
-        extra-string table
+        a dictionary reply, as above
     """
-    fields = [
-        ExtraStringFieldNames.TASK,
-        ExtraStringFieldNames.NAME,
-        ExtraStringFieldNames.LANGUAGE,
-        ExtraStringFieldNames.VALUE,
-    ]
-    rows = req.get_all_extra_strings()
-    reply = get_select_reply(fields, rows)
-    audit(req, "get_extra_strings")
-    return reply
+    payload = get_extra_strings_payload(req)
+    client_hash = get_str_var(
+        req, TabletParam.EXTRA_STRINGS_HASH, mandatory=False
+    )
+    if client_hash == payload.content_hash:
+        return {
+            TabletParam.RESULT: UNCHANGED_RESULT,
+            TabletParam.EXTRA_STRINGS_HASH: payload.content_hash,
+        }
+    if client_hash:
+        # The client's strings have changed. (Clients that don't send a hash
+        # fetch the strings every time, so aren't audited.)
+        audit(
+            req,
+            f"get_extra_strings: sent {payload.content_hash}, "
+            f"replacing {client_hash}",
+        )
+    return PreformattedReply(
+        payload.prefix,
+        {TabletParam.EXTRA_STRINGS_HASH: payload.content_hash},
+    )
 
 
 # noinspection PyUnusedLocal
@@ -3218,8 +3365,24 @@ def op_validate_patients(req: "CamcopsRequest") -> str:
     if not isinstance(pt_json_list, list):
         fail_user_error("Top-level JSON is not a list")
     group = Group.get_group_by_id(req.dbsession, req.user.upload_group_id)
+    # The client may send many patients at once. Parse the group's ID policies
+    # once, rather than once per patient; the policies also remember their
+    # result for each combination of information present, so in practice they
+    # are evaluated only a few times per batch. Patients are still checked in
+    # order, so the first invalid patient gives the same error as before.
+    if group:
+        upload_policy = group.tokenized_upload_policy()
+        finalize_policy = group.tokenized_finalize_policy()
+    else:
+        upload_policy = finalize_policy = None
     for pt_dict in pt_json_list:
-        ensure_valid_patient_json(req, group, pt_dict)
+        ensure_valid_patient_json(
+            req,
+            group,
+            pt_dict,
+            upload_policy=upload_policy,
+            finalize_policy=finalize_policy,
+        )
     return SUCCESS_MSG
 
 
@@ -3409,6 +3572,23 @@ def client_api(req: "CamcopsRequest") -> Response:
 
     log.debug("User agent: {!r}", req.user_agent)
 
+    # -------------------------------------------------------------------------
+    # Decompress the request, if the client compressed it
+    # -------------------------------------------------------------------------
+    try:
+        decompress_request_body(req)
+    except DecompressedSizeError as e:
+        log.warning("CLIENT-SIDE SCRIPT ERROR: {}", e)
+        return TextResponse(
+            "Request too large when decompressed\n",
+            status="413 Payload Too Large",
+        )
+    except ValueError as e:
+        log.warning("CLIENT-SIDE SCRIPT ERROR: {}", e)
+        return TextResponse(
+            "Not a valid CamCOPS API request\n", status="400 Bad Request"
+        )
+
     # -------------------------------------------------------------------------
     # Establish session (requires something coherent from the client)
     # -------------------------------------------------------------------------
@@ -3469,9 +3649,216 @@ def client_api(req: "CamcopsRequest") -> Response:
     resultdict[TabletParam.SESSION_TOKEN] = ts.session_token
 
     # Convert dictionary to text in name-value pair format
-    txt = "".join(f"{k}:{v}\n" for k, v in resultdict.items())
+    txt = reply_dict_to_text(resultdict)
+    if isinstance(resultdict, PreformattedReply):
+        response = make_preformatted_response(
+            req, resultdict.prefix, txt, status
+        )
+    else:
+        response = gzip_response_if_accepted(
+            req, TextResponse(txt, status=status)
+        )
 
     t1 = time.time()
     log.debug("Time in script (s): {t}", t=t1 - t0)
 
-    return TextResponse(txt, status=status)
+    return response
+
+
+def reply_dict_to_text(reply: Dict[str, Any]) -> str:
+    """
+    Converts a reply dictionary to the name-value pair text sent to the
+    client, as described in :func:`client_api`.
+    """
+    return "".join(f"{k}:{v}\n" for k, v in reply.items())
+
+
+def make_preformatted_response(
+    req: "CamcopsRequest", prefix: PrecompressedPrefix, txt: str, status: str
+) -> Response:
+    """
+    Makes the response for a :class:`PreformattedReply`: the preformatted
+    lines, then ``txt``, gzip-compressed if the client says it accepts that.
+    """
+    encoded = txt.encode(CLIENT_API_ENCODING)
+    if request_accepts_gzip(req):
+        response = Response(
+            body=prefix.gzip(encoded),
+            content_type=MimeType.TEXT,
+            charset=CLIENT_API_ENCODING,
+            status=status,
+        )
+        response.content_encoding = "gzip"
+    else:
+        response = Response(
+            body=prefix.data + encoded,
+            content_type=MimeType.TEXT,
+            charset=CLIENT_API_ENCODING,
+            status=status,
+        )
+    response.vary = ("Accept-Encoding",)
+    return response
+
+
+# =============================================================================
+# Benchmarking
+# =============================================================================
+
+
+def _make_benchmark_upload_body(
+    ntasks: int, nblobs: int, blob_size: int
+) -> bytes:
+    """
+    Makes the POST body for a synthetic "upload entire database" request
+    resembling a clinic tablet's: questionnaires (mostly small integers and
+    timestamps), their patients and ID numbers, and photographs (random, so
+    incompressible, binary data).
+    """
+    from camcops_server.cc_modules.cc_request import (
+        make_post_body_from_dict,
+    )  # delayed import
+
+    when = "2026-10-19T09:30:00.123+01:00"
+    std = {
+        "_device": "tablet_12345",
+        "_era": "NOW",
+        "when_created": when,
+        "when_last_modified": when,
+        "_move_off_tablet": 0,
+    }
+    npatients = max(1, ntasks // 10)
+    patients = [
+        dict(
+            std,
+            id=n,
+            forename=f"Forename{n}",
+            surname=f"Surname{n}",
+            dob="1970-01-01",
+            sex=random.choice("MF"),
+        )
+        for n in range(1, npatients + 1)
+    ]
+    idnums = [
+        dict(
+            std,
+            id=n,
+            patient_id=n,
+            which_idnum=1,
+            idnum_value=random.randint(10**9, 10**10 - 1),
+        )
+        for n in range(1, npatients + 1)
+    ]
+    tasks = [
+        dict(
+            std,
+            id=n,
+            patient_id=random.randint(1, npatients),
+            firstexit_is_abort=0,
+            firstexit_is_finish=1,
+            editing_time_s=round(random.uniform(30, 600), 3),
+            when_firstexit=when,
+            **{f"q{q}": random.randint(0, 3) for q in range(1, 11)},
+        )
+        for n in range(1, ntasks + 1)
+    ]
+    blobs = [
+        dict(
+            std,
+            id=n,
+            tablename="photo",
+            tablepk=n,
+            fieldname="photo_blobid",
+            filename="photo.jpg",
+            mimetype="image/jpeg",
+            theblob=base64.b64encode(secrets.token_bytes(blob_size)).decode(
+                "ascii"
+            ),
+        )
+        for n in range(1, nblobs + 1)
+    ]
+    dbdata = {
+        Patient.__tablename__: patients,
+        PatientIdNum.__tablename__: idnums,
+        "phq9": tasks,
+        Blob.__tablename__: blobs,
+    }
+    return make_post_body_from_dict(
+        {
+            TabletParam.OPERATION: Operations.UPLOAD_ENTIRE_DATABASE,
+            TabletParam.DBDATA: json.dumps(dbdata),
+        }
+    )
+
+
+def benchmark_compression(
+    payloads: Iterable[Tuple[int, int, int]] = (
+        (500, 0, 0),
+        (5000, 0, 0),
+        (500, 10, 500 * 1024),
+    ),
+    compresslevels: Iterable[int] = (1, 6),
+    bandwidth_mbps: float = 1.0,
+) -> None:
+    """
+    Measures the effect of gzip compression on synthetic uploads (see
+    :func:`_make_benchmark_upload_body`): the compressed size, the time the
+    client takes to compress, the time the server takes to decompress (as
+    :func:`decompress_request_body` does), and the time to send the request
+    over a slow network.
+
+    Use with:
+
+    .. code-block:: python
+
+        from cardinal_pythonlib.logs import main_only_quicksetup_rootlogger
+        from camcops_server.cc_modules.client_api import benchmark_compression
+        main_only_quicksetup_rootlogger()
+        benchmark_compression()
+
+    Args:
+        payloads: ``ntasks, nblobs, blob_size`` tuples describing each upload
+        compresslevels: zlib compression levels to try
+        bandwidth_mbps: network speed in megabits per second
+
+    Rough results (Oct 2026; 1 Mbit/s), for level 6:
+
+    - 500 tasks (about 0.36 Mb): compressed to about 4% of the original size
+      (the form-encoded JSON is very repetitive), in about 4 ms, and
+      decompressed in under 1 ms; sending takes about 0.1 s instead of 2.8 s.
+    - 5000 tasks (about 3.6 Mb): about 4%, 54 ms and 4 ms; sending takes about
+      1.2 s instead of 28.5 s.
+    - 500 tasks and ten 500 Kb photographs (about 7.6 Mb): about 70%, since
+      photographs don't compress, though their base64 encoding does; sending
+      takes about 43 s instead of 61 s.
+    - Level 1 compresses less well (about 7% for tasks alone) but about three
+      times as fast; either is much quicker than the network.
+    """
+    bytes_per_s = bandwidth_mbps * 1e6 / 8
+    for ntasks, nblobs, blob_size in payloads:
+        body = _make_benchmark_upload_body(ntasks, nblobs, blob_size)
+        for compresslevel in compresslevels:
+            start = time.perf_counter()
+            compressed = gzip.compress(body, compresslevel)
+            compress_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            gunzip_with_limit(compressed, len(body))
+            decompress_s = time.perf_counter() - start
+
+            log.info(
+                "{} tasks, {} BLOBs of {} bytes, level {}: {} -> {} bytes "
+                "({:.1%}); compress {:.3f} s, decompress {:.3f} s; "
+                "send at {} Mbit/s {:.1f} s -> {:.1f} s",
+                ntasks,
+                nblobs,
+                blob_size,
+                compresslevel,
+                len(body),
+                len(compressed),
+                len(compressed) / len(body),
+                compress_s,
+                decompress_s,
+                bandwidth_mbps,
+                len(body) / bytes_per_s,
+                len(compressed) / bytes_per_s,
+            )
@@ -25,9 +25,28 @@ camcops_server/cc_modules/tests/cc_all_models_tests.py
 
 """
 
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+import camcops_server
 from camcops_server.cc_modules.cc_sqlalchemy import log_all_ddl
 from camcops_server.cc_modules.cc_unittest import DemoDatabaseTestCase
 
+# Modules that should be loaded on first use, not by importing the models.
+HEAVY_OPTIONAL_MODULES = (
+    "fhirclient",  # FHIR export
+    "hl7",  # HL7 v2 export
+    "matplotlib",  # plotting
+    "pandas",  # REDCap export (and some task calculations)
+    "pdfkit",  # PDF generation
+    "redcap",  # REDCap export
+    "statsmodels",  # some task calculations
+    "weasyprint",  # PDF generation
+    "xhtml2pdf",  # PDF generation
+)
+
 
 class ModelTests(DemoDatabaseTestCase):
     """
@@ -37,3 +56,33 @@ class ModelTests(DemoDatabaseTestCase):
     # noinspection PyMethodMayBeStatic
     def test_show_ddl(self) -> None:
         log_all_ddl()
+
+
+class LazyImportTests(TestCase):
+    """
+    Check that heavy optional subsystems are not loaded by a basic import.
+    """
+
+    def test_heavy_modules_not_loaded_by_model_import(self) -> None:
+        # A new interpreter is needed, since the test process will already
+        # have imported everything.
+        code = (
+            "import sys\n"
+            "import camcops_server.cc_modules.cc_all_models\n"
+            f"heavy = {HEAVY_OPTIONAL_MODULES!r}\n"
+            "print(' '.join(m for m in heavy if m in sys.modules))\n"
+        )
+        # Run from the directory containing the package, so that it (not
+        # e.g. camcops_server.py) is what "import camcops_server" finds.
+        package_parent_dir = os.path.dirname(
+            os.path.dirname(os.path.abspath(camcops_server.__file__))
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            cwd=package_parent_dir,
+            text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        loaded = result.stdout.split()
+        self.assertEqual(loaded, [], f"Loaded at import: {loaded}")
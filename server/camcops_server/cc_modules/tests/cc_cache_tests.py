@@ -0,0 +1,168 @@
+"""
+camcops_server/cc_modules/tests/cc_cache_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import os
+from tempfile import TemporaryDirectory
+
+from dogpile.cache import make_region
+from sqlalchemy.sql.expression import update
+
+from camcops_server.cc_modules.cc_cache import (
+    configure_shared_cache,
+    get_cache_generation,
+)
+from camcops_server.cc_modules.cc_constants import SharedCacheBackendNames
+from camcops_server.cc_modules.cc_idnumdef import (
+    CACHE_GENERATION_IDNUM_DEFINITIONS,
+    get_cached_idnum_definitions,
+    IdNumDefinition,
+)
+from camcops_server.cc_modules.cc_serversettings import (
+    get_database_title,
+    ServerSettings,
+)
+from camcops_server.cc_modules.cc_unittest import DemoRequestTestCase
+
+
+class SharedCacheTests(DemoRequestTestCase):
+    """
+    Tests of the shared cache, using the file (DBM) backend.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tempdir = TemporaryDirectory()
+        self.cache_filename = os.path.join(self.tempdir.name, "cache.dbm")
+        self.req.config.shared_cache_backend = SharedCacheBackendNames.FILE
+        self.req.config.shared_cache_filename = self.cache_filename
+        configure_shared_cache(
+            SharedCacheBackendNames.FILE, filename=self.cache_filename
+        )
+
+        self.dbsession.add(
+            IdNumDefinition(which_idnum=1, description="NHS number")
+        )
+        self.dbsession.commit()
+
+    def tearDown(self) -> None:
+        configure_shared_cache(SharedCacheBackendNames.NONE)
+        self.tempdir.cleanup()
+        super().tearDown()
+
+    def _change_description_behind_cache(self, description: str) -> None:
+        # Bypasses the ORM, so the cache doesn't know.
+        self.dbsession.execute(
+            update(IdNumDefinition).values(description=description)
+        )
+        self.dbsession.commit()
+
+    def _cached_descriptions(self) -> list:
+        return [
+            iddef.description
+            for iddef in get_cached_idnum_definitions(self.req)
+        ]
+
+    def test_idnum_definitions_cached(self) -> None:
+        self.assertEqual(self._cached_descriptions(), ["NHS number"])
+        self._change_description_behind_cache("Changed behind our back")
+        self.assertEqual(self._cached_descriptions(), ["NHS number"])
+
+    def test_nothing_cached_without_backend(self) -> None:
+        self.req.config.shared_cache_backend = SharedCacheBackendNames.NONE
+        self.assertEqual(self._cached_descriptions(), ["NHS number"])
+        self._change_description_behind_cache("Changed behind our back")
+        self.assertEqual(
+            self._cached_descriptions(), ["Changed behind our back"]
+        )
+
+    def test_idnum_definitions_invalidated_by_commit(self) -> None:
+        self.assertEqual(self._cached_descriptions(), ["NHS number"])
+
+        iddef = self.dbsession.query(IdNumDefinition).one()
+        iddef.description = "Edited"
+        self.dbsession.add(
+            IdNumDefinition(which_idnum=2, description="RiO number")
+        )
+        # Uncommitted changes are visible to their own session...
+        self.assertEqual(self._cached_descriptions(), ["Edited", "RiO number"])
+        self.dbsession.commit()
+
+        # ... and to everyone after the commit.
+        self.assertEqual(self._cached_descriptions(), ["Edited", "RiO number"])
+        self._change_description_behind_cache("Changed behind our back")
+        self.assertEqual(self._cached_descriptions(), ["Edited", "RiO number"])
+
+    def test_uncommitted_changes_not_cached(self) -> None:
+        self.assertEqual(self._cached_descriptions(), ["NHS number"])
+
+        iddef = self.dbsession.query(IdNumDefinition).one()
+        iddef.description = "Edited"
+        self.assertEqual(self._cached_descriptions(), ["Edited"])
+
+        # The change might yet be rolled back, so the cache still holds the
+        # committed version.
+        region = make_region().configure(
+            "dogpile.cache.dbm", arguments={"filename": self.cache_filename}
+        )
+        generation = get_cache_generation(
+            region, CACHE_GENERATION_IDNUM_DEFINITIONS
+        )
+        rows = region.get(f"{CACHE_GENERATION_IDNUM_DEFINITIONS}:{generation}")
+        self.assertEqual([row["description"] for row in rows], ["NHS number"])
+
+    def test_generation_shared_between_regions(self) -> None:
+        # A second region using the same file, like another process would.
+        region = make_region().configure(
+            "dogpile.cache.dbm", arguments={"filename": self.cache_filename}
+        )
+        self._cached_descriptions()
+        generation = get_cache_generation(
+            region, CACHE_GENERATION_IDNUM_DEFINITIONS
+        )
+
+        self.dbsession.query(IdNumDefinition).one().description = "Edited"
+        self.dbsession.commit()
+
+        self.assertNotEqual(
+            get_cache_generation(region, CACHE_GENERATION_IDNUM_DEFINITIONS),
+            generation,
+        )
+
+    def test_database_title_invalidated_by_commit(self) -> None:
+        self.req.set_database_title("First title")
+        self.dbsession.commit()
+        self.assertEqual(get_database_title(self.req), "First title")
+
+        self.dbsession.execute(
+            update(ServerSettings).values(database_title="Sneaky")
+        )
+        self.dbsession.commit()
+        self.assertEqual(get_database_title(self.req), "First title")
+
+        self.req.set_database_title("Second title")
+        self.dbsession.commit()
+        self.assertEqual(get_database_title(self.req), "Second title")
@@ -30,6 +30,10 @@ import logging
 from unittest import TestCase
 
 from camcops_server.cc_modules.cc_config import CamcopsConfig, get_demo_config
+from camcops_server.cc_modules.cc_constants import (
+    SendfileMethodNames,
+    SharedCacheBackendNames,
+)
 
 # =============================================================================
 # Unit tests
@@ -116,3 +120,59 @@ class EmailConfigTests(TestCase):
         self.assertEqual(config.fonttools_loglevel, logging.INFO)
         logger = logging.getLogger("fontTools")
         self.assertEqual(logger.level, logging.INFO)
+
+    def _make_config(self) -> CamcopsConfig:
+        with StringIO() as buffer:
+            self.parser.write(buffer)
+            return CamcopsConfig(
+                config_filename="", config_text=buffer.getvalue()
+            )
+
+    def test_user_download_sendfile_defaults_to_none(self) -> None:
+        config = self._make_config()
+
+        self.assertEqual(
+            config.user_download_sendfile, SendfileMethodNames.NONE
+        )
+
+    def test_user_download_accel_redirect_needs_prefix(self) -> None:
+        self.parser.set("site", "USER_DOWNLOAD_SENDFILE", "X_ACCEL_REDIRECT")
+        with self.assertRaises(RuntimeError):
+            self._make_config()
+
+        self.parser.set(
+            "site", "USER_DOWNLOAD_ACCEL_REDIRECT_PREFIX", "/downloads/"
+        )
+        config = self._make_config()
+        self.assertEqual(
+            config.user_download_sendfile,
+            SendfileMethodNames.X_ACCEL_REDIRECT,
+        )
+        self.assertEqual(
+            config.user_download_accel_redirect_prefix, "/downloads/"
+        )
+
+    def test_bad_user_download_sendfile_rejected(self) -> None:
+        self.parser.set("site", "USER_DOWNLOAD_SENDFILE", "carrier_pigeon")
+        with self.assertRaises(ValueError):
+            self._make_config()
+
+    def test_shared_cache_file_backend_needs_filename(self) -> None:
+        self.assertEqual(
+            self._make_config().shared_cache_backend,
+            SharedCacheBackendNames.NONE,
+        )
+
+        self.parser.set("site", "SHARED_CACHE_BACKEND", "file")
+        with self.assertRaises(RuntimeError):
+            self._make_config()
+
+        self.parser.set("site", "SHARED_CACHE_FILENAME", "/tmp/cache.dbm")
+        config = self._make_config()
+        self.assertEqual(
+            config.shared_cache_backend, SharedCacheBackendNames.FILE
+        )
+
+        self.parser.set("site", "SHARED_CACHE_BACKEND", "carrier_pigeon")
+        with self.assertRaises(ValueError):
+            self._make_config()
@@ -25,13 +25,17 @@ camcops_server/cc_modules/tests/cc_dump_tests.py
 
 """
 
-from typing import List, TYPE_CHECKING
+import os
+from tempfile import TemporaryDirectory
+from typing import Any, Dict, Generator, List, TYPE_CHECKING
+from unittest import mock, TestCase
 
 import pytest
 from sqlalchemy import select
+from sqlalchemy.orm import object_session
 from sqlalchemy.sql.expression import table, text
-from sqlalchemy.sql.schema import Column
-from sqlalchemy.sql.sqltypes import String
+from sqlalchemy.sql.schema import Column, Table
+from sqlalchemy.sql.sqltypes import Integer, String
 
 from camcops_server.cc_modules.cc_constants import EXTRA_TASK_TABLENAME_FIELD
 from camcops_server.cc_modules.cc_db import (
@@ -42,11 +46,14 @@ from camcops_server.cc_modules.cc_db import (
 from camcops_server.cc_modules.cc_dump import (
     DumpController,
     copy_tasks_and_summaries,
+    create_sqlite_dump_engine,
+    OrmObjectKeySet,
 )
 from camcops_server.cc_modules.cc_db import FN_PK, FN_ADDITION_PENDING
 from camcops_server.cc_modules.cc_patientidnum import extra_id_colname
 from camcops_server.cc_modules.cc_simpleobjects import TaskExportOptions
 from camcops_server.cc_modules.cc_summaryelement import ExtraSummaryTable
+from camcops_server.cc_modules.cc_task import Task
 from camcops_server.cc_modules.cc_testfactories import (
     NHSPatientIdNumFactory,
     PatientFactory,
@@ -434,3 +441,155 @@ class GenAllDestColumnsTests(DumpTestCase):
         self.assertNotIn("blobs", table_column_names)
         self.assertIn(FN_PK, table_column_names["bmi"])
         self.assertNotIn(FN_ADDITION_PENDING, table_column_names["bmi"])
+
+
+class BufferedInsertTests(DumpTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.controller = DumpController(
+            self.temp_engine,
+            self.temp_session,
+            TaskExportOptions(),
+            self.req,
+            insert_batch_size=3,
+        )
+        self.table = Table(
+            "buffered",
+            self.controller.dst_metadata,
+            Column("id", Integer, primary_key=True),
+            Column("a", Integer),
+            Column("b", Integer),
+        )
+        self.controller.dst_tables[self.table.name] = self.table
+        self.table.create(self.temp_engine)
+
+    def _rows(self) -> List[Dict[str, Any]]:
+        return [
+            dict(row)
+            for row in self.temp_session.execute(
+                select(
+                    self.table.c.id, self.table.c.a, self.table.c.b
+                ).order_by(self.table.c.id)
+            ).mappings()
+        ]
+
+    def test_rows_inserted_in_batches(self) -> None:
+        with mock.patch.object(
+            self.temp_session, "execute", wraps=self.temp_session.execute
+        ) as mock_execute:
+            for i in range(1, 8):
+                self.controller._add_row(self.table, dict(id=i, a=i))
+            self.assertEqual(mock_execute.call_count, 2)
+            self.controller.flush()
+            self.assertEqual(mock_execute.call_count, 3)
+            self.controller.flush()
+            self.assertEqual(mock_execute.call_count, 3)
+
+        self.assertEqual(
+            [row["id"] for row in self._rows()], list(range(1, 8))
+        )
+
+    def test_rows_with_different_columns_inserted_in_order(self) -> None:
+        self.controller._add_row(self.table, dict(id=1, a=1))
+        self.controller._add_row(self.table, dict(id=2, a=2, b=2))
+        self.controller._add_row(self.table, dict(id=3, a=3))
+        self.controller.flush()
+
+        self.assertEqual(
+            self._rows(),
+            [
+                dict(id=1, a=1, b=None),
+                dict(id=2, a=2, b=2),
+                dict(id=3, a=3, b=None),
+            ],
+        )
+
+
+class CreateSqliteDumpEngineTests(TestCase):
+    def test_fast_pragmas_set(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            engine = create_sqlite_dump_engine(
+                os.path.join(tmpdir, "dump.sqlite")
+            )
+            with engine.connect() as conn:
+                self.assertEqual(
+                    conn.execute(text("PRAGMA journal_mode")).scalar(), "off"
+                )
+                self.assertEqual(
+                    conn.execute(text("PRAGMA synchronous")).scalar(), 0
+                )
+            engine.dispose()
+
+
+class OrmObjectKeySetTests(DumpTestCase):
+    def test_reloaded_object_recognized(self) -> None:
+        patient = PatientFactory()
+        self.dbsession.commit()
+        patient_id = patient.id
+
+        seen = OrmObjectKeySet()
+        seen.add(patient)
+        self.dbsession.expunge(patient)
+        reloaded = self.dbsession.get(type(patient), patient_id)
+
+        self.assertIsNot(reloaded, patient)
+        self.assertIn(reloaded, seen)
+        self.assertNotIn(BmiFactory(patient=reloaded), seen)
+
+
+class StreamingCopyTests(DumpTestCase):
+    def test_copied_objects_expunged_except_preexisting(self) -> None:
+        patient = PatientFactory()
+        bmis = [BmiFactory(patient=patient) for _ in range(2)]
+        self.dbsession.commit()
+        bmi_class = type(bmis[0])
+        bmi_pks = [bmi.pk for bmi in bmis]
+        patient_pk = patient.pk
+        for obj in bmis + [patient]:
+            self.dbsession.expunge(obj)
+        preexisting = BmiFactory(patient=PatientFactory())
+        self.dbsession.commit()
+
+        loaded = []
+
+        def gen_tasks() -> Generator[Task, None, None]:
+            # As when streaming, tasks are loaded as they're needed
+            for pk in bmi_pks:
+                task = self.dbsession.get(bmi_class, pk)
+                loaded.append(task)
+                yield task
+
+        copy_tasks_and_summaries(
+            tasks=gen_tasks(),
+            dst_engine=self.temp_engine,
+            dst_session=self.temp_session,
+            export_options=TaskExportOptions(),
+            req=self.req,
+            streaming=True,
+        )
+        self.temp_session.commit()
+
+        self.assertEqual(len(loaded), 2)
+        for task in loaded:
+            self.assertIsNone(object_session(task))
+        self.assertNotIn(
+            patient_pk,
+            [
+                obj.pk
+                for obj in self.dbsession.identity_map.values()
+                if isinstance(obj, type(patient))
+            ],
+        )
+        self.assertIs(object_session(preexisting), self.dbsession)
+        self.assertEqual(
+            self.temp_session.execute(
+                select(text("COUNT(*)")).select_from(table("bmi"))
+            ).scalar(),
+            2,
+        )
+        self.assertEqual(
+            self.temp_session.execute(
+                select(text("COUNT(*)")).select_from(table("patient"))
+            ).scalar(),
+            1,
+        )
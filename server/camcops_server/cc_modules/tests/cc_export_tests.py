@@ -25,12 +25,63 @@ camcops_server/cc_modules/tests/cc_export_tests.py
 
 """
 
+import gzip
+import io
+import os
 from os.path import join
 from pathlib import Path
+import sqlite3
 import tempfile
+from typing import Dict, List
 import unittest
+from unittest import mock
+import zipfile
 
-from camcops_server.cc_modules.cc_export import UserDownloadFile
+from pendulum import DateTime as Pendulum
+import pyarrow
+import pyarrow.parquet
+import pyexcel_ods3
+
+from sqlalchemy import (
+    column,
+    create_engine,
+    delete,
+    func,
+    Integer,
+    select,
+    table,
+)
+
+from camcops_server.cc_modules.cc_export import (
+    DownloadOptions,
+    DownloadTooLargeError,
+    export_database_shard,
+    export_database_shared_objects,
+    export_database_sharded,
+    make_exporter,
+    TaskCollectionExporter,
+    UserDownloadFile,
+)
+from camcops_server.cc_modules.cc_exportmodels import (
+    ExportedDatabaseRun,
+    ExportedDatabaseShard,
+    ExportedTask,
+    get_collection_for_export,
+)
+from camcops_server.cc_modules.cc_exportlock import FileExportLockManager
+from camcops_server.cc_modules.cc_exportrecipientinfo import (
+    ExportTransmissionMethod,
+)
+from camcops_server.cc_modules.cc_pyramid import ViewArg
+from camcops_server.cc_modules.cc_request import CamcopsRequest
+from camcops_server.cc_modules.cc_taskindex import TaskIndexEntry
+from camcops_server.cc_modules.cc_testfactories import (
+    ExportRecipientFactory,
+    NHSPatientIdNumFactory,
+)
+from camcops_server.cc_modules.cc_unittest import BasicDatabaseTestCase
+from camcops_server.cc_modules.cc_userdownload import UserDownloadRecord
+from camcops_server.tasks.tests.factories import BmiFactory
 
 # =============================================================================
 # Unit tests
@@ -70,3 +121,597 @@ class ExportTests(unittest.TestCase):
             danger_path = join("..", danger_dir, danger_filename)
             bad = UserDownloadFile(danger_path, str(safe_dir))
             self.assertEqual(bad.exists, False)
+
+
+class ExportCollectionTests(BasicDatabaseTestCase):
+    """
+    Test that incremental export collections skip tasks that have already
+    been exported.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+
+        idnum = NHSPatientIdNumFactory()
+        self.recipient = ExportRecipientFactory(
+            recipient_name="test",
+            transmission_method=ExportTransmissionMethod.FILE,
+            all_groups=True,
+            tasks=["bmi"],
+            finalized_only=False,
+            primary_idnum=idnum.which_idnum,
+        )
+        self.exported = BmiFactory(patient=idnum.patient)
+        self.not_exported = BmiFactory(patient=idnum.patient)
+        self.failed = BmiFactory(patient=idnum.patient)
+        now = Pendulum.utcnow()
+        for task in (self.exported, self.not_exported, self.failed):
+            TaskIndexEntry.index_task(task, self.dbsession, indexed_at_utc=now)
+        self.dbsession.flush()
+
+        # auto increment doesn't work for BigInteger with SQLite
+        success = ExportedTask(recipient=self.recipient, task=self.exported)
+        success.id = 1
+        success.succeed()
+        failure = ExportedTask(recipient=self.recipient, task=self.failed)
+        failure.id = 2
+        failure.abort("Test failure")
+        self.dbsession.add_all([success, failure])
+        self.dbsession.commit()
+
+    def test_collection_excludes_exported_tasks_without_index(self) -> None:
+        collection = get_collection_for_export(
+            self.req, self.recipient, via_index=False
+        )
+        self.assertEqual(
+            {t.pk for t in collection.gen_tasks_by_class()},
+            {self.not_exported.pk, self.failed.pk},
+        )
+
+    def test_collection_excludes_exported_tasks_via_index(self) -> None:
+        collection = get_collection_for_export(
+            self.req, self.recipient, via_index=True
+        )
+        self.assertEqual(
+            {t.pk for t in collection.gen_tasks_by_class()},
+            {self.not_exported.pk, self.failed.pk},
+        )
+
+    def test_task_pks_already_exported(self) -> None:
+        all_pks = [self.exported.pk, self.not_exported.pk, self.failed.pk]
+        self.assertEqual(
+            ExportedTask.task_pks_already_exported(
+                self.dbsession, "test", "bmi", all_pks
+            ),
+            {self.exported.pk},
+        )
+        self.assertEqual(
+            ExportedTask.task_pks_already_exported(
+                self.dbsession, "other_recipient", "bmi", all_pks
+            ),
+            set(),
+        )
+        self.assertTrue(
+            ExportedTask.task_already_exported(
+                self.dbsession, "test", "bmi", self.exported.pk
+            )
+        )
+        self.assertFalse(
+            ExportedTask.task_already_exported(
+                self.dbsession, "test", "bmi", self.failed.pk
+            )
+        )
+
+    def test_export_logs_inserted_in_bulk(self) -> None:
+        dbsession = mock.Mock()
+        now = Pendulum.utcnow()
+        tasks = [("bmi", pk, now) for pk in range(1, 51)]
+
+        ExportedTask.bulk_insert_successes(dbsession, self.recipient, tasks)
+
+        dbsession.execute.assert_called_once()
+        rows = dbsession.execute.call_args[0][1]
+        self.assertEqual(len(rows), 50)
+        self.assertTrue(all(row["success"] for row in rows))
+        self.assertEqual(
+            {row["recipient_id"] for row in rows}, {self.recipient.id}
+        )
+
+
+class UserDownloadTests(BasicDatabaseTestCase):
+    """
+    Test creating spreadsheet downloads in the user's download area, as done
+    via the back end.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+
+        idnum = NHSPatientIdNumFactory()
+        self.recipient = ExportRecipientFactory(
+            transmission_method=ExportTransmissionMethod.FILE,
+            all_groups=True,
+            tasks=["bmi"],
+            finalized_only=False,
+            primary_idnum=idnum.which_idnum,
+        )
+        self.tasks = [BmiFactory(patient=idnum.patient) for _ in range(3)]
+        self.superuser.email = "user@example.com"
+        self.dbsession.commit()
+
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.download_dir = tempdir.name
+        self.bytes_available = 1024 * 1024
+        for name, value in (
+            ("user_download_dir", self.download_dir),
+            ("user_download_bytes_available", self.bytes_available),
+            ("user_download_bytes_permitted", self.bytes_available),
+        ):
+            patcher = mock.patch.object(
+                CamcopsRequest,
+                name,
+                new_callable=mock.PropertyMock,
+                return_value=value,
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        email_patcher = mock.patch("camcops_server.cc_modules.cc_export.Email")
+        self.mock_email = email_patcher.start()
+        self.addCleanup(email_patcher.stop)
+
+    def _make_exporter(self, viewtype: str) -> TaskCollectionExporter:
+        collection = get_collection_for_export(
+            self.req, self.recipient, via_index=False
+        )
+        options = DownloadOptions(
+            user_id=self.superuser.id,
+            viewtype=viewtype,
+            delivery_mode=ViewArg.DOWNLOAD,
+            # Reading the information schema needs the configured database.
+            include_information_schema_columns=False,
+        )
+        return make_exporter(self.req, collection, options)
+
+    def _create_download(self, viewtype: str) -> str:
+        exporter = self._make_exporter(viewtype)
+        with mock.patch.object(
+            exporter, "get_filename", return_value=f"download.{viewtype}"
+        ):
+            exporter.create_user_download_and_email()
+        return os.path.join(self.download_dir, f"download.{viewtype}")
+
+    def test_tsv_zip_written_to_download_area(self) -> None:
+        filename = self._create_download(ViewArg.TSV_ZIP)
+
+        # Only the download is left (not any temporary files).
+        self.assertEqual(os.listdir(self.download_dir), ["download.tsv_zip"])
+        in_memory = self._make_exporter(ViewArg.TSV_ZIP).get_file_body()
+        with (
+            zipfile.ZipFile(filename) as spooled_zip,
+            zipfile.ZipFile(io.BytesIO(in_memory)) as in_memory_zip,
+        ):
+            self.assertIn("bmi.tsv", spooled_zip.namelist())
+            self.assertEqual(spooled_zip.namelist(), in_memory_zip.namelist())
+            for name in spooled_zip.namelist():
+                self.assertEqual(
+                    spooled_zip.read(name), in_memory_zip.read(name)
+                )
+        body = self.mock_email.call_args[1]["body"]
+        self.assertIn("is ready to be downloaded", body)
+        self.assertEqual(
+            UserDownloadRecord.get_bytes_used(
+                self.dbsession, self.superuser.id
+            ),
+            os.path.getsize(filename),
+        )
+
+    def test_ods_written_to_download_area(self) -> None:
+        filename = self._create_download(ViewArg.ODS)
+
+        in_memory = self._make_exporter(ViewArg.ODS).get_file_body()
+        data = pyexcel_ods3.get_data(filename)
+        self.assertEqual(len(data["bmi"]), 1 + len(self.tasks))
+        self.assertEqual(data, pyexcel_ods3.get_data(io.BytesIO(in_memory)))
+
+    def test_parquet_zip_written_to_download_area(self) -> None:
+        filename = self._create_download(ViewArg.PARQUET_ZIP)
+
+        extract_dir = os.path.join(self.download_dir, "extracted")
+        with zipfile.ZipFile(filename) as z:
+            self.assertIn("bmi.parquet", z.namelist())
+            z.extract("bmi.parquet", extract_dir)
+        table = pyarrow.parquet.read_table(
+            os.path.join(extract_dir, "bmi.parquet")
+        )
+        self.assertEqual(table.num_rows, len(self.tasks))
+        self.assertEqual(table.schema.field("id").type, pyarrow.int64())
+
+    def test_xlsx_written_to_download_area(self) -> None:
+        filename = self._create_download(ViewArg.XLSX)
+
+        with zipfile.ZipFile(filename) as z:
+            self.assertIn("xl/workbook.xml", z.namelist())
+
+    def _sqlite_export_contents(self) -> Dict[str, List[tuple]]:
+        filename = os.path.join(self.download_dir, "reference.sqlite")
+        with open(filename, "wb") as f:
+            f.write(self._make_exporter(ViewArg.SQLITE).get_file_body())
+        connection = sqlite3.connect(filename)
+        try:
+            return self._get_table_contents(connection)
+        finally:
+            connection.close()
+            os.remove(filename)
+
+    def _sql_reload_contents(self, sql: bytes) -> Dict[str, List[tuple]]:
+        connection = sqlite3.connect(":memory:")
+        try:
+            connection.executescript(sql.decode("utf-8"))
+            return self._get_table_contents(connection)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _get_table_contents(
+        connection: sqlite3.Connection,
+    ) -> Dict[str, List[tuple]]:
+        tablenames = [
+            row[0]
+            for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        ]
+        return {
+            tablename: sorted(
+                connection.execute(f'SELECT * FROM "{tablename}"'),
+                key=repr,
+            )
+            for tablename in tablenames
+        }
+
+    def test_sql_reloads_to_same_data_as_sqlite_export(self) -> None:
+        filename = self._create_download(ViewArg.SQL)
+
+        with open(filename, "rb") as f:
+            contents = self._sql_reload_contents(f.read())
+        self.assertEqual(len(contents["bmi"]), len(self.tasks))
+        self.assertEqual(contents, self._sqlite_export_contents())
+
+    def test_sql_gz_reloads_to_same_data_as_sqlite_export(self) -> None:
+        filename = self._create_download(ViewArg.SQL_GZ)
+
+        with gzip.open(filename, "rb") as f:
+            contents = self._sql_reload_contents(f.read())
+        self.assertEqual(len(contents["bmi"]), len(self.tasks))
+        self.assertEqual(contents, self._sqlite_export_contents())
+
+    def test_sql_gz_response_is_streamed(self) -> None:
+        exporter = self._make_exporter(ViewArg.SQL_GZ)
+        response = exporter.download_now()
+
+        self.assertNotIsInstance(response.app_iter, list)
+        self.assertEqual(response.content_type, "application/gzip")
+        self.assertIn(".sql.gz", response.content_disposition)
+        body = gzip.decompress(b"".join(response.app_iter))
+        self.assertEqual(
+            self._sql_reload_contents(body), self._sqlite_export_contents()
+        )
+
+    def test_download_too_big_for_space_is_deleted(self) -> None:
+        with mock.patch.object(
+            CamcopsRequest,
+            "user_download_bytes_available",
+            new_callable=mock.PropertyMock,
+            return_value=10,
+        ):
+            self._create_download(ViewArg.TSV_ZIP)
+
+        self.assertEqual(os.listdir(self.download_dir), [])
+        body = self.mock_email.call_args[1]["body"]
+        self.assertIn("You do not have enough space", body)
+        self.assertEqual(
+            UserDownloadRecord.get_bytes_used(
+                self.dbsession, self.superuser.id
+            ),
+            0,
+        )
+
+    def test_writing_stops_when_download_too_big(self) -> None:
+        fullpath = os.path.join(self.download_dir, "download")
+        for viewtype in (
+            ViewArg.ODS,
+            ViewArg.PARQUET_ZIP,
+            ViewArg.SQL,
+            ViewArg.SQL_GZ,
+            ViewArg.SQLITE,
+            ViewArg.TSV_ZIP,
+            ViewArg.XLSX,
+        ):
+            with self.subTest(viewtype=viewtype):
+                exporter = self._make_exporter(viewtype)
+                with self.assertRaises(DownloadTooLargeError):
+                    exporter.write_file_body(fullpath, max_size=10)
+
+    def test_temporary_files_count_towards_download_space(self) -> None:
+        for viewtype in (
+            ViewArg.ODS,
+            ViewArg.PARQUET_ZIP,
+            ViewArg.TSV_ZIP,
+            ViewArg.XLSX,
+        ):
+            with self.subTest(viewtype=viewtype):
+                fullpath = os.path.join(self.download_dir, f"a.{viewtype}")
+                self._make_exporter(viewtype).write_file_body(fullpath)
+                size = os.path.getsize(fullpath)
+
+                # The file alone would fit, but not with the temporary files
+                # used to create it:
+                exporter = self._make_exporter(viewtype)
+                with self.assertRaises(DownloadTooLargeError):
+                    exporter.write_file_body(
+                        os.path.join(self.download_dir, f"b.{viewtype}"),
+                        max_size=size,
+                    )
+
+
+class ShardedDatabaseExportTests(BasicDatabaseTestCase):
+    """
+    Test whole-database export in shards (as done via the back end), here
+    run in-process.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.dst_url = f"sqlite:///{self.tempdir.name}/export.sqlite"
+        idnum = NHSPatientIdNumFactory()
+        self.recipient = ExportRecipientFactory(
+            recipient_name="test_db",
+            transmission_method=ExportTransmissionMethod.DATABASE,
+            all_groups=True,
+            tasks=["bmi"],
+            finalized_only=False,
+            primary_idnum=idnum.which_idnum,
+            db_url=self.dst_url,
+        )
+        self.tasks = [BmiFactory(patient=idnum.patient) for _ in range(5)]
+        self.dbsession.commit()
+
+        # The export log uses a BigInteger PK, which doesn't autoincrement
+        # with SQLite.
+        patcher = mock.patch.object(ExportedTask, "bulk_insert_successes")
+        self.mock_bulk_insert = patcher.start()
+        self.addCleanup(patcher.stop)
+        shard_size_patcher = mock.patch(
+            "camcops_server.cc_modules.cc_export.EXPORT_DB_SHARD_SIZE", 2
+        )
+        shard_size_patcher.start()
+        self.addCleanup(shard_size_patcher.stop)
+        lock_patcher = mock.patch.object(
+            self.req.config,
+            "get_export_lock_manager",
+            return_value=FileExportLockManager(self.tempdir.name),
+        )
+        lock_patcher.start()
+        self.addCleanup(lock_patcher.stop)
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+        super().tearDown()
+
+    def _dst_count(self, tablename: str) -> int:
+        engine = create_engine(self.dst_url)
+        with engine.connect() as conn:
+            return conn.execute(
+                select(func.count()).select_from(table(tablename))
+            ).scalar()
+
+    def test_sharded_export_copies_tasks_and_shared_objects_once(
+        self,
+    ) -> None:
+        export_database_sharded(
+            self.req,
+            self.recipient,
+            via_index=False,
+            schedule_via_backend=False,
+        )
+
+        run = self.dbsession.query(ExportedDatabaseRun).one()
+        self.assertIsNotNone(run.finished_at_utc)
+        self.assertEqual(len(run.shards), 3)
+        self.assertEqual(
+            sorted(pk for shard in run.shards for pk in shard.task_pks),
+            sorted(task.pk for task in self.tasks),
+        )
+        self.assertEqual(list(run.gen_shared_object_keys()), [])
+
+        self.assertEqual(self._dst_count("bmi"), 5)
+        self.assertEqual(self._dst_count("patient"), 1)
+        self.assertEqual(self._dst_count("patient_idnum"), 1)
+        self.assertEqual(self.mock_bulk_insert.call_count, 3)
+
+    def test_incremental_export_copies_new_shared_objects(self) -> None:
+        export_database_sharded(
+            self.req,
+            self.recipient,
+            via_index=False,
+            schedule_via_backend=False,
+        )
+        # Export logs are mocked, so retire the exported tasks instead:
+        for task in self.tasks:
+            task._current = False
+        new_idnum = NHSPatientIdNumFactory()
+        BmiFactory(patient=new_idnum.patient)
+        self.dbsession.commit()
+
+        export_database_sharded(
+            self.req,
+            self.recipient,
+            via_index=False,
+            schedule_via_backend=False,
+        )
+
+        runs = self.dbsession.query(ExportedDatabaseRun).all()
+        self.assertEqual(len(runs), 2)
+        self.assertTrue(all(run.finished_at_utc for run in runs))
+        self.assertEqual(self._dst_count("bmi"), 6)
+        self.assertEqual(self._dst_count("patient"), 2)
+        self.assertEqual(self._dst_count("patient_idnum"), 2)
+        self.assertEqual(
+            self._dst_count("_security_groups"),
+            len({self.tasks[0]._group_id, new_idnum.patient._group_id}),
+        )
+
+    def test_retried_shared_objects_not_copied_twice(self) -> None:
+        with mock.patch(
+            "camcops_server.cc_modules.cc_export."
+            "export_database_shared_objects"
+        ):
+            export_database_sharded(
+                self.req,
+                self.recipient,
+                via_index=False,
+                schedule_via_backend=False,
+            )
+        run = self.dbsession.query(ExportedDatabaseRun).one()
+        # A previous attempt copied the shared objects, but failed to record
+        # that:
+        with mock.patch.object(run, "delete_shared_object_keys"):
+            export_database_shared_objects(self.req, run.id)
+        run.finished_at_utc = None
+        self.dbsession.commit()
+        self.assertNotEqual(list(run.gen_shared_object_keys()), [])
+
+        export_database_shared_objects(self.req, run.id)
+
+        self.assertIsNotNone(run.finished_at_utc)
+        self.assertEqual(self._dst_count("patient"), 1)
+        self.assertEqual(self._dst_count("patient_idnum"), 1)
+
+    def test_interrupted_export_resumes_unfinished_shards(self) -> None:
+        with (
+            mock.patch(
+                "camcops_server.cc_modules.cc_export.export_database_shard"
+            ),
+            mock.patch(
+                "camcops_server.cc_modules.cc_export."
+                "export_database_shared_objects"
+            ),
+        ):
+            export_database_sharded(
+                self.req,
+                self.recipient,
+                via_index=False,
+                schedule_via_backend=False,
+            )
+        run = self.dbsession.query(ExportedDatabaseRun).one()
+        first_shard = run.shards[0]
+        self.assertFalse(export_database_shard(self.req, first_shard.id))
+        self.assertIsNotNone(first_shard.finished_at_utc)
+
+        # A retried shard whose rows were committed isn't copied again.
+        second_shard = run.shards[1]
+        export_database_shard(self.req, second_shard.id)
+        second_shard.finished_at_utc = None
+        self.dbsession.commit()
+
+        export_database_sharded(
+            self.req,
+            self.recipient,
+            via_index=False,
+            schedule_via_backend=False,
+        )
+
+        self.assertEqual(self.dbsession.query(ExportedDatabaseRun).count(), 1)
+        self.assertIsNotNone(run.finished_at_utc)
+        self.assertEqual(
+            [shard.attempts for shard in run.shards],
+            [1, 2, 1],
+        )
+        self.assertEqual(self._dst_count("bmi"), 5)
+        self.assertEqual(self._dst_count("patient"), 1)
+
+    def test_retried_shard_copies_tasks_missing_from_destination(
+        self,
+    ) -> None:
+        with (
+            mock.patch(
+                "camcops_server.cc_modules.cc_export.export_database_shard"
+            ),
+            mock.patch(
+                "camcops_server.cc_modules.cc_export."
+                "export_database_shared_objects"
+            ),
+        ):
+            export_database_sharded(
+                self.req,
+                self.recipient,
+                via_index=False,
+                schedule_via_backend=False,
+            )
+        run = self.dbsession.query(ExportedDatabaseRun).one()
+        shard = run.shards[0]
+        present_pk, missing_pk = shard.task_pks
+        # The destination already has a row within the shard's PK range
+        # (e.g. from an earlier export), but not the whole shard:
+        export_database_shard(self.req, shard.id)
+        engine = create_engine(self.dst_url)
+        with engine.begin() as conn:
+            conn.execute(
+                delete(table("bmi", column("_pk"))).where(
+                    column("_pk") == missing_pk
+                )
+            )
+        shard.finished_at_utc = None
+        self.dbsession.commit()
+        self.mock_bulk_insert.reset_mock()
+
+        export_database_shard(self.req, shard.id)
+
+        self.assertIsNotNone(shard.finished_at_utc)
+        self.assertEqual(shard.attempts, 2)
+        with engine.connect() as conn:
+            dst_pks = set(
+                conn.execute(
+                    select(column("_pk", Integer)).select_from(table("bmi"))
+                )
+                .scalars()
+                .all()
+            )
+        self.assertEqual(dst_pks, {present_pk, missing_pk})
+        exported = self.mock_bulk_insert.call_args[0][2]
+        self.assertEqual(
+            sorted(pk for _, pk, _ in exported), sorted(shard.task_pks)
+        )
+        tablenames = {
+            tablename for tablename, _ in run.gen_shared_object_keys()
+        }
+        self.assertIn("patient", tablenames)
+
+    def test_shard_records_shared_objects(self) -> None:
+        with (
+            mock.patch(
+                "camcops_server.cc_modules.cc_export.export_database_shard"
+            ),
+            mock.patch(
+                "camcops_server.cc_modules.cc_export."
+                "export_database_shared_objects"
+            ),
+        ):
+            export_database_sharded(
+                self.req,
+                self.recipient,
+                via_index=False,
+                schedule_via_backend=False,
+            )
+        shard = self.dbsession.query(ExportedDatabaseShard).first()
+        export_database_shard(self.req, shard.id)
+
+        tablenames = {
+            tablename for tablename, _ in shard.run.gen_shared_object_keys()
+        }
+        self.assertIn("patient", tablenames)
+        self.assertIn("_security_groups", tablenames)
+        self.assertEqual(self._dst_count("patient"), 0)
@@ -0,0 +1,203 @@
+"""
+camcops_server/cc_modules/tests/cc_exportlock_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+from tempfile import TemporaryDirectory
+import logging
+import threading
+from unittest import mock, TestCase
+
+import lockfile
+from sqlalchemy import create_engine
+
+from camcops_server.cc_modules.cc_constants import ExportLockBackendNames
+from camcops_server.cc_modules.cc_exportlock import (
+    export_lockname_recipient_task,
+    FileExportLockManager,
+    make_export_lock_manager,
+    MySQLExportLockManager,
+    PostgreSQLExportLockManager,
+)
+
+
+class FileExportLockManagerTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tempdir = TemporaryDirectory()
+        self.manager = FileExportLockManager(self.tempdir.name)
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+        super().tearDown()
+
+    def _lock_held_elsewhere(self, name: str) -> lockfile.FileLock:
+        # Lockfiles are re-entrant within a thread, so this lock is created
+        # by another thread.
+        filelocks = []
+        thread = threading.Thread(
+            target=lambda: filelocks.append(
+                lockfile.FileLock(self.manager.lockfilename(name))
+            )
+        )
+        thread.start()
+        thread.join()
+        filelocks[0].acquire()
+        return filelocks[0]
+
+    def test_lock_is_exclusive(self) -> None:
+        other = self._lock_held_elsewhere("a")
+        with self.assertRaises(lockfile.AlreadyLocked):
+            with self.manager.lock("a", timeout=0):
+                pass
+        other.release()
+        with self.manager.lock("a"):
+            pass
+
+    def test_timeout_reported_as_already_locked(self) -> None:
+        other = self._lock_held_elsewhere("a")
+        with self.assertRaises(lockfile.AlreadyLocked):
+            with self.manager.lock("a", timeout=0.05):
+                pass
+        other.release()
+
+    def test_try_lock_many_skips_held_locks(self) -> None:
+        other = self._lock_held_elsewhere("b")
+        with self.manager.try_lock_many(["a", "b", "c", "a"]) as acquired:
+            self.assertEqual(acquired, ["a", "c"])
+        other.release()
+        with self.manager.try_lock_many(["a", "b", "c"]) as acquired:
+            self.assertEqual(acquired, ["a", "b", "c"])
+
+    def test_wait_and_hold_times_logged(self) -> None:
+        with self.assertLogs(level="DEBUG") as logging_cm:
+            with self.manager.lock("a"):
+                pass
+            with self.manager.try_lock_many(["a", "b"]):
+                pass
+        output = "\n".join(logging_cm.output)
+        self.assertIn("Acquired export lock 'a' (file backend)", output)
+        self.assertIn("Released export lock 'a' after holding it for", output)
+        self.assertIn("Acquired 2 of 2 export locks (file backend)", output)
+        self.assertIn("Released 2 export locks after holding them", output)
+        # Single locks are frequent, so are logged only at debug level:
+        single_lock_levels = {
+            record.levelno
+            for record in logging_cm.records
+            if "export lock 'a'" in record.getMessage()
+        }
+        self.assertEqual(single_lock_levels, {logging.DEBUG})
+
+
+class DatabaseExportLockManagerTests(TestCase):
+    @staticmethod
+    def _mock_engine(dialect_name: str) -> mock.MagicMock:
+        engine = mock.MagicMock()
+        engine.dialect.name = dialect_name
+        engine.url.database = "camcops"
+        return engine
+
+    def test_backend_chosen_by_dialect(self) -> None:
+        db = ExportLockBackendNames.DATABASE
+        for dialect_name, expected_class in (
+            ("mysql", MySQLExportLockManager),
+            ("mariadb", MySQLExportLockManager),
+            ("postgresql", PostgreSQLExportLockManager),
+        ):
+            manager = make_export_lock_manager(
+                db, "/tmp", self._mock_engine(dialect_name)
+            )
+            self.assertIsInstance(manager, expected_class)
+
+    def test_sqlite_falls_back_to_file_locks(self) -> None:
+        engine = create_engine("sqlite://")
+        manager = make_export_lock_manager(
+            ExportLockBackendNames.DATABASE, "/tmp", engine
+        )
+        self.assertIsInstance(manager, FileExportLockManager)
+
+    def test_file_backend(self) -> None:
+        manager = make_export_lock_manager(
+            ExportLockBackendNames.FILE, "/tmp", self._mock_engine("mysql")
+        )
+        self.assertIsInstance(manager, FileExportLockManager)
+
+    def test_bad_backend_rejected(self) -> None:
+        with self.assertRaises(ValueError):
+            make_export_lock_manager("carrier_pigeon", "/tmp", mock.Mock())
+
+    def test_mysql_locknames_fit(self) -> None:
+        manager = MySQLExportLockManager(self._mock_engine("mysql"))
+        short_name = "camcops_export_db_r"
+        self.assertEqual(
+            manager.server_lockname(short_name), "camcops.camcops_export_db_r"
+        )
+        long_name = export_lockname_recipient_task(
+            "a_recipient_with_a_long_name", "a_task_table", 123456789
+        )
+        long_lockname = manager.server_lockname(long_name)
+        self.assertLessEqual(
+            len(long_lockname), MySQLExportLockManager.MAX_LOCKNAME_LENGTH
+        )
+        self.assertNotEqual(
+            long_lockname,
+            manager.server_lockname(
+                export_lockname_recipient_task(
+                    "a_recipient_with_a_long_name", "a_task_table", 123456780
+                )
+            ),
+        )
+
+    def test_postgresql_keys_are_signed_64_bit(self) -> None:
+        key = PostgreSQLExportLockManager.lock_key("camcops_export_db_r")
+        self.assertEqual(
+            key, PostgreSQLExportLockManager.lock_key("camcops_export_db_r")
+        )
+        self.assertGreaterEqual(key, -(2**63))
+        self.assertLess(key, 2**63)
+
+    def test_try_lock_many_uses_one_round_trip_each_way(self) -> None:
+        engine = self._mock_engine("postgresql")
+        conn = engine.connect.return_value.__enter__.return_value
+        conn.execute.return_value.one.return_value = (True, False, True)
+        manager = PostgreSQLExportLockManager(engine)
+
+        with manager.try_lock_many(["a", "b", "c"]) as acquired:
+            self.assertEqual(acquired, ["a", "c"])
+            self.assertEqual(conn.execute.call_count, 1)
+
+        self.assertEqual(conn.execute.call_count, 2)
+        release_sql = str(conn.execute.call_args[0][0])
+        self.assertEqual(release_sql.count("pg_advisory_unlock("), 2)
+
+    def test_lock_raises_if_held_elsewhere(self) -> None:
+        engine = self._mock_engine("mysql")
+        conn = engine.connect.return_value.__enter__.return_value
+        conn.execute.return_value.one.return_value = (0,)
+        manager = MySQLExportLockManager(engine)
+
+        with self.assertRaises(lockfile.AlreadyLocked):
+            with manager.lock("a", timeout=0):
+                pass
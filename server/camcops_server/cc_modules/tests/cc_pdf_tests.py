@@ -33,8 +33,9 @@ class WeasyprintPageStylesheetTests(TestCase):
         mock_css_object = mock.Mock()
         mock_css_class = mock.Mock(return_value=mock_css_object)
 
+        # CSS is imported from WeasyPrint when first needed.
         with mock.patch.multiple(
-            "camcops_server.cc_modules.cc_pdf",
+            "weasyprint",
             CSS=mock_css_class,
         ):
             ret = weasyprint_page_stylesheet(
@@ -25,12 +25,17 @@ camcops_server/cc_modules/tests/cc_pyramid_tests.py
 
 """
 
+import os
+from unittest import TestCase
+
 from pyramid.security import Authenticated, Everyone
 
 from camcops_server.cc_modules.cc_constants import MfaMethod
 from camcops_server.cc_modules.cc_pyramid import (
     CamcopsAuthenticationPolicy,
+    MAKO_LOOKUP,
     Permission,
+    precompile_mako_templates,
 )
 from camcops_server.cc_modules.cc_testfactories import (
     GroupFactory,
@@ -138,3 +143,15 @@ class CamcopsAuthenticationPolicyTests(DemoRequestTestCase):
             Permission.GROUPADMIN,
             CamcopsAuthenticationPolicy.effective_principals(self.req),
         )
+
+
+class PrecompileMakoTemplatesTests(TestCase):
+    def test_all_templates_compiled(self) -> None:
+        n_templates = sum(
+            1
+            for directory in MAKO_LOOKUP.directories
+            for f in os.listdir(directory)
+            if f.endswith(".mako")
+        )
+
+        self.assertEqual(precompile_mako_templates(), n_templates)
@@ -25,7 +25,12 @@ camcops_server/cc_modules/tests/cc_session_tests.py
 
 """
 
+import datetime
+from typing import Any, List, Optional
+
 from pendulum import DateTime as Pendulum
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, ExecutionContext
 
 from camcops_server.cc_modules.cc_session import CamcopsSession, generate_token
 from camcops_server.cc_modules.cc_taskfilter import TaskFilter
@@ -122,3 +127,98 @@ class GetSessionTests(BasicDatabaseTestCase):
         self.dbsession.add(new_session)
         self.dbsession.flush()
         self.assertNotEqual(self.old_session.id, new_session.id)
+
+
+class SessionActivityTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        CamcopsSession.delete_old_sessions(self.req)
+
+        self.start = self.req.now_utc
+        self.session = CamcopsSession(
+            ip_addr=self.req.remote_addr, last_activity_utc=self.start
+        )
+        self.dbsession.add(self.session)
+        self.dbsession.commit()
+        self.session_id = self.session.id
+        self.session_token = self.session.token
+
+        self.session_updates = []  # type: List[str]
+        engine = self.dbsession.get_bind()
+
+        def count_session_updates(
+            conn: Connection,
+            cursor: Any,
+            statement: str,
+            parameters: Any,
+            context: Optional[ExecutionContext],
+            executemany: bool,
+        ) -> None:
+            if statement.startswith(f"UPDATE {CamcopsSession.__tablename__}"):
+                self.session_updates.append(statement)
+
+        event.listen(engine, "before_cursor_execute", count_session_updates)
+        self.addCleanup(
+            event.remove,
+            engine,
+            "before_cursor_execute",
+            count_session_updates,
+        )
+
+    def _request_at(self, seconds_after_start: int) -> CamcopsSession:
+        self.req.now_utc = self.start + datetime.timedelta(
+            seconds=seconds_after_start
+        )
+        return CamcopsSession.get_session(
+            self.req, str(self.session_id), self.session_token
+        )
+
+    def test_activity_writes_are_bounded(self) -> None:
+        self.req.config.session_activity_granularity = datetime.timedelta(
+            seconds=60
+        )
+        n_requests = 600  # one per second, for ten minutes
+        for i in range(1, n_requests + 1):
+            found = self._request_at(i)
+            self.assertEqual(found.id, self.session_id)
+
+        self.assertEqual(len(self.session_updates), n_requests // 60)
+        self.assertEqual(
+            self.session.last_activity_utc,
+            (self.start + datetime.timedelta(seconds=n_requests)).naive(),
+        )
+
+    def test_every_request_recorded_without_granularity(self) -> None:
+        self.req.config.session_activity_granularity = datetime.timedelta(0)
+        for i in range(1, 11):
+            self._request_at(i)
+
+        self.assertEqual(len(self.session_updates), 10)
+
+    def test_session_never_outlives_timeout(self) -> None:
+        granularity = datetime.timedelta(seconds=60)
+        timeout = self.req.config.session_timeout
+        self.req.config.session_activity_granularity = granularity
+
+        # Activity just within the granularity isn't recorded...
+        self._request_at(59)
+        self.assertEqual(self.session_updates, [])
+
+        # ... so the session times out relative to the recorded activity.
+        seconds_to_timeout = int(timeout.total_seconds())
+        self.assertEqual(
+            self._request_at(seconds_to_timeout).id, self.session_id
+        )
+        self.dbsession.rollback()  # forget the time now recorded
+        self.assertNotEqual(
+            self._request_at(seconds_to_timeout + 1).id, self.session_id
+        )
+        self.dbsession.rollback()  # discard the new session
+
+        CamcopsSession.delete_old_sessions(self.req)
+        self.dbsession.commit()
+        self.assertIsNone(
+            self.dbsession.query(CamcopsSession)
+            .filter(CamcopsSession.id == self.session_id)
+            .first()
+        )
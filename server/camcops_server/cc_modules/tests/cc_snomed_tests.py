@@ -0,0 +1,227 @@
+"""
+camcops_server/cc_modules/tests/cc_snomed_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import os
+from tempfile import TemporaryDirectory
+from typing import Any, List, Mapping, Tuple
+from unittest import TestCase
+
+from camcops_server.cc_modules.cc_snomed import (
+    CLIENT_ICD9CM_CODES,
+    CLIENT_ICD10_CODES,
+    CompiledSnomedConcepts,
+    get_all_task_snomed_concepts,
+    get_compiled_snomed_concepts,
+    get_icd9_snomed_concepts_from_xml,
+    get_icd10_snomed_concepts_from_xml,
+    SnomedConcept,
+    SnomedLookup,
+    SnomedLookupSet,
+    VALID_SNOMED_LOOKUPS,
+    write_compiled_snomed_concepts,
+    write_snomed_concepts_to_xml,
+)
+from camcops_server.cc_modules.cc_unittest import DemoRequestTestCase
+
+
+def _as_tuples(concepts: Mapping[str, Any]) -> List[Tuple[str, Any]]:
+    """
+    Returns a mapping of lookups to concepts (or lists of concepts) in a form
+    that can be compared, preserving order.
+    """
+    result = []
+    for lookup, value in concepts.items():
+        if isinstance(value, list):
+            value = [(c.identifier, c.term) for c in value]
+        else:
+            value = (value.identifier, value.term)
+        result.append((lookup, value))
+    return result
+
+
+class CompiledSnomedTests(TestCase):
+    """
+    Tests of the compiled SNOMED-CT file, which must give the same results as
+    reading the XML.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tempdir = TemporaryDirectory()
+        self.task_xml = os.path.join(self.tempdir.name, "task.xml")
+        self.icd9_xml = os.path.join(self.tempdir.name, "icd9.xml")
+        self.icd10_xml = os.path.join(self.tempdir.name, "icd10.xml")
+        self.compiled = os.path.join(self.tempdir.name, "snomed.sqlite")
+
+        identifier = 100000
+        task_concepts = {}
+        for lookup in sorted(VALID_SNOMED_LOOKUPS, reverse=True):
+            identifier += 1
+            task_concepts[lookup] = [
+                SnomedConcept(identifier, f"Term for {lookup}")
+            ]
+        task_concepts["not_a_camcops_lookup"] = [
+            SnomedConcept(999999, "Ignored")
+        ]
+        write_snomed_concepts_to_xml(self.task_xml, task_concepts)
+
+        for xml_filename, codes in (
+            (self.icd9_xml, CLIENT_ICD9CM_CODES),
+            (self.icd10_xml, CLIENT_ICD10_CODES),
+        ):
+            icd_concepts = {}
+            for n, code in enumerate(sorted(codes)[:50]):
+                icd_concepts[code] = [
+                    SnomedConcept(200000 + 10 * n + i, f"{code} term {i}")
+                    for i in range(1 + n % 3)
+                ]
+            icd_concepts["not_a_camcops_code"] = [
+                SnomedConcept(888888, "Ignored")
+            ]
+            # An empty term is read from the XML as "":
+            icd_concepts[sorted(codes)[-1]] = [SnomedConcept(777777, "")]
+            write_snomed_concepts_to_xml(xml_filename, icd_concepts)
+
+        write_compiled_snomed_concepts(
+            compiled_filename=self.compiled,
+            task_xml_filename=self.task_xml,
+            icd9_xml_filename=self.icd9_xml,
+            icd10_xml_filename=self.icd10_xml,
+        )
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+        super().tearDown()
+
+    def test_compiled_lookups_match_xml(self) -> None:
+        for reader, xml_filename in (
+            (get_all_task_snomed_concepts, self.task_xml),
+            (get_icd9_snomed_concepts_from_xml, self.icd9_xml),
+            (get_icd10_snomed_concepts_from_xml, self.icd10_xml),
+        ):
+            from_xml = reader(xml_filename)
+            compiled = reader(xml_filename, self.compiled)
+            self.assertIsInstance(compiled, CompiledSnomedConcepts)
+            self.assertEqual(_as_tuples(compiled), _as_tuples(from_xml))
+            self.assertEqual(len(compiled), len(from_xml))
+            self.assertTrue(compiled)
+
+    def test_compiled_file_readable_by_all(self) -> None:
+        self.assertEqual(os.stat(self.compiled).st_mode & 0o777, 0o644)
+
+    def test_single_lookup(self) -> None:
+        from_xml = get_all_task_snomed_concepts(self.task_xml)
+        compiled = get_all_task_snomed_concepts(self.task_xml, self.compiled)
+        lookup = SnomedLookup.PHQ9_SCALE
+        self.assertEqual(
+            (compiled[lookup].identifier, compiled[lookup].term),
+            (from_xml[lookup].identifier, from_xml[lookup].term),
+        )
+        self.assertIn(lookup, compiled)
+        with self.assertRaises(KeyError):
+            _ = compiled["not_a_camcops_lookup"]
+
+    def test_icd_lookup_returns_list(self) -> None:
+        code = sorted(CLIENT_ICD10_CODES)[-1]
+        compiled = get_icd10_snomed_concepts_from_xml(
+            self.icd10_xml, self.compiled
+        )
+        concepts = compiled[code]
+        self.assertEqual(
+            [(c.identifier, c.term) for c in concepts], [(777777, "")]
+        )
+
+    def test_out_of_date_file_not_used(self) -> None:
+        statinfo = os.stat(self.icd9_xml)
+        os.utime(
+            self.icd9_xml,
+            ns=(statinfo.st_atime_ns, statinfo.st_mtime_ns + 1_000_000_000),
+        )
+        self.assertIsNone(
+            get_compiled_snomed_concepts(
+                self.compiled, SnomedLookupSet.ICD9CM, self.icd9_xml
+            )
+        )
+        self.assertIsNotNone(
+            get_compiled_snomed_concepts(
+                self.compiled, SnomedLookupSet.ICD10, self.icd10_xml
+            )
+        )
+
+    def test_missing_file_not_used(self) -> None:
+        os.remove(self.compiled)
+        self.assertIsNone(
+            get_compiled_snomed_concepts(
+                self.compiled, SnomedLookupSet.TASK, self.task_xml
+            )
+        )
+
+    def test_set_not_compiled_not_used(self) -> None:
+        write_compiled_snomed_concepts(
+            compiled_filename=self.compiled, task_xml_filename=self.task_xml
+        )
+        self.assertIsNone(
+            get_compiled_snomed_concepts(
+                self.compiled, SnomedLookupSet.ICD10, self.icd10_xml
+            )
+        )
+
+
+class RequestSnomedTests(DemoRequestTestCase):
+    """
+    Tests of SNOMED-CT lookups via the request, using a compiled file.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tempdir = TemporaryDirectory()
+        self.task_xml = os.path.join(self.tempdir.name, "task.xml")
+        self.compiled = os.path.join(self.tempdir.name, "snomed.sqlite")
+        write_snomed_concepts_to_xml(
+            self.task_xml,
+            {
+                lookup: [SnomedConcept(300000 + n, lookup)]
+                for n, lookup in enumerate(sorted(VALID_SNOMED_LOOKUPS))
+            },
+        )
+        write_compiled_snomed_concepts(
+            compiled_filename=self.compiled, task_xml_filename=self.task_xml
+        )
+        self.req.config.snomed_task_xml_filename = self.task_xml
+        self.req.config.snomed_compiled_filename = self.compiled
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+        super().tearDown()
+
+    def test_request_uses_compiled_file(self) -> None:
+        self.assertIsInstance(
+            self.req.config.get_task_snomed_concepts(), CompiledSnomedConcepts
+        )
+        self.assertTrue(self.req.snomed_supported)
+        concept = self.req.snomed(SnomedLookup.PHQ9_SCALE)
+        self.assertEqual(concept.term, SnomedLookup.PHQ9_SCALE)
@@ -25,14 +25,25 @@ camcops_server/cc_modules/tests/cc_spreadsheet_tests.py
 
 """
 
+import datetime
 import io
-from typing import Any, Dict
+import os
+from tempfile import TemporaryDirectory
+import tracemalloc
+from typing import Any, Dict, List, Tuple
 from unittest import TestCase
 import uuid
 from xml.dom.minidom import parseString
 import zipfile
 
+import pendulum
+import pyarrow
+import pyarrow.parquet
+import pyexcel_ods3
+
 from camcops_server.cc_modules.cc_spreadsheet import (
+    SpooledSpreadsheetCollection,
+    SpoolTooLargeError,
     SpreadsheetCollection,
     SpreadsheetPage,
     XLSX_VIA_PYEXCEL,
@@ -53,6 +64,66 @@ else:
 # =============================================================================
 
 
+class SpreadsheetPageTests(TestCase):
+    def test_missing_values_distinct_from_none(self) -> None:
+        page = SpreadsheetPage(
+            name="test", rows=[{"a": 1, "b": None}, {"c": 3}, {}]
+        )
+
+        self.assertEqual(page.headings, ["a", "b", "c"])
+        self.assertEqual(page.rows, [{"a": 1, "b": None}, {"c": 3}, {}])
+        self.assertEqual(
+            page.plainrows,
+            [[1, None, None], [None, None, 3], [None, None, None]],
+        )
+        self.assertEqual(
+            page.get_tsv(), "a\tb\tc\r\n1\t\t\r\n\t\t3\r\n\t\t\r\n"
+        )
+
+    def test_rows_added_from_pages(self) -> None:
+        coll = SpreadsheetCollection()
+        coll.add_page(SpreadsheetPage(name="test", rows=[{"a": 1, "b": 2}]))
+        coll.add_page(SpreadsheetPage(name="test", rows=[{"c": 3, "a": 4}]))
+        coll.add_page(SpreadsheetPage(name="test", rows=[{"b": 5}]))
+
+        page = coll.page_with_name("test")
+        self.assertEqual(page.headings, ["a", "b", "c"])
+        self.assertEqual(
+            page.plainrows, [[1, 2, None], [4, None, 3], [None, 5, None]]
+        )
+
+    def test_columns_set_from_page(self) -> None:
+        page = SpreadsheetPage(name="test", rows=[{"a": 1}, {"a": 2}])
+        other = SpreadsheetPage(name="other", rows=[{"b": 3}, {"a": 4}])
+
+        page.add_or_set_columns_from_page(other)
+        page.add_or_set_column("c", [5, 6])
+
+        self.assertEqual(
+            page.rows, [{"a": 1, "b": 3, "c": 5}, {"a": 4, "c": 6}]
+        )
+
+    def test_deleted_and_sorted_headings(self) -> None:
+        page = SpreadsheetPage(name="test", rows=[{"z": 1, "y": 2, "x": 3}])
+        page.delete_columns(["y"])
+        page.sort_headings()
+
+        self.assertEqual(page.get_tsv(), "x\tz\r\n3\t1\r\n")
+        page.add_or_set_value("y", 4)
+        self.assertEqual(page.headings, ["x", "z", "y"])
+        self.assertEqual(page.plainrows, [[3, 1, 4]])
+
+    def test_from_headings_rows(self) -> None:
+        page = SpreadsheetPage.from_headings_rows(
+            "test", ["a", "b"], [(1, 2), (3, 4)]
+        )
+
+        self.assertEqual(page.rows, [{"a": 1, "b": 2}, {"a": 3, "b": 4}])
+        self.assertEqual(
+            page.spreadsheetrows(str), [["a", "b"], ["1", "2"], ["3", "4"]]
+        )
+
+
 class SpreadsheetCollectionTests(TestCase):
     def test_xlsx_created_from_zero_rows(self) -> None:
         page = SpreadsheetPage(name="test", rows=[])
@@ -196,3 +267,313 @@ class SpreadsheetCollectionTests(TestCase):
             self.assertIn(
                 ["6457cb90-1ca0-47a7-9f40-767567819bee"], wb["Testing"]
             )
+
+
+class SpooledSpreadsheetCollectionTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tempdir = TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+        super().tearDown()
+
+    @staticmethod
+    def _add_test_pages(coll: SpreadsheetCollection) -> None:
+        rows = [
+            {"a": 1, "b": "two  spaces,\ttab\nnewline <&>", "c": None},
+            {"c": 2.5, "d": True},
+            {"a": datetime.date(2020, 1, 2), "e": uuid.UUID(int=1)},
+            {"b": ""},
+        ]  # type: List[Dict[str, Any]]
+        for row in rows:
+            coll.add_page(SpreadsheetPage(name="test", rows=[row]))
+        coll.add_page(SpreadsheetPage(name="other 'page'", rows=[{"z": 1}]))
+        coll.add_page(SpreadsheetPage(name="empty", rows=[]))
+        coll.delete_columns(["d"])
+        coll.sort_pages()
+
+    def _make_collections(
+        self,
+    ) -> Tuple[SpreadsheetCollection, SpooledSpreadsheetCollection]:
+        in_memory = SpreadsheetCollection()
+        self._add_test_pages(in_memory)
+        spooled = SpooledSpreadsheetCollection(self.tempdir.name)
+        self.addCleanup(spooled.close)
+        self._add_test_pages(spooled)
+        return in_memory, spooled
+
+    def test_rows_are_spooled(self) -> None:
+        in_memory, spooled = self._make_collections()
+
+        self.assertEqual(spooled.get_page_names(), ["other 'page'", "test"])
+        for page_name in spooled.get_page_names():
+            self.assertEqual(
+                spooled.page_with_name(page_name).rows,
+                in_memory.page_with_name(page_name).rows,
+            )
+            self.assertEqual(
+                spooled.get_tsv_file(page_name),
+                in_memory.get_tsv_file(page_name),
+            )
+        self.assertEqual(spooled.as_r(), in_memory.as_r())
+
+    def test_zip_matches_in_memory_version(self) -> None:
+        in_memory, spooled = self._make_collections()
+        filename = os.path.join(self.tempdir.name, "test.zip")
+
+        spooled.write_zip(filename)
+
+        with (
+            zipfile.ZipFile(filename) as spooled_zip,
+            zipfile.ZipFile(io.BytesIO(in_memory.as_zip())) as in_memory_zip,
+        ):
+            self.assertEqual(
+                spooled_zip.namelist(), ["other 'page'.tsv", "test.tsv"]
+            )
+            self.assertEqual(spooled_zip.namelist(), in_memory_zip.namelist())
+            for name in spooled_zip.namelist():
+                self.assertEqual(
+                    spooled_zip.read(name), in_memory_zip.read(name)
+                )
+
+    def test_xlsx_matches_in_memory_version(self) -> None:
+        if not pyexcel_xlsx:
+            self.skipTest("This test has not been written for openpyxl")
+        in_memory, spooled = self._make_collections()
+        filename = os.path.join(self.tempdir.name, "test.xlsx")
+
+        spooled.write_xlsx(filename)
+
+        self.assertEqual(
+            pyexcel_xlsx.get_data(filename),
+            pyexcel_xlsx.get_data(io.BytesIO(in_memory.as_xlsx())),
+        )
+
+    def test_ods_matches_in_memory_version(self) -> None:
+        in_memory, spooled = self._make_collections()
+        filename = os.path.join(self.tempdir.name, "test.ods")
+
+        spooled.write_ods(filename)
+
+        data = pyexcel_ods3.get_data(filename)
+        self.assertEqual(list(data.keys()), ["other _page_", "test"])
+        self.assertEqual(
+            data["test"][1], [1, "two  spaces,\ttab\nnewline <&>"]
+        )
+        self.assertEqual(
+            data, pyexcel_ods3.get_data(io.BytesIO(in_memory.as_ods()))
+        )
+        with zipfile.ZipFile(filename) as z:
+            # The MIME type must be first, and uncompressed.
+            first = z.infolist()[0]
+            self.assertEqual(first.filename, "mimetype")
+            self.assertEqual(first.compress_type, zipfile.ZIP_STORED)
+
+    def test_ods_cell_types_read_back(self) -> None:
+        values = [
+            True,
+            False,
+            0,
+            -3,
+            2**40,
+            1.5,
+            -0.25,
+            datetime.date(2020, 1, 2),
+            datetime.datetime(2020, 1, 2, 3, 4, 5),
+            pendulum.datetime(2020, 1, 2, 3, 4, 5, tz="Europe/London"),
+            datetime.time(1, 2, 3),
+            datetime.timedelta(hours=25, minutes=3, seconds=4),
+            "",
+            "   leading and  double spaces ",
+            "tab\tand\nnewline",
+            "<xml & 'quotes' \"here\">",
+            None,
+        ]
+        row = {f"c{i:02d}": value for i, value in enumerate(values)}
+        in_memory = SpreadsheetCollection()
+        in_memory.add_page(SpreadsheetPage(name="test", rows=[row]))
+        spooled = SpooledSpreadsheetCollection(self.tempdir.name)
+        self.addCleanup(spooled.close)
+        spooled.add_page(SpreadsheetPage(name="test", rows=[row]))
+        filename = os.path.join(self.tempdir.name, "test.ods")
+
+        spooled.write_ods(filename)
+
+        # Read back by pyexcel-ods3 as it reads its own output:
+        data = pyexcel_ods3.get_data(filename)
+        self.assertEqual(
+            data, pyexcel_ods3.get_data(io.BytesIO(in_memory.as_ods()))
+        )
+        self.assertEqual(data["test"][1][:3], [True, False, 0])
+
+    def test_ods_invalid_xml_characters_removed(self) -> None:
+        with SpooledSpreadsheetCollection(self.tempdir.name) as coll:
+            coll.add_page(
+                SpreadsheetPage(name="test", rows=[{"a\x01": "b\x00c"}])
+            )
+            filename = os.path.join(self.tempdir.name, "test.ods")
+            coll.write_ods(filename)
+
+        self.assertEqual(
+            pyexcel_ods3.get_data(filename)["test"], [["a"], ["bc"]]
+        )
+
+    def test_spool_size_limited(self) -> None:
+        with SpooledSpreadsheetCollection(
+            self.tempdir.name, max_size=1000
+        ) as coll:
+            coll.add_page(SpreadsheetPage(name="test", rows=[{"a": 1}]))
+            self.assertGreater(coll.spool_size, 0)
+            with self.assertRaises(SpoolTooLargeError):
+                for _ in range(100):
+                    coll.add_page(
+                        SpreadsheetPage(name="test", rows=[{"a": "x" * 20}])
+                    )
+            self.assertGreater(coll.spool_size, 1000)
+
+    def _peak_memory_writing(self, n_rows: int, extension: str) -> int:
+        """
+        Returns the peak memory allocated (in bytes) while creating a spooled
+        collection with ``n_rows`` rows and writing it to a file.
+        """
+        filename = os.path.join(self.tempdir.name, f"test.{extension}")
+        tracemalloc.start()
+        try:
+            with SpooledSpreadsheetCollection(self.tempdir.name) as coll:
+                for i in range(n_rows):
+                    row = {f"c{j}": f"value {i}, {j}" for j in range(20)}
+                    coll.add_page(SpreadsheetPage(name="test", rows=[row]))
+                if extension == "zip":
+                    coll.write_zip(filename)
+                elif extension == "xlsx":
+                    coll.write_xlsx(filename)
+                else:
+                    coll.write_ods(filename)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        os.remove(filename)
+        return peak
+
+    def test_memory_does_not_grow_with_rows(self) -> None:
+        # Building these in memory takes about 3 times as much memory for
+        # 4 times as many rows.
+        for extension in ("zip", "xlsx", "ods"):
+            small = self._peak_memory_writing(200, extension)
+            large = self._peak_memory_writing(800, extension)
+            self.assertLess(large, small * 1.5, msg=extension)
+
+    def test_temporary_files_deleted(self) -> None:
+        with SpooledSpreadsheetCollection(self.tempdir.name) as coll:
+            self._add_test_pages(coll)
+            coll.write_zip(os.path.join(self.tempdir.name, "test.zip"))
+        self.assertEqual(os.listdir(self.tempdir.name), ["test.zip"])
+
+
+class ParquetZipTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tempdir = TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+        super().tearDown()
+
+    @staticmethod
+    def _add_test_pages(coll: SpreadsheetCollection) -> None:
+        rows = [
+            {
+                "int": 1,
+                "float": 1.5,
+                "int_and_float": 1,
+                "bool": True,
+                "str": "one",
+                "when": pendulum.datetime(
+                    2020, 1, 2, 3, 4, 5, tz=pendulum.fixed_timezone(3600)
+                ),
+                "date": datetime.date(2020, 1, 2),
+                "uuid": uuid.UUID(int=1),
+                "mixed": 1,
+                "null": None,
+            },
+            {
+                "int": None,
+                "float": 2.5,
+                "int_and_float": 2.5,
+                "bool": False,
+                "str": None,
+                "mixed": "two",
+            },
+        ]
+        for row in rows:
+            coll.add_page(SpreadsheetPage(name="test", rows=[row]))
+        coll.add_page(SpreadsheetPage(name="other", rows=[{"z": 1}]))
+
+    def _read_tables(self, zip_filename: str) -> Dict[str, Any]:
+        # Read from files: in pyarrow 21, reading from an in-memory buffer
+        # can crash the interpreter at exit.
+        extract_dir = os.path.join(self.tempdir.name, "extracted")
+        with zipfile.ZipFile(zip_filename) as z:
+            names = z.namelist()
+            z.extractall(extract_dir)
+        return {
+            name: pyarrow.parquet.read_table(os.path.join(extract_dir, name))
+            for name in names
+        }
+
+    def _write_in_memory_version(self) -> str:
+        coll = SpreadsheetCollection()
+        self._add_test_pages(coll)
+        filename = os.path.join(self.tempdir.name, "in_memory.zip")
+        with open(filename, "wb") as f:
+            f.write(coll.as_parquet_zip())
+        return filename
+
+    def test_column_types_preserved(self) -> None:
+        tables = self._read_tables(self._write_in_memory_version())
+
+        self.assertEqual(
+            sorted(tables.keys()), ["other.parquet", "test.parquet"]
+        )
+        table = tables["test.parquet"]
+        schema = table.schema
+        self.assertEqual(schema.field("int").type, pyarrow.int64())
+        self.assertEqual(schema.field("float").type, pyarrow.float64())
+        self.assertEqual(schema.field("int_and_float").type, pyarrow.float64())
+        self.assertEqual(schema.field("bool").type, pyarrow.bool_())
+        self.assertEqual(schema.field("str").type, pyarrow.string())
+        self.assertEqual(
+            schema.field("when").type, pyarrow.timestamp("us", tz="UTC")
+        )
+        self.assertEqual(schema.field("date").type, pyarrow.date32())
+        self.assertEqual(schema.field("uuid").type, pyarrow.string())
+        self.assertEqual(schema.field("mixed").type, pyarrow.string())
+        self.assertEqual(schema.field("null").type, pyarrow.null())
+
+        data = table.to_pydict()
+        self.assertEqual(data["int"], [1, None])
+        self.assertEqual(data["int_and_float"], [1.0, 2.5])
+        self.assertEqual(data["str"], ["one", None])
+        self.assertEqual(
+            data["when"][0],
+            datetime.datetime(
+                2020, 1, 2, 2, 4, 5, tzinfo=datetime.timezone.utc
+            ),
+        )
+        self.assertEqual(data["date"], [datetime.date(2020, 1, 2), None])
+        self.assertEqual(data["uuid"], [str(uuid.UUID(int=1)), None])
+        self.assertEqual(data["mixed"], ["1", "two"])
+
+    def test_spooled_matches_in_memory_version(self) -> None:
+        in_memory = self._read_tables(self._write_in_memory_version())
+
+        filename = os.path.join(self.tempdir.name, "spooled.zip")
+        with SpooledSpreadsheetCollection(self.tempdir.name) as coll:
+            self._add_test_pages(coll)
+            coll.write_parquet_zip(filename)
+        spooled = self._read_tables(filename)
+
+        self.assertEqual(spooled.keys(), in_memory.keys())
+        for name, table in spooled.items():
+            self.assertTrue(table.equals(in_memory[name]), msg=name)
@@ -0,0 +1,147 @@
+"""
+camcops_server/cc_modules/tests/cc_string_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import glob
+import json
+import os
+import shutil
+from tempfile import TemporaryDirectory
+from typing import List
+from unittest import TestCase
+
+from camcops_server.cc_modules.cc_baseconstants import (
+    DEFAULT_EXTRA_STRINGS_DIR,
+)
+from camcops_server.cc_modules.cc_string import (
+    read_compiled_extra_strings,
+    read_extra_strings_from_xml,
+    write_compiled_extra_strings,
+)
+
+
+class CompiledExtraStringsTests(TestCase):
+    """
+    Tests of the compiled extra strings file, which must give the same
+    strings as the XML.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tempdir = TemporaryDirectory()
+        self.compiled = os.path.join(self.tempdir.name, "strings.json")
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+        super().tearDown()
+
+    def _copy_xml(self, *basenames: str) -> List[str]:
+        filenames = []
+        for basename in basenames:
+            filename = os.path.join(self.tempdir.name, basename)
+            shutil.copy(
+                os.path.join(DEFAULT_EXTRA_STRINGS_DIR, basename), filename
+            )
+            filenames.append(filename)
+        return sorted(filenames)
+
+    def test_compiled_strings_match_xml(self) -> None:
+        filenames = sorted(
+            glob.glob(os.path.join(DEFAULT_EXTRA_STRINGS_DIR, "*.xml"))
+        )
+        from_xml = read_extra_strings_from_xml(filenames)
+        write_compiled_extra_strings(self.compiled, filenames, from_xml)
+        self.assertEqual(
+            read_compiled_extra_strings(self.compiled, filenames), from_xml
+        )
+
+    def test_compiled_file_readable_by_all(self) -> None:
+        filenames = self._copy_xml("camcops.xml")
+        strings = read_extra_strings_from_xml(filenames)
+        write_compiled_extra_strings(self.compiled, filenames, strings)
+        self.assertEqual(os.stat(self.compiled).st_mode & 0o777, 0o644)
+
+    def test_missing_file_means_rebuild(self) -> None:
+        filenames = self._copy_xml("camcops.xml")
+        self.assertIsNone(
+            read_compiled_extra_strings(self.compiled, filenames)
+        )
+
+    def test_changed_content_means_rebuild(self) -> None:
+        filenames = self._copy_xml("camcops.xml", "phq9.xml")
+        strings = read_extra_strings_from_xml(filenames)
+        write_compiled_extra_strings(self.compiled, filenames, strings)
+        with open(filenames[1], "r+") as f:
+            content = f.read().replace(
+                "</resources>",
+                '<task name="phq9"><string name="x">y</string></task>'
+                "</resources>",
+            )
+            f.seek(0)
+            f.write(content)
+        self.assertIsNone(
+            read_compiled_extra_strings(self.compiled, filenames)
+        )
+
+    def test_changed_file_list_means_rebuild(self) -> None:
+        filenames = self._copy_xml("camcops.xml", "phq9.xml")
+        strings = read_extra_strings_from_xml(filenames)
+        write_compiled_extra_strings(self.compiled, filenames, strings)
+        self.assertIsNone(
+            read_compiled_extra_strings(self.compiled, filenames[:1])
+        )
+
+    def test_changed_time_same_content_reused(self) -> None:
+        filenames = self._copy_xml("camcops.xml")
+        strings = read_extra_strings_from_xml(filenames)
+        write_compiled_extra_strings(self.compiled, filenames, strings)
+        statinfo = os.stat(filenames[0])
+        new_mtime_ns = statinfo.st_mtime_ns + 1_000_000_000
+        os.utime(filenames[0], ns=(statinfo.st_atime_ns, new_mtime_ns))
+
+        self.assertEqual(
+            read_compiled_extra_strings(self.compiled, filenames), strings
+        )
+        # The new time has been recorded:
+        with open(self.compiled, "rt", encoding="utf-8") as f:
+            sources = json.loads(f.readline())["sources"]
+        self.assertEqual(sources[0][1], new_mtime_ns)
+
+    def test_corrupt_file_means_rebuild(self) -> None:
+        filenames = self._copy_xml("camcops.xml")
+        for contents in (
+            b"not JSON",
+            b"\x80\x05not UTF-8",  # e.g. an old (pickle) compiled file
+            b'{"version": 2, "sources": [["too", "short"]]}\n{}\n',
+            b'["not", "a", "header"]\n{}\n',
+        ):
+            with self.subTest(contents=contents):
+                with open(self.compiled, "wb") as f:
+                    f.write(contents)
+                with self.assertLogs(level="WARNING"):
+                    self.assertIsNone(
+                        read_compiled_extra_strings(self.compiled, filenames)
+                    )
@@ -25,14 +25,40 @@ camcops_server/cc_modules/tests/cc_taskcollection_tests.py
 
 """
 
+import datetime
+from typing import cast
+from unittest import mock
+
 from kombu.serialization import dumps, loads
+import pendulum
+from pendulum import DateTime as Pendulum
+from sqlalchemy.sql.schema import Table
+
+from camcops_server.cc_modules.cc_client_api_core import UploadTableChanges
+from camcops_server.cc_modules.cc_exportmodels import (
+    get_collection_for_export,
+)
+from camcops_server.cc_modules.cc_exportrecipientinfo import (
+    ExportTransmissionMethod,
+)
 from camcops_server.cc_modules.cc_taskcollection import (
     TaskCollection,
     TaskSortMethod,
 )
 
 from camcops_server.cc_modules.cc_taskfilter import TaskFilter
+from camcops_server.cc_modules.cc_taskindex import (
+    PendingIndexUpdate,
+    TaskIndexEntry,
+)
+from camcops_server.cc_modules.cc_testfactories import (
+    ExportRecipientFactory,
+    NHSPatientIdNumFactory,
+)
 from camcops_server.cc_modules.cc_unittest import BasicDatabaseTestCase
+from camcops_server.tasks.bmi import Bmi
+from camcops_server.tasks.phq9 import Phq9
+from camcops_server.tasks.tests.factories import BmiFactory
 
 # =============================================================================
 # Unit tests
@@ -62,3 +88,354 @@ class TaskCollectionTests(BasicDatabaseTestCase):
             new_coll._filter.task_types, ["task1", "task2", "task3"]
         )
         self.assertEqual(new_coll._filter.group_ids, [1, 2, 3])
+        # Collections are sent to the back end as a snapshot, which can
+        # still use the index:
+        self.assertIsInstance(new_coll._snapshot_utc, datetime.datetime)
+        self.assertTrue(new_coll._via_index)
+
+    def test_snapshot_survives_serialization(self) -> None:
+        snapshot_utc = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        coll = TaskCollection(
+            self.req, taskfilter=TaskFilter(), snapshot_utc=snapshot_utc
+        )
+        content_type, encoding, data = dumps(coll, serializer="json")
+        new_coll = loads(data, content_type, encoding)
+
+        self.assertEqual(new_coll._snapshot_utc, snapshot_utc)
+
+    def _add_pending_index_update(self, table: Table) -> None:
+        self.dbsession.add(
+            PendingIndexUpdate(
+                device_id=self.server_device.id,
+                batch_utc=datetime.datetime(2020, 1, 2, 3, 4, 5),
+                tablename=table.name,
+                table_changes=UploadTableChanges(table).pks_as_dict(),
+            )
+        )
+        self.dbsession.flush()
+
+    def test_index_not_used_while_index_updates_pending(self) -> None:
+        self.req.config.index_uploads_in_background = True
+        coll = TaskCollection(self.req, taskfilter=TaskFilter())
+        self.assertTrue(coll._using_index())
+
+        self._add_pending_index_update(cast(Table, Bmi.__table__))
+
+        coll = TaskCollection(self.req, taskfilter=TaskFilter())
+        self.assertFalse(coll._using_index())
+
+    def test_back_end_checks_pending_index_updates(self) -> None:
+        self.req.config.index_uploads_in_background = True
+        self._add_pending_index_update(cast(Table, Bmi.__table__))
+        coll = TaskCollection(self.req, taskfilter=TaskFilter())
+        content_type, encoding, data = dumps(coll, serializer="json")
+        new_coll = loads(data, content_type, encoding)
+        new_coll.set_request(self.req)
+
+        self.assertEqual(new_coll.all_tasks, [])
+        self.assertFalse(new_coll._via_index)
+
+    def test_index_used_if_pending_updates_are_for_other_tables(
+        self,
+    ) -> None:
+        self.req.config.index_uploads_in_background = True
+        self._add_pending_index_update(cast(Table, Bmi.__table__))
+
+        taskfilter = TaskFilter()
+        taskfilter.task_types = [Phq9.__tablename__]
+        coll = TaskCollection(self.req, taskfilter=taskfilter)
+        self.assertTrue(coll._using_index())
+
+    def test_pending_updates_not_checked_unless_indexing_in_background(
+        self,
+    ) -> None:
+        self.req.config.index_uploads_in_background = False
+        with mock.patch(
+            "camcops_server.cc_modules.cc_taskcollection."
+            "any_pending_index_updates"
+        ) as mock_any_pending:
+            coll = TaskCollection(self.req, taskfilter=TaskFilter())
+            self.assertTrue(coll._using_index())
+        mock_any_pending.assert_not_called()
+
+
+class TaskCollectionChunkTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+
+        idnum = NHSPatientIdNumFactory()
+        self.recipient = ExportRecipientFactory(
+            transmission_method=ExportTransmissionMethod.FILE,
+            all_groups=True,
+            tasks=["bmi"],
+            finalized_only=False,
+            primary_idnum=idnum.which_idnum,
+        )
+        self.tasks = [BmiFactory(patient=idnum.patient) for _ in range(7)]
+        now = Pendulum.utcnow()
+        for task in self.tasks:
+            TaskIndexEntry.index_task(task, self.dbsession, indexed_at_utc=now)
+        self.dbsession.commit()
+
+    def _check_chunks(self, via_index: bool) -> None:
+        collection = get_collection_for_export(
+            self.req, self.recipient, via_index=via_index
+        )
+
+        task_chunks = list(
+            collection.gen_task_chunks_for_task_class(Bmi, chunk_size=3)
+        )
+
+        self.assertEqual([len(chunk) for chunk in task_chunks], [3, 3, 1])
+        self.assertEqual(
+            [task.pk for chunk in task_chunks for task in chunk],
+            sorted(task.pk for task in self.tasks),
+        )
+        self.assertNotIn(Bmi, collection._tasks_by_class)
+
+    def test_chunks_without_index(self) -> None:
+        self._check_chunks(via_index=False)
+
+    def test_chunks_via_index(self) -> None:
+        self._check_chunks(via_index=True)
+
+    def test_full_query_built_once_not_per_chunk(self) -> None:
+        collection = get_collection_for_export(
+            self.req, self.recipient, via_index=False
+        )
+
+        with mock.patch.object(
+            collection, "_serial_query", wraps=collection._serial_query
+        ) as mock_serial_query:
+            task_chunks = list(
+                collection.gen_task_chunks_for_task_class(Bmi, chunk_size=3)
+            )
+
+        self.assertEqual(len(task_chunks), 3)
+        mock_serial_query.assert_called_once_with(Bmi)
+
+    def test_chunked_tasks_are_expunged_once_used(self) -> None:
+        for task in self.tasks:
+            self.dbsession.expunge(task)
+        collection = get_collection_for_export(
+            self.req, self.recipient, via_index=False
+        )
+
+        seen = []
+        for task in collection.gen_tasks_for_task_class_chunked(
+            Bmi, chunk_size=3
+        ):
+            self.assertIn(task, self.dbsession)
+            seen.append(task)
+
+        self.assertEqual(len(seen), len(self.tasks))
+        for task in seen:
+            self.assertNotIn(task, self.dbsession)
+
+    def test_tasks_already_in_session_are_not_expunged(self) -> None:
+        collection = get_collection_for_export(
+            self.req, self.recipient, via_index=False
+        )
+
+        list(collection.gen_tasks_for_task_class_chunked(Bmi, chunk_size=3))
+
+        for task in self.tasks:
+            self.assertIn(task, self.dbsession)
+
+
+class TaskCollectionChunkOrderTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+
+        idnum = NHSPatientIdNumFactory()
+        when_created = [
+            pendulum.datetime(2020, 3, 1, tz="UTC"),
+            pendulum.datetime(2020, 1, 1, tz="UTC"),
+            # Same moment, different timezone; upload time breaks the tie:
+            pendulum.datetime(2020, 2, 1, 1, tz=pendulum.fixed_timezone(3600)),
+            pendulum.datetime(2020, 2, 1, tz="UTC"),
+            pendulum.datetime(2020, 1, 15, tz="UTC"),
+        ]
+        uploaded = [
+            datetime.datetime(2021, 1, 1),
+            datetime.datetime(2021, 1, 2),
+            datetime.datetime(2021, 1, 4),
+            datetime.datetime(2021, 1, 3),
+            datetime.datetime(2021, 1, 5),
+        ]
+        tasks = [
+            BmiFactory(
+                patient=idnum.patient,
+                when_created=created,
+                _when_added_batch_utc=added,
+            )
+            for created, added in zip(when_created, uploaded)
+        ]
+        now = Pendulum.utcnow()
+        for task in tasks:
+            TaskIndexEntry.index_task(task, self.dbsession, indexed_at_utc=now)
+        self.dbsession.commit()
+
+        self.taskfilter = TaskFilter()
+        self.taskfilter.task_types = [Bmi.__tablename__]
+
+    def _check_order(
+        self, sort_method: TaskSortMethod, via_index: bool
+    ) -> None:
+        def make_collection() -> TaskCollection:
+            return TaskCollection(
+                self.req,
+                taskfilter=self.taskfilter,
+                as_dump=True,
+                sort_method_by_class=sort_method,
+                via_index=via_index,
+            )
+
+        expected = [
+            task.pk for task in make_collection().tasks_for_task_class(Bmi)
+        ]
+        chunked_collection = make_collection()
+        chunked = [
+            task.pk
+            for task in chunked_collection.gen_tasks_for_task_class_chunked(
+                Bmi, chunk_size=2
+            )
+        ]
+
+        self.assertEqual(chunked, expected)
+        self.assertNotIn(Bmi, chunked_collection._tasks_by_class)
+
+    def test_ascending_without_index(self) -> None:
+        self._check_order(TaskSortMethod.CREATION_DATE_ASC, via_index=False)
+
+    def test_descending_without_index(self) -> None:
+        self._check_order(TaskSortMethod.CREATION_DATE_DESC, via_index=False)
+
+    def test_ascending_via_index(self) -> None:
+        self._check_order(TaskSortMethod.CREATION_DATE_ASC, via_index=True)
+
+    def test_descending_via_index(self) -> None:
+        self._check_order(TaskSortMethod.CREATION_DATE_DESC, via_index=True)
+
+
+class TaskCollectionSnapshotTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+
+        self.snapshot_utc = datetime.datetime(2022, 6, 1, 12, 0, 0)
+        before = datetime.datetime(2022, 1, 1)
+        after = datetime.datetime(2022, 12, 1)
+
+        idnum = NHSPatientIdNumFactory()
+        patient = idnum.patient
+        self.unchanged = BmiFactory(
+            patient=patient, _when_added_batch_utc=before
+        )
+        # A task that was edited after the snapshot: the old version was
+        # current at the time of the snapshot.
+        self.edited_old = BmiFactory(
+            patient=patient, _when_added_batch_utc=before
+        )
+        self.edited_old._current = False
+        self.edited_old._when_removed_batch_utc = after
+        self.edited_new = BmiFactory(
+            patient=patient, _when_added_batch_utc=after
+        )
+        # A task deleted before the snapshot:
+        deleted = BmiFactory(patient=patient, _when_added_batch_utc=before)
+        deleted._current = False
+        deleted._when_removed_batch_utc = before
+        # A task uploaded after the snapshot:
+        self.added_later = BmiFactory(
+            patient=patient, _when_added_batch_utc=after
+        )
+        now = Pendulum.utcnow()
+        for task in (self.unchanged, self.edited_new, self.added_later):
+            TaskIndexEntry.index_task(task, self.dbsession, indexed_at_utc=now)
+        self.dbsession.commit()
+
+        self.taskfilter = TaskFilter()
+        self.taskfilter.task_types = [Bmi.__tablename__]
+
+    def _task_pks(self, collection: TaskCollection) -> list:
+        return sorted(task.pk for task in collection.gen_tasks_by_class())
+
+    def test_tasks_as_at_snapshot(self) -> None:
+        collection = TaskCollection(
+            self.req,
+            taskfilter=self.taskfilter,
+            as_dump=True,
+            via_index=False,
+            snapshot_utc=self.snapshot_utc,
+        )
+
+        self.assertEqual(
+            self._task_pks(collection),
+            sorted([self.unchanged.pk, self.edited_old.pk]),
+        )
+
+    def test_index_not_used_if_tasks_changed_since_snapshot(self) -> None:
+        collection = TaskCollection(
+            self.req,
+            taskfilter=self.taskfilter,
+            as_dump=True,
+            snapshot_utc=self.snapshot_utc,
+        )
+
+        # The index only describes current tasks, so wouldn't include the
+        # edited task as it was at the snapshot.
+        self.assertEqual(
+            self._task_pks(collection),
+            sorted([self.unchanged.pk, self.edited_old.pk]),
+        )
+        self.assertFalse(collection._via_index)
+
+    def test_index_used_with_snapshot_if_nothing_changed_since(
+        self,
+    ) -> None:
+        collection = TaskCollection(
+            self.req,
+            taskfilter=self.taskfilter,
+            as_dump=True,
+            snapshot_utc=datetime.datetime(2023, 1, 1),
+        )
+
+        self.assertEqual(
+            self._task_pks(collection),
+            sorted(
+                [self.unchanged.pk, self.edited_new.pk, self.added_later.pk]
+            ),
+        )
+        self.assertTrue(collection._via_index)
+
+    def test_current_tasks_without_snapshot(self) -> None:
+        collection = TaskCollection(
+            self.req, taskfilter=self.taskfilter, as_dump=True, via_index=False
+        )
+
+        self.assertEqual(
+            self._task_pks(collection),
+            sorted(
+                [self.unchanged.pk, self.edited_new.pk, self.added_later.pk]
+            ),
+        )
+
+    def test_back_end_fetches_snapshot_in_chunks(self) -> None:
+        collection = TaskCollection(
+            self.req,
+            taskfilter=self.taskfilter,
+            as_dump=True,
+            snapshot_utc=self.snapshot_utc,
+        )
+        content_type, encoding, data = dumps(collection, serializer="json")
+        new_collection = loads(data, content_type, encoding)
+        new_collection.set_request(self.req)
+
+        task_chunks = list(
+            new_collection.gen_task_chunks_for_task_class(Bmi, chunk_size=1)
+        )
+
+        self.assertEqual(
+            [task.pk for chunk in task_chunks for task in chunk],
+            [self.unchanged.pk, self.edited_old.pk],
+        )
@@ -25,6 +25,10 @@ camcops_server/cc_modules/tests/cc_user_tests.py
 
 """
 
+from typing import Optional
+from unittest import mock
+
+import cardinal_pythonlib.crypto as rnc_crypto
 from pendulum import DateTime as Pendulum
 import phonenumbers
 
@@ -45,6 +49,7 @@ from camcops_server.cc_modules.cc_user import (
     SecurityAccountLockout,
     SecurityLoginFailure,
     User,
+    VERIFIED_CREDENTIALS,
 )
 
 # =============================================================================
@@ -960,3 +965,93 @@ class SetGroupIdsTests(DemoRequestTestCase):
         self.dbsession.refresh(user)
 
         self.assertEqual(len(user.user_group_memberships), 2)
+
+
+class VerifiedCredentialCacheTests(DemoRequestTestCase):
+    password = "correct horse battery staple"
+
+    def setUp(self) -> None:
+        super().setUp()
+        VERIFIED_CREDENTIALS.clear()
+        self.addCleanup(VERIFIED_CREDENTIALS.clear)
+        self.user = UserFactory(
+            password=self.password, password__request=self.req
+        )
+        self.dbsession.flush()
+
+        patcher = mock.patch(
+            "camcops_server.cc_modules.cc_user.rnc_crypto.is_password_valid",
+            wraps=rnc_crypto.is_password_valid,
+        )
+        self.mock_is_password_valid = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get_user(
+        self, password: str = None, use_credential_cache: bool = True
+    ) -> Optional[User]:
+        return User.get_user_from_username_password(
+            self.req,
+            self.user.username,
+            self.password if password is None else password,
+            use_credential_cache=use_credential_cache,
+        )
+
+    def test_repeat_verification_skips_bcrypt(self) -> None:
+        for _ in range(5):
+            self.assertEqual(self._get_user(), self.user)
+
+        self.assertEqual(self.mock_is_password_valid.call_count, 1)
+
+    def test_cache_not_used_unless_requested(self) -> None:
+        self._get_user()
+        self._get_user(use_credential_cache=False)
+
+        self.assertEqual(self.mock_is_password_valid.call_count, 2)
+
+    def test_wrong_password_always_checked(self) -> None:
+        self._get_user()
+        for _ in range(3):
+            self.assertIsNone(self._get_user("wrong"))
+
+        self.assertEqual(self.mock_is_password_valid.call_count, 4)
+
+    def test_password_change_invalidates(self) -> None:
+        self._get_user()
+        self.user.set_password(self.req, "new password")
+
+        self.assertIsNone(self._get_user())
+        self.assertEqual(self._get_user("new password"), self.user)
+
+    def test_password_change_elsewhere_invalidates(self) -> None:
+        self._get_user()
+        # As if changed by another process, so this cache isn't told:
+        self.user.hashedpw = rnc_crypto.hash_password("new password", 4)
+
+        self.assertIsNone(self._get_user())
+
+    def test_lockout_bypasses_cache(self) -> None:
+        self._get_user()
+        SecurityAccountLockout.lock_user_out(self.req, self.user.username, 5)
+
+        # Same result as without the cache, but bcrypt is run:
+        self.assertEqual(self._get_user(), self.user)
+        self.assertEqual(self.mock_is_password_valid.call_count, 2)
+
+        SecurityAccountLockout.unlock_user(self.req, self.user.username)
+        self._get_user()
+        self._get_user()
+        self.assertEqual(self.mock_is_password_valid.call_count, 3)
+
+    def test_verification_expires(self) -> None:
+        with mock.patch(
+            "camcops_server.cc_modules.cc_user.time.monotonic",
+            return_value=1000.0,
+        ):
+            self._get_user()
+        with mock.patch(
+            "camcops_server.cc_modules.cc_user.time.monotonic",
+            return_value=1000.0 + VERIFIED_CREDENTIALS.ttl_s,
+        ):
+            self._get_user()
+
+        self.assertEqual(self.mock_is_password_valid.call_count, 2)
@@ -0,0 +1,188 @@
+"""
+camcops_server/cc_modules/tests/cc_userdownload_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import datetime
+import os
+import tempfile
+from unittest import mock
+
+from cardinal_pythonlib.datetimefunc import get_now_utc_datetime
+from sqlalchemy import select
+
+from camcops_server.cc_modules import celery
+from camcops_server.cc_modules.cc_testfactories import UserFactory
+from camcops_server.cc_modules.cc_unittest import BasicDatabaseTestCase
+from camcops_server.cc_modules.cc_userdownload import (
+    delete_expired_user_downloads,
+    reconcile_user_downloads,
+    UserDownloadRecord,
+)
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+
+class UserDownloadRecordTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.basedir = tempdir.name
+        self.req.config.user_download_dir = self.basedir
+        self.req.config.user_download_max_space_mb = 100
+        self.other_user = UserFactory()
+        self.dbsession.flush()
+
+    def _write_file(self, user_id: int, filename: str, size: int) -> str:
+        userdir = os.path.join(self.basedir, str(user_id))
+        os.makedirs(userdir, exist_ok=True)
+        fullpath = os.path.join(userdir, filename)
+        with open(fullpath, "wb") as f:
+            f.write(b"x" * size)
+        return fullpath
+
+    def _records(self) -> dict:
+        return {
+            (r.user_id, r.filename): r.size_bytes
+            for r in self.dbsession.execute(
+                select(UserDownloadRecord)
+            ).scalars()
+        }
+
+    def test_quota_uses_ledger(self) -> None:
+        user_id = self.req.user_id
+        UserDownloadRecord.record_file(self.req, user_id, "a.zip", 100)
+        UserDownloadRecord.record_file(self.req, user_id, "b.zip", 20)
+        UserDownloadRecord.record_file(self.req, self.other_user.id, "a", 7)
+        # Recording a file again replaces the old record:
+        UserDownloadRecord.record_file(self.req, user_id, "b.zip", 30)
+        self.dbsession.flush()
+
+        self.assertEqual(self.req.user_download_bytes_used, 130)
+        self.assertEqual(
+            self.req.user_download_bytes_available,
+            100 * 1024 * 1024 - 130,
+        )
+
+        UserDownloadRecord.forget_file(self.dbsession, user_id, "a.zip")
+        self.assertEqual(
+            UserDownloadRecord.get_bytes_used(self.dbsession, user_id), 30
+        )
+        self.assertEqual(
+            UserDownloadRecord.get_bytes_used(self.dbsession, 99999), 0
+        )
+
+    def test_expired_files_deleted(self) -> None:
+        user_id = self.req.user_id
+        old = self._write_file(user_id, "old.zip", 10)
+        new = self._write_file(user_id, "new.zip", 10)
+        UserDownloadRecord.record_file(self.req, user_id, "old.zip", 10)
+        UserDownloadRecord.record_file(self.req, user_id, "new.zip", 10)
+        UserDownloadRecord.record_file(self.req, user_id, "gone.zip", 10)
+        past = get_now_utc_datetime() - datetime.timedelta(minutes=1)
+        for record in self.dbsession.execute(
+            select(UserDownloadRecord).where(
+                UserDownloadRecord.filename.in_(["old.zip", "gone.zip"])
+            )
+        ).scalars():
+            record.expires_at_utc = past
+        self.dbsession.flush()
+
+        self.assertEqual(delete_expired_user_downloads(self.req), 2)
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        self.assertEqual(self._records(), {(user_id, "new.zip"): 10})
+
+    def test_reconcile_with_disk(self) -> None:
+        user_id = self.req.user_id
+        self._write_file(user_id, "unrecorded.zip", 5)
+        self._write_file(user_id, "resized.zip", 50)
+        self._write_file(self.other_user.id, "recorded.zip", 3)
+        stray = os.path.join(self.basedir, "stray.txt")
+        with open(stray, "w") as f:
+            f.write("not in a user's directory")
+        UserDownloadRecord.record_file(self.req, user_id, "resized.zip", 10)
+        UserDownloadRecord.record_file(
+            self.req, self.other_user.id, "recorded.zip", 3
+        )
+        UserDownloadRecord.record_file(self.req, user_id, "deleted.zip", 10)
+        self.dbsession.flush()
+
+        with self.assertLogs(level="WARNING") as logging_cm:
+            result = reconcile_user_downloads(self.req)
+        self.dbsession.flush()
+
+        self.assertEqual(result, (1, 1, 1))
+        self.assertIn(stray, "\n".join(logging_cm.output))
+        self.assertTrue(os.path.exists(stray))
+        self.assertEqual(
+            self._records(),
+            {
+                (user_id, "unrecorded.zip"): 5,
+                (user_id, "resized.zip"): 50,
+                (self.other_user.id, "recorded.zip"): 3,
+            },
+        )
+        # The expiry of an unrecorded file is based on its modification time.
+        added = self.dbsession.execute(
+            select(UserDownloadRecord).where(
+                UserDownloadRecord.filename == "unrecorded.zip"
+            )
+        ).scalar_one()
+        self.assertEqual(
+            added.expires_at_utc - added.created_at_utc,
+            self.req.user_download_lifetime_duration,
+        )
+
+        self.assertEqual(reconcile_user_downloads(self.req), (0, 0, 0))
+
+    def test_first_housekeeping_pass_records_existing_files(self) -> None:
+        user_id = self.req.user_id
+        old = self._write_file(user_id, "old.zip", 10)
+        self._write_file(user_id, "new.zip", 20)
+        old_mtime = (
+            get_now_utc_datetime()
+            - self.req.user_download_lifetime_duration
+            - datetime.timedelta(minutes=1)
+        ).timestamp()
+        os.utime(old, (old_mtime, old_mtime))
+
+        with mock.patch.object(celery, "_user_downloads_reconciled", False):
+            celery.delete_old_user_downloads(self.req)
+            self.dbsession.flush()
+
+            self.assertFalse(os.path.exists(old))
+            self.assertEqual(self._records(), {(user_id, "new.zip"): 20})
+
+            # Later passes use the ledger alone.
+            self._write_file(user_id, "later.zip", 5)
+            celery.delete_old_user_downloads(self.req)
+            self.dbsession.flush()
+
+            self.assertEqual(self._records(), {(user_id, "new.zip"): 20})
@@ -0,0 +1,161 @@
+"""
+camcops_server/cc_modules/tests/cc_xml_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import base64
+from unittest import TestCase
+
+from cardinal_pythonlib.httpconst import MimeType
+
+from camcops_server.cc_modules.cc_response import XmlStreamingResponse
+from camcops_server.cc_modules.cc_xml import (
+    gen_xml_document,
+    get_xml_blob_element,
+    get_xml_document,
+    XML_BASE64_CHUNK_BYTES,
+    XmlDataTypes,
+    XmlElement,
+    XmlLiteral,
+)
+
+
+class XmlDocumentTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.blobdata = bytes(range(256)) * 3
+        self.root = XmlElement(
+            name="root",
+            value=[
+                XmlElement(
+                    name="flag",
+                    value=True,
+                    datatype=XmlDataTypes.BOOLEAN,
+                    comment='A "flag"',
+                ),
+                XmlElement(
+                    name="nothing", value=None, datatype=XmlDataTypes.INTEGER
+                ),
+                XmlLiteral("<!-- literal -->"),
+                XmlElement(name="text", value="a < b & c", comment="Text"),
+                XmlElement(
+                    name="child",
+                    value=[
+                        XmlElement(
+                            name="n", value=3, datatype=XmlDataTypes.INTEGER
+                        )
+                    ],
+                ),
+                get_xml_blob_element("blob", self.blobdata, comment="BLOB"),
+                get_xml_blob_element("empty_blob", None),
+            ],
+        )
+
+    def test_document_rendered_as_before(self) -> None:
+        b64 = base64.b64encode(self.blobdata).decode("ascii")
+        self.assertEqual(
+            get_xml_document(self.root),
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<root xmlns:xsi="https://www.w3.org/2001/XMLSchema-instance">\n'
+            '    <flag xsi:type="boolean">true</flag>\n'
+            '    <nothing xsi:type="integer" xsi:nil="true"/>\n'
+            "    <!-- literal -->\n"
+            "    <text>a &lt; b &amp; c</text>\n"
+            "    <child>\n"
+            '        <n xsi:type="integer">3</n>\n'
+            "    </child>\n"
+            f'    <blob xsi:type="base64Binary">{b64}</blob>\n'
+            '    <empty_blob xsi:type="base64Binary" xsi:nil="true"/>\n'
+            "</root>\n",
+        )
+
+    def test_comments_rendered_as_before(self) -> None:
+        xml = get_xml_document(self.root, include_comments=True)
+        self.assertIn(
+            '<root xmlns:xsi="https://www.w3.org/2001/XMLSchema-instance" '
+            'xmlns:mc="https://schemas.openxmlformats.org/markup-'
+            'compatibility/2006" '
+            'xmlns:ignore="https://camcops.readthedocs.org/ignore" '
+            'mc:Ignorable="ignore">\n',
+            xml,
+        )
+        self.assertIn(
+            '    <flag xsi:type="boolean" ignore:comment=\'A "flag"\'>'
+            "true</flag>\n",
+            xml,
+        )
+
+    def test_streamed_document_identical(self) -> None:
+        for include_comments in (False, True):
+            for indent_spaces in (0, 2, 4):
+                fragments = list(
+                    gen_xml_document(
+                        self.root,
+                        indent_spaces=indent_spaces,
+                        include_comments=include_comments,
+                    )
+                )
+                self.assertGreater(len(fragments), 1)
+                self.assertEqual(
+                    "".join(fragments),
+                    get_xml_document(
+                        self.root,
+                        indent_spaces=indent_spaces,
+                        include_comments=include_comments,
+                    ),
+                )
+
+    def test_large_blob_encoded_in_chunks(self) -> None:
+        for size in (
+            XML_BASE64_CHUNK_BYTES - 1,
+            XML_BASE64_CHUNK_BYTES,
+            2 * XML_BASE64_CHUNK_BYTES + 1,
+        ):
+            blobdata = bytes(i % 251 for i in range(size))
+            element = get_xml_blob_element("blob", blobdata)
+            fragments = list(gen_xml_document(element))
+            b64 = base64.b64encode(blobdata).decode("ascii")
+            self.assertEqual(
+                "".join(fragments),
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<blob xmlns:xsi="https://www.w3.org/2001/XMLSchema-instance"'
+                f' xsi:type="base64Binary">{b64}</blob>\n',
+            )
+            self.assertLessEqual(
+                max(len(f) for f in fragments),
+                XML_BASE64_CHUNK_BYTES * 4 // 3,
+            )
+
+    def test_streaming_response_body(self) -> None:
+        root = XmlElement(name="text", value="café " * 20000)
+        response = XmlStreamingResponse(gen_xml_document(root))
+        blocks = list(response.app_iter)
+
+        self.assertGreater(len(blocks), 1)
+        self.assertEqual(
+            b"".join(blocks), get_xml_document(root).encode("utf-8")
+        )
+        self.assertEqual(response.content_type, MimeType.XML)
+        self.assertEqual(response.charset, "UTF-8")
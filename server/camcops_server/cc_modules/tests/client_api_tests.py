@@ -25,9 +25,10 @@ camcops_server/cc_modules/tests/client_api_tests.py
 
 """
 
+import gzip
 import json
 import string
-from typing import Dict
+from typing import Dict, List
 from unittest import mock, TestCase
 
 from cardinal_pythonlib.classes import class_attribute_names
@@ -44,6 +45,7 @@ from semantic_version import Version
 from sqlalchemy import select
 
 from camcops_server.cc_modules.cc_all_models import CLIENT_TABLE_MAP
+from camcops_server.cc_modules.cc_audit import AuditEntry
 from camcops_server.cc_modules.cc_cache import cache_region_static
 from camcops_server.cc_modules.cc_client_api_core import (
     AllowedTablesFieldNames,
@@ -61,8 +63,13 @@ from camcops_server.cc_modules.cc_device import Device
 from camcops_server.cc_modules.cc_dirtytables import DirtyTable
 from camcops_server.cc_modules.cc_patientidnum import PatientIdNum
 from camcops_server.cc_modules.cc_proquint import uuid_from_proquint
+from camcops_server.cc_modules.cc_request import make_post_body_from_dict
 from camcops_server.cc_modules.cc_taskindex import (
+    any_pending_index_updates,
+    check_indexes,
     PatientIdNumIndexEntry,
+    PendingIndexUpdate,
+    process_pending_index_updates,
     TaskIndexEntry,
 )
 from camcops_server.cc_modules.cc_testfactories import (
@@ -96,6 +103,7 @@ from camcops_server.cc_modules.client_api import (
     make_single_user_mode_username,
     Operations,
     SUCCESS_CODE,
+    UNCHANGED_RESULT,
 )
 from camcops_server.tasks import Bmi
 from camcops_server.tasks.tests.factories import BmiFactory, Phq9Factory
@@ -260,6 +268,94 @@ class MalformedRequestTests(ClientApiTestCase):
         self.assertIn(b"Not a valid CamCOPS API request", response.body)
 
 
+class CompressionTests(ClientApiTestCase):
+    """
+    Tests of gzip-compressed requests and replies.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.post_dict[TabletParam.OPERATION] = Operations.GET_ALLOWED_TABLES
+
+    def call_api_gzipped(self, body: bytes) -> Response:
+        self.req.set_post_body(body)
+        self.req.headers["Content-Encoding"] = "gzip"
+        return client_api(self.req)
+
+    def test_gzipped_request_succeeds(self) -> None:
+        response = self.call_api_gzipped(
+            gzip.compress(make_post_body_from_dict(self.post_dict))
+        )
+        reply_dict = get_reply_dict_from_response(response)
+
+        self.assertEqual(
+            reply_dict[TabletParam.SUCCESS], SUCCESS_CODE, msg=reply_dict
+        )
+        self.assertGreater(int(reply_dict[TabletParam.NRECORDS]), 0)
+        self.assertNotIn("Content-Encoding", self.req.headers)
+
+    def test_decompression_bomb_rejected(self) -> None:
+        self.req.config.client_api_max_decompressed_mb = 1
+        body = (
+            make_post_body_from_dict(self.post_dict)
+            + b"&x="
+            + (b"0" * (1024 * 1024))
+        )
+        compressed = gzip.compress(body)
+        self.assertLess(len(compressed), 10 * 1024)
+
+        response = self.call_api_gzipped(compressed)
+
+        self.assertEqual(response.status, "413 Payload Too Large")
+
+    def test_invalid_gzip_rejected(self) -> None:
+        body = gzip.compress(make_post_body_from_dict(self.post_dict))
+        for bad_body in (b"rubbish", body[:-10], body + body):
+            response = self.call_api_gzipped(bad_body)
+
+            self.assertEqual(
+                response.status, "400 Bad Request", msg=repr(bad_body)
+            )
+
+    def test_unsupported_encoding_rejected(self) -> None:
+        self.req.fake_request_post_from_dict(self.post_dict)
+        self.req.headers["Content-Encoding"] = "br"
+
+        response = client_api(self.req)
+
+        self.assertEqual(response.status, "400 Bad Request")
+
+    def test_gzip_reply_matches_plain_reply(self) -> None:
+        self.req.fake_request_post_from_dict(self.post_dict)
+        plain_response = client_api(self.req)
+        self.assertIsNone(plain_response.content_encoding)
+
+        self.req.headers["Accept-Encoding"] = "gzip, deflate"
+        gzip_response = client_api(self.req)
+
+        self.assertEqual(gzip_response.content_encoding, "gzip")
+        self.assertIn("Accept-Encoding", gzip_response.vary)
+        self.assertLess(len(gzip_response.body), len(plain_response.body))
+        self.assertEqual(
+            gzip.decompress(gzip_response.body), plain_response.body
+        )
+
+    def test_small_reply_not_compressed(self) -> None:
+        self.post_dict[TabletParam.OPERATION] = (
+            Operations.CHECK_DEVICE_REGISTERED
+        )
+        self.req.fake_request_post_from_dict(self.post_dict)
+        self.req.headers["Accept-Encoding"] = "gzip"
+
+        response = client_api(self.req)
+
+        self.assertIsNone(response.content_encoding)
+        reply_dict = get_reply_dict_from_response(response)
+        self.assertEqual(
+            reply_dict[TabletParam.SUCCESS], SUCCESS_CODE, msg=reply_dict
+        )
+
+
 class OpRegisterPatientTests(ClientApiTestCase):
     def setUp(self) -> None:
         super().setUp()
@@ -829,6 +925,127 @@ class OpUploadEntireDatabaseTests(ClientApiTestCase):
         self.assertIsNotNone(bmi._when_removed_batch_utc)
 
 
+class BackgroundIndexingTests(ClientApiTestCase):
+    """
+    Tests of upload index updates performed in the background, with the
+    ``INDEX_UPLOADS_IN_BACKGROUND`` option.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.req.config.index_uploads_in_background = True
+
+        self.recipient = mock.Mock(
+            recipient_name="push_recipient",
+            finalized_only=False,
+            is_upload_suitable_for_push=mock.Mock(return_value=True),
+        )
+        # Replace the (reified) push recipients for this request:
+        self.req.__dict__["all_push_recipients"] = [self.recipient]
+
+    def upload_bmi(self) -> Bmi:
+        now_utc_string = now("UTC").isoformat()
+        patient = PatientFactory(_device=self.device)
+        bmi_data = {
+            "id": "1",
+            "height_m": "1.83",
+            "mass_kg": "67",
+            "when_created": now_utc_string,
+            "when_last_modified": now_utc_string,
+            "_move_off_tablet": "1",
+            "patient_id": str(patient.id),
+        }
+        self.post_dict[TabletParam.OPERATION] = (
+            Operations.UPLOAD_ENTIRE_DATABASE
+        )
+        self.post_dict[TabletParam.FINALIZING] = 1
+        self.post_dict[TabletParam.PKNAMEINFO] = json.dumps({"bmi": "id"})
+        self.post_dict[TabletParam.DBDATA] = json.dumps({"bmi": [bmi_data]})
+
+        reply_dict = self.call_api()
+        self.assertEqual(
+            reply_dict[TabletParam.SUCCESS], SUCCESS_CODE, msg=reply_dict
+        )
+        return self.dbsession.execute(
+            select(Bmi).where(Bmi.id == 1)
+        ).scalar_one()
+
+    def get_bmi_index_entries(self, bmi: Bmi) -> List[TaskIndexEntry]:
+        return list(
+            self.dbsession.execute(
+                select(TaskIndexEntry)
+                .where(TaskIndexEntry.task_table_name == Bmi.__tablename__)
+                .where(TaskIndexEntry.task_pk == bmi.pk)
+            ).scalars()
+        )
+
+    def test_upload_leaves_index_update_pending(self) -> None:
+        bmi = self.upload_bmi()
+
+        self.assertEqual(self.get_bmi_index_entries(bmi), [])
+        self.assertTrue(any_pending_index_updates(self.dbsession))
+        pending = self.dbsession.execute(
+            select(PendingIndexUpdate).where(
+                PendingIndexUpdate.tablename == Bmi.__tablename__
+            )
+        ).scalar_one()
+        self.assertEqual(pending.device_id, self.device.id)
+        self.assertEqual(pending.group_id, self.group.id)
+        self.assertIn(bmi.pk, pending.get_table_changes().task_reindex_pks)
+        self.assertEqual(self.req._pending_export_push_requests, [])
+        # Pending work is not reported as a fault in the index:
+        self.assertTrue(check_indexes(self.dbsession, show_all_bad=True))
+
+    def test_pending_index_update_processed(self) -> None:
+        bmi = self.upload_bmi()
+
+        self.assertGreater(process_pending_index_updates(self.req), 0)
+
+        self.assertEqual(len(self.get_bmi_index_entries(bmi)), 1)
+        self.assertFalse(any_pending_index_updates(self.dbsession))
+        self.assertTrue(check_indexes(self.dbsession, show_all_bad=True))
+        self.assertIn(
+            ("push_recipient", Bmi.__tablename__, bmi.pk),
+            self.req._pending_export_push_requests,
+        )
+
+    def test_index_update_can_be_repeated(self) -> None:
+        bmi = self.upload_bmi()
+        pending = self.dbsession.execute(
+            select(PendingIndexUpdate).where(
+                PendingIndexUpdate.tablename == Bmi.__tablename__
+            )
+        ).scalar_one()
+        table_changes = pending.table_changes
+        process_pending_index_updates(self.req)
+
+        self.dbsession.add(
+            PendingIndexUpdate(
+                device_id=self.device.id,
+                group_id=self.group.id,
+                batch_utc=pending.batch_utc,
+                tablename=Bmi.__tablename__,
+                table_changes=table_changes,
+            )
+        )
+        self.assertEqual(process_pending_index_updates(self.req), 1)
+
+        self.assertEqual(len(self.get_bmi_index_entries(bmi)), 1)
+        self.assertTrue(check_indexes(self.dbsession, show_all_bad=True))
+
+    def test_index_updated_during_upload_by_default(self) -> None:
+        self.req.config.index_uploads_in_background = False
+
+        bmi = self.upload_bmi()
+
+        self.assertEqual(len(self.get_bmi_index_entries(bmi)), 1)
+        self.assertFalse(any_pending_index_updates(self.dbsession))
+        self.assertIn(
+            ("push_recipient", Bmi.__tablename__, bmi.pk),
+            self.req._pending_export_push_requests,
+        )
+
+
 class OpValidatePatientsTests(ClientApiTestCase):
     def setUp(self) -> None:
         super().setUp()
@@ -1235,6 +1452,74 @@ class OpValidatePatientsTests(ClientApiTestCase):
             reply_dict[TabletParam.SUCCESS], SUCCESS_CODE, msg=reply_dict
         )
 
+    def _many_patients_with_nhs_number(self, num_patients: int) -> List[Dict]:
+        iddef = NHSIdNumDefinitionFactory()
+        self.group.upload_policy = f"sex AND idnum{iddef.which_idnum}"
+        self.group.finalize_policy = (
+            f"sex AND forename AND surname AND dob "
+            f"AND idnum{iddef.which_idnum}"
+        )
+        self.dbsession.flush()
+
+        patients = []  # type: List[Dict]
+        for i in range(num_patients):
+            dob = Fake.en_gb.consistent_date_of_birth()
+            patients.append(
+                {
+                    TabletParam.FORENAME: Fake.en_gb.first_name(),
+                    TabletParam.SURNAME: Fake.en_gb.last_name(),
+                    TabletParam.SEX: "F" if i % 2 else "M",
+                    TabletParam.DOB: dob.isoformat(),
+                    f"{TabletParam.IDNUM_PREFIX}{iddef.which_idnum}": (
+                        generate_random_nhs_number()
+                    ),
+                    TabletParam.FINALIZING: bool(i % 3),
+                }
+            )
+        return patients
+
+    def test_succeeds_for_many_valid_patients(self) -> None:
+        patients = self._many_patients_with_nhs_number(3000)
+        self.post_dict[TabletParam.PATIENT_INFO] = json.dumps(patients)
+
+        reply_dict = self.call_api()
+
+        self.assertEqual(
+            reply_dict[TabletParam.SUCCESS], SUCCESS_CODE, msg=reply_dict
+        )
+
+    def test_first_invalid_patient_reported_among_many(self) -> None:
+        patients = self._many_patients_with_nhs_number(3000)
+        # Valid for upload but not for finalizing:
+        patients[2500][TabletParam.FINALIZING] = True
+        del patients[2500][TabletParam.DOB]
+        patients[2800][TabletParam.FINALIZING] = False
+        del patients[2800][TabletParam.SEX]
+
+        # The same error as if that patient had been sent on its own:
+        self.post_dict[TabletParam.PATIENT_INFO] = json.dumps([patients[2500]])
+        single_reply_dict = self.call_api()
+        self.assertEqual(
+            single_reply_dict[TabletParam.SUCCESS],
+            FAILURE_CODE,
+            msg=single_reply_dict,
+        )
+        self.assertIn(
+            "Fails finalizing ID policy",
+            single_reply_dict[TabletParam.ERROR],
+        )
+
+        self.post_dict[TabletParam.PATIENT_INFO] = json.dumps(patients)
+        reply_dict = self.call_api()
+
+        self.assertEqual(
+            reply_dict[TabletParam.SUCCESS], FAILURE_CODE, msg=reply_dict
+        )
+        self.assertEqual(
+            reply_dict[TabletParam.ERROR],
+            single_reply_dict[TabletParam.ERROR],
+        )
+
 
 class OpWhichKeysToSendTests(ClientApiTestCase):
     def setUp(self) -> None:
@@ -2452,6 +2737,65 @@ class OpGetExtraStringsTests(ClientApiTestCase):
             reply_dict["record1"], "'task2','name2','language2','value2'"
         )
 
+    def _extra_strings_audit_details(self) -> List[str]:
+        return list(
+            self.dbsession.execute(
+                select(AuditEntry.details).where(
+                    AuditEntry.details.startswith("get_extra_strings")
+                )
+            ).scalars()
+        )
+
+    def test_returns_unchanged_for_current_hash(self) -> None:
+        reply_dict = self.call_api()
+        self.assertEqual(
+            reply_dict[TabletParam.SUCCESS], SUCCESS_CODE, msg=reply_dict
+        )
+        content_hash = reply_dict[TabletParam.EXTRA_STRINGS_HASH]
+        self.assertGreater(int(reply_dict[TabletParam.NRECORDS]), 0)
+
+        self.post_dict[TabletParam.EXTRA_STRINGS_HASH] = content_hash
+        reply_dict = self.call_api()
+
+        self.assertEqual(
+            reply_dict[TabletParam.SUCCESS], SUCCESS_CODE, msg=reply_dict
+        )
+        self.assertEqual(reply_dict[TabletParam.RESULT], UNCHANGED_RESULT)
+        self.assertEqual(
+            reply_dict[TabletParam.EXTRA_STRINGS_HASH], content_hash
+        )
+        self.assertNotIn(TabletParam.NRECORDS, reply_dict)
+        self.assertEqual(self._extra_strings_audit_details(), [])
+
+    def test_returns_strings_for_stale_hash(self) -> None:
+        self.post_dict[TabletParam.EXTRA_STRINGS_HASH] = "stale"
+        reply_dict = self.call_api()
+
+        self.assertEqual(
+            reply_dict[TabletParam.SUCCESS], SUCCESS_CODE, msg=reply_dict
+        )
+        self.assertGreater(int(reply_dict[TabletParam.NRECORDS]), 0)
+        content_hash = reply_dict[TabletParam.EXTRA_STRINGS_HASH]
+        self.assertNotEqual(content_hash, "stale")
+        self.assertEqual(
+            self._extra_strings_audit_details(),
+            [f"get_extra_strings: sent {content_hash}, replacing stale"],
+        )
+
+    def test_gzip_reply_matches_plain_reply(self) -> None:
+        self.req.fake_request_post_from_dict(self.post_dict)
+        plain_response = client_api(self.req)
+        self.assertIsNone(plain_response.content_encoding)
+
+        self.req.headers["Accept-Encoding"] = "gzip, deflate"
+        gzip_response = client_api(self.req)
+
+        self.assertEqual(gzip_response.content_encoding, "gzip")
+        self.assertLess(len(gzip_response.body), len(plain_response.body))
+        self.assertEqual(
+            gzip.decompress(gzip_response.body), plain_response.body
+        )
+
 
 class OpRegisterDeviceTests(ClientApiTestCase):
     def setUp(self) -> None:
@@ -28,8 +28,10 @@ from collections import OrderedDict
 import datetime
 import json
 import logging
+import os
+import tempfile
 import time
-from typing import cast
+from typing import cast, Dict
 import unittest
 from unittest import mock
 from urllib.parse import urlparse
@@ -40,11 +42,14 @@ from pendulum import Duration, local
 import phonenumbers
 import pyotp
 from pyramid.httpexceptions import HTTPBadRequest, HTTPFound
+from pyramid.response import Response
 from webob.multidict import MultiDict
+from webob.request import BaseRequest
 
 from camcops_server.cc_modules.cc_constants import (
     ERA_NOW,
     MfaMethod,
+    SendfileMethodNames,
     SmsBackendNames,
 )
 from camcops_server.cc_modules.cc_device import Device
@@ -58,6 +63,7 @@ from camcops_server.cc_modules.cc_pyramid import (
     ViewArg,
     ViewParam,
 )
+from camcops_server.cc_modules.cc_simpleobjects import TaskExportOptions
 from camcops_server.cc_modules.cc_sms import ConsoleSmsBackend, get_sms_backend
 from camcops_server.cc_modules.cc_taskindex import PatientIdNumIndexEntry
 from camcops_server.cc_modules.cc_taskschedule import (
@@ -97,7 +103,7 @@ from camcops_server.cc_modules.cc_validators import (
     validate_alphanum_underscore,
 )
 from camcops_server.cc_modules.cc_view_classes import FormWizardMixin
-from camcops_server.tasks.tests.factories import BmiFactory
+from camcops_server.tasks.tests.factories import BmiFactory, PhotoFactory
 from camcops_server.cc_modules.tests.cc_view_classes_tests import (
     TestStateMixin,
 )
@@ -114,6 +120,7 @@ from camcops_server.cc_modules.webview import (
     DeleteServerCreatedPatientView,
     DeleteTaskScheduleItemView,
     DeleteTaskScheduleView,
+    download_file,
     edit_finalized_patient,
     edit_group,
     edit_server_created_patient,
@@ -133,6 +140,7 @@ from camcops_server.cc_modules.webview import (
     LoginView,
     MfaMixin,
     SendEmailFromPatientTaskScheduleView,
+    serve_task,
     view_patient_task_schedule,
     view_patient_task_schedules,
 )
@@ -4743,3 +4751,151 @@ class ForciblyFinalizeTests(BasicDatabaseTestCase):
         for bmi in bmis:
             self.assertEqual(bmi._preserving_user_id, self.groupadmin.id)
             self.assertTrue(bmi._forcibly_preserved)
+
+
+class DownloadFileViewTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.req.config.user_download_dir = tempdir.name
+        self.req.config.user_download_max_space_mb = 100
+        self.contents = bytes(range(256)) * 4096
+        self.fullpath = os.path.join(self.req.user_download_dir, "a b.zip")
+        with open(self.fullpath, "wb") as f:
+            f.write(self.contents)
+        self.req.add_get_params({ViewParam.FILENAME: "a b.zip"})
+
+    def _get(self, headers: Dict[str, str] = None) -> Response:
+        """
+        Passes the view's response through WSGI, for a GET request with the
+        specified headers.
+        """
+        response = download_file(self.req)
+        if response._file is not None:
+            self.addCleanup(response._file.close)
+        return BaseRequest.blank("/", headers=headers).get_response(response)
+
+    def test_file_sent_in_blocks(self) -> None:
+        response = download_file(self.req)
+        self.addCleanup(response._file.close)
+        self.assertFalse(isinstance(response.app_iter, list))
+
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, self.contents)
+        self.assertEqual(response.content_length, len(self.contents))
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+        self.assertEqual(
+            response.content_disposition, "attachment; filename=a b.zip"
+        )
+
+    def test_range_request_served(self) -> None:
+        response = self._get({"Range": "bytes=1000-1999"})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.body, self.contents[1000:2000])
+        self.assertEqual(
+            response.headers["Content-Range"],
+            f"bytes 1000-1999/{len(self.contents)}",
+        )
+
+    def test_open_ended_range_request_served(self) -> None:
+        start = len(self.contents) - 10
+        response = self._get({"Range": f"bytes={start}-"})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.body, self.contents[start:])
+
+    def test_stale_if_range_gets_whole_file(self) -> None:
+        response = self._get({"Range": "bytes=0-9", "If-Range": '"stale"'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, self.contents)
+
+    def test_unsatisfiable_range_rejected(self) -> None:
+        response = self._get({"Range": f"bytes={len(self.contents) + 1}-"})
+
+        self.assertEqual(response.status_code, 416)
+
+    def test_wsgi_file_wrapper_used(self) -> None:
+        file_wrapper = mock.Mock()
+        self.req.environ["wsgi.file_wrapper"] = file_wrapper
+
+        response = download_file(self.req)
+        self.addCleanup(response._file.close)
+
+        self.assertIs(response.app_iter, file_wrapper.return_value)
+        file_wrapper.assert_called_once_with(
+            response._file, response.BLOCK_SIZE
+        )
+
+        # Ranges are still served by seeking within the file:
+        response = self._get({"Range": "bytes=10-19"})
+        self.assertEqual(response.body, self.contents[10:20])
+
+    def test_x_sendfile(self) -> None:
+        self.req.config.user_download_sendfile = SendfileMethodNames.X_SENDFILE
+
+        response = self._get()
+
+        self.assertEqual(response.headers["X-Sendfile"], self.fullpath)
+        self.assertEqual(response.body, b"")
+        self.assertEqual(
+            response.content_disposition, "attachment; filename=a b.zip"
+        )
+
+    def test_x_accel_redirect(self) -> None:
+        self.req.config.user_download_sendfile = (
+            SendfileMethodNames.X_ACCEL_REDIRECT
+        )
+        self.req.config.user_download_accel_redirect_prefix = "/downloads/"
+
+        response = self._get()
+
+        self.assertEqual(
+            response.headers["X-Accel-Redirect"],
+            f"/downloads/{self.req.user_id}/a%20b.zip",
+        )
+        self.assertEqual(response.body, b"")
+
+    def test_missing_file_rejected(self) -> None:
+        self.req.add_get_params({ViewParam.FILENAME: "missing.zip"})
+
+        with self.assertRaises(HTTPBadRequest):
+            download_file(self.req)
+
+
+class ServeTaskXmlViewTests(BasicDatabaseTestCase):
+    def test_xml_streamed_with_blobs(self) -> None:
+        photo = PhotoFactory(
+            patient=NHSPatientIdNumFactory().patient,
+            create_blob__theblob=bytes(range(256)) * 1000,
+        )
+        self.req.add_get_params(
+            {
+                ViewParam.TABLE_NAME: photo.tablename,
+                ViewParam.SERVER_PK: str(photo.pk),
+                ViewParam.VIEWTYPE: ViewArg.XML,
+            }
+        )
+
+        response = serve_task(self.req)
+
+        self.assertFalse(isinstance(response.app_iter, list))
+        self.assertEqual(response.content_type, MimeType.XML)
+        expected = photo.get_xml(
+            self.req,
+            options=TaskExportOptions(
+                xml_include_ancillary=True,
+                include_blobs=True,
+                xml_include_comments=True,
+                xml_include_calculated=True,
+                xml_include_patient=True,
+                xml_include_plain_columns=True,
+                xml_include_snomed=True,
+                xml_with_header_comments=True,
+            ),
+        )
+        self.assertIn(">AAECAwQFBgcI", expected)  # the BLOB
+        self.assertEqual(b"".join(response.app_iter).decode("utf-8"), expected)
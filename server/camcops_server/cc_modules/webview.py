@@ -144,10 +144,8 @@ from cardinal_pythonlib.deform_utils import get_head_form_html
 from cardinal_pythonlib.httpconst import HttpMethod, MimeType
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.pyramid.responses import (
-    BinaryResponse,
     JsonResponse,
     PdfResponse,
-    XmlResponse,
 )
 from cardinal_pythonlib.sqlalchemy.dialect import (
     get_dialect_name,
@@ -283,9 +281,6 @@ from camcops_server.cc_modules.cc_idnumdef import IdNumDefinition
 from camcops_server.cc_modules.cc_membership import UserGroupMembership
 from camcops_server.cc_modules.cc_patient import Patient
 from camcops_server.cc_modules.cc_patientidnum import PatientIdNum
-
-# noinspection PyUnresolvedReferences
-import camcops_server.cc_modules.cc_plot  # import side effects (configure matplotlib)  # noqa
 from camcops_server.cc_modules.cc_pyramid import (
     CamcopsPage,
     FlashQueue,
@@ -301,6 +296,7 @@ from camcops_server.cc_modules.cc_pyramid import (
 )
 from camcops_server.cc_modules.cc_report import get_report_instance
 from camcops_server.cc_modules.cc_request import CamcopsRequest
+from camcops_server.cc_modules.cc_response import XmlStreamingResponse
 from camcops_server.cc_modules.cc_simpleobjects import (
     IdNumReference,
     TaskExportOptions,
@@ -341,6 +337,7 @@ from camcops_server.cc_modules.cc_user import (
     SecurityLoginFailure,
     User,
 )
+from camcops_server.cc_modules.cc_userdownload import UserDownloadRecord
 from camcops_server.cc_modules.cc_validators import (
     validate_download_filename,
     validate_export_recipient_name,
@@ -2145,7 +2142,7 @@ def serve_task(req: "CamcopsRequest") -> Response:
             ),
             xml_with_header_comments=True,
         )
-        return XmlResponse(task.get_xml(req=req, options=options))
+        return XmlStreamingResponse(task.gen_xml(req=req, options=options))
     elif viewtype == ViewArg.FHIRJSON:  # debugging option
         dummy_recipient = ExportRecipient()
         bundle = task.get_fhir_bundle(
@@ -2332,7 +2329,9 @@ def serve_tracker_or_ctv(req: "CamcopsRequest", as_ctv: bool) -> Response:
         return Response(tracker.get_pdf_html())
     elif viewtype == ViewArg.XML:
         include_comments = req.get_bool_param(ViewParam.INCLUDE_COMMENTS, True)
-        return XmlResponse(tracker.get_xml(include_comments=include_comments))
+        return XmlStreamingResponse(
+            tracker.gen_xml(include_comments=include_comments)
+        )
     else:
         permissible = [ViewArg.HTML, ViewArg.PDF, ViewArg.PDFHTML, ViewArg.XML]
         raise HTTPBadRequest(
@@ -2706,12 +2705,7 @@ def download_file(req: "CamcopsRequest") -> Response:
     if not udf.exists:
         raise HTTPBadRequest(f'{_("No such file:")} {filename}')
     try:
-        return BinaryResponse(
-            body=udf.contents,
-            filename=udf.filename,
-            content_type=MimeType.BINARY,
-            as_inline=False,
-        )
+        return udf.make_response(req)
     except OSError:
         raise HTTPBadRequest(f'{_("Error reading file:")} {filename}')
 
@@ -2738,6 +2732,7 @@ def delete_file(req: "CamcopsRequest") -> Response:
         _ = req.gettext
         raise HTTPBadRequest(f'{_("No such file:")} {filename}')
     udf.delete()
+    UserDownloadRecord.forget_file(req.dbsession, req.user_id, udf.filename)
     return HTTPFound(req.route_url(Routes.DOWNLOAD_AREA))  # redirect
 
 
@@ -28,9 +28,6 @@ camcops_server/tasks/bmi.py
 from typing import Dict, List, Optional, TYPE_CHECKING
 
 import cardinal_pythonlib.rnc_web as ws
-from fhirclient.models.codeableconcept import CodeableConcept
-from fhirclient.models.coding import Coding
-from fhirclient.models.quantity import Quantity
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.sql.sqltypes import Float, UnicodeText
 
@@ -376,6 +373,12 @@ class Bmi(TaskHasPatientMixin, Task):  # type: ignore[misc]
         """
         See https://www.hl7.org/fhir/bmi.html
         """
+        from fhirclient.models.codeableconcept import (
+            CodeableConcept,
+        )  # delayed import
+        from fhirclient.models.coding import Coding  # delayed import
+        from fhirclient.models.quantity import Quantity  # delayed import
+
         bundle_entries = []  # type: List[Dict]
 
         # Height
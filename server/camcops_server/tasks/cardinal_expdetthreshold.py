@@ -27,11 +27,10 @@ camcops_server/tasks/cardinal_expdetthreshold.py
 
 import math
 import logging
-from typing import List, Optional, Tuple, Type
+from typing import List, Optional, Tuple, Type, TYPE_CHECKING
 
 from cardinal_pythonlib.maths_numpy import inv_logistic, logistic
 import cardinal_pythonlib.rnc_web as ws
-from matplotlib.figure import Figure
 import numpy as np
 from pendulum import DateTime as Pendulum
 from sqlalchemy.orm import Mapped, mapped_column
@@ -57,6 +56,9 @@ from camcops_server.cc_modules.cc_sqlalchemy import Base
 from camcops_server.cc_modules.cc_task import Task, TaskHasPatientMixin
 from camcops_server.cc_modules.cc_text import SS
 
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
 log = logging.getLogger(__name__)
 
 
@@ -275,7 +277,7 @@ class CardinalExpDetThreshold(TaskHasPatientMixin, Task):  # type: ignore[misc]
 
     def _get_figures(
         self, req: CamcopsRequest
-    ) -> Tuple[Figure, Optional[Figure]]:
+    ) -> Tuple["Figure", Optional["Figure"]]:
         """
         Create and return figures. Returns ``trialfig, fitfig``.
         """
@@ -26,10 +26,18 @@ camcops_server/tasks/cardinal_expectationdetection.py
 """
 
 import logging
-from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TYPE_CHECKING,
+)
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
-from matplotlib.axes import Axes
 import numpy
 from pendulum import DateTime as Pendulum
 import scipy.stats  # http://docs.scipy.org/doc/scipy/reference/stats.html
@@ -68,6 +76,9 @@ from camcops_server.cc_modules.cc_summaryelement import (
 )
 from camcops_server.cc_modules.cc_task import Task, TaskHasPatientMixin
 
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
 
@@ -597,7 +608,7 @@ class CardinalExpectationDetection(TaskHasPatientMixin, Task):  # type: ignore[m
     def plot_roc(
         self,
         req: CamcopsRequest,
-        ax: Axes,
+        ax: "Axes",
         count_stimulus: Sequence[int],
         count_nostimulus: Sequence[int],
         show_x_label: bool,
@@ -37,11 +37,6 @@ from cardinal_pythonlib.logs import BraceStyleAdapter
 import cardinal_pythonlib.rnc_web as ws
 from cardinal_pythonlib.sqlalchemy.dump import get_literal_query
 from colander import Invalid, SchemaNode, SequenceSchema, String
-from fhirclient.models.annotation import Annotation
-from fhirclient.models.codeableconcept import CodeableConcept
-from fhirclient.models.coding import Coding
-from fhirclient.models.condition import Condition
-import hl7
 from pyramid.renderers import render_to_response
 from pyramid.response import Response
 from sqlalchemy import CompoundSelect, Select
@@ -100,6 +95,7 @@ from camcops_server.cc_modules.cc_validators import (
 )
 
 if TYPE_CHECKING:
+    import hl7
     from sqlalchemy.sql.elements import ColumnElement
 
 log = BraceStyleAdapter(logging.getLogger(__name__))
@@ -250,7 +246,7 @@ class DiagnosisBase(  # type: ignore[misc]
     # noinspection PyUnusedLocal
     def get_hl7_extra_data_segments(
         self, recipient_def: ExportRecipient
-    ) -> List[hl7.Segment]:
+    ) -> "List[hl7.Segment]":
         segments = []
         clinician = guess_name_components(self.clinician_name)
         for i in range(len(self.items)):
@@ -274,6 +270,13 @@ class DiagnosisBase(  # type: ignore[misc]
     def _get_fhir_extra_bundle_entries_for_system(
         self, req: CamcopsRequest, recipient: ExportRecipient, system: str
     ) -> List[Dict]:
+        from fhirclient.models.annotation import Annotation  # delayed import
+        from fhirclient.models.codeableconcept import (
+            CodeableConcept,
+        )  # delayed import
+        from fhirclient.models.coding import Coding  # delayed import
+        from fhirclient.models.condition import Condition  # delayed import
+
         bundle_entries = []  # type: List[Dict]
         for item in self.items:
             display = item.human()
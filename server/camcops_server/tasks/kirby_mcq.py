@@ -27,18 +27,13 @@ camcops_server/tasks/kirby.py
 
 import logging
 import math
-from typing import Dict, List, Optional, Type
+from typing import Dict, List, Optional, Type, TYPE_CHECKING
 
 import numpy as np
 from numpy.linalg.linalg import LinAlgError
 from scipy.stats.mstats import gmean
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.sql.sqltypes import Float
-import statsmodels.api as sm
-
-# noinspection PyProtectedMember
-from statsmodels.discrete.discrete_model import BinaryResultsWrapper
-from statsmodels.tools.sm_exceptions import PerfectSeparationError
 
 from camcops_server.cc_modules.cc_constants import CssClass
 from camcops_server.cc_modules.cc_db import (
@@ -56,6 +51,10 @@ from camcops_server.cc_modules.cc_sqla_coltypes import (
 from camcops_server.cc_modules.cc_summaryelement import SummaryElement
 from camcops_server.cc_modules.cc_task import Task, TaskHasPatientMixin
 
+if TYPE_CHECKING:
+    # noinspection PyProtectedMember
+    from statsmodels.discrete.discrete_model import BinaryResultsWrapper
+
 log = logging.getLogger(__name__)
 
 
@@ -327,6 +326,12 @@ class Kirby(TaskHasPatientMixin, Task):  # type: ignore[misc]
         Returns k for a subject as determined using Wileyto et al.'s (2004)
         method. See :ref:`kirby_mcq.rst <kirby_mcq>`.
         """
+        # Delayed imports; statsmodels loads pandas, which is slow to load
+        import statsmodels.api as sm  # delayed import
+        from statsmodels.tools.sm_exceptions import (
+            PerfectSeparationError,
+        )  # delayed import
+
         if not results:
             return None
         n_predictors = 2